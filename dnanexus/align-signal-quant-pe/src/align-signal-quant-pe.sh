@@ -0,0 +1,253 @@
+#!/bin/bash
+# align-signal-quant-pe.sh
+
+memory_available() {
+    # Determine memory available
+    memory_GB=60
+    if [ -f /usr/bin/parse_property.py ]; then
+        instance_type=`parse_property.py --job ${DX_JOB_ID} --describe --key instanceType --quiet`
+        if [ "$instance_type" == "mem3_hdd2_x8" ]; then
+            memory_GB=60
+        elif [ "$instance_type" == "mem3_ssd1_x16" ]; then
+            memory_GB=100
+        elif [ "$instance_type" == "mem3_ssd1_x32" ]; then
+            memory_GB=220
+        elif [ "$instance_type" == "mem1_hdd2_x32" ] || [ "$instance_type" == "mem3_ssd1_x8" ]; then
+            memory_GB=50
+        else
+            echo "* WARNING: unexpected instance type: '$instance_type''"
+        fi
+        echo "* Memory to use: '${memory_GB}GB'"
+    fi
+}
+
+main() {
+    # Fuses align-star-pe, bam-to-bigwig and quant-rsem into one job, so the bams are used where they are made.
+    # Results are named just as those applets name them.
+
+    # If available, will print tool versions to stderr and json string to stdout
+    versions=''
+    if [ -f /usr/bin/tool_versions.py ]; then
+        versions=`tool_versions.py --dxjson dnanexus-executable.json`
+    fi
+
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
+    echo "* Value of reads1: '$reads1'"
+    echo "* Value of reads2: '$reads2'"
+    echo "* Value of star_index: '$star_index'"
+    echo "* Value of chrom_sizes: '$chrom_sizes'"
+    echo "* Value of rsem_index: '$rsem_index'"
+    echo "* Value of library_id: '$library_id'"
+    echo "* Value of stranded: '$stranded'"
+    echo "* Value of read_strand: '$read_strand'"
+    echo "* Random number seed: '$rnd_seed'"
+    echo "* Number of threads (default 8): '$nthreads'"
+
+    # Determine memory available
+    memory_available
+
+    #echo "* Download files..."
+    exp_rep_root=""
+    if [ -f /usr/bin/parse_property.py ]; then
+        new_root=`parse_property.py -f "'${reads1[0]}'" --project "${DX_PROJECT_CONTEXT_ID}" --root_name --quiet`
+        if [ "$new_root" != "" ]; then
+            exp_rep_root="${new_root}"
+        fi
+    fi
+    outfile_name=""
+    concat=""
+    rm -f concat.fq
+    for ix in ${!reads1[@]}
+    do
+        file_root=`dx describe "${reads1[$ix]}" --name`
+        file_root=${file_root%.fastq.gz}
+        file_root=${file_root%.fq.gz}
+        if [ "${outfile_name}" == "" ]; then
+            outfile_name="${file_root}"
+        else
+            outfile_name="${file_root}_${outfile_name}"
+            if [ "${concat}" == "" ]; then
+                outfile_name="${outfile_name}_concat"
+                concat="s concatenated as"
+            fi
+        fi
+        echo "* Downloading concatenating ${file_root}.fq.gz file..."
+        dx download "${reads1[$ix]}" -o - | gunzip >> concat.fq
+    done
+    if [ "${concat}" != "" ]; then
+        if [ "${exp_rep_root}" != "" ]; then
+            outfile_name="${exp_rep_root}_reads1"
+        elif [ ${#outfile_name} -gt 200 ]; then
+            outfile_name="concatenated_reads1"
+        fi
+    fi
+    mv concat.fq ${outfile_name}.fq
+    echo "* Gzipping file..."
+    gzip ${outfile_name}.fq
+    echo "* Reads1 fastq${concat} file: '${outfile_name}.fq.gz'"
+    reads1_root=${outfile_name}
+    ls -l ${reads1_root}.fq.gz
+
+    outfile_name=""
+    concat=""
+    rm -f concat.fq
+    for ix in ${!reads2[@]}
+    do
+        file_root=`dx describe "${reads2[$ix]}" --name`
+        file_root=${file_root%.fastq.gz}
+        file_root=${file_root%.fq.gz}
+        if [ "${outfile_name}" == "" ]; then
+            outfile_name="${file_root}"
+        else
+            outfile_name="${file_root}_${outfile_name}"
+            if [ "${concat}" == "" ]; then
+                outfile_name="${outfile_name}_concat"
+                concat="s concatenated as"
+            fi
+        fi
+        echo "* Downloading and concatenating ${file_root}.fq.gz file..."
+        dx download "${reads2[$ix]}" -o - | gunzip >> concat.fq
+    done
+    if [ "${concat}" != "" ]; then
+        if [ "${exp_rep_root}" != "" ]; then
+            outfile_name="${exp_rep_root}_reads2"
+        elif [ ${#outfile_name} -gt 200 ]; then
+            outfile_name="concatenated_reads2"
+        fi
+    fi
+    mv concat.fq ${outfile_name}.fq
+    echo "* Gzipping file..."
+    gzip ${outfile_name}.fq
+    echo "* Reads2 fastq${concat} file: '${outfile_name}.fq.gz'"
+    ls -l ${outfile_name}.fq.gz
+    reads2_root=${outfile_name}
+    ls -l ${reads2_root}.fq.gz
+    bam_root="${reads1_root}_${reads2_root}"
+    if [ "${exp_rep_root}" != "" ]; then
+        bam_root="${exp_rep_root}"
+    fi
+
+    echo "* Downloading reference files..."
+    dx download "$star_index" -o star_index.tgz
+    dx download "$chrom_sizes" -o chrom.sizes
+    dx download "$rsem_index" -o rsem_index.tgz
+
+    # DX/ENCODE independent scripts are found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    lrna_align_star_pe.sh star_index.tgz ${reads1_root}.fq.gz ${reads2_root}.fq.gz "$library_id" $nthreads ${memory_GB} $bam_root
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+
+    # Both the STAR and RSEM indexes extract into 'out/', and signals only need STAR itself.
+    rm -rf out star_index.tgz ${reads1_root}.fq.gz ${reads2_root}.fq.gz
+
+    # quant-rsem names results from the annotation bam without its '_star_anno' suffix
+    ln -s ${bam_root}_star_anno.bam ${bam_root}.bam
+
+    # Signals are single threaded so they are made while RSEM quantifies (as one sub-step, since their own marks
+    # would interleave)
+    echo "* ===== Calling DNAnexus and ENCODE independent scripts... ====="
+    telemetry mark signals_and_quantification
+    set -x
+    STAGE_TELEMETRY= lrna_bam_to_signals.sh ${bam_root}_star_genome.bam chrom.sizes $stranded &
+    signals_pid=$!
+    STAGE_TELEMETRY= lrna_rsem_quantification.sh rsem_index.tgz ${bam_root}.bam true $read_strand $rnd_seed $nthreads
+    wait $signals_pid
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent scripts ====="
+    rm -f ${bam_root}.bam
+    bam_root="${bam_root}_star"
+
+    echo "* Prepare metadata..."
+    telemetry mark qc_metrics
+    qc_genome_stats=''
+    qc_anno_stats=''
+    reads=0
+    anno_reads=0
+    if [ -f /usr/bin/qc_metrics.py ]; then
+        qc_genome_stats=`qc_metrics.py -n STAR_log_final -f ${bam_root}_Log.final.out`
+        qc_anno_stats=$qc_genome_stats
+        meta=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_genome_flagstat.txt`
+        reads=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_genome_flagstat.txt -k total`
+        qc_genome_stats=`echo $qc_genome_stats, $meta`
+        meta=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_anno_flagstat.txt`
+        anno_reads=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_anno_flagstat.txt -k total`
+        qc_anno_stats=`echo $qc_anno_stats, $meta`
+    fi
+
+    echo "* Upload results..."
+    genome_metadata=$qc_genome_stats
+    anno_metadata=$qc_anno_stats
+    telemetry=`telemetry details`
+    if [ -n "$telemetry" ]; then
+        genome_metadata="${qc_genome_stats:+$qc_genome_stats, }$telemetry"
+        anno_metadata="${qc_anno_stats:+$qc_anno_stats, }$telemetry"
+    fi
+    telemetry mark upload
+    star_genome_bam=$(dx upload ${bam_root}_genome.bam --details="{ $genome_metadata }" --property reads="$reads" \
+                                                                                        --property SW="$versions" --brief)
+    star_anno_bam=$(dx upload ${bam_root}_anno.bam     --details="{ $anno_metadata }"   --property reads="$anno_reads" \
+                                                                                        --property SW="$versions" --brief)
+    star_log=$(dx upload ${bam_root}_Log.final.out --details="{ $genome_metadata }" --property SW="$versions" --brief)
+    genome_flagstat=$(dx upload ${bam_root}_genome_flagstat.txt --details="{ $genome_metadata }" \
+                                                                --property reads="$reads" --property SW="$versions" --brief)
+    anno_flagstat=$(dx upload ${bam_root}_anno_flagstat.txt --details="{ $anno_metadata }" \
+                                                            --property reads="$anno_reads" --property SW="$versions" --brief)
+
+    dx-jobutil-add-output star_genome_bam "$star_genome_bam" --class=file
+    dx-jobutil-add-output star_anno_bam "$star_anno_bam" --class=file
+    dx-jobutil-add-output star_log "$star_log" --class=file
+    dx-jobutil-add-output genome_flagstat "$genome_flagstat" --class=file
+    dx-jobutil-add-output anno_flagstat "$anno_flagstat" --class=file
+
+    if [ "$stranded" == "true" ]; then
+        minus_all_bw=$(dx upload ${bam_root}_genome_minusAll.bw   --details="{ $telemetry }" \
+                                                                  --property SW="$versions" --brief)
+        minus_uniq_bw=$(dx upload ${bam_root}_genome_minusUniq.bw --details="{ $telemetry }" \
+                                                                  --property SW="$versions" --brief)
+        plus_all_bw=$(dx upload ${bam_root}_genome_plusAll.bw     --details="{ $telemetry }" \
+                                                                  --property SW="$versions" --brief)
+        plus_uniq_bw=$(dx upload ${bam_root}_genome_plusUniq.bw   --details="{ $telemetry }" \
+                                                                  --property SW="$versions" --brief)
+
+        dx-jobutil-add-output minus_all_bw "$minus_all_bw" --class=file
+        dx-jobutil-add-output minus_uniq_bw "$minus_uniq_bw" --class=file
+        dx-jobutil-add-output plus_all_bw "$plus_all_bw" --class=file
+        dx-jobutil-add-output plus_uniq_bw "$plus_uniq_bw" --class=file
+    else
+        all_bw=$(dx upload ${bam_root}_genome_all.bw   --details="{ $telemetry }" --property SW="$versions" --brief)
+        uniq_bw=$(dx upload ${bam_root}_genome_uniq.bw --details="{ $telemetry }" --property SW="$versions" --brief)
+
+        dx-jobutil-add-output all_bw "$all_bw" --class=file
+        dx-jobutil-add-output uniq_bw "$uniq_bw" --class=file
+    fi
+
+    rsem_root=${bam_root%_star}
+    rsem_gene_results=$(dx upload ${rsem_root}_rsem.genes.results   --details="{ $telemetry }" \
+                                                                    --property SW="$versions" --brief)
+    rsem_iso_results=$(dx upload ${rsem_root}_rsem.isoforms.results --details="{ $telemetry }" \
+                                                                    --property SW="$versions" --brief)
+
+    dx-jobutil-add-output rsem_gene_results "$rsem_gene_results" --class=file
+    dx-jobutil-add-output rsem_iso_results "$rsem_iso_results" --class=file
+    if [ -f /usr/bin/quant_columns.py ]; then
+        # Columnar companions let cross-sample analyses load values without parsing the text results
+        quant_columns.py write rsem ${rsem_root}_rsem.genes.results    ${rsem_root}_rsem.genes.qcol
+        quant_columns.py write rsem ${rsem_root}_rsem.isoforms.results ${rsem_root}_rsem.isoforms.qcol
+        rsem_gene_columns=$(dx upload ${rsem_root}_rsem.genes.qcol   --details="{ $telemetry }" \
+                                                                     --property SW="$versions" --brief)
+        rsem_iso_columns=$(dx upload ${rsem_root}_rsem.isoforms.qcol --details="{ $telemetry }" \
+                                                                     --property SW="$versions" --brief)
+        dx-jobutil-add-output rsem_gene_columns "$rsem_gene_columns" --class=file
+        dx-jobutil-add-output rsem_iso_columns "$rsem_iso_columns" --class=file
+    fi
+
+    dx-jobutil-add-output reads "$reads" --class=string
+    dx-jobutil-add-output metadata "{ $qc_genome_stats }" --class=string
+
+    telemetry stop
+    echo "* Finished."
+}
@@ -0,0 +1,67 @@
+#!/bin/bash -e
+
+if [ $# -lt 4 ]; then
+    echo "usage v1: lrna_merge_star_shards.sh <ncpus> <bam_root> <shard_root> <shard_root> [<shard_root>...]"
+    echo "Merge STAR alignments of read shards made by lrna_align_star_pe.sh.  Is independent of DX and encodeD."
+    echo "Expects '<shard_root>_star_genome.bam', '<shard_root>_star_anno.bam' and '<shard_root>_star_Log.final.out' for each shard."
+    exit -1;
+fi
+ncpus=$1           # Number of cpus available.
+bam_root="$2_star" # root name for output bam (e.g. "out_bam" will create "out_bam_star_genome.bam" and "out_bam_star_anno.bam")
+shift 2
+shard_roots=$@     # root names of the shard alignments, in shard order.
+
+echo "-- Alignments file will be: '${bam_root}_genome.bam' and '${bam_root}_anno.bam'"
+
+genome_bams=""
+logs=""
+for shard_root in $shard_roots; do
+    genome_bams="$genome_bams ${shard_root}_star_genome.bam"
+    logs="$logs ${shard_root}_star_Log.final.out"
+done
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
+echo "-- Merging genome bams..."
+telemetry mark merge_genome
+set -x
+samtools view -H ${shard_roots%% *}_star_genome.bam > genome_header.sam
+samtools merge -@ $ncpus -h genome_header.sam ${bam_root}_genome.bam $genome_bams
+set +x
+ls -l ${bam_root}_genome.bam
+
+echo "-- Merging annotation bams..."
+telemetry mark merge_anno
+# Each shard's annotation bam is already in the deterministic order made by lrna_align_star_pe.sh (mate pairs joined
+# into single lines and sorted), so the same order for the whole library is made by merging rather than resorting.
+set -x
+rm -rf shard_fifos
+mkdir shard_fifos
+sorted_shards=""
+for shard_root in $shard_roots; do
+    mkfifo shard_fifos/${shard_root}.sam
+    samtools view ${shard_root}_star_anno.bam | awk '{printf $0 " "; getline; print}' > shard_fifos/${shard_root}.sam &
+    sorted_shards="$sorted_shards shard_fifos/${shard_root}.sam"
+done
+cat <( samtools view -H ${shard_roots%% *}_star_anno.bam ) \
+    <( sort -m -T ./ $sorted_shards | tr ' ' '\n' ) | \
+    samtools view -@ $ncpus -bS - > ${bam_root}_anno.bam
+wait
+rm -rf shard_fifos
+set +x
+ls -l ${bam_root}_anno.bam
+
+echo "-- Merging STAR logs..."
+set -x
+awk -f /usr/bin/merge_star_logs.awk $logs > ${bam_root}_Log.final.out
+set +x
+
+echo "-- Collect bam flagstats..."
+telemetry mark flagstat
+set -x
+samtools flagstat ${bam_root}_genome.bam > ${bam_root}_genome_flagstat.txt
+samtools flagstat ${bam_root}_anno.bam > ${bam_root}_anno_flagstat.txt
+set +x
+
+echo "-- The results..."
+ls -l ${bam_root}*
@@ -0,0 +1,28 @@
+#!/bin/bash -e
+
+if [ $# -lt 3 ]; then
+    echo "usage v1: lrna_split_fastq.sh <nshards> <shard_root> <reads.fq.gz> [<reads.fq.gz>...]"
+    echo "Split one end of (concatenated) fastq files into shards for scattered alignment.  Is independent of DX and encodeD."
+    echo "Reads are dealt to shards in blocks, so read1 and read2 split with the same arguments remain mates."
+    exit -1;
+fi
+nshards=$1         # Number of shards to split reads into.
+shard_root=$2      # root name for shards (e.g. "reads1" will create "reads1_shard1.fq.gz", "reads1_shard2.fq.gz", ...)
+shift 2
+reads_fq_gzs=$@    # One or more gzipped fastq files which will be concatenated in the order given.
+block_reads=1000000 # Reads in each block dealt round-robin to the shards.
+
+echo "-- Shards will be: '${shard_root}_shard1.fq.gz' ... '${shard_root}_shard${nshards}.fq.gz'"
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
+echo "-- Splitting reads..."
+telemetry mark split_fastq
+set -x
+zcat $reads_fq_gzs | \
+    awk -v nshards=$nshards -v block=$(( block_reads * 4 )) -v root="$shard_root" \
+        '{ shard = int((NR - 1) / block) % nshards + 1; print | ("gzip -c > " root "_shard" shard ".fq.gz") }'
+set +x
+
+echo "-- The results..."
+ls -l ${shard_root}_shard*.fq.gz
@@ -0,0 +1,66 @@
+#! /bin/awk -f
+# Merges STAR Log.final.out files from alignments of read shards into a single Log.final.out
+# version 1.0
+# usage: merge_star_logs.awk shard1_Log.final.out shard2_Log.final.out ... > merged_Log.final.out
+#   input files:
+#      shard*_Log.final.out:  STAR final logs, one per shard of the same library, all with the same layout
+#   output:
+#      Log.final.out in the same layout.  Counts are summed, rates are weighted by each shard's input reads,
+#      mapping speeds are summed and start/finish times are taken from the first/last shard.
+
+BEGIN { files=0; };
+FNR==1 { files++; };
+{
+    if (files == 1) {
+        lines=FNR
+        split_at=index($0,"|")
+        if (split_at > 0) {
+            label[FNR]=substr($0,1,split_at)
+        } else {
+            label[FNR]=$0
+        }
+    }
+    split_at=index($0,"|")
+    if (split_at > 0) {
+        value=substr($0,split_at+1)
+        sub(/^[ \t]+/,"",value)
+        val[FNR,files]=value
+        if (label[FNR] ~ /Number of input reads/) {
+            weight[files]=value
+            total+=value
+        }
+    }
+};
+END {
+    for (ix=1; ix<=lines; ix++) {
+        if (index(label[ix],"|") == 0) {
+            print label[ix]
+            continue
+        }
+        if (label[ix] ~ /Started job on|Started mapping on/) {
+            out=val[ix,1]
+        } else if (label[ix] ~ /Finished on/) {
+            out=val[ix,files]
+        } else if (label[ix] ~ /Mapping speed/) {
+            sum=0
+            for (f=1; f<=files; f++) { sum+=val[ix,f] }
+            out=sprintf("%.2f",sum)
+        } else if (label[ix] ~ /Number of|number/) {
+            sum=0
+            for (f=1; f<=files; f++) { sum+=val[ix,f] }
+            out=sprintf("%d",sum)
+        } else {
+            sum=0
+            for (f=1; f<=files; f++) { sum+=val[ix,f] * weight[f] }
+            if (total > 0) { sum=sum/total }
+            if (val[ix,1] ~ /%$/) {
+                out=sprintf("%.2f%%",sum)
+            } else if (val[ix,1] ~ /\./) {
+                out=sprintf("%.2f",sum)
+            } else {
+                out=sprintf("%d",sum + 0.5)
+            }
+        }
+        print label[ix] "\t" out
+    }
+};
@@ -1,6 +1,75 @@
 #!/bin/bash
 # align-star-pe.sh
 
+memory_available() {
+    # Determine memory available
+    memory_GB=60
+    if [ -f /usr/bin/parse_property.py ]; then
+        instance_type=`parse_property.py --job ${DX_JOB_ID} --describe --key instanceType --quiet`
+        if [ "$instance_type" == "mem3_hdd2_x8" ]; then
+            memory_GB=60
+        elif [ "$instance_type" == "mem3_ssd1_x16" ]; then
+            memory_GB=100
+        elif [ "$instance_type" == "mem3_ssd1_x32" ]; then
+            memory_GB=220
+        elif [ "$instance_type" == "mem1_hdd2_x32" ] || [ "$instance_type" == "mem3_ssd1_x8" ]; then
+            memory_GB=50
+        elif [ "$instance_type" == "mem2_ssd1_x8" ]; then
+            memory_GB=29  # align-star-pe-lowmem, which expects a sparse STAR index (~16GB) to leave room to sort
+        else
+            echo "* WARNING: unexpected instance type: '$instance_type''"
+        fi
+        echo "* Memory to use: '${memory_GB}GB'"
+    fi
+}
+
+upload_results() {
+    echo "* Prepare metadata..."
+    telemetry mark qc_metrics
+    qc_genome_stats=''
+    qc_anno_stats=''
+    reads=0
+    anno_reads=0
+    if [ -f /usr/bin/qc_metrics.py ]; then
+        qc_genome_stats=`qc_metrics.py -n STAR_log_final -f ${bam_root}_Log.final.out`
+        qc_anno_stats=$qc_genome_stats
+        meta=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_genome_flagstat.txt`
+        reads=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_genome_flagstat.txt -k total`
+        qc_genome_stats=`echo $qc_genome_stats, $meta`
+        meta=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_anno_flagstat.txt`
+        anno_reads=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_anno_flagstat.txt -k total`
+        qc_anno_stats=`echo $qc_anno_stats, $meta`
+    fi
+
+    echo "* Upload results..."
+    genome_metadata=$qc_genome_stats
+    anno_metadata=$qc_anno_stats
+    telemetry=`telemetry details`
+    if [ -n "$telemetry" ]; then
+        genome_metadata="${qc_genome_stats:+$qc_genome_stats, }$telemetry"
+        anno_metadata="${qc_anno_stats:+$qc_anno_stats, }$telemetry"
+    fi
+    telemetry mark upload
+    star_genome_bam=$(dx upload ${bam_root}_genome.bam --details="{ $genome_metadata }" --property reads="$reads" \
+                                                                                        --property SW="$versions" --brief)
+    star_anno_bam=$(dx upload ${bam_root}_anno.bam     --details="{ $anno_metadata }"   --property reads="$anno_reads" \
+                                                                                        --property SW="$versions" --brief)
+    star_log=$(dx upload ${bam_root}_Log.final.out --details="{ $genome_metadata }" --property SW="$versions" --brief)
+    genome_flagstat=$(dx upload ${bam_root}_genome_flagstat.txt --details="{ $genome_metadata }" \
+                                                                --property reads="$reads" --property SW="$versions" --brief)
+    anno_flagstat=$(dx upload ${bam_root}_anno_flagstat.txt --details="{ $anno_metadata }" \
+                                                            --property reads="$anno_reads" --property SW="$versions" --brief)
+
+    dx-jobutil-add-output star_genome_bam "$star_genome_bam" --class=file
+    dx-jobutil-add-output star_anno_bam "$star_anno_bam" --class=file
+    dx-jobutil-add-output star_log "$star_log" --class=file
+    dx-jobutil-add-output genome_flagstat "$genome_flagstat" --class=file
+    dx-jobutil-add-output anno_flagstat "$anno_flagstat" --class=file
+
+    dx-jobutil-add-output reads "$reads" --class=string
+    dx-jobutil-add-output metadata "{ $qc_genome_stats }" --class=string
+}
+
 main() {
     # Now in resources/usr/bin
     #echo "* Download and install STAR..."
@@ -15,29 +84,18 @@ main() {
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
 
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     echo "* Value of reads_1: '$reads_1'"
     echo "* Value of reads_2: '$reads_2'"
     echo "* Value of star_index: '$star_index'"
     echo "* Value of library_id: '$library_id'"
     echo "* Number of threads (default 8): '$nthreads'"
+    echo "* Number of shards (default 1): '$nshards'"
 
     # Determine memory available
-    memory_GB=60
-    if [ -f /usr/bin/parse_property.py ]; then
-        instance_type=`parse_property.py --job ${DX_JOB_ID} --describe --key instanceType --quiet`
-        if [ "$instance_type" == "mem3_hdd2_x8" ]; then
-            memory_GB=60
-        elif [ "$instance_type" == "mem3_ssd1_x16" ]; then
-            memory_GB=100
-        elif [ "$instance_type" == "mem3_ssd1_x32" ]; then
-            memory_GB=220
-        elif [ "$instance_type" == "mem1_hdd2_x32" ] || [ "$instance_type" == "mem3_ssd1_x8" ]; then
-            memory_GB=50
-        else
-            echo "* WARNING: unexpected instance type: '$instance_type''"
-        fi
-        echo "* Memory to use: '${memory_GB}GB'"
-    fi
+    memory_available
 
     #echo "* Download files..."
     exp_rep_root=""
@@ -49,7 +107,7 @@ main() {
     fi
     outfile_name=""
     concat=""
-    rm -f concat.fq
+    rm -f concat.fq concat.fq.gz
     for ix in ${!reads1[@]}
     do
         file_root=`dx describe "${reads1[$ix]}" --name`
@@ -65,7 +123,12 @@ main() {
             fi
         fi
         echo "* Downloading concatenating ${file_root}.fq.gz file..."
-        dx download "${reads1[$ix]}" -o - | gunzip >> concat.fq
+        if [ $nshards -gt 1 ]; then
+            # Shards are split from a stream of the archives, so they need not be recompressed
+            dx download "${reads1[$ix]}" -o - >> concat.fq.gz
+        else
+            dx download "${reads1[$ix]}" -o - | gunzip >> concat.fq
+        fi
     done
     if [ "${concat}" != "" ]; then
         if [ "${exp_rep_root}" != "" ]; then
@@ -74,16 +137,20 @@ main() {
             outfile_name="concatenated_reads1"
         fi
     fi
-    mv concat.fq ${outfile_name}.fq
-    echo "* Gzipping file..."
-    gzip ${outfile_name}.fq
+    if [ $nshards -gt 1 ]; then
+        mv concat.fq.gz ${outfile_name}.fq.gz
+    else
+        mv concat.fq ${outfile_name}.fq
+        echo "* Gzipping file..."
+        gzip ${outfile_name}.fq
+    fi
     echo "* Reads1 fastq${concat} file: '${outfile_name}.fq.gz'"
     reads1_root=${outfile_name}
     ls -l ${reads1_root}.fq.gz
 
     outfile_name=""
     concat=""
-    rm -f concat.fq
+    rm -f concat.fq concat.fq.gz
     for ix in ${!reads2[@]}
     do
         file_root=`dx describe "${reads2[$ix]}" --name`
@@ -99,7 +166,12 @@ main() {
             fi
         fi
         echo "* Downloading and concatenating ${file_root}.fq.gz file..."
-        dx download "${reads2[$ix]}" -o - | gunzip >> concat.fq
+        if [ $nshards -gt 1 ]; then
+            # Shards are split from a stream of the archives, so they need not be recompressed
+            dx download "${reads2[$ix]}" -o - >> concat.fq.gz
+        else
+            dx download "${reads2[$ix]}" -o - | gunzip >> concat.fq
+        fi
     done
     if [ "${concat}" != "" ]; then
         if [ "${exp_rep_root}" != "" ]; then
@@ -108,9 +180,13 @@ main() {
             outfile_name="concatenated_reads2"
         fi
     fi
-    mv concat.fq ${outfile_name}.fq
-    echo "* Gzipping file..."
-    gzip ${outfile_name}.fq
+    if [ $nshards -gt 1 ]; then
+        mv concat.fq.gz ${outfile_name}.fq.gz
+    else
+        mv concat.fq ${outfile_name}.fq
+        echo "* Gzipping file..."
+        gzip ${outfile_name}.fq
+    fi
     echo "* Reads2 fastq${concat} file: '${outfile_name}.fq.gz'"
     ls -l ${outfile_name}.fq.gz
     reads2_root=${outfile_name}
@@ -120,6 +196,11 @@ main() {
         bam_root="${exp_rep_root}"
     fi
 
+    if [ $nshards -gt 1 ]; then
+        scatter_shards
+        return
+    fi
+
     echo "* Downloading star index archive..."
     dx download "$star_index" -o star_index.tgz
 
@@ -131,41 +212,122 @@ main() {
     echo "* ===== Returned from dnanexus and encodeD independent script ====="
     bam_root="${bam_root}_star"
 
-    echo "* Prepare metadata..."
-    qc_genome_stats=''
-    qc_anno_stats=''
-    reads=0
-    anno_reads=0
-    if [ -f /usr/bin/qc_metrics.py ]; then
-        qc_genome_stats=`qc_metrics.py -n STAR_log_final -f ${bam_root}_Log.final.out`
-        qc_anno_stats=$qc_genome_stats
-        meta=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_genome_flagstat.txt`
-        reads=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_genome_flagstat.txt -k total`
-        qc_genome_stats=`echo $qc_genome_stats, $meta`
-        meta=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_anno_flagstat.txt`
-        anno_reads=`qc_metrics.py -n samtools_flagstats -f ${bam_root}_anno_flagstat.txt -k total`
-        qc_anno_stats=`echo $qc_anno_stats, $meta`
-    fi
+    upload_results
 
-    echo "* Upload results..."
-    star_genome_bam=$(dx upload ${bam_root}_genome.bam --details="{ $qc_genome_stats }" --property reads="$reads" \
-                                                                                        --property SW="$versions" --brief)
-    star_anno_bam=$(dx upload ${bam_root}_anno.bam     --details="{ $qc_anno_stats }"   --property reads="$anno_reads" \
-                                                                                        --property SW="$versions" --brief)
-    star_log=$(dx upload ${bam_root}_Log.final.out --details="{ $qc_genome_stats }" --property SW="$versions" --brief)
-    genome_flagstat=$(dx upload ${bam_root}_genome_flagstat.txt --details="{ $qc_genome_stats }" \
-                                                                --property reads="$reads" --property SW="$versions" --brief)
-    anno_flagstat=$(dx upload ${bam_root}_anno_flagstat.txt --details="{ $qc_anno_stats }" \
-                                                            --property reads="$anno_reads" --property SW="$versions" --brief)
+    telemetry stop
+    echo "* Finished."
+}
+
+scatter_shards() {
+    # Split reads into shards, align each shard in its own job and then gather them back together
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    lrna_split_fastq.sh $nshards reads1 ${reads1_root}.fq.gz &
+    split1_pid=$!
+    lrna_split_fastq.sh $nshards reads2 ${reads2_root}.fq.gz &
+    split2_pid=$!
+    wait $split1_pid
+    wait $split2_pid
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+
+    echo "* Scattering shards..."
+    star_index_id=`dx-jobutil-parse-link "$star_index"`
+    gather_inputs=""
+    for (( shard=1; shard<=$nshards; shard++ )); do
+        # Reads are dealt to shards in blocks so small inputs may leave the last shards empty
+        if [ ! -f reads1_shard${shard}.fq.gz ]; then
+            break
+        fi
+        reads1_shard=$(dx upload reads1_shard${shard}.fq.gz --visibility hidden --brief)
+        reads2_shard=$(dx upload reads2_shard${shard}.fq.gz --visibility hidden --brief)
+        shard_job=$(dx-jobutil-new-job align_shard -ireads1_shard="$reads1_shard" -ireads2_shard="$reads2_shard" \
+                                                   -istar_index="$star_index_id" -ilibrary_id="$library_id" \
+                                                   -inthreads=$nthreads -ishard_root="shard${shard}")
+        echo "* Shard ${shard} is aligning in job: '$shard_job'"
+        gather_inputs="$gather_inputs -ishard_genome_bams=${shard_job}:star_genome_bam"
+        gather_inputs="$gather_inputs -ishard_anno_bams=${shard_job}:star_anno_bam"
+        gather_inputs="$gather_inputs -ishard_logs=${shard_job}:star_log"
+    done
+    gather_job=$(dx-jobutil-new-job gather $gather_inputs -ibam_root="$bam_root" -inthreads=$nthreads)
+    echo "* Shards are gathered in job: '$gather_job'"
+
+    for output in star_genome_bam star_anno_bam star_log genome_flagstat anno_flagstat reads metadata; do
+        dx-jobutil-add-output $output "${gather_job}:${output}" --class=jobref
+    done
+}
+
+align_shard() {
+    echo "* Value of reads1_shard: '$reads1_shard'"
+    echo "* Value of reads2_shard: '$reads2_shard'"
+    echo "* Value of star_index: '$star_index'"
+    echo "* Value of library_id: '$library_id'"
+    echo "* Value of shard_root: '$shard_root'"
+    echo "* Number of threads: '$nthreads'"
+
+    # Determine memory available
+    memory_available
+
+    echo "* Downloading files..."
+    dx download "$reads1_shard" -o ${shard_root}_reads1.fq.gz
+    dx download "$reads2_shard" -o ${shard_root}_reads2.fq.gz
+    dx download "$star_index" -o star_index.tgz
+
+    # DX/ENCODE independent script is found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    lrna_align_star_pe.sh star_index.tgz ${shard_root}_reads1.fq.gz ${shard_root}_reads2.fq.gz "$library_id" $nthreads \
+                                                                                                ${memory_GB} $shard_root
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+
+    echo "* Upload shard results..."
+    star_genome_bam=$(dx upload ${shard_root}_star_genome.bam --visibility hidden --brief)
+    star_anno_bam=$(dx upload ${shard_root}_star_anno.bam --visibility hidden --brief)
+    star_log=$(dx upload ${shard_root}_star_Log.final.out --visibility hidden --brief)
 
     dx-jobutil-add-output star_genome_bam "$star_genome_bam" --class=file
     dx-jobutil-add-output star_anno_bam "$star_anno_bam" --class=file
     dx-jobutil-add-output star_log "$star_log" --class=file
-    dx-jobutil-add-output genome_flagstat "$genome_flagstat" --class=file
-    dx-jobutil-add-output anno_flagstat "$anno_flagstat" --class=file
 
-    dx-jobutil-add-output reads "$reads" --class=string
-    dx-jobutil-add-output metadata "{ $qc_genome_stats }" --class=string
+    echo "* Finished."
+}
+
+gather() {
+    # If available, will print tool versions to stderr and json string to stdout
+    versions=''
+    if [ -f /usr/bin/tool_versions.py ]; then
+        versions=`tool_versions.py --dxjson dnanexus-executable.json`
+    fi
+
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
+    echo "* Value of bam_root: '$bam_root'"
+    echo "* Number of shards: '${#shard_genome_bams[@]}'"
+    echo "* Number of threads: '$nthreads'"
+
+    echo "* Downloading shard alignments..."
+    shard_roots=""
+    for ix in ${!shard_genome_bams[@]}
+    do
+        shard_root="shard$(( ix + 1 ))"
+        dx download "${shard_genome_bams[$ix]}" -o ${shard_root}_star_genome.bam
+        dx download "${shard_anno_bams[$ix]}" -o ${shard_root}_star_anno.bam
+        dx download "${shard_logs[$ix]}" -o ${shard_root}_star_Log.final.out
+        shard_roots="$shard_roots $shard_root"
+    done
+
+    # DX/ENCODE independent script is found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    lrna_merge_star_shards.sh $nthreads $bam_root $shard_roots
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+    bam_root="${bam_root}_star"
+
+    upload_results
 
+    telemetry stop
     echo "* Finished."
 }
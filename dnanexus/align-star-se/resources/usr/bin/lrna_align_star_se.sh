@@ -1,7 +1,7 @@
 #!/bin/bash -e
 
-if [ $# -ne 5 ]; then
-    echo "usage v1: lrna_align_star_se.sh <star_index.tgz> <reads.fq.gz> <library_id> <ncpus> <bam_root>"
+if [ $# -lt 5 ] || [ $# -gt 6 ]; then
+    echo "usage v1: lrna_align_star_se.sh <star_index.tgz> <reads.fq.gz> <library_id> <ncpus> <bam_root> [<ram_GB>]"
     echo "Align single-end reads with STAR.  Is independent of DX and encodeD."
     exit -1; 
 fi
@@ -10,22 +10,58 @@ reads_fq_gz=$2     # gzipped fastq of of single-end reads.
 library_id=$3      # Library identifier which will be added to bam header.
 ncpus=$4            # Number of cpus available.
 bam_root="$5_star" # root name for output bam (e.g. "out_bam" will create "out_bam_star_genome.bam" and "out_bam_star_anno.bam") 
+ram_GB=60
+if [ $# -eq 6 ]; then
+    ram_GB=$6      # ram memory avaliable (default 60), less the index for STAR sorting
+fi
 
 echo "-- Alignments file will be: '${bam_root}_genome.bam' and '${bam_root}_anno.bam'"
 
+echo "-- Reading the index's bam comment lines..."
+# An index archive gives up the one member without the rest being decompressed, so the header is known before the
+# index is extracted.  Plain '.tgz' indexes are read once, by the extraction.
+rm -f index_comments.txt
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py cat $star_index_tgz '*_bamCommentLines.txt' --indexed_only > index_comments.txt \
+        || rm -f index_comments.txt
+fi
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
 echo "-- Extracting star index archive..."
-tar zxvf $star_index_tgz
+telemetry mark index_extraction
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py extract $star_index_tgz --threads $ncpus
+else
+    tar zxvf $star_index_tgz --exclude=.index_archive_toc.json
+fi
 # unzips into "out/"
+if [ ! -f index_comments.txt ]; then
+    cat out/*_bamCommentLines.txt > index_comments.txt
+fi
+
+# The genome stays loaded while STAR sorts, so STAR may only sort in what the index leaves of the memory
+index_GB=$(( `du -sk out | cut -f1` / 1048576 + 1 ))
+sort_GB=$(( ram_GB - index_GB - 2 ))
+if [ $sort_GB -lt 2 ]; then
+    sort_GB=2
+fi
+echo "-- The index takes ${index_GB}GB of the ${ram_GB}GB, leaving ${sort_GB}GB for sorting."
 
 echo "-- Set up headers..."
 set -x
 libraryComment="@CO\tLIBID:${library_id}"
 echo -e ${libraryComment} > COfile.txt
-cat out/*_bamCommentLines.txt >> COfile.txt
+cat index_comments.txt >> COfile.txt
 echo `cat COfile.txt`
 set +x
 
 echo "-- Map reads..."
+telemetry mark star_mapping
+# If available, will log STAR's throughput, mapping rate and ETA while it maps
+if which star_progress.py > /dev/null 2>&1; then
+    star_progress.py Log.progress.out $reads_fq_gz --pid $$ --out ${bam_root}_progress.json &
+fi
 set -x
 STAR --genomeDir out --readFilesIn $reads_fq_gz                                 \
     --readFilesCommand zcat --runThreadN $ncpus --genomeLoad NoSharedMemory      \
@@ -35,7 +71,7 @@ STAR --genomeDir out --readFilesIn $reads_fq_gz
     --outSAMheaderCommentFile COfile.txt --outSAMheaderHD @HD VN:1.4 SO:coordinate   \
     --outSAMunmapped Within --outFilterType BySJout --outSAMattributes NH HI AS NM MD \
     --outSAMstrandField intronMotif --outSAMtype BAM SortedByCoordinate                \
-    --quantMode TranscriptomeSAM --sjdbScore 1 --limitBAMsortRAM 60000000000
+    --quantMode TranscriptomeSAM --sjdbScore 1 --limitBAMsortRAM ${sort_GB}000000000
 
 mv Aligned.sortedByCoord.out.bam ${bam_root}_genome.bam
 mv Log.final.out ${bam_root}_Log.final.out
@@ -43,14 +79,16 @@ set +x
 ls -l ${bam_root}_genome.bam
 
 echo "-- Sorting annotation bam..."
+telemetry mark anno_sort
 set -x
 cat <( samtools view -H Aligned.toTranscriptome.out.bam ) \
-    <( samtools view -@ $ncpus Aligned.toTranscriptome.out.bam | sort -S 60G -T ./ ) | \
+    <( samtools view -@ $ncpus Aligned.toTranscriptome.out.bam | sort -S ${sort_GB}G -T ./ ) | \
     samtools view -@ $ncpus -bS - > ${bam_root}_anno.bam
 set +x
 ls -l ${bam_root}_anno.bam
 
 echo "-- Collect bam flagstats..."
+telemetry mark flagstat
 set -x
 samtools flagstat ${bam_root}_genome.bam > ${bam_root}_genome_flagstat.txt
 samtools flagstat ${bam_root}_anno.bam > ${bam_root}_anno_flagstat.txt
@@ -1,6 +1,28 @@
 #!/bin/bash
 # align-star-se.sh
 
+memory_available() {
+    # Determine memory available
+    memory_GB=60
+    if [ -f /usr/bin/parse_property.py ]; then
+        instance_type=`parse_property.py --job ${DX_JOB_ID} --describe --key instanceType --quiet`
+        if [ "$instance_type" == "mem3_hdd2_x8" ]; then
+            memory_GB=60
+        elif [ "$instance_type" == "mem3_ssd1_x16" ]; then
+            memory_GB=100
+        elif [ "$instance_type" == "mem3_ssd1_x32" ]; then
+            memory_GB=220
+        elif [ "$instance_type" == "mem1_hdd2_x32" ] || [ "$instance_type" == "mem3_ssd1_x8" ]; then
+            memory_GB=50
+        elif [ "$instance_type" == "mem2_ssd1_x8" ]; then
+            memory_GB=29  # align-star-se-lowmem, which expects a sparse STAR index (~16GB) to leave room to sort
+        else
+            echo "* WARNING: unexpected instance type: '$instance_type''"
+        fi
+        echo "* Memory to use: '${memory_GB}GB'"
+    fi
+}
+
 main() {
     # Now in resources/usr/bin
     #echo "* Download and install STAR..."
@@ -15,11 +37,17 @@ main() {
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
 
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     echo "* Value of reads: '$reads'"
     echo "* Value of star_index: '$star_index'"
     echo "* Value of library_id: '$library_id'"
     echo "* Value of nthreads: '$nthreads'"
 
+    # Determine memory available
+    memory_available
+
     #echo "* Download files..."
     exp_rep_root=""
     if [ -f /usr/bin/parse_property.py ]; then
@@ -73,12 +101,13 @@ main() {
     # DX/ENCODE independent script is found in resources/usr/bin
     echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
     set -x
-    lrna_align_star_se.sh star_index.tgz ${reads_root}.fq.gz "$library_id" $nthreads $bam_root
+    lrna_align_star_se.sh star_index.tgz ${reads_root}.fq.gz "$library_id" $nthreads $bam_root ${memory_GB}
     set +x
     echo "* ===== Returned from dnanexus and encodeD independent script ====="
     bam_root="${bam_root}_star"
 
     echo "* Prepare metadata..."
+    telemetry mark qc_metrics
     qc_genome_stats=''
     qc_anno_stats=''
     reads=0
@@ -95,14 +124,22 @@ main() {
     fi
 
     echo "* Upload results..."
-    star_genome_bam=$(dx upload ${bam_root}_genome.bam --details="{ $qc_genome_stats }" --property reads="$reads" \
+    genome_metadata=$qc_genome_stats
+    anno_metadata=$qc_anno_stats
+    telemetry=`telemetry details`
+    if [ -n "$telemetry" ]; then
+        genome_metadata="${qc_genome_stats:+$qc_genome_stats, }$telemetry"
+        anno_metadata="${qc_anno_stats:+$qc_anno_stats, }$telemetry"
+    fi
+    telemetry mark upload
+    star_genome_bam=$(dx upload ${bam_root}_genome.bam --details="{ $genome_metadata }" --property reads="$reads" \
                                                                                         --property SW="$versions" --brief)
-    star_anno_bam=$(dx upload ${bam_root}_anno.bam     --details="{ $qc_anno_stats }"   --property reads="$anno_reads" \
+    star_anno_bam=$(dx upload ${bam_root}_anno.bam     --details="{ $anno_metadata }"   --property reads="$anno_reads" \
                                                                                         --property SW="$versions" --brief)
-    star_log=$(dx upload ${bam_root}_Log.final.out --details="{ $qc_genome_stats }" --property SW="$versions" --brief)
-    genome_flagstat=$(dx upload ${bam_root}_genome_flagstat.txt --details="{ $qc_genome_stats }" \
+    star_log=$(dx upload ${bam_root}_Log.final.out --details="{ $genome_metadata }" --property SW="$versions" --brief)
+    genome_flagstat=$(dx upload ${bam_root}_genome_flagstat.txt --details="{ $genome_metadata }" \
                                                                 --property reads="$reads" --property SW="$versions" --brief)
-    anno_flagstat=$(dx upload ${bam_root}_anno_flagstat.txt --details="{ $qc_anno_stats }" \
+    anno_flagstat=$(dx upload ${bam_root}_anno_flagstat.txt --details="{ $anno_metadata }" \
                                                             --property reads="$anno_reads" --property SW="$versions" --brief)
 
     dx-jobutil-add-output star_genome_bam "$star_genome_bam" --class=file
@@ -114,5 +151,6 @@ main() {
     dx-jobutil-add-output reads "$reads" --class=string
     dx-jobutil-add-output metadata "{ $qc_genome_stats }" --class=string
 
+    telemetry stop
     echo "* Finished."
 }
@@ -0,0 +1,63 @@
+#! /bin/awk -f
+# Rewrites the header of TopHat's accepted_hits and fixes XS:A strand tags, in one pass over 'samtools view -h' output
+# version 1.0
+# usage: samtools view -h accepted_hits.bam | \
+#        gawk -f tophat_bam_fix.awk -v HD="..." -v newPG="..." -v library="..." -v comments=file [-v fix_xs=0] | \
+#        samtools view -@ ncpus -bS - > fixed.bam
+#   variables:
+#      HD:        @HD line replacing TopHat's
+#      newPG:     @PG line put ahead of TopHat's @PG line
+#      library:   @CO line with the library id
+#      comments:  file of further header lines (genome and annotation comments)
+#      fix_xs:    1 (default) fixes XS:A tags as tophat_bam_xsA_tag_fix.pl does, 0 leaves records as they are
+#   header:  keeps @SQ lines, replaces @HD, then ends with newPG, the (last) @PG, library and the comments.
+#   records: XS:A is '+' for read1 on the reverse strand or read2 on the forward strand, and '-' otherwise.  The first
+#            XS:A:+/- tag is set in place (or one is appended) and any others are dropped.  Reads that are neither
+#            read1 nor read2 are dropped, as tophat_bam_xsA_tag_fix.pl drops them.
+
+BEGIN {FS="\t"; OFS="\t"; header_done=0; if (fix_xs == "") fix_xs=1;};
+
+function end_header() {
+    print newPG"\n"PG"\n"library;
+    if (comments != "") {
+        while ((getline line < comments) > 0) print line;
+        close(comments);
+    };
+    header_done=1;
+};
+
+{
+    if (substr($0,1,1)=="@" && !header_done) {
+        if ($0 ~ /^@PG/) {PG=$0}
+        else if ($0 ~ /^@HD/) {print HD}
+        else if ($0 ~ /^@SQ/) {print $0};
+        next;
+    };
+    if (!header_done) end_header();
+    if (fix_xs == 0) {print; next};
+
+    if (int($2/64)%2==1) {
+        strand = (int($2/16)%2==1) ? "+" : "-";
+    } else if (int($2/128)%2==1) {
+        strand = (int($2/16)%2==1) ? "-" : "+";
+    } else {
+        next;
+    };
+    tagged=0;
+    line=$1;
+    for (ix=2; ix<=NF; ix++) {
+        field=$ix;
+        if (ix > 11 && (field=="XS:A:+" || field=="XS:A:-")) {
+            if (tagged) continue;
+            field="XS:A:"strand;
+            tagged=1;
+        };
+        line=line OFS field;
+    };
+    if (!tagged) line=line OFS "XS:A:"strand;
+    print line;
+};
+
+END {
+    if (!header_done) end_header();
+};
@@ -15,6 +15,10 @@ main() {
     if [ -f /usr/bin/tool_versions.py ]; then 
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
+
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     #echo "*****"
     #echo "* Running: align-tophat-pe.sh v[1.0.1]"
     #echo "* TopHat version: "`tophat -v | awk '{print $2}'`
@@ -121,6 +125,7 @@ main() {
     bam_root="${bam_root}_tophat"
 
     echo "* Prepare metadata..."
+    telemetry mark qc_metrics
     qc_stats=''
     reads=0
     if [ -f /usr/bin/qc_metrics.py ]; then
@@ -129,9 +134,15 @@ main() {
     fi
 
     echo "* Upload results..."
-    tophat_bam=$(dx upload ${bam_root}.bam --details="{ $qc_stats }" --property reads="$reads" \
+    metadata=$qc_stats
+    telemetry=`telemetry details`
+    if [ -n "$telemetry" ]; then
+        metadata="${qc_stats:+$qc_stats, }$telemetry"
+    fi
+    telemetry mark upload
+    tophat_bam=$(dx upload ${bam_root}.bam --details="{ $metadata }" --property reads="$reads" \
                                                                      --property SW="$versions" --brief)
-    tophat_flagstat=$(dx upload ${bam_root}_flagstat.txt --details="{ $qc_stats }" --property reads="$reads" \
+    tophat_flagstat=$(dx upload ${bam_root}_flagstat.txt --details="{ $metadata }" --property reads="$reads" \
                                                                                    --property SW="$versions" --brief)
 
     dx-jobutil-add-output tophat_bam "$tophat_bam" --class=file
@@ -139,6 +150,7 @@ main() {
 
     dx-jobutil-add-output reads "$reads" --class=string
     dx-jobutil-add-output metadata "{ $qc_stats }" --class=string
+    telemetry stop
     echo "* Finished."
 }
 
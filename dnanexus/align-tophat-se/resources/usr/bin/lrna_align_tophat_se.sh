@@ -13,8 +13,15 @@ bam_root="$5_tophat" # root name for output bam (e.g. "out_bam" will create "out
 
 echo "-- Alignments file will be: '${bam_root}.bam'"
 
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
 echo "-- Extracting TopHat index archive..."
-tar zxvf $tophat_index_tgz
+telemetry mark index_extraction
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py extract $tophat_index_tgz --threads $ncpus
+else
+    tar zxvf $tophat_index_tgz --exclude=.index_archive_toc.json
+fi
 # unzips into "out/"
 
 # unzips into "out/"
@@ -26,6 +33,7 @@ echo "-- Value of geno_prefix: '$geno_prefix'"
 echo "-- Value of anno_prefix: '$anno_prefix'"
 
 echo "-- Map reads..."
+telemetry mark tophat_mapping
 set -x
 tophat -p $ncpus -z0 -a 8 -m 0 --min-intron-length 20 --max-intron-length 1000000 \
     --read-edit-dist 4 --read-mismatches 4 -g 20  --library-type fr-unstranded \
@@ -35,40 +43,44 @@ ls -l tophat_out/accepted_hits.bam
 ls -l tophat_out/unmapped.bam
 
 echo "-- Set up headers..."
+telemetry mark bam_fix
 set -x
 HD="@HD\tVN:1.4\tSO:coordinate" 
-stCommand="perl tophat_bam_xsA_tag_fix.pl tophat_out/accepted_hits.bam | samtools view -bS - | samtools sort - mapped_fixed; samtools merge -h newHeader.sam merged.bam mapped_fixed.bam out/unmapped.bam"
+stCommand="(samtools view -h tophat_out/accepted_hits.bam | gawk -f tophat_bam_fix.awk -v fix_xs=0; samtools view tophat_out/unmapped.bam) | samtools view -@ $ncpus -bS - > ${bam_root}.bam"
 newPG="@PG\tID:Samtools\tPN:Samtools\tCL:"$stCommand"\tPP:Tophat\tVN:VN:0.1.17 (r973:277)"
 libraryComment="@CO\tLIBID:${library_id}"
-
-samtools view -H tophat_out/accepted_hits.bam | \
-gawk -v HD="$HD" -v newPG="$newPG" -v library="$libraryComment" \
-    '{     if ($0 ~ /^@PG/) {PG=$0} 
-      else if ($0 ~ /^@HD/) {print HD; }
-      else if($0 ~ /^@SQ/) {print $0};
-     }; END{print newPG"\n"PG"\n"library;}' > newHeader.sam
-
-# Add reference genome and transcriptome used
-cat ${geno_prefix}_bamCommentLines.txt >> newHeader.sam
-set +x
-cat newHeader.sam
-
-echo "-- Fix unmapped bam and sort before merge..."
-#perl /usr/bin/tophat_bam_xsA_tag_fix.pl tophat_out/accepted_hits.bam | \
-#            samtools view -bS - | samtools sort - mapped_fixed
-set -x
-mv tophat_out/accepted_hits.bam mapped_fixed.bam
 set +x
-ls -l mapped_fixed.bam
 
-echo "-- Merge aligned and unaligned into single bam, using the patched up header..."
-set -x
-samtools merge -@ $ncpus -h newHeader.sam merged.bam mapped_fixed.bam tophat_out/unmapped.bam
-mv merged.bam ${bam_root}.bam
-set +x
+# TopHat's accepted hits are already sorted, and its unmapped reads have no position so would be merged after them.
+# Rewriting the header as the records stream past, then appending the unmapped reads, makes the
+# final bam in one pass, without intermediate bams.  Should any unmapped read have a position, merge as before.
+placed=`samtools view tophat_out/unmapped.bam | gawk '$3 != "*"' | head -1 | wc -l`
+set -o pipefail
+if [ $placed -eq 0 ]; then
+    echo "-- Fix header and append unmapped reads in a single pass..."
+    set -x
+    ( samtools view -h tophat_out/accepted_hits.bam | \
+          gawk -f /usr/bin/tophat_bam_fix.awk -v HD="$HD" -v newPG="$newPG" -v library="$libraryComment" \
+                                              -v comments=${geno_prefix}_bamCommentLines.txt -v fix_xs=0; \
+      samtools view tophat_out/unmapped.bam ) | samtools view -@ $ncpus -bS - > ${bam_root}.bam
+    set +x
+else
+    echo "-- Fix header, then merge aligned and unaligned into single bam..."
+    set -x
+    samtools view -h tophat_out/accepted_hits.bam | \
+        gawk -f /usr/bin/tophat_bam_fix.awk -v HD="$HD" -v newPG="$newPG" -v library="$libraryComment" \
+                                            -v comments=${geno_prefix}_bamCommentLines.txt -v fix_xs=0 | \
+        samtools view -@ $ncpus -bS - > mapped_fixed.bam
+    samtools view -H mapped_fixed.bam > newHeader.sam
+    samtools merge -@ $ncpus -h newHeader.sam merged.bam mapped_fixed.bam tophat_out/unmapped.bam
+    mv merged.bam ${bam_root}.bam
+    set +x
+fi
+set +o pipefail
 ls -l ${bam_root}.bam
 
 echo "-- Collect bam flagstats..."
+telemetry mark flagstat
 set -x
 samtools flagstat ${bam_root}.bam > ${bam_root}_flagstat.txt
 set +x
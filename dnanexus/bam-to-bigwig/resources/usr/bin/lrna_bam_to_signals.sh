@@ -15,10 +15,13 @@ fi
 bam_root=${bam_file%.bam}
 echo "-- Results will be: '${bam_root}_*.bw'"
 
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
 # force uppercase in compare
 if [ "${stranded^^}" == "T" ] || [ "${stranded^^}" == "Y" ] || [ "${stranded}" == "1" ]; then
 
     echo "-- Make stranded signals..."
+    telemetry mark bedgraph
     set -x
     mkdir -p Signal
     STAR --runMode inputAlignmentsFromBAM --inputBAMfile $bam_file --outWigType bedGraph \
@@ -27,6 +30,7 @@ if [ "${stranded^^}" == "T" ] || [ "${stranded^^}" == "Y" ] || [ "${stranded}" =
     set +x
 
     echo "-- Convert stranded bedGraph to bigWigs..."
+    telemetry mark bigwig
     set -x
     bedGraphToBigWig Signal.UniqueMultiple.str1.out.bg $chrom_sizes ${bam_root}_minusAll.bw
     bedGraphToBigWig Signal.Unique.str1.out.bg         $chrom_sizes ${bam_root}_minusUniq.bw
@@ -37,6 +41,7 @@ if [ "${stranded^^}" == "T" ] || [ "${stranded^^}" == "Y" ] || [ "${stranded}" =
 else
 
     echo "-- Make unstranded signals..."
+    telemetry mark bedgraph
     set -x
     mkdir -p Signal
     STAR --runMode inputAlignmentsFromBAM --inputBAMfile $bam_file --outWigType bedGraph \
@@ -46,6 +51,7 @@ else
     echo `ls -l`
 
     echo "-- Convert unstranded bedGraph to bigWigs..."
+    telemetry mark bigwig
     set -x
     bedGraphToBigWig Signal.UniqueMultiple.str1.out.bg $chrom_sizes ${bam_root}_all.bw
     bedGraphToBigWig Signal.Unique.str1.out.bg         $chrom_sizes ${bam_root}_uniq.bw
@@ -15,6 +15,9 @@ main() {
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
 
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     echo "Value of bam_file:    '$bam_file'"
     echo "Value of chrom_sizes: '$chrom_sizes'"
     echo "Value of stranded:    '$stranded'"
@@ -35,23 +38,26 @@ main() {
     echo "* ===== Returned from dnanexus and encodeD independent script ====="
 
     echo "* Upload results..."
+    telemetry=`telemetry details`
+    telemetry mark upload
     if [ "$stranded" == "true" ]; then
-        minus_all_bw=$(dx upload ${bam_root}_minusAll.bw   --property SW="$versions" --brief)
-        minus_uniq_bw=$(dx upload ${bam_root}_minusUniq.bw --property SW="$versions" --brief)
-        plus_all_bw=$(dx upload ${bam_root}_plusAll.bw     --property SW="$versions" --brief)
-        plus_uniq_bw=$(dx upload ${bam_root}_plusUniq.bw   --property SW="$versions" --brief)
+        minus_all_bw=$(dx upload ${bam_root}_minusAll.bw   --details="{ $telemetry }" --property SW="$versions" --brief)
+        minus_uniq_bw=$(dx upload ${bam_root}_minusUniq.bw --details="{ $telemetry }" --property SW="$versions" --brief)
+        plus_all_bw=$(dx upload ${bam_root}_plusAll.bw     --details="{ $telemetry }" --property SW="$versions" --brief)
+        plus_uniq_bw=$(dx upload ${bam_root}_plusUniq.bw   --details="{ $telemetry }" --property SW="$versions" --brief)
 
         dx-jobutil-add-output minus_all_bw "$minus_all_bw" --class=file
         dx-jobutil-add-output minus_uniq_bw "$minus_uniq_bw" --class=file
         dx-jobutil-add-output plus_all_bw "$plus_all_bw" --class=file
         dx-jobutil-add-output plus_uniq_bw "$plus_uniq_bw" --class=file
     else
-        all_bw=$(dx upload ${bam_root}_all.bw   --property SW="$versions" --brief)
-        uniq_bw=$(dx upload ${bam_root}_uniq.bw --property SW="$versions" --brief)
+        all_bw=$(dx upload ${bam_root}_all.bw   --details="{ $telemetry }" --property SW="$versions" --brief)
+        uniq_bw=$(dx upload ${bam_root}_uniq.bw --details="{ $telemetry }" --property SW="$versions" --brief)
 
         dx-jobutil-add-output all_bw "$all_bw" --class=file
         dx-jobutil-add-output uniq_bw "$uniq_bw" --class=file
     fi
 
+    telemetry stop
     echo "* Finished."
 }
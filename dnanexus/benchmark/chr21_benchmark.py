@@ -0,0 +1,332 @@
+#!/usr/bin/env python2.7
+# chr21_benchmark.py v1 Builds chr21 indexes, makes synthetic reads and runs every DX-independent script on them,
+#                       recording each stage's wall and cpu time, peak memory, scratch disk and block I/O.
+
+import sys, os, re, glob, json, time, pipes, shutil, argparse, threading, subprocess, multiprocessing
+
+# NOTES: Each stage runs in its own directory under the work directory, one at a time so that stages do not share
+#        the machine.  Its input files are copied in by name, as the applets download them (several scripts gunzip
+#        their inputs in place), so scratch disk includes the inputs.
+#      - Stage results are saved as a json baseline ('compare' shows which stages got slower or bigger since another).
+#      - cpu seconds, peak RSS and block I/O come from the rusage of the stage's whole process tree (peak RSS is that
+#        of its largest process).  Scratch disk is the high-water mark of the stage directory, sampled.
+#      - Stages whose inputs are missing (e.g. no tRNA annotation) or whose tools are not installed are skipped.
+
+STAGES = [
+    # (stage, command, {file name: glob of stage result}, [required tools])
+    # Fields in {} are files (copied into the stage directory) or the settings ncpus, ram_GB, half_cpus.
+    # Scripts are found on the PATH, except where applets ship different copies ($PIPELINE_DIR is dnanexus/).
+    # references:
+    ("merge-annotation",    "lrna_merge_annotation.sh {annotation} {trna} {spike_ins} bench_merged {ncpus}",
+                            {"gene_gtf": "bench_merged.gtf.gz"}, []),
+    ("index-star",          "lrna_index_star.sh {genome} {spike_ins} {gene_gtf} bench chr21 '' {ncpus}",
+                            {"star_index": "*_starIndex.tgz"}, ["STAR"]),
+    ("index-star-sparse",   "lrna_index_star.sh {genome} {spike_ins} {gene_gtf} bench chr21 '' {ncpus} sparse",
+                            {"star_index_sparse": "*_sparse_starIndex.tgz"}, ["STAR"]),
+    ("index-rsem",          "lrna_index_rsem.sh {genome} {spike_ins} {gene_gtf} bench chr21",
+                            {"rsem_index": "*_rsemIndex.tgz"}, ["rsem-prepare-reference"]),
+    ("index-tophat",        "lrna_index_tophat.sh {genome} {spike_ins} {gene_gtf} {tiny_fq} bench chr21 '' {ncpus}",
+                            {"tophat_index": "*_tophatIndex.tgz"}, ["tophat", "bowtie2-build"]),
+    ("index-all",           "lrna_index_all.sh {genome} {spike_ins} {gene_gtf} {tiny_fq} bench chr21 {ncpus} {ram_GB}",
+                            {}, ["STAR", "rsem-prepare-reference", "tophat"]),
+    ("index-srna",          "srna_index.sh {genome} {gene_gtf} bench chr21",
+                            {"srna_index": "*_sRNA_starIndex.tgz"}, ["STAR"]),
+    # long-rna alignment:
+    ("align-star-pe",       "lrna_align_star_pe.sh {star_index} {pe_stranded_rep1_R1} {pe_stranded_rep1_R2} bench " + \
+                            "{ncpus} {ram_GB} pe_rep1",
+                            {"pe_rep1_genome": "pe_rep1_star_genome.bam", "pe_rep1_anno": "pe_rep1_star_anno.bam",
+                             "pe_rep1_log": "pe_rep1_star_Log.final.out"}, ["STAR", "samtools"]),
+    ("align-star-pe-rep2",  "lrna_align_star_pe.sh {star_index} {pe_stranded_rep2_R1} {pe_stranded_rep2_R2} bench " + \
+                            "{ncpus} {ram_GB} pe_rep2",
+                            {"pe_rep2_genome": "pe_rep2_star_genome.bam", "pe_rep2_anno": "pe_rep2_star_anno.bam",
+                             "pe_rep2_log": "pe_rep2_star_Log.final.out"}, ["STAR", "samtools"]),
+    ("align-star-pe-unstranded", "lrna_align_star_pe.sh {star_index} {pe_unstranded_rep1_R1} {pe_unstranded_rep1_R2} " + \
+                            "bench {ncpus} {ram_GB} pe_unstranded",
+                            {"pe_unstranded_genome": "pe_unstranded_star_genome.bam"}, ["STAR", "samtools"]),
+    ("align-star-pe-sparse", "lrna_align_star_pe.sh {star_index_sparse} {pe_stranded_rep1_R1} {pe_stranded_rep1_R2} " + \
+                            "bench {ncpus} {ram_GB} pe_sparse",
+                            {}, ["STAR", "samtools"]),
+    ("align-star-se",       "lrna_align_star_se.sh {star_index} {se_unstranded_rep1} bench {ncpus} se_rep1 {ram_GB}",
+                            {"se_rep1_genome": "se_rep1_star_genome.bam", "se_rep1_anno": "se_rep1_star_anno.bam"},
+                            ["STAR", "samtools"]),
+    ("align-star-se-rep2",  "lrna_align_star_se.sh {star_index} {se_unstranded_rep2} bench {ncpus} se_rep2 {ram_GB}",
+                            {"se_rep2_anno": "se_rep2_star_anno.bam"}, ["STAR", "samtools"]),
+    ("align-star-se-stranded", "lrna_align_star_se.sh {star_index} {se_stranded_rep1} bench {ncpus} se_stranded {ram_GB}",
+                            {}, ["STAR", "samtools"]),
+    ("split-fastq",         "lrna_split_fastq.sh 2 reads1 {pe_stranded_rep1_R1} && " + \
+                            "lrna_split_fastq.sh 2 reads2 {pe_stranded_rep1_R2}",
+                            {}, []),
+    # Two replicates' alignments stand in for two shards
+    ("merge-star-shards",   "ls -l {pe_rep1_genome} {pe_rep1_anno} {pe_rep1_log} {pe_rep2_genome} {pe_rep2_anno} " + \
+                            "{pe_rep2_log} && lrna_merge_star_shards.sh {ncpus} pe_merged pe_rep1 pe_rep2",
+                            {}, ["samtools"]),
+    ("align-tophat-pe",     "lrna_align_tophat_pe.sh {tophat_index} {pe_stranded_rep1_R1} {pe_stranded_rep1_R2} bench " + \
+                            "{ncpus} pe_rep1",
+                            {}, ["tophat", "samtools"]),
+    ("align-tophat-se",     "lrna_align_tophat_se.sh {tophat_index} {se_unstranded_rep1} bench {ncpus} se_rep1",
+                            {}, ["tophat", "samtools"]),
+    # long-rna signals and quantification:
+    ("signals-stranded",    "lrna_bam_to_signals.sh {pe_rep1_genome} {chrom_sizes} true",
+                            {}, ["STAR", "bedGraphToBigWig"]),
+    ("signals-unstranded",  "lrna_bam_to_signals.sh {se_rep1_genome} {chrom_sizes} false",
+                            {}, ["STAR", "bedGraphToBigWig"]),
+    ("quant-rsem-pe",       "lrna_rsem_quantification.sh {rsem_index} {pe_rep1_anno} true reverse 12345 {ncpus}",
+                            {"pe_rep1_genes": "*_rsem.genes.results"}, ["rsem-calculate-expression"]),
+    ("quant-rsem-pe-rep2",  "lrna_rsem_quantification.sh {rsem_index} {pe_rep2_anno} true reverse 12345 {ncpus}",
+                            {"pe_rep2_genes": "*_rsem.genes.results"}, ["rsem-calculate-expression"]),
+    ("quant-rsem-se",       "lrna_rsem_quantification.sh {rsem_index} {se_rep1_anno} false unstranded 12345 {ncpus}",
+                            {}, ["rsem-calculate-expression"]),
+    ("quant-rsem-defer",    "lrna_rsem_quantification.sh {rsem_index} {pe_rep1_anno} true reverse 12345 {ncpus} defer",
+                            {"rsem_state": "*_rsem_state.tgz"}, ["rsem-calculate-expression"]),
+    ("quant-rsem-ci",       "lrna_rsem_credibility_intervals.sh {rsem_index} {rsem_state}",
+                            {}, ["rsem-calculate-expression"]),
+    ("quant-rsem-multi",    "lrna_rsem_quantification_multi.sh {rsem_index} {ncpus} full " + \
+                            "{pe_rep1_anno},true,reverse,12345,{half_cpus} {se_rep2_anno},false,unstranded,12345,{half_cpus}",
+                            {}, ["rsem-calculate-expression"]),
+    ("mad-qc",              "Rscript `which MAD.R` {pe_rep1_genes} {pe_rep2_genes} > bench_mad_qc.json",
+                            {}, ["Rscript"]),
+    # small-rna:
+    ("srna-align",          "srna_align.sh {srna_index} {srna_rep1} bench {ncpus} srna_rep1",
+                            {"srna_rep1_bam": "srna_rep1_srna_star.bam", "srna_rep1_quant": "srna_rep1_srna_star_quant.tsv"},
+                            ["STAR", "samtools"]),
+    ("srna-align-rep2",     "srna_align.sh {srna_index} {srna_rep2} bench {ncpus} srna_rep2",
+                            {"srna_rep2_quant": "srna_rep2_srna_star_quant.tsv"}, ["STAR", "samtools"]),
+    ("srna-align-collapsed", "srna_align.sh {srna_index} {srna_rep1} bench {ncpus} srna_collapsed ENCODE3 collapsed",
+                            {}, ["STAR", "samtools"]),
+    ("srna-signals",        "srna_signals.sh {srna_rep1_bam} {chrom_sizes}",
+                            {}, ["STAR", "bedGraphToBigWig"]),
+    ("srna-mad-qc",         "cp `which extract_gene_ids.awk` `which sum_srna_expression.awk` `which MAD.R` . && " + \
+                            "srna_mad_qc.sh {gene_gtf} {srna_rep1_quant} {srna_rep2_quant} srna_rep1-2",
+                            {}, ["Rscript"]),
+    # rampage:
+    ("rampage-align",       "rampage_align_star.sh {star_index} {rampage_rep1_R1} {rampage_rep1_R2} bench {ncpus} " + \
+                            "{ram_GB} rampage_rep1_rampage_star",
+                            {"rampage_rep1_bam": "rampage_rep1_rampage_star_marked.bam"}, ["STAR", "samtools"]),
+    ("rampage-align-rep2",  "rampage_align_star.sh {star_index} {rampage_rep2_R1} {rampage_rep2_R2} bench {ncpus} " + \
+                            "{ram_GB} rampage_rep2_rampage_star",
+                            {"rampage_rep2_bam": "rampage_rep2_rampage_star_marked.bam"}, ["STAR", "samtools"]),
+    ("rampage-signals",     "rampage_signal.sh {rampage_rep1_bam} {chrom_sizes} rampage_rep1_rampage_5p true",
+                            {}, ["STAR", "bedGraphToBigWig"]),
+    ("rampage-peaks",       "rampage_peaks.sh {rampage_rep1_bam} {pe_rep1_genome} {gene_gtf} {chrom_sizes} rampage " + \
+                            "{ncpus} rampage_rep1_rampage_peaks",
+                            {"peaks_rep1": "*_peaks.bed.gz", "peak_quants_rep1": "*_peaks_quant.tsv"},
+                            ["call_peaks", "bedToBigBed"]),
+    ("rampage-peaks-rep2",  "rampage_peaks.sh {rampage_rep2_bam} {pe_rep2_genome} {gene_gtf} {chrom_sizes} rampage " + \
+                            "{ncpus} rampage_rep2_rampage_peaks",
+                            {"peaks_rep2": "*_peaks.bed.gz", "peak_quants_rep2": "*_peaks_quant.tsv"},
+                            ["call_peaks", "bedToBigBed"]),
+    ("rampage-idr",         "ln -s `which idr | xargs dirname | xargs dirname` idr && " + \
+                            "rampage_idr.sh {peaks_rep1} {peaks_rep2} {chrom_sizes} rampage_rep1-2_rampage_idr",
+                            {}, ["idr", "bedToBigBed"]),
+    ("rampage-mad-qc",      "rampage_mad_qc.sh {peak_quants_rep1} {peak_quants_rep2} rampage_rep1-2_mad " + \
+                            "$PIPELINE_DIR/rampage/rampage-mad-qc/resources/usr/bin/MAD.R",
+                            {}, ["Rscript"]),
+    ]
+
+METRICS = ["wall_sec", "cpu_sec", "peak_rss_MB", "scratch_MB", "read_MB", "write_MB"]
+NOISE = {"wall_sec": 2.0, "cpu_sec": 2.0, "peak_rss_MB": 50.0, "scratch_MB": 50.0, "read_MB": 50.0, "write_MB": 50.0}
+'''Differences smaller than these are not counted as regressions however large the ratio.'''
+SAMPLE_SECONDS = 1.0
+'''How often the scratch disk of a running stage is measured.'''
+TINY_FQ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prep-tophat", "test", "tiny.fq.gz")
+
+def disk_used(path):
+    '''Returns bytes of disk used under path.'''
+    used = 0
+    for (root, dirs, files) in os.walk(path):
+        for name in files:
+            try:
+                used += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass  # removed while walking
+    return used
+
+def run_measured(command, stage_dir, env, log):
+    '''Runs command in stage_dir, returning its exit status and metrics.'''
+    peak = [disk_used(stage_dir)]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(SAMPLE_SECONDS):
+            peak[0] = max(peak[0], disk_used(stage_dir))
+
+    sampler = threading.Thread(target=sample)
+    sampler.daemon = True
+    sampler.start()
+    start = time.time()
+    proc = subprocess.Popen(["bash", "-e", "-c", command], cwd=stage_dir, env=env, stdout=log,
+                            stderr=subprocess.STDOUT)
+    (pid, status, rusage) = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    done.set()
+    sampler.join()
+    peak[0] = max(peak[0], disk_used(stage_dir))
+    metrics = {"wall_sec":    round(wall, 1),
+               "cpu_sec":     round(rusage.ru_utime + rusage.ru_stime, 1),
+               "peak_rss_MB": round(rusage.ru_maxrss / 1024.0, 1),
+               "scratch_MB":  round(peak[0] / 1048576.0, 1),
+               "read_MB":     round(rusage.ru_inblock * 512 / 1048576.0, 1),
+               "write_MB":    round(rusage.ru_oublock * 512 / 1048576.0, 1)}
+    return (os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status), metrics)
+
+def tool_env():
+    '''Returns the environment with the pipeline's scripts on the PATH after any installed tools.'''
+    env = os.environ.copy()
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script_dirs = sorted(glob.glob(os.path.join(top, "*", "resources", "usr", "bin")) + \
+                         glob.glob(os.path.join(top, "*", "*", "resources", "usr", "bin")))
+    env["PATH"] = os.pathsep.join([env.get("PATH", "")] + script_dirs + [os.path.join(top, "tools")])
+    env["PIPELINE_DIR"] = top
+    return env
+
+def installed(tool, env):
+    return subprocess.call("which " + tool + " > /dev/null 2>&1", shell=True, env=env) == 0
+
+def make_reads(args, files):
+    '''Makes (or reuses) the synthetic fastqs and adds them to the files.'''
+    reads_dir = os.path.join(args.work, "reads")
+    maker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "make_test_reads.py")
+    settings_file = os.path.join(reads_dir, "settings.json")
+    settings = {"depth": args.depth, "read_length": args.read_length, "seed": args.seed,
+                "genome": os.path.abspath(args.genome), "annotation": os.path.abspath(args.annotation)}
+    if not os.path.exists(settings_file) or json.load(open(settings_file)) != settings:
+        if os.path.exists(reads_dir):
+            shutil.rmtree(reads_dir)
+        print "Making synthetic reads..."
+        subprocess.check_call([sys.executable, maker, args.genome, args.annotation, "-o", reads_dir,
+                               "-d", str(args.depth), "--read_length", str(args.read_length),
+                               "-s", str(args.seed)], stdout=open(os.devnull, 'w'))
+        json.dump(settings, open(settings_file, 'w'))
+    for path in glob.glob(os.path.join(reads_dir, "*.fq.gz")):
+        files[os.path.basename(path)[:-len(".fq.gz")]] = path
+    files["chrom_sizes"] = os.path.join(reads_dir, "chrom.sizes")
+
+def run_stages(args):
+    '''Runs the selected stages and returns the benchmark results.'''
+    env = tool_env()
+    files = {"genome": args.genome, "spike_ins": args.spike_ins, "annotation": args.annotation,
+             "gene_gtf": args.annotation, "tiny_fq": args.tiny_fq}
+    if args.trna:
+        files["trna"] = args.trna
+    files = dict((name, os.path.abspath(path)) for (name, path) in files.items())
+    make_reads(args, files)
+    settings = {"ncpus": args.ncpus, "ram_GB": args.ram_GB, "half_cpus": max(1, args.ncpus / 2)}
+    results = {"settings": {"genome": os.path.basename(args.genome), "depth": args.depth,
+                            "read_length": args.read_length, "seed": args.seed, "ncpus": args.ncpus,
+                            "ram_GB": args.ram_GB},
+               "stages": {}}
+    for (stage, command, outputs, tools) in STAGES:
+        if args.stages and stage not in args.stages:
+            continue
+        result = {"status": "skipped"}
+        results["stages"][stage] = result
+        fields = re.findall(r"{(\w+)}", command)
+        missing = [name for name in fields if name not in files and name not in settings]
+        missing += [tool for tool in tools if not installed(tool, env)]
+        if missing:
+            result["missing"] = sorted(set(missing))
+            print "Skipping '%s': no %s" % (stage, ", ".join(result["missing"]))
+            continue
+        stage_dir = os.path.join(args.work, stage)
+        if os.path.exists(stage_dir):
+            shutil.rmtree(stage_dir)
+        os.makedirs(stage_dir)
+        values = dict((name, str(value)) for (name, value) in settings.items())
+        for name in fields:
+            if name in files:
+                copy = os.path.basename(files[name])
+                if not os.path.exists(os.path.join(stage_dir, copy)):
+                    shutil.copy(files[name], os.path.join(stage_dir, copy))
+                values[name] = pipes.quote(copy)
+        print "Running '%s'..." % stage
+        with open(os.path.join(args.work, stage + ".log"), 'w') as log:
+            (status, metrics) = run_measured(command.format(**values), stage_dir, env, log)
+        result.update(metrics)
+        result["status"] = "done" if status == 0 else "failed (%d)" % status
+        print "  %s: %s" % (result["status"], ", ".join("%s %s" % (metric, metrics[metric]) for metric in METRICS))
+        if status != 0:
+            print "  See '%s'" % os.path.join(args.work, stage + ".log")
+            continue
+        for (name, pattern) in outputs.items():
+            matches = sorted(glob.glob(os.path.join(stage_dir, pattern)))
+            if matches:
+                files[name] = matches[0]
+    return results
+
+def compare(old, new, tolerance, metrics=METRICS, noise=NOISE):
+    '''Prints each stage's metrics against a baseline and returns the regressions.'''
+    regressions = []
+    print "%-26s %-12s %12s %12s %8s" % ("stage", "metric", "baseline", "now", "ratio")
+    for stage in sorted(set(old["stages"].keys()) | set(new["stages"].keys())):
+        old_stage = old["stages"].get(stage, {})
+        new_stage = new["stages"].get(stage, {})
+        if old_stage.get("status") != new_stage.get("status"):
+            print "%-26s %-12s %12s %12s" % (stage, "status", old_stage.get("status"), new_stage.get("status"))
+            if old_stage.get("status") == "done":
+                regressions.append((stage, "status"))
+            continue
+        if new_stage.get("status") != "done":
+            continue
+        for metric in metrics:
+            (before, after) = (old_stage.get(metric), new_stage.get(metric))
+            if before is None or after is None:
+                continue
+            ratio = float(after) / before if before else float('inf') if after else 1.0
+            flag = ""
+            if ratio > 1 + tolerance and after - before > noise[metric]:
+                flag = "  <== regression"
+                regressions.append((stage, metric))
+            print "%-26s %-12s %12s %12s %8.2f%s" % (stage, metric, before, after, ratio, flag)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks every DX-independent script on the chr21 reference.")
+    subparsers = parser.add_subparsers(dest='command')
+    runner = subparsers.add_parser('run', help="Run the benchmark and write its results.")
+    runner.add_argument('genome', help="Genome fasta (e.g. 'chr21.fa.gz').")
+    runner.add_argument('spike_ins', help="Spike-in fasta (e.g. 'ERCC.fa.gz').")
+    runner.add_argument('annotation', help="Gene annotation gtf of the genome.")
+    runner.add_argument('--trna', help="tRNA gtf, which lets 'merge-annotation' run and feed the indexes.")
+    runner.add_argument('--tiny_fq', default=TINY_FQ, help="Tiny fastq that completes the TopHat index.")
+    runner.add_argument('-w', '--work', default="chr21_benchmark", help="Work directory (default: 'chr21_benchmark').")
+    runner.add_argument('-o', '--results', help="Results json (default: '<work>/chr21_benchmark.json').")
+    runner.add_argument('-s', '--stages', nargs='+', choices=[stage[0] for stage in STAGES],
+                        help="Stages to run (default: all).  Earlier stages must have made their inputs.")
+    runner.add_argument('-d', '--depth', type=int, default=200000, help="Reads (or pairs) per library.")
+    runner.add_argument('--read_length', type=int, default=100, help="Long-RNA and RAMPAGE read length.")
+    runner.add_argument('--seed', type=int, default=12345, help="Random seed for the reads.")
+    runner.add_argument('--ncpus', type=int, default=multiprocessing.cpu_count(), help="cpus given to each stage.")
+    runner.add_argument('--ram_GB', type=int, default=16, help="Memory (GB) given to each stage that asks.")
+    runner.add_argument('-b', '--baseline', help="Compare the results with this earlier results json.")
+    runner.add_argument('-t', '--tolerance', type=float, default=0.2, help="Fraction worse that is a regression.")
+    comparer = subparsers.add_parser('compare', help="Compare two results jsons.")
+    comparer.add_argument('baseline', help="Earlier results json.")
+    comparer.add_argument('results', help="Later results json.")
+    comparer.add_argument('-t', '--tolerance', type=float, default=0.2, help="Fraction worse that is a regression.")
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        baseline = json.load(open(args.baseline))
+        results = json.load(open(args.results))
+    else:
+        args.work = os.path.abspath(args.work)
+        if not os.path.isdir(args.work):
+            os.makedirs(args.work)
+        results = run_stages(args)
+        results_file = args.results or os.path.join(args.work, "chr21_benchmark.json")
+        with open(results_file, 'w') as fh:
+            json.dump(results, fh, indent=4, sort_keys=True, separators=(",", ": "))
+            fh.write("\n")
+        print "Results: '%s'" % results_file
+        if not args.baseline:
+            return
+        baseline = json.load(open(args.baseline))
+    if baseline.get("settings") != results.get("settings"):
+        print "WARNING: settings differ: %s and %s" % (json.dumps(baseline.get("settings"), sort_keys=True),
+                                                        json.dumps(results.get("settings"), sort_keys=True))
+    regressions = compare(baseline, results, args.tolerance)
+    if regressions:
+        sys.exit("%d regressions: %s" % (len(regressions), ", ".join("%s %s" % pair for pair in regressions)))
+
+if __name__ == '__main__':
+    main()
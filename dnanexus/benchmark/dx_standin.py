@@ -0,0 +1,373 @@
+#!/usr/bin/env python2.7
+# dx_standin.py v1 Answers the DNAnexus API calls of the launchers and applet helpers from an in-memory project model,
+#                  with injected latency and a count of each call, so they can be timed and regression-tested offline.
+
+import sys, os, re, json, time, atexit, fnmatch, argparse, threading, urlparse
+
+# Usage:
+#     dx_standin.py --model model.json --latency_ms 80 --counts counts.json lrnaLaunch.py --test -e ENCSR000AAA -r 1
+#     dx_standin.py --model model.json tools/parse_property.py -f file-... --project ... --root_name
+# or from python, after importing dxpy:
+#     standin = dx_standin.StandIn(json.load(open("model.json")), latency_ms=80)
+#     standin.install()
+#
+# NOTES: The stand-in replaces dxpy's DXHTTPRequest, which every dxpy binding and api call goes through, so the code
+#        under test runs unchanged.  Calls are counted by route ('system/findDataObjects', 'file/describe',
+#        'workflow/addStage'...) and each sleeps --latency_ms (or its route's '--latency route=ms').  Sleeping happens
+#        outside the model's lock, so calls made concurrently overlap as they would against the platform.
+#      - The model is json: {"projects": [...], "objects": [...], "executions": [...], "encoded": {...}}.
+#        projects:   {"name", "id"?, "folders"?: [...]}
+#        objects:    {"class": "file"|"applet"|"workflow"|..., "name", "project" (name or id), "folder"?,
+#                     "properties"?, "details"?, "tags"?, "state"?, "id"?}
+#        executions: {"class": "job"|"analysis", "name", "project", "folder"?, "state"?, "input"?, "output"?, "id"?}
+#        encoded:    {"/experiments/ENCSR000AAA/": {...}, ...} answers encodeD GETs by path, when given.
+#        Missing ids are made up deterministically.  Objects and executions made by the code under test (folders,
+#        workflows and their stages, jobs and analyses run) are added to the model, which '--save' writes out.
+#      - Only the calls the launchers, parse_property.py and dx_long_rna_seq.py make are answered.  Any other is an
+#        'InvalidInput' API error, so a new call shows up rather than passing silently.
+
+DEFAULT_LATENCY_MS = 0
+
+class StandInError(Exception):
+    '''Raised for calls the model cannot answer when dxpy's own API error is not available.'''
+    pass
+
+class StandIn(object):
+    '''In-memory DNAnexus projects, data objects and executions answering DXHTTPRequest calls.'''
+
+    def __init__(self, model, latency_ms=DEFAULT_LATENCY_MS, route_latency_ms=None):
+        self.latency_ms = latency_ms
+        self.route_latency_ms = route_latency_ms or {}
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.serial = 0
+        self.projects = {}
+        self.objects = {}
+        self.executions = {}
+        self.encoded = model.get("encoded", {})
+        for project in model.get("projects", []):
+            project = dict(project)
+            project.setdefault("id", self.new_id("project"))
+            project["folders"] = set(["/"] + project.get("folders", []))
+            self.projects[project["id"]] = project
+        for obj in model.get("objects", []):
+            self.add(self.objects, obj)
+        for execution in model.get("executions", []):
+            execution.setdefault("state", "done")
+            self.add(self.executions, execution)
+
+    def new_id(self, dx_class):
+        '''Returns a made up id of the class, in DNAnexus' form.'''
+        self.serial += 1
+        return "%s-%024d" % (dx_class, self.serial)
+
+    def project_id(self, project):
+        '''Returns the id of a project given by id or name.'''
+        if project in self.projects:
+            return project
+        for (project_id, description) in self.projects.items():
+            if description["name"] == project:
+                return project_id
+        raise self.error("ResourceNotFound", "No project '%s'" % project, 404)
+
+    def add(self, table, item):
+        item = dict(item)
+        item.setdefault("id", self.new_id(item.get("class", "file")))
+        item["class"] = item["id"].split('-')[0]
+        item["project"] = self.project_id(item["project"])
+        item.setdefault("folder", "/")
+        item.setdefault("state", "closed")
+        item.setdefault("properties", {})
+        item.setdefault("tags", [])
+        item.setdefault("created", int(time.time() * 1000))
+        item.setdefault("modified", item["created"])
+        self.make_folder(item["project"], item["folder"])
+        table[item["id"]] = item
+        return item
+
+    def make_folder(self, project_id, folder):
+        folders = self.projects[project_id]["folders"]
+        while folder not in folders:
+            folders.add(folder)
+            folder = os.path.dirname(folder.rstrip('/')) or "/"
+
+    def error(self, error_type, message, code=422):
+        try:
+            from dxpy.exceptions import DXAPIError
+            return DXAPIError({"error": {"type": error_type, "message": message}}, code)
+        except ImportError:
+            return StandInError("%s: %s" % (error_type, message))
+
+    # ----- Matching -----
+
+    def matches_name(self, name, query):
+        if query is None:
+            return True
+        if isinstance(query, dict):
+            if "glob" in query:
+                return fnmatch.fnmatchcase(name, query["glob"])
+            if "regexp" in query:
+                return re.search(query["regexp"], name) is not None
+        return name == query
+
+    def matches_properties(self, properties, query):
+        for (key, value) in (query or {}).items():
+            if key not in properties or (value is not True and properties[key] != value):
+                return False
+        return True
+
+    def in_scope(self, item, scope):
+        if not scope:
+            return True
+        if item["project"] != self.project_id(scope["project"]):
+            return False
+        folder = scope.get("folder", "/")
+        if scope.get("recurse", True):
+            return item["folder"] == folder or item["folder"].startswith(folder.rstrip('/') + '/')
+        return item["folder"] == folder
+
+    # ----- Descriptions -----
+
+    def describe_item(self, item):
+        description = dict(item)
+        if item["class"] == "project":
+            description["folders"] = sorted(item["folders"])
+            description.setdefault("level", "ADMINISTER")
+        return json.loads(json.dumps(description))
+
+    def results(self, items, data):
+        results = []
+        for item in sorted(items, key=lambda item: item["id"]):
+            result = {"id": item["id"]}
+            if item["class"] not in ["project", "job", "analysis"]:
+                result["project"] = item["project"]
+            if data.get("describe"):
+                result["describe"] = self.describe_item(item)
+            if item["class"] == "project":
+                result["level"] = item.get("level", "ADMINISTER")
+            results.append(result)
+        limit = data.get("limit")
+        return {"results": results[:limit] if limit else results, "next": None}
+
+    # ----- Routes -----
+
+    def find_projects(self, data):
+        projects = [project for project in self.projects.values()
+                    if self.matches_name(project["name"], data.get("name")) and
+                       data.get("id", project["id"]) == project["id"]]
+        return self.results([dict(project, **{"class": "project"}) for project in projects], data)
+
+    def find_data_objects(self, data):
+        objects = [obj for obj in self.objects.values()
+                   if data.get("class", obj["class"]) == obj["class"] and
+                      self.matches_name(obj["name"], data.get("name")) and
+                      self.matches_properties(obj["properties"], data.get("properties")) and
+                      data.get("state", obj["state"]) == obj["state"] and self.in_scope(obj, data.get("scope"))]
+        return self.results(objects, data)
+
+    def find_executions(self, data, dx_class=None):
+        states = data.get("state")
+        if isinstance(states, basestring):
+            states = [states]
+        executions = [execution for execution in self.executions.values()
+                      if (dx_class is None or execution["class"] == dx_class) and
+                         ("project" not in data or execution["project"] == self.project_id(data["project"])) and
+                         (not states or execution["state"] in states) and
+                         data.get("created", {}).get("after", 0) <= execution["created"] and
+                         self.matches_name(execution["name"], data.get("name"))]
+        return self.results(executions, data)
+
+    def lookup(self, dx_id):
+        if dx_id in self.objects:
+            return self.objects[dx_id]
+        if dx_id in self.executions:
+            return self.executions[dx_id]
+        if dx_id in self.projects:
+            return dict(self.projects[dx_id], **{"class": "project"})
+        raise self.error("ResourceNotFound", "'%s' is not in the model" % dx_id, 404)
+
+    def new_object(self, dx_class, data):
+        item = {"class": dx_class, "name": data.get("name", dx_class), "project": data["project"],
+                "folder": data.get("folder", "/"), "properties": data.get("properties", {}),
+                "details": data.get("details", {}), "state": "open"}
+        if dx_class == "workflow":
+            item.update({"stages": [], "editVersion": 0})
+        return {"id": self.add(self.objects, item)["id"]}
+
+    def run(self, executable, data):
+        dx_class = "analysis" if executable["class"] == "workflow" else "job"
+        execution = self.add(self.executions, {"class": dx_class, "name": data.get("name", executable["name"]),
+                                               "project": data.get("project", executable["project"]),
+                                               "folder": data.get("folder", executable.get("folder", "/")),
+                                               "executable": executable["id"], "input": data.get("input", {}),
+                                               "output": {}, "state": "done"})
+        return {"id": execution["id"]}
+
+    def object_route(self, dx_id, method, data):
+        if method == "newFolder":
+            self.make_folder(self.project_id(dx_id), data["folder"])
+            return {"id": dx_id}
+        if method == "listFolder":
+            project_id = self.project_id(dx_id)
+            folder = data.get("folder", "/")
+            objects = [obj for obj in self.objects.values() if obj["project"] == project_id and obj["folder"] == folder]
+            parent = folder.rstrip('/') or "/"
+            folders = sorted(sub for sub in self.projects[project_id]["folders"]
+                             if sub != "/" and os.path.dirname(sub.rstrip('/')) == parent)
+            listing = {"objects": [{"id": obj["id"]} for obj in sorted(objects, key=lambda obj: obj["id"])]}
+            if data.get("describe"):
+                for entry in listing["objects"]:
+                    entry["describe"] = self.describe_item(self.objects[entry["id"]])
+            if data.get("only", "all") in ["all", "folders"]:
+                listing["folders"] = folders
+            return listing
+        item = self.lookup(dx_id)
+        if method == "describe":
+            return self.describe_item(item)
+        if method == "setProperties":
+            for (key, value) in data.get("properties", {}).items():
+                if value is None:
+                    item["properties"].pop(key, None)
+                else:
+                    item["properties"][key] = value
+            return {"id": dx_id}
+        if method == "addTags":
+            item["tags"] = item["tags"] + [tag for tag in data.get("tags", []) if tag not in item["tags"]]
+            return {"id": dx_id}
+        if method == "removeTags":
+            item["tags"] = [tag for tag in item["tags"] if tag not in data.get("tags", [])]
+            return {"id": dx_id}
+        if method == "getDetails":
+            return item.get("details", {})
+        if method == "setDetails":
+            item["details"] = data
+            return {"id": dx_id}
+        if method == "close":
+            item["state"] = "closed"
+            return {"id": dx_id}
+        if method == "addStage" and item["class"] == "workflow":
+            stage = {"id": "stage-%024d" % (len(item["stages"]) + 1), "executable": data["executable"],
+                     "name": data.get("name"), "folder": data.get("folder"), "input": data.get("input", {})}
+            item["stages"].append(stage)
+            item["editVersion"] += 1
+            return {"stage": stage["id"], "editVersion": item["editVersion"]}
+        if method == "run" and item["class"] in ["applet", "app", "workflow"]:
+            return self.run(item, data)
+        raise self.error("InvalidInput", "The stand-in does not answer '%s/%s'" % (item["class"], method))
+
+    def answer(self, route, data):
+        '''Returns the response to one API call.'''
+        (target, method) = route.strip('/').split('/', 1)
+        if target == "system":
+            if method == "findProjects":
+                return self.find_projects(data)
+            if method == "findDataObjects":
+                return self.find_data_objects(data)
+            if method in ["findExecutions", "findJobs", "findAnalyses"]:
+                return self.find_executions(data, {"findJobs": "job", "findAnalyses": "analysis"}.get(method))
+            raise self.error("InvalidInput", "The stand-in does not answer 'system/%s'" % method)
+        if method == "new" and target in ["file", "workflow", "record"]:
+            return self.new_object(target, data)
+        return self.object_route(target, method, data)
+
+    def route_name(self, route):
+        (target, method) = route.strip('/').split('/', 1)
+        return "%s/%s" % (target.split('-')[0], method)
+
+    # ----- Calls -----
+
+    def request(self, resource, data=None, method='POST', **kwargs):
+        '''Stands in for dxpy.DXHTTPRequest.'''
+        route = self.route_name(resource)
+        with self.lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+        time.sleep(self.route_latency_ms.get(route, self.latency_ms) / 1000.0)
+        with self.lock:
+            # Responses are copies, as the platform's are, so callers cannot change the model by accident
+            return json.loads(json.dumps(self.answer(resource, data if isinstance(data, dict) else {})))
+
+    def encoded_request(self, session, method, url, *args, **kwargs):
+        '''Stands in for requests' Session.request, answering encodeD GETs from the model.'''
+        import requests
+        path = urlparse.urlparse(url).path
+        route = "encoded/" + method.upper()
+        with self.lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+        time.sleep(self.route_latency_ms.get(route, self.latency_ms) / 1000.0)
+        response = requests.models.Response()
+        response.url = url
+        response.status_code = 404
+        response._content = json.dumps({"status": "error", "title": "Not Found"})
+        if method.upper() == "GET" and path in self.encoded:
+            response.status_code = 200
+            response._content = json.dumps(self.encoded[path])
+        return response
+
+    def install(self):
+        '''Routes dxpy's API calls (and encodeD's, when the model has any) to the stand-in.'''
+        import dxpy
+        dxpy.DXHTTPRequest = self.request
+        api = sys.modules.get('dxpy.api')
+        if api is not None:
+            api.DXHTTPRequest = self.request
+        if self.encoded:
+            import requests.sessions
+            standin = self
+            def request(session, method, url, *args, **kwargs):
+                return standin.encoded_request(session, method, url, *args, **kwargs)
+            requests.sessions.Session.request = request
+
+    def model(self):
+        '''Returns the model as it is now, in the form it was given.'''
+        projects = [dict(project, folders=sorted(project["folders"])) for project in self.projects.values()]
+        return {"projects": sorted(projects, key=lambda project: project["id"]),
+                "objects": sorted(self.objects.values(), key=lambda obj: obj["id"]),
+                "executions": sorted(self.executions.values(), key=lambda execution: execution["id"]),
+                "encoded": self.encoded}
+
+    def report(self, counts_file=None):
+        '''Writes the calls made to stderr and, if given a file, as json.'''
+        total = sum(self.counts.values())
+        print >> sys.stderr, "dx stand-in: %d calls: %s" % (total, ", ".join("%s %d" % (route, self.counts[route])
+                                                            for route in sorted(self.counts)))
+        if counts_file:
+            with open(counts_file, 'w') as fh:
+                json.dump({"total": total, "calls": self.counts}, fh, indent=4, sort_keys=True,
+                          separators=(",", ": "))
+                fh.write("\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a python script against an offline DNAnexus stand-in.")
+    parser.add_argument('-m', '--model', help="Project model json (default: no projects).")
+    parser.add_argument('--latency_ms', type=float, default=DEFAULT_LATENCY_MS, help="Latency of each call.")
+    parser.add_argument('--latency', action='append', default=[], metavar="ROUTE=MS",
+                        help="Latency of one route, e.g. 'system/findDataObjects=250' (repeatable).")
+    parser.add_argument('-c', '--counts', help="Write the calls made by route to this json.")
+    parser.add_argument('-s', '--save', help="Write the model, with what the script made, to this json.")
+    parser.add_argument('script', help="Python script to run.")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="The script's arguments.")
+    args = parser.parse_args()
+
+    model = json.load(open(args.model)) if args.model else {}
+    route_latency_ms = dict((route, float(ms)) for (route, ms) in (pair.split('=', 1) for pair in args.latency))
+    standin = StandIn(model, args.latency_ms, route_latency_ms)
+    if standin.projects and "DX_PROJECT_CONTEXT_ID" not in os.environ:
+        os.environ["DX_PROJECT_CONTEXT_ID"] = sorted(standin.projects)[0]
+    import dxpy
+    import dxpy.api
+    standin.install()
+    def finish():
+        standin.report(args.counts)
+        if args.save:
+            with open(args.save, 'w') as fh:
+                json.dump(standin.model(), fh, indent=4, sort_keys=True, separators=(",", ": "))
+                fh.write("\n")
+    atexit.register(finish)
+
+    import runpy
+    sys.argv = [args.script] + args.args
+    sys.path[0] = os.path.dirname(os.path.abspath(args.script))
+    runpy.run_path(args.script, run_name="__main__")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python2.7
+# launch_benchmark.py v2 Times launcher command lines with '--profile', recording each launch's wall time, the time
+#                        of each of its phases and its remote calls, and compares them with a baseline.
+
+import sys, os, json, time, shlex, argparse, tempfile, subprocess
+
+from chr21_benchmark import compare
+
+# NOTES: Each case is a launcher command line, run '--repeat' times.  Times are the medians of the runs and remote
+#        calls those of the last run.  wall_sec includes starting python, so '--help' cases show the startup cost.
+#      - Launchers are found in the pipeline directory (e.g. 'lrnaLaunch.py', 'rampage/rampageLaunch.py') and run with
+#        this python.  With '--standin' they run offline against dx_standin.py's model of projects, files and encodeD
+#        metadata, each call taking '--latency_ms', so results only change when the launchers do.  Without it they talk
+#        to whatever platform the environment is logged in to.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.join(BENCHMARK_DIR, "..")
+CASES = ["lrnaLaunch.py --help", "rampage/rampageLaunch.py --help", "small-rna/srnaLaunch.py --help"]
+'''Cases run when none are given: starting each launcher.'''
+NOISE_SEC = 0.05
+IMPORT_CHECKS = ["from xml.dom import minidom; minidom.parseString('<a/>')",
+                 "import xml.dom.minidom; xml.dom.minidom.parseString('<a/>')",
+                 "from xml import dom; dom.Node",
+                 "import xml.etree.ElementTree as ElementTree; ElementTree.fromstring('<a/>')"]
+'''Imports that must work with 'xml' deferred by launch_profile.defer_imports(), as dxpy and dxencode are.'''
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) / 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+def run_case(case, repeat, log, standin=None, latency_ms=0):
+    '''Runs one launcher command line repeatedly and returns its result.'''
+    words = shlex.split(case)
+    command = [sys.executable]
+    if standin:
+        command += [os.path.join(BENCHMARK_DIR, "dx_standin.py"), "--model", standin, "--latency_ms", str(latency_ms)]
+    command += [os.path.join(PIPELINE_DIR, words[0])] + words[1:]
+    (walls, profiles) = ([], [])
+    for run in range(repeat):
+        (fd, profile_file) = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        began = time.time()
+        status = subprocess.call(command + ["--profile", profile_file], stdout=log, stderr=subprocess.STDOUT)
+        walls.append(time.time() - began)
+        try:
+            with open(profile_file) as fh:
+                profiles.append(json.load(fh))
+        except ValueError:
+            pass  # the launcher failed before profiling
+        os.remove(profile_file)
+        # A launcher exits with 0 after '--help'; a failed run is not timed again.
+        if status != 0 or len(profiles) <= run:
+            return {"status": "failed (%d)" % status}
+    result = {"status": "done", "wall_sec": round(median(walls), 3),
+              "launch_sec": round(median([profile["total_sec"] for profile in profiles]), 3),
+              "remote_calls": sum(phase["remote_calls"] for phase in profiles[-1]["phases"].values())}
+    for name in profiles[-1]["phase_order"]:
+        times = [profile["phases"][name]["wall_sec"] for profile in profiles if name in profile["phases"]]
+        result[name + "_sec"] = round(median(times), 3)
+    return result
+
+def check_imports(checks):
+    '''Runs each import check in a fresh python and returns those that failed.'''
+    failed = []
+    for check in checks:
+        script = "import sys; sys.path.insert(0, %r); " % PIPELINE_DIR + \
+                 "import launch_profile; launch_profile.defer_imports(['xml']); %s; " % check + \
+                 "assert all(vars(sys.modules['xml']).get(name[4:]) is module for (name, module) in " + \
+                 "sys.modules.items() if name.startswith('xml.') and name.count('.') == 1 and module)"
+        process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        print "  %s: %s" % ("ok" if process.returncode == 0 else "FAILED", check)
+        if process.returncode != 0:
+            print "    " + output.strip().replace("\n", "\n    ")
+            failed.append(check)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks launcher command lines by launch phase.")
+    subparsers = parser.add_subparsers(dest='command')
+    runner = subparsers.add_parser('run', help="Run the benchmark and write its results.")
+    runner.add_argument('-c', '--case', action='append', dest='cases',
+                        help="Launcher command line, relative to the pipeline directory, e.g. " + \
+                             "\"lrnaLaunch.py --test -e ENCSR000AAA -r 1\" (repeatable; default: each '--help').")
+    runner.add_argument('-s', '--standin', help="Run offline against this dx_standin.py model json.")
+    runner.add_argument('--latency_ms', type=float, default=50, help="Latency of each stand-in call (default: 50).")
+    runner.add_argument('-r', '--repeat', type=int, default=3, help="Runs of each case (default: 3).")
+    runner.add_argument('-o', '--results', default="launch_benchmark.json", help="Results json.")
+    runner.add_argument('-l', '--log', default="launch_benchmark.log", help="Launchers' output.")
+    runner.add_argument('-b', '--baseline', help="Compare the results with this earlier results json.")
+    runner.add_argument('-t', '--tolerance', type=float, default=0.2, help="Fraction worse that is a regression.")
+    comparer = subparsers.add_parser('compare', help="Compare two results jsons.")
+    comparer.add_argument('baseline', help="Earlier results json.")
+    comparer.add_argument('results', help="Later results json.")
+    comparer.add_argument('-t', '--tolerance', type=float, default=0.2, help="Fraction worse that is a regression.")
+    subparsers.add_parser('imports', help="Check imports of a deferred package's submodules (see launch_profile.py).")
+    args = parser.parse_args()
+
+    if args.command == 'imports':
+        failed = check_imports(IMPORT_CHECKS)
+        if failed:
+            sys.exit("%d import checks failed" % len(failed))
+        return
+    if args.command == 'compare':
+        baseline = json.load(open(args.baseline))
+        results = json.load(open(args.results))
+    else:
+        results = {"settings": {"repeat": args.repeat}, "stages": {}}
+        if args.standin:
+            args.standin = os.path.abspath(args.standin)
+            results["settings"].update({"standin": os.path.basename(args.standin), "latency_ms": args.latency_ms})
+        with open(args.log, 'w') as log:
+            for case in args.cases or CASES:
+                print "Running '%s'..." % case
+                log.write("==== %s\n" % case)
+                log.flush()
+                result = run_case(case, args.repeat, log, args.standin, args.latency_ms)
+                results["stages"][case] = result
+                print "  %s: %s" % (result["status"], ", ".join("%s %s" % (metric, result[metric])
+                                                             for metric in sorted(result) if metric != "status"))
+        with open(args.results, 'w') as fh:
+            json.dump(results, fh, indent=4, sort_keys=True, separators=(",", ": "))
+            fh.write("\n")
+        print "Results: '%s'" % args.results
+        if not args.baseline:
+            return
+        baseline = json.load(open(args.baseline))
+    if baseline.get("settings") != results.get("settings"):
+        print "WARNING: settings differ: %s and %s" % (json.dumps(baseline.get("settings"), sort_keys=True),
+                                                        json.dumps(results.get("settings"), sort_keys=True))
+    metrics = set()
+    for stage in baseline["stages"].values() + results["stages"].values():
+        metrics |= set(metric for metric in stage if metric.endswith("_sec"))
+    metrics = ["wall_sec", "launch_sec"] + sorted(metrics - set(["wall_sec", "launch_sec"])) + ["remote_calls"]
+    noise = dict((metric, NOISE_SEC) for metric in metrics)
+    noise["remote_calls"] = 0
+    regressions = compare(baseline, results, args.tolerance, metrics, noise)
+    if regressions:
+        sys.exit("%d regressions: %s" % (len(regressions), ", ".join("%s %s" % pair for pair in regressions)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python2.7
+# make_test_reads.py v1 Makes synthetic long-RNA, small-RNA and RAMPAGE fastqs from a genome and its annotation.
+#                       Reads are drawn from annotated transcripts with seeded random expression, so the same
+#                       arguments always make the same reads.
+
+import sys, os, gzip, random, argparse
+
+LIBRARIES = {
+    # library: (paired, kind)
+    "pe_stranded":   (True,  "long"),
+    "pe_unstranded": (True,  "long"),
+    "se_stranded":   (False, "long"),
+    "se_unstranded": (False, "long"),
+    "srna":          (False, "small"),
+    "rampage":       (True,  "rampage"),
+    }
+SMALL_TYPES = ["miRNA", "snoRNA", "snRNA", "misc_RNA", "scaRNA", "Mt_tRNA", "tRNA"]
+SRNA_ADAPTER = "TGGAATTCTCGGGTGCCAAGG"   # Clipped by srna_align.sh's ENCODE3 model
+RAMPAGE_CLIP = (6, 15)                   # 5' bases clipped from RAMPAGE read1 and read2 by rampage_align_star.sh
+FRAGMENT_MEAN = 250
+FRAGMENT_SD = 50
+ERROR_RATE = 0.005
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
+
+def open_text(path):
+    return gzip.open(path) if path.endswith(".gz") else open(path)
+
+def revcomp(seq):
+    return ''.join(COMPLEMENT.get(base, 'N') for base in reversed(seq))
+
+def read_fasta(path):
+    '''Returns {chrom: sequence} of an (optionally gzipped) fasta file.'''
+    genome = {}
+    chrom = None
+    parts = []
+    for line in open_text(path):
+        if line.startswith('>'):
+            if chrom is not None:
+                genome[chrom] = ''.join(parts).upper()
+            chrom = line[1:].split()[0]
+            parts = []
+        else:
+            parts.append(line.strip())
+    if chrom is not None:
+        genome[chrom] = ''.join(parts).upper()
+    return genome
+
+def read_transcripts(path, genome):
+    '''Returns [(transcript_type, sequence)] for the gtf's transcripts on the genome's chromosomes.'''
+    exons = {}
+    for line in open_text(path):
+        if line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 9 or fields[2] != "exon" or fields[0] not in genome:
+            continue
+        attrs = {}
+        for attr in fields[8].split(';'):
+            parts = attr.strip().split(' ', 1)
+            if len(parts) == 2:
+                attrs[parts[0]] = parts[1].strip('"')
+        transcript_id = attrs.get("transcript_id")
+        if transcript_id is None:
+            continue
+        transcript_type = attrs.get("transcript_type", attrs.get("gene_type", ""))
+        entry = exons.setdefault(transcript_id, (fields[0], fields[6], transcript_type, []))
+        entry[3].append((int(fields[3]) - 1, int(fields[4])))
+    transcripts = []
+    for transcript_id in sorted(exons.keys()):
+        (chrom, strand, transcript_type, spans) = exons[transcript_id]
+        seq = ''.join(genome[chrom][start:end] for (start, end) in sorted(spans))
+        if strand == '-':
+            seq = revcomp(seq)
+        if seq and seq.count('N') < len(seq) / 10:
+            transcripts.append((transcript_type, seq))
+    return transcripts
+
+def with_errors(seq, rng):
+    '''Adds sequencing errors at about ERROR_RATE per base.'''
+    if rng.random() >= len(seq) * ERROR_RATE:
+        return seq
+    pos = rng.randrange(len(seq))
+    return seq[:pos] + rng.choice([base for base in "ACGT" if base != seq[pos]]) + seq[pos + 1:]
+
+def fit(seq, length, rng):
+    '''Pads (with random bases) or trims a read to the read length.'''
+    if len(seq) < length:
+        seq += ''.join(rng.choice("ACGT") for _ in range(length - len(seq)))
+    return seq[:length]
+
+def expression(count, rep, seed):
+    '''Returns seeded lognormal expression weights; a second replicate varies a little from the first.'''
+    rng = random.Random(seed)
+    weights = [rng.lognormvariate(0, 2) for _ in range(count)]
+    if rep > 1:
+        rep_rng = random.Random(seed * 1000 + rep)
+        weights = [weight * rep_rng.lognormvariate(0, 0.3) for weight in weights]
+    return weights
+
+def choose(cumulative, total, rng):
+    '''Returns the index drawn from cumulative weights.'''
+    target = rng.random() * total
+    lo, hi = 0, len(cumulative) - 1
+    while lo < hi:
+        mid = (lo + hi) / 2
+        if cumulative[mid] < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def make_library(library, rep, transcripts, out_dir, depth, read_length, seed):
+    '''Writes one library's fastq(s) and returns their paths.'''
+    (paired, kind) = LIBRARIES[library]
+    if kind == "small":
+        pool = [seq for (transcript_type, seq) in transcripts if transcript_type in SMALL_TYPES]
+        if not pool:
+            pool = [seq for (transcript_type, seq) in transcripts]
+    else:
+        pool = [seq for (transcript_type, seq) in transcripts if len(seq) >= read_length + 50]
+    if not pool:
+        sys.exit("ERROR: No transcripts to make '%s' reads from." % library)
+    cumulative = []
+    total = 0.0
+    for weight in expression(len(pool), rep, seed):
+        total += weight
+        cumulative.append(total)
+    rng = random.Random("%d_%s_%d" % (seed, library, rep))
+
+    root = os.path.join(out_dir, "%s_rep%d" % (library, rep))
+    paths = [root + "_R1.fq.gz", root + "_R2.fq.gz"] if paired else [root + ".fq.gz"]
+    outs = [gzip.open(path, 'wb', 1) for path in paths]
+    quals = 'I' * read_length
+    for ix in xrange(depth):
+        seq = pool[choose(cumulative, total, rng)]
+        if kind == "small":
+            start = rng.randrange(max(1, len(seq) - 30))
+            insert = seq[start:start + rng.randint(18, 30)]
+            reads = [fit(insert + SRNA_ADAPTER, read_length, rng)]
+        elif kind == "rampage":
+            # Read1 starts at (or near) the 5' end of the transcript, read2 is the antisense end of the fragment
+            start = min(rng.randint(0, 5), len(seq) - read_length)
+            end = min(len(seq), start + max(read_length, int(rng.gauss(FRAGMENT_MEAN, FRAGMENT_SD))))
+            fragment = seq[start:end]
+            reads = [fit(''.join(rng.choice("ACGT") for _ in range(RAMPAGE_CLIP[0])) + fragment, read_length, rng),
+                     fit(''.join(rng.choice("ACGT") for _ in range(RAMPAGE_CLIP[1])) + revcomp(fragment),
+                         read_length, rng)]
+        else:
+            length = min(len(seq), max(read_length, int(rng.gauss(FRAGMENT_MEAN, FRAGMENT_SD))))
+            start = rng.randint(0, len(seq) - length)
+            fragment = seq[start:start + length]
+            # Stranded libraries are ENCODE's usual rd1-/rd2+ (AKA 'reverse')
+            reads = [revcomp(fragment)[:read_length], fragment[:read_length]]
+            if library.endswith("unstranded") and rng.random() < 0.5:
+                reads.reverse()
+            if not paired:
+                reads = reads[:1]
+        name = "@%s_rep%d_%d" % (library, rep, ix + 1)
+        for (out, read) in zip(outs, reads):
+            out.write("%s\n%s\n+\n%s\n" % (name, with_errors(read, rng), quals[:len(read)]))
+    for out in outs:
+        out.close()
+    return paths
+
+def write_chrom_sizes(genome, out_dir):
+    path = os.path.join(out_dir, "chrom.sizes")
+    with open(path, 'w') as fh:
+        for chrom in sorted(genome.keys()):
+            fh.write("%s\t%d\n" % (chrom, len(genome[chrom])))
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Makes synthetic RNA-seq fastqs from a genome fasta and gtf.")
+    parser.add_argument('genome', help="Genome fasta (e.g. 'chr21.fa.gz').")
+    parser.add_argument('annotation', help="Gene annotation gtf of the genome (e.g. 'gencode.v24.chr21.gtf.gz').")
+    parser.add_argument('-o', '--out_dir', default='.', help="Directory for the fastqs and 'chrom.sizes'.")
+    parser.add_argument('-l', '--libraries', nargs='+', default=sorted(LIBRARIES.keys()),
+                        choices=sorted(LIBRARIES.keys()), help="Libraries to make (default: all).")
+    parser.add_argument('-r', '--reps', type=int, default=2, help="Replicates of each library (default: 2).")
+    parser.add_argument('-d', '--depth', type=int, default=200000, help="Reads (or pairs) per library.")
+    parser.add_argument('--read_length', type=int, default=100, help="Long-RNA and RAMPAGE read length.")
+    parser.add_argument('--srna_length', type=int, default=50, help="Small-RNA read length.")
+    parser.add_argument('-s', '--seed', type=int, default=12345, help="Random seed.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    genome = read_fasta(args.genome)
+    transcripts = read_transcripts(args.annotation, genome)
+    print >> sys.stderr, "Read %d chromosomes and %d transcripts" % (len(genome), len(transcripts))
+    print write_chrom_sizes(genome, args.out_dir)
+    for library in args.libraries:
+        read_length = args.srna_length if LIBRARIES[library][1] == "small" else args.read_length
+        for rep in range(1, args.reps + 1):
+            for path in make_library(library, rep, transcripts, args.out_dir, args.depth, read_length, args.seed):
+                print path
+
+if __name__ == '__main__':
+    main()
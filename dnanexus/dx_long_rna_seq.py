@@ -57,6 +57,7 @@ ANALYSIS_STEPS = [
     'prep-star',
     'prep-rsem',
     'prep-tophat',
+    'prep-indexes',
     'align-star-se',
     'align-star-pe',
     'align-tophat-pe',
@@ -114,6 +115,11 @@ def get_args():
                     default=8,
                     required=False)
 
+    ap.add_argument('-i', '--prep_indexes',
+                    help='Build the STAR, RSEM and TopHat indexes in one prep-indexes job',
+                    action='store_true',
+                    required=False)
+
     return ap.parse_args()
 
 def find_reference_file_by_name(reference_name, project_name):
@@ -179,27 +185,47 @@ def populate_workflow(wf, replicates, experiment, inputs, applets_project_id, ex
         prep_input['genome'] = genome
         prep_input['spike_in'] = spike_in
         prep_input['index_prefix'] = index_prefix
-    stage_id = wf.add_stage(find_applet_by_name('prep-star', applets_project_id), stage_input=prep_input, folder=experiment)
-    prep_star_output = dxpy.dxlink({
-        'stage': stage_id,
-        'outputField': 'star_index'
-    })
-    #'prep-tophat',
-    stage_id = wf.add_stage(find_applet_by_name('prep-tophat', applets_project_id), stage_input=prep_input, folder=experiment)
-    prep_tophat_output = dxpy.dxlink({
-        'stage': stage_id,
-        'outputField': 'tophat_index'
-    })
-    #'prep-rsem',
-    if not export:
-        prep_input['genome'] = rsem_genome
-        ## overwrite with male only
-
-    stage_id = wf.add_stage(find_applet_by_name('prep-rsem', applets_project_id), stage_input=prep_input, folder=experiment)
-    prep_rsem_output = dxpy.dxlink({
-        'stage': stage_id,
-        'outputField': 'rsem_index'
-    })
+    if inputs.get('prep_indexes'):
+        #'prep-indexes', all three indexes from one download and unzip of the inputs
+        rsem_input = dict(prep_input)
+        if not export and inputs['gender'] != 'm':
+            rsem_input['rsem_genome'] = rsem_genome  # RSEM always takes male genome
+        stage_id = wf.add_stage(find_applet_by_name('prep-indexes', applets_project_id), stage_input=rsem_input, folder=experiment)
+        prep_star_output = dxpy.dxlink({
+            'stage': stage_id,
+            'outputField': 'star_index'
+        })
+        prep_tophat_output = dxpy.dxlink({
+            'stage': stage_id,
+            'outputField': 'tophat_index'
+        })
+        prep_rsem_output = dxpy.dxlink({
+            'stage': stage_id,
+            'outputField': 'rsem_index'
+        })
+    else:
+        stage_id = wf.add_stage(find_applet_by_name('prep-star', applets_project_id), stage_input=prep_input, folder=experiment)
+        prep_star_output = dxpy.dxlink({
+            'stage': stage_id,
+            'outputField': 'star_index'
+        })
+        #'prep-tophat',
+        stage_id = wf.add_stage(find_applet_by_name('prep-tophat', applets_project_id), stage_input=prep_input, folder=experiment)
+        prep_tophat_output = dxpy.dxlink({
+            'stage': stage_id,
+            'outputField': 'tophat_index'
+        })
+    #'prep-rsem', unless prep-indexes already built it (from the male genome)
+    if not inputs.get('prep_indexes'):
+        if not export:
+            prep_input['genome'] = rsem_genome
+            ## overwrite with male only
+
+        stage_id = wf.add_stage(find_applet_by_name('prep-rsem', applets_project_id), stage_input=prep_input, folder=experiment)
+        prep_rsem_output = dxpy.dxlink({
+            'stage': stage_id,
+            'outputField': 'rsem_index'
+        })
 
     ## alignment steps
     align_input = {
@@ -330,6 +356,7 @@ def main():
     inputs['organism'] = args.organism
     inputs['library_id'] = args.library
     inputs['nthreads'] = args.nthreads
+    inputs['prep_indexes'] = args.prep_indexes
     #TODO determine paired or gender from ENCSR metadata
     # Now create a new workflow ()
     inputs['spec_name'] = args.experiment+'-'+'-'.join([ r.split('.')[0] for r in args.replicates])
@@ -0,0 +1,223 @@
+#!/usr/bin/env python2.7
+# job_monitor.py 1.0.2  Tracks the states of a project's jobs and analyses with one batched query per interval, so
+#                       launchers and submitters can wait on them or be called back when they finish.
+
+import sys
+import time
+import argparse
+import threading
+import subprocess
+
+import dxpy
+
+# NOTES: Each refresh is one (paged) findExecutions query for the project, covering every execution that may still
+#        be running: those created since the oldest unfinished one the monitor knows of.  States are cached, so
+#        asking whether a results folder has running analyses, or whether a job is done, costs no further calls.
+#      - The interval starts at '--interval' seconds and grows by 'backoff' while nothing changes, up to
+#        '--max_interval'; any change of state, or executions newly tracked, bring it back down.
+#      - Callbacks (on_done, on_change) run on the thread refreshing the monitor: the caller of wait() or refresh(),
+#        or the monitor's own thread after start().
+#      - At first the monitor looks back 'lookback_hours' for executions still running (e.g. for running_in()).
+#        Executions created before then ('window_ms') are unknown to it, however long they have been running.
+
+TERMINAL_STATES = ["done", "failed", "terminated", "partially_failed"]
+FIELDS = {"id": True, "class": True, "name": True, "state": True, "folder": True, "created": True,
+          "executableName": True, "output": True, "failureReason": True, "parentAnalysis": True}
+
+
+class JobMonitor(object):
+    '''Cached states of a project's jobs and analyses, refreshed with one query per interval.'''
+
+    def __init__(self, project, interval=5.0, max_interval=120.0, backoff=1.5, lookback_hours=72, verbose=False):
+        self.project = project
+        self.interval = interval
+        self.min_interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.verbose = verbose
+        self.since_ms = int((time.time() - lookback_hours * 3600) * 1000)
+        self.window_ms = self.since_ms
+        self.executions = {}
+        self.watches = []
+        self.listeners = []
+        self.lock = threading.RLock()
+        self.queries = 0
+        self.thread = None
+        self.stopping = threading.Event()
+
+    # ----- Queries -----
+
+    def find_executions(self, query):
+        '''Returns every page of a findExecutions query.'''
+        results = []
+        while True:
+            response = dxpy.api.system_find_executions(query)
+            self.queries += 1
+            results += response.get("results", [])
+            if not response.get("next"):
+                return results
+            query = dict(query, starting=response["next"])
+
+    def refresh(self):
+        '''Brings the cached states up to date and calls back on what changed.  Returns the number of changes.'''
+        with self.lock:
+            started_ms = int(time.time() * 1000)
+            query = {"project": self.project, "includeSubjobs": False, "created": {"after": self.since_ms},
+                     "describe": {"fields": FIELDS}}
+            changed = []
+            for result in self.find_executions(query):
+                description = result.get("describe", {"id": result["id"]})
+                known = self.executions.get(result["id"])
+                if known is None or known.get("state") != description.get("state"):
+                    changed.append(description)
+                self.executions[result["id"]] = description
+            # The next query need only reach back to the oldest execution still unfinished
+            unfinished = [execution.get("created", started_ms) for execution in self.executions.values()
+                          if execution.get("state") not in TERMINAL_STATES]
+            self.since_ms = min(unfinished + [started_ms]) - 1000
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            if self.verbose:
+                print >> sys.stderr, "job_monitor: %d executions, %d changed, next look in %.1fs" % \
+                                     (len(self.executions), len(changed), self.interval)
+            for description in changed:
+                for listener in list(self.listeners):
+                    listener(description)
+            self.fire_watches()
+            return len(changed)
+
+    # ----- Subscriptions -----
+
+    def track(self, execution_ids):
+        '''Adds executions just started, which the next refresh will find, and looks again soon.'''
+        with self.lock:
+            now_ms = int(time.time() * 1000)
+            self.interval = self.min_interval
+            for execution_id in execution_ids:
+                self.executions.setdefault(execution_id, {"id": execution_id, "state": "idle", "created": now_ms})
+                self.since_ms = min(self.since_ms, now_ms - 60000)
+
+    def on_change(self, callback):
+        '''Calls callback(description) whenever an execution's state changes.'''
+        with self.lock:
+            self.listeners.append(callback)
+
+    def on_done(self, execution_ids, callback):
+        '''Calls callback({id: description}) once all of the executions have finished (whether done or failed).'''
+        with self.lock:
+            self.track(execution_ids)
+            self.watches.append((list(execution_ids), callback))
+            self.fire_watches()
+
+    def fire_watches(self):
+        for (execution_ids, callback) in list(self.watches):
+            if all(self.finished(execution_id) for execution_id in execution_ids):
+                self.watches.remove((execution_ids, callback))
+                callback(dict((execution_id, self.executions[execution_id]) for execution_id in execution_ids))
+
+    # ----- Cached states -----
+
+    def state(self, execution_id):
+        with self.lock:
+            return self.executions.get(execution_id, {}).get("state")
+
+    def finished(self, execution_id):
+        return self.state(execution_id) in TERMINAL_STATES
+
+    def describe(self, execution_id):
+        with self.lock:
+            return self.executions.get(execution_id)
+
+    def running_in(self, folder, classes=("analysis",)):
+        '''Returns the unfinished executions (analyses by default) writing into a folder or below it.'''
+        folder = folder.rstrip('/') + '/'
+        with self.lock:
+            return [execution for execution in self.executions.values()
+                    if execution.get("state") not in TERMINAL_STATES and execution.get("class") in classes and
+                       (execution.get("folder", "").rstrip('/') + '/').startswith(folder)]
+
+    # ----- Waiting -----
+
+    def wait(self, execution_ids=None, timeout=None):
+        '''Refreshes until the executions (or all known) have finished.  Returns {id: description}.'''
+        if execution_ids is not None:
+            self.track(execution_ids)
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.thread is None:
+                self.refresh()
+            with self.lock:
+                ids = execution_ids if execution_ids is not None else self.executions.keys()
+                if all(self.finished(execution_id) for execution_id in ids):
+                    return dict((execution_id, self.executions[execution_id]) for execution_id in ids)
+                interval = self.interval
+            if deadline is not None and time.time() + interval > deadline:
+                raise RuntimeError("Timed out waiting on %s" % ", ".join(sorted(ids)))
+            time.sleep(interval if self.thread is None else min(interval, 1.0))
+
+    def start(self):
+        '''Refreshes on a thread of its own until stop(), calling back from that thread.'''
+        def loop():
+            while not self.stopping.is_set():
+                try:
+                    self.refresh()
+                except Exception as e:  # a failed query is tried again next time
+                    print >> sys.stderr, "job_monitor: refresh failed: %s" % e
+                self.stopping.wait(self.interval)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=loop, name="job_monitor")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shows or waits on the jobs and analyses of a project.")
+    parser.add_argument('-p', '--project', required=True, help="Project name or id.")
+    parser.add_argument('-f', '--folder', help="Only show executions writing into this folder.")
+    parser.add_argument('-w', '--wait', nargs='+', metavar="ID", help="Wait until these jobs or analyses finish.")
+    parser.add_argument('--then', help="Command to run once they have all finished ok (e.g. launch combined reps).")
+    parser.add_argument('-i', '--interval', type=float, default=5.0, help="Seconds between first looks.")
+    parser.add_argument('--max_interval', type=float, default=120.0, help="Most seconds between looks.")
+    parser.add_argument('--lookback_hours', type=float, default=72, help="How far back to look for running jobs.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log each look.")
+    args = parser.parse_args()
+
+    project = args.project
+    if not project.startswith("project-"):
+        project = dxpy.find_one_project(name=project, return_handler=False)["id"]
+    monitor = JobMonitor(project, args.interval, args.max_interval, lookback_hours=args.lookback_hours,
+                         verbose=args.verbose)
+    if not args.wait:
+        monitor.refresh()
+        executions = monitor.running_in(args.folder or "/", classes=("job", "analysis"))
+        for execution in sorted(executions, key=lambda execution: execution.get("created")):
+            print "%-32s %-18s %-40s %s" % (execution["id"], execution.get("state"), execution.get("name"),
+                                           execution.get("folder"))
+        print "%d running (%d queries)" % (len(executions), monitor.queries)
+        return
+
+    def report(description):
+        if description["id"] in args.wait:
+            print "%s %s: %s" % (description["id"], description.get("name"), description.get("state"))
+            sys.stdout.flush()
+    monitor.on_change(report)
+    finished = monitor.wait(args.wait)
+    failed = sorted(execution_id for (execution_id, description) in finished.items()
+                    if description.get("state") != "done")
+    print "All finished after %d queries" % monitor.queries
+    if failed:
+        sys.exit("Not done: " + ", ".join("%s (%s)" % (execution_id, finished[execution_id].get("state"))
+                                           for execution_id in failed))
+    if args.then:
+        sys.exit(subprocess.call(args.then, shell=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python2.7
+# launch_client.py 1.1.1  Makes a launch's independent platform lookups concurrently, over dxpy's pooled connections,
+#                         and remembers their answers for the rest of the launch.
+
+import sys
+import fnmatch
+import threading
+
+try:
+    from concurrent.futures import ThreadPoolExecutor  # 'futures' backport, installed with dxpy on python 2.7
+except ImportError:
+    ThreadPoolExecutor = None
+
+# NOTES: dxpy keeps one pool of persistent HTTPS connections (32 of them) shared by all threads, so concurrent
+#        lookups need only threads to wait on their answers.  MAX_LOOKUPS bounds them well within that pool, so
+#        the platform sees a modest burst rather than a storm.
+#      - gather() runs a set of independent calls together and returns when the last answers, so a launch waits on
+#        its longest chain of lookups rather than on their sum.  Without concurrent.futures calls run one by one.
+#      - Answers of cached() calls are kept for the launch, so a batch of experiments on the same genome looks up
+#        each reference file once.  Only found answers are kept; a missing file is looked up again.
+#      - Prior results are looked up one by one by dxencode's Launch, most of them missing on a first launch.  One
+#        listing of an experiment's results folder (replicate folders and all) lets known_missing() answer those
+#        without a call each; files the listing shows are still looked up as Launch looks them up.
+#      - monitor() keeps one job_monitor.py JobMonitor per project, so checking each results folder for running
+#        analyses, or waiting on them, costs one findExecutions query for the whole launch rather than one per folder.
+#      - The monitor only knows of analyses started within its look back, so none_running() only vouches for a folder
+#        whose files (the run log Launch writes on starting an analysis among them) are all newer than that.
+
+MAX_LOOKUPS = 8
+'''Most lookups in flight at once.'''
+
+
+class PlatformClient(object):
+    '''Runs independent platform lookups concurrently and caches their answers.'''
+
+    def __init__(self, max_lookups=MAX_LOOKUPS):
+        self.max_lookups = max_lookups
+        self.executor = None
+        self.cache = {}
+        self.listings = {}
+        self.monitors = {}
+        self.lock = threading.Lock()
+
+    def pool(self):
+        with self.lock:
+            if self.executor is None and ThreadPoolExecutor is not None and self.max_lookups > 1:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_lookups)
+        return self.executor
+
+    def gather(self, calls):
+        '''Runs {key: (function, arg, ...)} calls concurrently and returns {key: answer}.
+           Every call is finished before the first failure, in key order, is raised.'''
+        pool = self.pool()
+        if pool is None or len(calls) < 2:
+            return dict((key, call[0](*call[1:])) for (key, call) in calls.items())
+        futures = dict((key, pool.submit(*call)) for (key, call) in calls.items())
+        answers = {}
+        failure = None
+        for key in sorted(futures):
+            try:
+                answers[key] = futures[key].result()
+            except Exception:
+                if failure is None:
+                    failure = sys.exc_info()
+        if failure is not None:
+            raise failure[0], failure[1], failure[2]
+        return answers
+
+    def cached(self, function, *args):
+        '''Returns function(*args), calling it only if it has not already found an answer for these args.'''
+        key = (getattr(function, '__name__', repr(function)),) + args
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+        answer = function(*args)
+        if answer is not None:
+            with self.lock:
+                self.cache[key] = answer
+        return answer
+
+    def find_files(self, find_file, paths, project):
+        '''Returns {key: file id or None} for {key: path} in project, looking them all up together.'''
+        return self.gather(dict((key, (self.cached, find_file, path, project)) for (key, path) in paths.items()))
+
+    def list_folder(self, project, folder):
+        '''Returns (folder, name, created) of every file in or below a folder, listing it only once for the launch.'''
+        key = (project, folder)
+        with self.lock:
+            if key in self.listings:
+                return self.listings[key]
+            within = folder.rstrip('/') + '/'
+            for ((listed_project, listed_folder), listing) in self.listings.items():
+                if listed_project == project and within.startswith(listed_folder.rstrip('/') + '/'):
+                    return [found for found in listing if (found[0].rstrip('/') + '/').startswith(within)]
+        import dxpy  # not before a lookup needs it, as launch_profile defers it
+        try:
+            listing = [(found['describe']['folder'], found['describe']['name'], found['describe']['created'])
+                       for found in dxpy.find_data_objects(classname='file', project=project,
+                                                           folder=folder.rstrip('/') or '/', recurse=True,
+                                                           describe={'fields': {'folder': True, 'name': True,
+                                                                                'created': True}})]
+        except dxpy.exceptions.ResourceNotFound:
+            listing = []  # no folder yet, so no results yet
+        with self.lock:
+            self.listings[key] = listing
+        return listing
+
+    def known_missing(self, path, project, folder):
+        '''Returns True if no file in or below the path's folder, which is within folder, could match the path.'''
+        if not path.startswith(folder):
+            return False
+        (path_folder, name) = path.rsplit('/', 1)
+        path_folder = path_folder.rstrip('/') + '/'
+        for (found_folder, found_name, created) in self.list_folder(project, folder):
+            if (found_folder.rstrip('/') + '/').startswith(path_folder) and fnmatch.fnmatchcase(found_name, name):
+                return False
+        return True
+
+    def monitor(self, project):
+        '''Returns the launch's JobMonitor of a project's jobs and analyses, refreshed when first asked for.'''
+        with self.lock:
+            if project in self.monitors:
+                return self.monitors[project]
+        from job_monitor import JobMonitor  # imports dxpy, not before it is needed
+        monitor = JobMonitor(project)
+        monitor.refresh()
+        with self.lock:
+            return self.monitors.setdefault(project, monitor)
+
+    def none_running(self, project, folder):
+        '''Returns True if no analyses are running in or below a folder, as far as the project's monitor can tell.
+           It can not tell for a folder holding files, and so perhaps a run log, from before its look back.'''
+        monitor = self.monitor(project)
+        if monitor.running_in(folder):
+            return False
+        listing = self.list_folder(project, folder)
+        return all(created >= monitor.window_ms for (found_folder, found_name, created) in listing)
+
+    def wait_running(self, project, folder):
+        '''Waits for the analyses running in or below a folder to finish.  Returns the ids of those not 'done'.'''
+        monitor = self.monitor(project)
+        running = sorted(analysis["id"] for analysis in monitor.running_in(folder))
+        if not running:
+            return []
+        print "Waiting for %s running in '%s' to finish..." % (", ".join(running), folder)
+        sys.stdout.flush()
+        finished = monitor.wait(running)
+        return [analysis_id for analysis_id in running if finished[analysis_id].get("state") != "done"]
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+
+CLIENT = PlatformClient()
+'''The launch's client, shared by the launcher's steps.'''
@@ -0,0 +1,311 @@
+#!/usr/bin/env python2.7
+# launch_profile.py 1.1.1  Times the phases of a pipeline launch and counts the remote calls made in each, for the
+#                          '--profile' option of lrnaLaunch.py, rampage/rampageLaunch.py and small-rna/srnaLaunch.py.
+
+import sys
+import json
+import time
+import types
+import urlparse
+import threading
+from contextlib import contextmanager
+
+# NOTES: The Launch class comes from dxencode, so its phases are profiled by wrapping its methods on the launcher
+#        instance: whichever of PHASE_METHODS the Launch version has are timed, the rest are simply not there.
+#      - A phase's time excludes the phases it calls, so the phases add up to the whole launch.  Time in none of them
+#        (e.g. printing the run plans) is 'other'.
+#      - Remote calls are counted by wrapping dxpy's DXHTTPRequest (every DNAnexus API call) and requests' sessions
+#        (encodeD metadata).  A requests call made by dxpy is counted once, as the dxpy call.  Calls made together by
+#        launch_client.py's threads count towards the phase waiting on them, so remote_sec may exceed wall_sec.
+#      - Timing is always on and costs next to nothing; remote calls are only counted with '--profile'.
+#      - defer_imports() leaves dxpy and dxencode unimported until something first uses them, so '--help' and argument
+#        errors come back at once.  The import is then timed as an 'imports' phase within the phase that needed it.
+#      - Python 2 adds an imported submodule to the parent it found in sys.modules, which for a deferred package is
+#        the stand-in.  SUBMODULES imports a deferred package's submodules from the real package instead, so that
+#        'from dxpy.api import x' leaves 'api' on the real dxpy too ('benchmark/launch_benchmark.py imports' checks).
+
+PHASE_METHODS = [
+    ("arguments",       ["get_args"]),
+    ("encode_metadata", ["pipeline_specific_vars"]),
+    ("references",      ["find_all_ref_files", "find_ref_files"]),
+    ("priors",          ["find_all_prior_results", "find_prior_results", "find_results_from_prev_branch"]),
+    ("planning",        ["determine_steps_needed", "determine_steps_to_run"]),
+    ("running_check",   ["check_run_log"]),
+    ("workflow",        ["create_or_extend_workflow", "create_workflow", "launch_workflow"]),
+]
+'''Launch phases and the Launch methods that make them up.'''
+
+DEFERRED_IMPORTS = ["dxpy", "dxencode"]
+'''Modules the launch module imports, which take a while and are not needed to parse arguments.'''
+
+
+class LaunchProfile(object):
+    '''Accumulates wall time and remote calls by launch phase.'''
+
+    def __init__(self):
+        self.started = time.time()
+        self.mark = self.started
+        self.stack = []
+        self.phases = {}
+        self.order = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.out = None
+        self.counting = set()
+
+    def entry(self, name):
+        if name not in self.phases:
+            self.phases[name] = {"calls": 0, "wall_sec": 0.0, "remote_sec": 0.0, "remote": {}}
+            self.order.append(name)
+        return self.phases[name]
+
+    def current(self):
+        return self.stack[-1] if self.stack else "other"
+
+    def account(self):
+        '''Adds the time since the last change of phase to the current phase.'''
+        now = time.time()
+        self.entry(self.current())["wall_sec"] += now - self.mark
+        self.mark = now
+
+    @contextmanager
+    def phase(self, name):
+        '''Attributes the time and remote calls within to the named phase.'''
+        self.account()
+        self.entry(name)["calls"] += 1
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.account()
+            self.stack.pop()
+
+    def timed(self, name, method):
+        def call(*args, **kwargs):
+            with self.phase(name):
+                return method(*args, **kwargs)
+        return call
+
+    def counted(self, kind_of, function):
+        def call(*args, **kwargs):
+            if getattr(self.local, 'in_remote', False):
+                return function(*args, **kwargs)
+            kind = kind_of(args, kwargs)
+            self.local.in_remote = True
+            began = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.in_remote = False
+                with self.lock:
+                    entry = self.entry(self.current())
+                    entry["remote"][kind] = entry["remote"].get(kind, 0) + 1
+                    entry["remote_sec"] += time.time() - began
+        return call
+
+    def instrument(self, launcher):
+        '''Times the launcher's phase methods and counts its remote calls.'''
+        for (name, methods) in PHASE_METHODS:
+            for method in methods:
+                if callable(getattr(launcher, method, None)):
+                    setattr(launcher, method, self.timed(name, getattr(launcher, method)))
+        self.count_remote()
+
+    def count_remote(self):
+        '''Counts the remote calls of dxpy and requests, once each is imported.'''
+        for name in DEFERRED_IMPORTS:
+            module = sys.modules.get(name)
+            if isinstance(module, DeferredModule) and not module.imported():
+                module.after_import(self.count_remote)
+        dxpy = imported('dxpy')
+        if dxpy is not None and 'dxpy' not in self.counting and hasattr(dxpy, 'DXHTTPRequest'):
+            self.counting.add('dxpy')
+            request = self.counted(dx_kind, dxpy.DXHTTPRequest)
+            dxpy.DXHTTPRequest = request
+            api = sys.modules.get('dxpy.api')
+            if api is not None and hasattr(api, 'DXHTTPRequest'):
+                api.DXHTTPRequest = request
+        sessions = sys.modules.get('requests.sessions')
+        if sessions is not None and 'requests' not in self.counting:
+            self.counting.add('requests')
+            sessions.Session.request = self.counted(http_kind, sessions.Session.request.__func__)
+
+    def run(self, launcher, argv=None):
+        '''Runs the launcher, profiling it when '--profile' is on the command line.'''
+        self.out = profile_option(sys.argv[1:] if argv is None else argv)
+        if self.out is None:
+            return launcher.run()
+        self.instrument(launcher)
+        try:
+            return launcher.run()
+        finally:
+            self.report(type(launcher).__name__)
+
+    def results(self, launcher_name):
+        '''Returns the profile so far as a dict.'''
+        self.account()
+        phases = {}
+        for name in self.order:
+            entry = self.phases[name]
+            phases[name] = {"calls": entry["calls"], "wall_sec": round(entry["wall_sec"], 3),
+                            "remote_calls": sum(entry["remote"].values()),
+                            "remote_sec": round(entry["remote_sec"], 3), "remote": entry["remote"]}
+        order = [name for name in self.order if name != "other"] + [name for name in self.order if name == "other"]
+        return {"launcher": launcher_name, "total_sec": round(self.mark - self.started, 3),
+                "phase_order": order, "phases": phases}
+
+    def report(self, launcher_name):
+        '''Writes the breakdown to stderr and, if given a file, the profile json.'''
+        results = self.results(launcher_name)
+        print >> sys.stderr, "Launch profile of %s:" % launcher_name
+        print >> sys.stderr, "%-16s %6s %9s %7s %13s %11s" % \
+                             ("phase", "calls", "wall_sec", "share", "remote_calls", "remote_sec")
+        for name in results["phase_order"]:
+            phase = results["phases"][name]
+            share = phase["wall_sec"] / results["total_sec"] if results["total_sec"] else 0.0
+            print >> sys.stderr, "%-16s %6d %9.3f %6.1f%% %13d %11.3f" % (name, phase["calls"], phase["wall_sec"],
+                                 share * 100.0, phase["remote_calls"], phase["remote_sec"])
+        print >> sys.stderr, "%-16s %6s %9.3f %6.1f%% %13d %11.3f" % ("total", "", results["total_sec"], 100.0,
+                             sum(phase["remote_calls"] for phase in results["phases"].values()),
+                             sum(phase["remote_sec"] for phase in results["phases"].values()))
+        kinds = {}
+        for phase in results["phases"].values():
+            for (kind, count) in phase["remote"].items():
+                kinds[kind] = kinds.get(kind, 0) + count
+        if kinds:
+            print >> sys.stderr, "Remote calls: " + \
+                                 ", ".join("%s %d" % (kind, kinds[kind]) for kind in sorted(kinds, key=kinds.get,
+                                                                                             reverse=True))
+        if self.out != '-':
+            with open(self.out, 'w') as fh:
+                json.dump(results, fh, indent=4, sort_keys=True, separators=(",", ": "))
+                fh.write("\n")
+        return results
+
+
+def dx_kind(args, kwargs):
+    '''Names a DNAnexus API call by its route's method (e.g. 'dx:describe').'''
+    resource = args[0] if args else kwargs.get('resource', '')
+    return "dx:" + str(resource).rstrip('/').split('/')[-1]
+
+
+def http_kind(args, kwargs):
+    '''Names a requests call by its method and host (e.g. 'http:GET www.encodeproject.org').'''
+    method = args[1] if len(args) > 1 else kwargs.get('method', '')
+    url = args[2] if len(args) > 2 else kwargs.get('url', '')
+    return "http:%s %s" % (str(method).upper(), urlparse.urlparse(url).netloc)
+
+
+def profile_option(argv):
+    '''Returns the '--profile' json file, '-' for none or None when not profiling, as argparse will parse it.'''
+    for (ix, arg) in enumerate(argv):
+        if arg.startswith('--profile='):
+            return arg.split('=', 1)[1] or '-'
+        if arg == '--profile':
+            if ix + 1 < len(argv) and not argv[ix + 1].startswith('-'):
+                return argv[ix + 1]
+            return '-'
+    return None
+
+
+def add_argument(ap):
+    '''Adds '--profile' to a launcher's arguments.'''
+    ap.add_argument('--profile',
+                    help="Time each launch phase and count its remote calls, writing a breakdown to stderr " + \
+                         "and, if given a file, the profile json.",
+                    nargs='?',
+                    const='-',
+                    default=None,
+                    required=False)
+
+
+class DeferredModule(types.ModuleType):
+    '''Stands in sys.modules for a module until one of its attributes is first used, then imports it.'''
+
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_deferred'] = {"module": None, "hooks": [], "lock": threading.RLock()}
+
+    def imported(self):
+        return self._deferred["module"] is not None
+
+    def after_import(self, hook):
+        '''Calls hook once the module is imported.'''
+        if hook not in self._deferred["hooks"]:
+            self._deferred["hooks"].append(hook)
+
+    def load(self):
+        '''Imports the module, which replaces this stand-in in sys.modules.'''
+        deferred = self._deferred
+        with deferred["lock"]:  # first used by several of launch_client's threads at once
+            if deferred["module"] is None:
+                name = self.__name__
+                with PROFILE.phase("imports"):
+                    del sys.modules[name]
+                    try:
+                        __import__(name)
+                    except:
+                        sys.modules[name] = self
+                        raise
+                deferred["module"] = sys.modules[name]
+                for hook in deferred["hooks"]:
+                    hook()
+        return deferred["module"]
+
+    def __getattr__(self, attr):
+        # Only called for attributes not in this stand-in's own dict (its name and doc), so everything else is the
+        # module's, as it is now rather than a copy
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+
+class SubmoduleFinder(object):
+    '''On sys.meta_path, imports the submodules of deferred packages into the real package, not its stand-in.'''
+
+    def __init__(self):
+        self.stand_ins = {}
+        self.loading = set()
+
+    def find_module(self, fullname, path=None):
+        # Called once the stand-in has given up the real package's __path__, so the real package is in sys.modules.
+        # The import lock is held, so this is the only import; a submodule that is not found is left to the others.
+        stand_in = self.stand_ins.get(fullname.rpartition('.')[0])
+        if stand_in is None or not stand_in.imported() or fullname in self.loading:
+            return None
+        self.loading.add(fullname)
+        try:
+            __import__(fullname)
+        except ImportError:
+            return None
+        finally:
+            self.loading.discard(fullname)
+        return self
+
+    def load_module(self, fullname):
+        return sys.modules[fullname]
+
+
+def imported(name):
+    '''Returns the named module if it has been imported, deferred or not, or else None.'''
+    module = sys.modules.get(name)
+    if isinstance(module, DeferredModule):
+        return module._deferred["module"]
+    return module
+
+
+def defer_imports(names=DEFERRED_IMPORTS):
+    '''Defers importing the named modules, when not already imported, until they are first used.'''
+    for name in names:
+        if name not in sys.modules:
+            sys.modules[name] = SUBMODULES.stand_ins[name] = DeferredModule(name)
+    if SUBMODULES.stand_ins and SUBMODULES not in sys.meta_path:
+        sys.meta_path.insert(0, SUBMODULES)
+
+
+PROFILE = LaunchProfile()
+'''The launch's profile, started when a launcher first imports this module.'''
+
+SUBMODULES = SubmoduleFinder()
+'''Imports the submodules of the packages defer_imports() has deferred.'''
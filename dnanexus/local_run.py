@@ -0,0 +1,529 @@
+#!/usr/bin/env python2.7
+# local_run.py 1.0.1  Runs a pipeline's DX-independent scripts on one machine (or a cluster sharing a filesystem),
+#                     without DNAnexus.
+
+import sys
+import os
+import ast
+import copy
+import glob
+import json
+import time
+import pipes
+import shutil
+import argparse
+import subprocess
+import multiprocessing
+
+# NOTES: The steps, their order and the tokens connecting them are read from the same launcher definitions that the
+#        DNAnexus launchers use (PIPELINE_BRANCHES, FILE_GLOBS, etc.), but the launchers are parsed, not imported, so
+#        neither dxpy nor launch.py is needed.
+#      - Each step runs the script(s) its applet would, in its own work directory, with inputs linked in by name.
+#        Result files (those named with the replicate's root) are then moved to that replicate's results directory.
+#      - A step runs as soon as the steps making its input tokens are done and its cpu and memory tokens are free.
+#      - Steps whose results (by FILE_GLOBS) are already in the results directory are skipped.
+
+LAUNCHERS = {
+    "lrna":    "lrnaLaunch.py",
+    "rampage": "rampage/rampageLaunch.py",
+    "srna":    "small-rna/srnaLaunch.py",
+    }
+'''Launcher (relative to this script) holding each pipeline's definitions.'''
+
+LAUNCHER_DEFINITIONS = ["PIPELINE_BRANCH_ORDER", "PIPELINE_BRANCHES", "FILE_GLOBS", "PRUNE_STEPS", "FUSED_STEPS",
+                        "DEFERRED_CI_STEPS"]
+'''Class attributes read from the launcher.  Only literals can be read, which these all are.'''
+
+COMMANDS = {
+    # Keyed by step name, app or the app that a virtual app stands for (looked up in that order).  Fields are the
+    # applet's input names (as linked into the work directory), the pipeline variables, and the step's 'root',
+    # 'ncpus' and 'memory_GB'.  Like the applets, each names its results from the replicate's root.
+    # lrna:
+    "align-star-pe":         "lrna_align_star_pe.sh {star_index} {reads1} {reads2} '{library_id}' {ncpus} {memory_GB} {root}",
+    "align-star-se":         "lrna_align_star_se.sh {star_index} {reads} '{library_id}' {ncpus} {root} {memory_GB}",
+    "align-tophat-pe":       "lrna_align_tophat_pe.sh {tophat_index} {reads1} {reads2} '{library_id}' {ncpus} {root}",
+    "align-tophat-se":       "lrna_align_tophat_se.sh {tophat_index} {reads} '{library_id}' {ncpus} {root}",
+    "bam-to-bigwig":         "lrna_bam_to_signals.sh {bam_file} {chrom_sizes} {stranded}",
+    "quant-rsem":            "ln -s {star_anno_bam} {root}.bam && " + \
+                             "lrna_rsem_quantification.sh {rsem_index} {root}.bam {paired_end} {read_strand} " + \
+                             "{rnd_seed} {ncpus} {ci_mode}",
+    "quant-rsem-ci":         "lrna_rsem_credibility_intervals.sh {rsem_index} {rsem_state}",
+    "align-signal-quant-pe": "lrna_align_star_pe.sh {star_index} {reads1} {reads2} '{library_id}' {ncpus} {memory_GB} {root} && " + \
+                             "rm -rf out && ln -s {root}_star_anno.bam {root}.bam && " + \
+                             "lrna_bam_to_signals.sh {root}_star_genome.bam {chrom_sizes} {stranded} && " + \
+                             "lrna_rsem_quantification.sh {rsem_index} {root}.bam true {read_strand} {rnd_seed} {ncpus}",
+    "mad-qc":                "Rscript `which MAD.R` {quants_a} {quants_b} > {root}_mad_qc.json && " + \
+                             "mv MAplot.png {root}_mad_plot.png",
+    # rampage:
+    "rampage-align-pe":      "rampage_align_star.sh {star_index} {reads1} {reads2} '{library_id}' {ncpus} {memory_GB} " + \
+                             "{root}_{assay_type}_star",
+    "rampage-align-signals": "rampage_align_star.sh {star_index} {reads1} {reads2} '{library_id}' {ncpus} {memory_GB} " + \
+                             "{root}_{assay_type}_star --signals {chrom_sizes} {root}_{assay_type}_5p {stranded}",
+    "rampage-signals":       "ln -s {rampage_marked_bam} {root}.bam && " + \
+                             "rampage_signal.sh {root}.bam {chrom_sizes} {root}_{assay_type}_5p {stranded}",
+    "rampage-peaks":         "ln -s {rampage_marked_bam} {root}.bam && " + \
+                             "rampage_peaks.sh {root}.bam {control_bam} {gene_annotation} {chrom_sizes} {assay_type} " + \
+                             "{ncpus} {root}_{assay_type}_peaks",
+    "rampage-idr":           "rampage_idr.sh {peaks_a} {peaks_b} {chrom_sizes} {root}_{assay_type}_idr",
+    "rampage-mad-qc":        "rampage_mad_qc.sh {quants_a} {quants_b} {root}_mad `which MAD.R`",
+    # srna:
+    "small-rna-align":       "srna_align.sh {star_index} {reads} '{library_id}' {ncpus} {root} {clipping_model} {align_mode}",
+    "small-rna-signals":     "srna_signals.sh {srna_bam} {chrom_sizes}",
+    "small-rna-mad-qc":      "cp `which extract_gene_ids.awk` `which sum_srna_expression.awk` `which MAD.R` . && " + \
+                             "srna_mad_qc.sh {annotations} {quants_a} {quants_b} {root}",
+    }
+
+APP_TOKENS = {
+    # cpu and memory (GB) tokens each app holds while it runs (looked up as COMMANDS are).
+    # lrna:
+    "align-star-pe":         (8, 40),
+    "align-star-se":         (8, 40),
+    "align-tophat-pe":       (8, 16),
+    "align-tophat-se":       (8, 16),
+    "bam-to-bigwig":         (1, 8),
+    "quant-rsem":            (8, 16),
+    "quant-rsem-ci":         (8, 8),
+    "align-signal-quant-pe": (8, 40),
+    "mad-qc":                (1, 2),
+    # rampage:
+    "rampage-align-pe":      (8, 40),
+    "rampage-signals":       (1, 8),
+    "rampage-peaks":         (8, 16),
+    "rampage-idr":           (1, 4),
+    "rampage-mad-qc":        (1, 2),
+    # srna:
+    "small-rna-align":       (8, 40),
+    "small-rna-signals":     (1, 8),
+    "small-rna-mad-qc":      (1, 2),
+    }
+
+PARAM_DEFAULTS = {
+    # Pipeline variables the launchers would otherwise set (see pipeline_specific_vars()).
+    "rnd_seed":       12345,
+    "ci_mode":        "full",
+    "nshards":        1,
+    "stranded":       False,
+    "clipping_model": "ENCODE3",
+    "collapse_reads": False,
+    "assay_type":     "rampage",
+    }
+
+POLL_SECONDS = 5
+'''How often running steps are checked.'''
+
+STATUS_FILE = "local_run_steps.tsv"
+'''Written to the results directory: one line per step with its status, tokens and wall seconds.'''
+
+
+def read_launcher(pipeline):
+    '''Returns the launcher class's pipeline definitions, parsed from its source.'''
+    launcher = os.path.join(os.path.dirname(os.path.abspath(__file__)), LAUNCHERS[pipeline])
+    tree = ast.parse(open(launcher).read(), launcher)
+    defs = {}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for item in node.body:
+            if not isinstance(item, ast.Assign) or len(item.targets) != 1:
+                continue
+            target = item.targets[0]
+            if isinstance(target, ast.Name) and target.id in LAUNCHER_DEFINITIONS:
+                defs[target.id] = ast.literal_eval(item.value)
+    for required in ["PIPELINE_BRANCH_ORDER", "PIPELINE_BRANCHES", "FILE_GLOBS"]:
+        if required not in defs:
+            sys.exit("ERROR: '%s' has no %s." % (launcher, required))
+    return defs
+
+
+def virtual_apps():
+    '''Returns the virtual app to parent app mapping from tools/tool_versions.py.'''
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+    from tool_versions import VIRTUAL_APPS
+    return VIRTUAL_APPS
+
+
+def lookup(table, step_name, app, virtuals):
+    '''Returns the entry for a step in COMMANDS or APP_TOKENS, by step name, app or virtual app's parent.'''
+    for key in [step_name, app, virtuals.get(app)]:
+        if key in table:
+            return table[key]
+    return None
+
+
+def root_name_from_pair(root_a, root_b):
+    '''Returns a root name based upon the common and uncommon parts of a pair of roots (as the mad-qc apps do).'''
+    prefix = os.path.commonprefix([root_a, root_b])
+    suffix = os.path.commonprefix([root_a[len(prefix):][::-1], root_b[len(prefix):][::-1]])[::-1]
+    middle_a = root_a[len(prefix):len(root_a) - len(suffix)]
+    middle_b = root_b[len(prefix):len(root_b) - len(suffix)]
+    return prefix + middle_a + '-' + middle_b + suffix  # exp1_rep1_1 and exp1_rep2_1 yield exp1_rep1-2_1
+
+
+def shell_value(value):
+    '''Formats a pipeline variable as the applets receive it.'''
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def result_glob(defs, token):
+    return defs["FILE_GLOBS"].get(token, "").lstrip('/')
+
+
+def pipeline_vars(config, args):
+    '''Returns the pipeline variables shared by all replicates.'''
+    psv = copy.deepcopy(PARAM_DEFAULTS)
+    psv.update(config.get("params", {}))
+    reps = config["reps"]
+    if "paired_end" not in psv:
+        psv["paired_end"] = all("reads2" in rep.get("files", {}) for rep in reps.values())
+    if args.defer_ci:
+        psv["ci_mode"] = "defer"
+    # As lrnaLaunch.py: usual ENCODE stranded paired-end libraries are rd1-/rd2+ (AKA reverse)
+    if "read_strand" not in psv:
+        psv["read_strand"] = "reverse" if psv["paired_end"] and psv["stranded"] else "unstranded"
+    psv["align_mode"] = "collapsed" if psv["collapse_reads"] else "reads"
+    return psv
+
+
+def branch_order(defs, branch, psv, args):
+    '''Returns a branch's steps and their order, with steps pruned, fused or added as the launchers would.'''
+    steps = copy.deepcopy(defs["PIPELINE_BRANCHES"][branch]["STEPS"])
+    order = defs["PIPELINE_BRANCHES"][branch]["ORDER"]
+    end = "pe" if psv["paired_end"] else "se"
+    if isinstance(order, dict):
+        order = order[end]
+    order = list(order)
+    if not args.all_steps:
+        order = [step for step in order if step not in defs.get("PRUNE_STEPS", [])]
+    if args.fused and end in defs.get("FUSED_STEPS", {}):
+        (split_steps, fused_step) = defs["FUSED_STEPS"][end]
+        if split_steps[0] in order:
+            order.insert(order.index(split_steps[0]), fused_step)
+            order = [step for step in order if step not in split_steps]
+    if psv["ci_mode"] == "defer":
+        for (quant_step, ci_step) in defs.get("DEFERRED_CI_STEPS", {}).items():
+            if quant_step in order:
+                steps[quant_step]["results"]["rsem_state"] = "rsem_state"
+                order.insert(order.index(quant_step) + 1, ci_step)
+    return (order, steps)
+
+
+def abs_files(files, config_dir):
+    '''Returns a token to file list dict, with paths relative to the config file made absolute.'''
+    abs_paths = {}
+    for (token, paths) in files.items():
+        if not isinstance(paths, list):
+            paths = [paths]
+        abs_paths[token] = [os.path.join(config_dir, os.path.expanduser(path)) for path in paths]
+    return abs_paths
+
+
+def plan_steps(defs, config, config_dir, psv, args):
+    '''Returns every step to run, in launch priority order, with the source of each of its inputs.'''
+    virtuals = virtual_apps()
+    shared_files = abs_files(config.get("files", {}), config_dir)
+    rep_keys = sorted(config["reps"].keys())
+    planned = []
+    rep_producers = {}
+    for branch in defs["PIPELINE_BRANCH_ORDER"]:
+        if branch == "REP":
+            instances = [(key, [key]) for key in rep_keys]
+        elif len(rep_keys) >= 2:
+            instances = [("-".join(rep_keys[:2]), rep_keys[:2])]
+        else:
+            continue
+        (order, steps) = branch_order(defs, branch, psv, args)
+        for (instance, rep_pair) in instances:
+            rep = config["reps"][rep_pair[0]] if branch == "REP" else {}
+            if branch == "REP":
+                root = rep.get("root", "rep" + instance)
+            else:
+                root = root_name_from_pair(*[config["reps"][key].get("root", "rep" + key) for key in rep_pair])
+            files = copy.deepcopy(shared_files)
+            files.update(abs_files(rep.get("files", {}), config_dir))
+            step_vars = copy.deepcopy(psv)
+            step_vars.update(rep.get("params", {}))
+            step_vars.setdefault("library_id", root)
+            producers = {}
+            for step_name in order:
+                step_def = steps[step_name]
+                app = step_def["app"]
+                command = lookup(COMMANDS, step_name, app, virtuals)
+                tokens = lookup(APP_TOKENS, step_name, app, virtuals)
+                if command is None or tokens is None:
+                    sys.exit("ERROR: No local command for step '%s' (app '%s')." % (step_name, app))
+                step = {"name": step_name, "app": app, "instance": instance, "root": root,
+                        "outdir": os.path.join(args.results, root), "command": command, "cpus": tokens[0],
+                        "memory_GB": tokens[1], "vars": step_vars, "results": step_def["results"],
+                        "inputs": {}, "status": "pending"}
+                for (token, input_name) in step_def["inputs"].items():
+                    if token in files:
+                        step["inputs"][input_name] = ("files", files[token])
+                    elif token in producers:
+                        step["inputs"][input_name] = ("step", producers[token], token)
+                    elif branch != "REP" and token[-2:] in ["_a", "_b"]:
+                        # Combined inputs come from the replicate results with the same file glob
+                        rep_key = rep_pair[0] if token.endswith("_a") else rep_pair[1]
+                        rep_token = None
+                        for (candidate, producer) in rep_producers[rep_key].items():
+                            if result_glob(defs, candidate) == result_glob(defs, token):
+                                rep_token = candidate
+                        if rep_token is None:
+                            sys.exit("ERROR: No replicate step makes '%s' for step '%s'." % (token, step_name))
+                        step["inputs"][input_name] = ("step", rep_producers[rep_key][rep_token], rep_token)
+                    else:
+                        sys.exit("ERROR: Step '%s' of '%s' needs '%s', which is neither in the config 'files' " \
+                                 "nor made by an earlier step." % (step_name, instance, token))
+                for token in step_def["results"].keys():
+                    producers[token] = step
+                planned.append(step)
+            if branch == "REP":
+                rep_producers[instance] = producers
+    return planned
+
+
+def find_results(defs, step):
+    '''Returns the step's result files found in its results directory, and whether all required ones were found.'''
+    found = {}
+    complete = True
+    for token in step["results"].keys():
+        pattern = result_glob(defs, token)
+        matches = sorted(glob.glob(os.path.join(step["outdir"], pattern))) if pattern else []
+        if len(matches) > 1:
+            sys.exit("ERROR: More than one '%s' in '%s'." % (pattern, step["outdir"]))
+        if matches:
+            found[token] = matches[0]
+        elif not token.startswith("OPT_"):
+            complete = False
+    return (found, complete and len(found) > 0)
+
+
+def input_files(defs, step):
+    '''Returns the input name to file list dict for a step whose inputs are all ready.'''
+    inputs = {}
+    for (input_name, source) in step["inputs"].items():
+        if source[0] == "files":
+            inputs[input_name] = source[1]
+        else:
+            (producer, token) = source[1:]
+            if producer["status"] not in ["done", "skipped"] or token not in producer["found"]:
+                return None
+            inputs[input_name] = [producer["found"][token]]
+    return inputs
+
+
+def start_step(defs, step, inputs, cpus, memory_GB, args, env):
+    '''Links the inputs into a fresh work directory and starts the step's command.'''
+    step["workdir"] = os.path.join(step["outdir"], "_" + step["name"])
+    if os.path.exists(step["workdir"]):
+        shutil.rmtree(step["workdir"])
+    os.makedirs(step["workdir"])
+    fields = dict((key, shell_value(value)) for (key, value) in step["vars"].items())
+    for (input_name, paths) in inputs.items():
+        name = os.path.basename(paths[0])
+        if len(paths) == 1:
+            os.symlink(os.path.abspath(paths[0]), os.path.join(step["workdir"], name))
+        else:
+            # Several fastqs are concatenated as the applets do (gzip members concatenate cleanly)
+            name = "concat_" + name
+            with open(os.path.join(step["workdir"], name), 'wb') as concat:
+                for path in paths:
+                    with open(path, 'rb') as part:
+                        shutil.copyfileobj(part, concat)
+        fields[input_name] = name
+    fields.update({"root": step["root"], "ncpus": cpus, "memory_GB": memory_GB})
+    command = "bash -e -c " + pipes.quote(step["command"].format(**fields))
+    if args.submit:
+        command = args.submit.format(ncpus=cpus, memory_GB=memory_GB, name=step["name"]) + " " + command
+    step["log"] = os.path.join(step["outdir"], step["name"] + ".log")
+    print "Running '%s' for '%s' with %d cpus and %dGB: %s" % (step["name"], step["instance"], cpus, memory_GB,
+                                                                command)
+    step["granted"] = (cpus, memory_GB)
+    step["start"] = time.time()
+    log = open(step["log"], 'w')
+    step["proc"] = subprocess.Popen(command, shell=True, cwd=step["workdir"], stdout=log, stderr=subprocess.STDOUT,
+                                    env=env)
+    log.close()
+    step["status"] = "running"
+
+
+def finish_step(defs, step, args):
+    '''Moves a finished step's results into its results directory and records whether it succeeded.'''
+    step["seconds"] = time.time() - step["start"]
+    returncode = step["proc"].returncode
+    if returncode == 0:
+        for name in os.listdir(step["workdir"]):
+            path = os.path.join(step["workdir"], name)
+            if name.startswith(step["root"]) and os.path.isfile(path) and not os.path.islink(path):
+                os.rename(path, os.path.join(step["outdir"], name))
+        (step["found"], complete) = find_results(defs, step)
+        if not complete:
+            returncode = "missing results"
+    if returncode == 0:
+        step["status"] = "done"
+        if not args.keep_work:
+            shutil.rmtree(step["workdir"])
+        print "Finished '%s' for '%s' in %.0f seconds" % (step["name"], step["instance"], step["seconds"])
+    else:
+        step["status"] = "failed"
+        print "ERROR: '%s' for '%s' failed (%s).  See '%s' and '%s'." % (step["name"], step["instance"],
+                                                                         returncode, step["log"], step["workdir"])
+
+
+def blocked(step):
+    '''Returns True if a step can never run, because a step it depends on did not succeed.'''
+    for source in step["inputs"].values():
+        if source[0] == "step" and source[1]["status"] in ["failed", "blocked"]:
+            return True
+    return False
+
+
+def run_steps(defs, planned, args):
+    '''Runs planned steps as their inputs become ready and their cpu and memory tokens are free.'''
+    env = os.environ.copy()
+    here = os.path.dirname(os.path.abspath(__file__))
+    # The pipeline's scripts are found after any installed tools, so a node's own STAR, samtools, etc. are used
+    script_dirs = sorted(glob.glob(os.path.join(here, "*", "resources", "usr", "bin")) + \
+                         glob.glob(os.path.join(here, "*", "*", "resources", "usr", "bin")))
+    env["PATH"] = os.pathsep.join([env.get("PATH", "")] + script_dirs + [os.path.join(here, "tools")])
+    free_cpus = args.cpus
+    free_GB = args.memory_GB
+    failed = False
+    while True:
+        for step in planned:
+            if step["status"] == "running" and step["proc"].poll() is not None:
+                finish_step(defs, step, args)
+                free_cpus += step["granted"][0]
+                free_GB += step["granted"][1]
+                failed = failed or step["status"] == "failed"
+        for step in planned:
+            if step["status"] != "pending":
+                continue
+            if blocked(step):
+                step["status"] = "blocked"
+                continue
+            if failed and not args.keep_going:
+                continue
+            inputs = input_files(defs, step)
+            if inputs is None:
+                continue
+            # A step wanting more than the machine has gets all of it, once all else is done
+            cpus = min(step["cpus"], args.cpus)
+            memory_GB = min(step["memory_GB"], args.memory_GB)
+            if cpus <= free_cpus and memory_GB <= free_GB:
+                start_step(defs, step, inputs, cpus, memory_GB, args, env)
+                free_cpus -= cpus
+                free_GB -= memory_GB
+        if not [step for step in planned if step["status"] == "running"]:
+            break
+        time.sleep(POLL_SECONDS)
+    for step in planned:
+        if step["status"] == "pending":
+            step["status"] = "not run"
+
+
+def write_status(planned, args):
+    '''Writes and prints the status, tokens and wall time of every step.'''
+    status_file = os.path.join(args.results, STATUS_FILE)
+    with open(status_file, 'w') as fh:
+        fh.write("\t".join(["step", "instance", "status", "cpus", "memory_GB", "seconds"]) + "\n")
+        for step in planned:
+            (cpus, memory_GB) = step.get("granted", ("", ""))
+            seconds = "%.0f" % step["seconds"] if "seconds" in step else ""
+            fh.write("\t".join([step["name"], step["instance"], step["status"], str(cpus), str(memory_GB),
+                                seconds]) + "\n")
+    print open(status_file).read()
+
+
+def memory_GB_available():
+    '''Returns the machine's memory in GB.'''
+    for line in open("/proc/meminfo"):
+        if line.startswith("MemTotal:"):
+            return int(line.split()[1]) / (1024 * 1024)
+    return 0
+
+
+def get_args():
+    '''Parse the input arguments.'''
+    ap = argparse.ArgumentParser(description="Runs a pipeline's DNAnexus independent scripts locally, steps " +
+                                 "running concurrently as their inputs and cpu and memory tokens allow.  " +
+                                 "Steps whose results already exist are skipped.")
+    ap.add_argument('pipeline',
+                    help="Pipeline whose launcher defines the steps.",
+                    choices=sorted(LAUNCHERS.keys()))
+    ap.add_argument('config',
+                    help="JSON file of 'files' (tokens such as 'star_index' to paths), 'params' and 'reps', each " +
+                         "rep with a 'root', its own 'files' (e.g. 'reads1') and optional 'params'.")
+    ap.add_argument('-r', '--results',
+                    help="Directory in which each replicate gets a results directory named by its root " +
+                         "(default: '.').",
+                    default='.',
+                    required=False)
+    ap.add_argument('--cpus',
+                    help="Number of cpu tokens shared by all steps (default: cpus on this machine).",
+                    type=int,
+                    default=multiprocessing.cpu_count(),
+                    required=False)
+    ap.add_argument('--memory_GB',
+                    help="Number of memory (GB) tokens shared by all steps (default: memory on this machine).",
+                    type=int,
+                    default=memory_GB_available(),
+                    required=False)
+    ap.add_argument('--submit',
+                    help="Command prefixed to each step to run it elsewhere on a shared filesystem, with " +
+                         "{ncpus}, {memory_GB} and {name} filled in (e.g. 'srun -c {ncpus} --mem={memory_GB}G').",
+                    required=False)
+    ap.add_argument('--all_steps',
+                    help="Do not prune the steps the launcher prunes by default (e.g. TopHat).",
+                    action='store_true',
+                    required=False)
+    ap.add_argument('--fused',
+                    help="Run the launcher's fused steps in place of the split steps.",
+                    action='store_true',
+                    required=False)
+    ap.add_argument('--defer_ci',
+                    help="Calculate RSEM credibility intervals in a follow-on step.",
+                    action='store_true',
+                    required=False)
+    ap.add_argument('--keep_going',
+                    help="Keep starting steps that do not depend on a failed step.",
+                    action='store_true',
+                    required=False)
+    ap.add_argument('--keep_work',
+                    help="Keep each step's work directory.",
+                    action='store_true',
+                    required=False)
+    ap.add_argument('--test',
+                    help='Test run only, do not run anything.',
+                    action='store_true',
+                    required=False)
+    return ap.parse_args()
+
+
+def main():
+    args = get_args()
+    defs = read_launcher(args.pipeline)
+    config = json.load(open(args.config))
+    if not config.get("reps"):
+        sys.exit("ERROR: '%s' has no 'reps'." % args.config)
+    config_dir = os.path.dirname(os.path.abspath(args.config))
+    psv = pipeline_vars(config, args)
+    planned = plan_steps(defs, config, config_dir, psv, args)
+
+    for step in planned:
+        (step["found"], complete) = find_results(defs, step)
+        if complete:
+            step["status"] = "skipped"
+        print "%-24s %-8s %s" % (step["name"], step["instance"],
+                                 "(results exist)" if complete else step["command"])
+    if args.test:
+        return
+    run_steps(defs, planned, args)
+    write_status(planned, args)
+    if [step for step in planned if step["status"] not in ["done", "skipped"]]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,13 @@
 #!/usr/bin/env python
-# lrnaLaunch.py 2.1.1
+# lrnaLaunch.py 2.1.3
 
 import sys
 import json
+import copy
 
-# import dxpy
+import launch_client
+import launch_profile
+launch_profile.defer_imports()  # dxpy and dxencode are imported when first used, not to parse arguments
 from launch import Launch
 # from template import Launch # (does not use dxencode at all)
 
@@ -81,7 +84,8 @@ class LrnaLaunch(Launch):
                             },
                             "align-star-pe":   {
                                         "app":     "align-star-pe",
-                                        "params":  {"library_id":      "library_id"},  # "nthreads"
+                                        "params":  {"library_id":      "library_id",
+                                                    "nshards":         "nshards"},  # "nthreads"
                                         "inputs":  {"reads1":          "reads1",
                                                     "reads2":          "reads2",
                                                     "star_index":      "star_index"},
@@ -112,10 +116,32 @@ class LrnaLaunch(Launch):
                                                     "OPT_star_plus_all_bw":   "plus_all_bw",
                                                     "OPT_star_plus_uniq_bw":  "plus_uniq_bw"}
                             },
+                            "align-signal-quant-pe": {
+                                        "app":     "align-signal-quant-pe",
+                                        "params":  {"library_id":        "library_id",
+                                                    "stranded":          "stranded",
+                                                    "read_strand":       "read_strand"},  # "nthreads"
+                                        "inputs":  {"reads1":            "reads1",
+                                                    "reads2":            "reads2",
+                                                    "star_index":        "star_index",
+                                                    "chrom_sizes":       "chrom_sizes",
+                                                    "rsem_index":        "rsem_index"},
+                                        "results": {"star_genome_bam":   "star_genome_bam",
+                                                    "star_anno_bam":     "star_anno_bam",
+                                                    "OPT_star_all_bw":     "all_bw",
+                                                    "OPT_star_uniq_bw":    "uniq_bw",
+                                                    "OPT_star_minus_all_bw":  "minus_all_bw",
+                                                    "OPT_star_minus_uniq_bw": "minus_uniq_bw",
+                                                    "OPT_star_plus_all_bw":   "plus_all_bw",
+                                                    "OPT_star_plus_uniq_bw":  "plus_uniq_bw",
+                                                    "rsem_iso_results":  "rsem_iso_results",
+                                                    "rsem_gene_results": "rsem_gene_results"}
+                            },
                             "quant-rsem":     {
                                         "app":     "quant-rsem",
                                         "params":  {"paired_end":       "paired_end",
-                                                    "read_strand":       "read_strand"},
+                                                    "read_strand":       "read_strand",
+                                                    "ci_mode":           "ci_mode"},
                                         "inputs":  {"star_anno_bam":     "star_anno_bam",
                                                     "rsem_index":        "rsem_index"},
                                         "results": {"rsem_iso_results":  "rsem_iso_results",
@@ -124,11 +150,22 @@ class LrnaLaunch(Launch):
                             "quant-rsem-alt":     {
                                         "app":     "quant-rsem-alt",
                                         "params":  {"paired_end":       "paired_end",
-                                                    "read_strand":       "read_strand"},
+                                                    "read_strand":       "read_strand",
+                                                    "ci_mode":           "ci_mode"},
                                         "inputs":  {"star_anno_bam":     "star_anno_bam",
                                                     "rsem_index":        "rsem_index"},
                                         "results": {"rsem_iso_results":  "rsem_iso_results",
                                                     "rsem_gene_results": "rsem_gene_results"}
+                            },
+                            "quant-rsem-ci":     {
+                                        "app":     "quant-rsem-ci",
+                                        "params":  {},
+                                        "inputs":  {"rsem_state":        "rsem_state",
+                                                    "rsem_index":        "rsem_index",
+                                                    "rsem_gene_results": "rsem_gene_results",
+                                                    "rsem_iso_results":  "rsem_iso_results"},
+                                        "results": {"rsem_ci_iso_results":  "rsem_ci_iso_results",
+                                                    "rsem_ci_gene_results": "rsem_ci_gene_results"}
                             }
                 }
         },
@@ -159,6 +196,20 @@ class LrnaLaunch(Launch):
     PRUNE_STEPS = ["align-tophat-se", "align-tophat-pe","b2bw-se-top","b2bw-pe-top"]
     '''If --no-tophat is requested, these steps are pruned from the pipeline before launching.'''
 
+    FUSED_STEPS = {"pe": (["align-star-pe", "b2bw-pe-star", "quant-rsem"], "align-signal-quant-pe")}
+    '''Split steps that may be replaced by one fused step, which avoids moving bams between jobs.'''
+
+    FUSED_MAX_GB = 10
+    '''With '--fused auto', launches whose replicates all have at most this many GB of gzipped fastqs run fused.'''
+
+    LOWMEM_APPS = {"align-star-pe": "align-star-pe-lowmem", "align-star-se": "align-star-se-lowmem"}
+    '''With '--star_profile sparse --lowmem', these STAR steps run as their low-memory virtual apps on cheaper
+       instances.  Their memory savings have not been measured (prep-star's lrna_star_profiles_benchmark.sh), so
+       they are never chosen by default.'''
+
+    DEFERRED_CI_STEPS = {"quant-rsem": "quant-rsem-ci", "quant-rsem-alt": "quant-rsem-ci"}
+    '''With '--defer_ci', these RSEM steps skip credibility intervals which the follow-on step calculates.'''
+
     FILE_GLOBS = {
         # For looking up previous result files, use wild-cards
         "tophat_bam":           "/*_tophat.bam",
@@ -179,6 +230,9 @@ class LrnaLaunch(Launch):
         "OPT_star_uniq_bw":         "/*_star_genome_uniq.bw",
         "rsem_iso_results":     "/*_rsem.isoforms.results",
         "rsem_gene_results":    "/*_rsem.genes.results",
+        "rsem_state":           "/*_rsem_state.tgz",
+        "rsem_ci_iso_results":  "/*_rsem_ci.isoforms.results",
+        "rsem_ci_gene_results": "/*_rsem_ci.genes.results",
         "quants_a":             "/*_rsem.genes.results",
         "quants_b":             "/*_rsem.genes.results",
         "mad_plot":             "/*_mad_plot.png",
@@ -232,6 +286,28 @@ class LrnaLaunch(Launch):
                                             }
                                 }
                         },
+        "star_index_sparse": {
+                        "GRCh38": {
+                                "female":   {"v24": "GRCh38_v24pri_tRNAs_ERCC_phiX_sparse_starIndex.tgz"},
+                                "male":     {"v24": "GRCh38_v24pri_tRNAs_ERCC_phiX_sparse_starIndex.tgz"}
+                                },
+                        "hg19": {
+                                "female":   {"v19": "hg19_female_v19_ERCC_sparse_starIndex.tgz"},
+                                "male":     {"v19": "hg19_male_v19_ERCC_sparse_starIndex.tgz"}
+                                },
+                        "mm10": {
+                                "female":   {
+                                            "M2":  "mm10_male_M2_ERCC_sparse_starIndex.tgz",
+                                            "M3":  "mm10_male_M3_ERCC_sparse_starIndex.tgz",
+                                            "M4":  "mm10_XY_M4_ERCC_phiX_sparse_starIndex.tgz"
+                                            },
+                                "male":     {
+                                            "M2":  "mm10_male_M2_ERCC_sparse_starIndex.tgz",
+                                            "M3":  "mm10_male_M3_ERCC_sparse_starIndex.tgz",
+                                            "M4":  "mm10_XY_M4_ERCC_phiX_sparse_starIndex.tgz"
+                                            }
+                                }
+                        },
         "rsem_index":    {
                         "GRCh38":   {"v24": "GRCh38_v24pri_tRNAs_ERCC_phiX_rsemIndex.tgz"},
                         "hg19":     {"v19": "hg19_male_v19_ERCC_rsemIndex.tgz"},
@@ -274,6 +350,48 @@ class LrnaLaunch(Launch):
                         action='store_true',
                         required=False)
 
+        ap.add_argument('--shards',
+                        help='Scatter paired-end STAR alignment of each replicate across this many jobs (default: 1).',
+                        type=int,
+                        default=1,
+                        required=False)
+
+        ap.add_argument('--fused',
+                        help="Run paired-end STAR alignment, signals and RSEM in one job: 'always', 'never' or " + \
+                             "'auto' when every replicate has up to " + str(self.FUSED_MAX_GB) + "GB of fastqs " + \
+                             "(default: 'never').  All replicates of a launch share one choice, so with 'auto' " + \
+                             "one larger replicate keeps them all split; launch it with '-r' on its own to " + \
+                             "fuse the others.  Not with '--shards'.",
+                        choices=['auto', 'always', 'never'],
+                        default='never',
+                        required=False)
+
+        ap.add_argument('--star_profile',
+                        help="STAR index profile: 'full' or the low-memory 'sparse' index (default: 'full').  " + \
+                             "The sparse index runs on the usual instances unless '--lowmem' is also given.",
+                        choices=['full', 'sparse'],
+                        default='full',
+                        required=False)
+
+        ap.add_argument('--lowmem',
+                        help="With '--star_profile sparse', run split STAR steps on cheaper low-memory " + \
+                             "instances.  Unmeasured: the sparse index's memory use has not yet been benchmarked.",
+                        action='store_true',
+                        required=False)
+
+        ap.add_argument('--defer_ci',
+                        help='Publish RSEM results without credibility intervals, which a follow-on step adds later.',
+                        action='store_true',
+                        required=False)
+
+        ap.add_argument('--after_running',
+                        help="First wait for analyses still running in the experiment's results folder (e.g. " + \
+                             "replicates launched on their own) to finish, so the combined replicate steps follow.",
+                        action='store_true',
+                        required=False)
+
+        launch_profile.add_argument(ap)
+
         return ap.parse_args()
 
     def pipeline_specific_vars(self, args, verbose=False):
@@ -291,6 +409,12 @@ class LrnaLaunch(Launch):
         # Some specific settings
         psv['nthreads'] = 8
         psv['rnd_seed'] = 12345
+        psv['nshards'] = max(args.shards, 1)
+        psv['ci_mode'] = "defer" if args.defer_ci else "full"
+        psv['star_profile'] = args.star_profile
+        if args.lowmem and args.star_profile != "sparse":
+            print "The low-memory STAR apps need '--star_profile sparse'."
+            sys.exit(1)
 
         # If paired-end then read_strand might vary TruSeq or ScriptSeq, but only for quant-rsem
         psv["read_strand"] = "unstranded"  # SE experiments are all unstranded
@@ -321,6 +445,10 @@ class LrnaLaunch(Launch):
             self.no_tophat = False
             self.PRUNE_STEPS = []  # This blocks pruning... keeping tophat
 
+        self.choose_fused_steps(args, psv)
+        self.choose_lowmem_apps(args, psv)
+        self.add_deferred_ci_steps(psv)
+
         # Must override results location because of annotation
         psv['resultsLoc'] = self.umbrella_folder(args.folder, self.FOLDER_DEFAULT, self.proj_name,
                                                  psv['exp_type'], psv['genome'], psv['annotation'])
@@ -328,45 +456,128 @@ class LrnaLaunch(Launch):
         if not self.template:
             psv['resultsFolder'] += psv['experiment'] + '/'
         self.update_rep_result_folders(psv)
+        if args.after_running:
+            failed = launch_client.CLIENT.wait_running(self.proj_id, psv['resultsFolder'])
+            if failed:
+                sys.exit("ERROR: Not done: " + ", ".join(failed))
 
         if verbose:
             print "Pipeline Specific Vars:"
             print json.dumps(psv, indent=4)
         return psv
 
+    def fastqs_size_gb(self, rep):
+        '''Returns the size in GB of a replicate's fastqs from the experiment's file metadata, or None if unknown.'''
+        exp = getattr(self, 'exp', None)
+        if not exp or 'fastqs' not in rep:
+            return None
+        file_sizes = {}
+        for exp_file in exp.get('files', []):
+            if isinstance(exp_file, dict) and exp_file.get('file_size') is not None:
+                file_sizes[exp_file.get('accession')] = exp_file['file_size']
+        size = 0
+        for fastqs in rep['fastqs'].values():
+            for fastq in fastqs:
+                accession = fastq.split('/')[-1].split('.')[0]
+                if accession not in file_sizes:
+                    return None
+                size += file_sizes[accession]
+        return size / 1000000000.0
+
+    def choose_fused_steps(self, args, psv):
+        '''Replaces split steps with their fused step when requested or when every replicate is small enough.'''
+        # All replicates of a launch share the REP branch order, so one large replicate keeps them all split.
+        end = "pe" if psv['paired_end'] else "se"
+        if end not in self.FUSED_STEPS or args.fused == 'never':
+            return
+        (split_steps, fused_step) = self.FUSED_STEPS[end]
+        # The fused step aligns in one job, so it cannot honour '--shards'
+        if psv['nshards'] > 1:
+            if args.fused == 'always':
+                print "'--fused always' cannot be combined with '--shards %d'." % psv['nshards']
+                sys.exit(1)
+            print "Will run split steps, as '--shards %d' scatters the alignment" % psv['nshards']
+            return
+        if args.fused == 'auto':
+            for ltr in sorted(psv['reps'].keys()):
+                if len(ltr) != 1:  # only simple reps
+                    continue
+                rep = psv['reps'][ltr]
+                size = self.fastqs_size_gb(rep)
+                if size is None:
+                    print "Replicate %s has fastqs of unknown size so will run split steps" % rep['rep_tech']
+                    return
+                if size > self.FUSED_MAX_GB:
+                    print "Replicate %s has %.1fGB of fastqs so will run split steps" % (rep['rep_tech'], size)
+                    return
+        branches = copy.deepcopy(self.PIPELINE_BRANCHES)
+        order = branches["REP"]["ORDER"][end]
+        order.insert(order.index(split_steps[0]), fused_step)
+        for step in split_steps:
+            order.remove(step)
+        self.PIPELINE_BRANCHES = branches
+        print "Will run fused step '%s' in place of %s" % (fused_step, ", ".join(split_steps))
+
+    def choose_lowmem_apps(self, args, psv):
+        '''Runs split STAR steps as their low-memory apps when asked to with the sparse STAR index.'''
+        # A fused step keeps its own instance, since RSEM there needs the memory whatever the STAR index.
+        if not args.lowmem:
+            return
+        branches = copy.deepcopy(self.PIPELINE_BRANCHES)
+        for (step, lowmem_app) in self.LOWMEM_APPS.items():
+            branches["REP"]["STEPS"][step]["app"] = lowmem_app
+        self.PIPELINE_BRANCHES = branches
+        print "Will align with the sparse STAR index on low-memory instances"
+
+    def add_deferred_ci_steps(self, psv):
+        '''Follows each RSEM step with its credibility interval step when credibility intervals are deferred.'''
+        # A fused step calculates its credibility intervals in full, so only split RSEM steps are followed.
+        if psv['ci_mode'] != "defer":
+            return
+        end = "pe" if psv['paired_end'] else "se"
+        branches = copy.deepcopy(self.PIPELINE_BRANCHES)
+        order = branches["REP"]["ORDER"][end]
+        for (quant_step, ci_step) in self.DEFERRED_CI_STEPS.items():
+            if quant_step not in order:
+                continue
+            branches["REP"]["STEPS"][quant_step]["results"]["rsem_state"] = "rsem_state"
+            order.insert(order.index(quant_step) + 1, ci_step)
+            print "Will run '%s' after '%s' to calculate credibility intervals" % (ci_step, quant_step)
+        self.PIPELINE_BRANCHES = branches
+
+    def check_run_log(self, results_folder, *args, **kwargs):
+        '''Checks for analyses still running in the results folder, looking at all of the project's at once.'''
+        # Launch's own check reads the folder's run log, which may name analyses older than the monitor knows of
+        if launch_client.CLIENT.none_running(self.proj_id, results_folder):
+            return True
+        return Launch.check_run_log(self, results_folder, *args, **kwargs)
+
+    def find_file(self, path, *args, **kwargs):
+        '''Looks up a file, except a prior result that the listed results folder shows is not there.'''
+        psv = getattr(self, 'psv', None) or {}
+        project = args[0] if args else kwargs.get('project')
+        if psv.get('resultsFolder') and project == getattr(self, 'proj_id', None) and \
+           launch_client.CLIENT.known_missing(path, project, psv['resultsFolder']):
+            return None
+        return Launch.find_file(self, path, *args, **kwargs)
+
     def find_ref_files(self, priors):
         '''Locates all reference files based upon gender, organism and annotation.'''
-        top_path = self.psv['refLoc']+self.REFERENCE_FILES['tophat_index'][self.psv['genome']][
-                                                    self.psv['gender']][self.psv['annotation']]
-        top_fid = self.find_file(top_path, self.REF_PROJECT_DEFAULT)
-        if top_fid is None:
-            sys.exit("ERROR: Unable to locate TopHat index file '" + top_path + "'")
-        else:
-            priors['tophat_index'] = top_fid
-
-        star_path = self.psv['refLoc']+self.REFERENCE_FILES['star_index'][self.psv['genome']][
-                                                    self.psv['gender']][self.psv['annotation']]
-        star_fid = self.find_file(star_path, self.REF_PROJECT_DEFAULT)
-        if star_fid is None:
-            sys.exit("ERROR: Unable to locate STAR index file '" + star_path + "'")
-        else:
-            priors['star_index'] = star_fid
-
-        rsem_path = self.psv['refLoc']+self.REFERENCE_FILES['rsem_index'][self.psv['genome']][
-                                                                        self.psv['annotation']]
-        rsem_fid = self.find_file(rsem_path, self.REF_PROJECT_DEFAULT)
-        if rsem_fid is None:
-            sys.exit("ERROR: Unable to locate RSEM index file '" + rsem_path + "'")
-        else:
-            priors['rsem_index'] = rsem_fid
-
-        chrom_sizes = self.psv['refLoc']+self.REFERENCE_FILES['chrom_sizes'][self.psv['genome']][
-                                                                                self.psv['gender']]
-        chrom_sizes_fid = self.find_file(chrom_sizes, self.REF_PROJECT_DEFAULT)
-        if chrom_sizes_fid is None:
-            sys.exit("ERROR: Unable to locate Chrom Sizes file '" + chrom_sizes + "'")
-        else:
-            priors['chrom_sizes'] = chrom_sizes_fid
+        (genome, gender, annotation) = (self.psv['genome'], self.psv['gender'], self.psv['annotation'])
+        star_key = 'star_index_sparse' if self.psv.get('star_profile') == "sparse" else 'star_index'
+        paths = {'tophat_index': self.REFERENCE_FILES['tophat_index'][genome][gender][annotation],
+                 'star_index':   self.REFERENCE_FILES[star_key][genome][gender][annotation],
+                 'rsem_index':   self.REFERENCE_FILES['rsem_index'][genome][annotation],
+                 'chrom_sizes':  self.REFERENCE_FILES['chrom_sizes'][genome][gender]}
+        for key in paths:
+            paths[key] = self.psv['refLoc'] + paths[key]
+        # The lookups are independent, so are made together (and only once for a batch of experiments)
+        fids = launch_client.CLIENT.find_files(self.find_file, paths, self.REF_PROJECT_DEFAULT)
+        for (key, label) in [('tophat_index', "TopHat index"), ('star_index', "STAR index"),
+                             ('rsem_index', "RSEM index"), ('chrom_sizes', "Chrom Sizes")]:
+            if fids[key] is None:
+                sys.exit("ERROR: Unable to locate " + label + " file '" + paths[key] + "'")
+            priors[key] = fids[key]
         self.psv['ref_files'] = self.REFERENCE_FILES.keys()
         return priors
 
@@ -376,5 +587,5 @@ class LrnaLaunch(Launch):
 if __name__ == '__main__':
     '''Run from the command line.'''
     lrnaLaunch = LrnaLaunch()
-    lrnaLaunch.run()
+    launch_profile.PROFILE.run(lrnaLaunch)
 
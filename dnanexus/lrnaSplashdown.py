@@ -8,10 +8,12 @@ import argparse
 import os
 import sys
 import json
+import time
 import itertools
 
 import dxpy
 import dxencode as dxencode
+from launch_client import CLIENT
 #from dxencode import dxencode as dxencode
 import json
 
@@ -27,6 +29,13 @@ import json
 #        - STEPS contains step definitions and enforces dependencies by input file tokens matching
 #          to result file tokens of earlier steps.
 #        - FILE_GLOBS is needed for locating result files from prior runs.
+#      - Files are posted in the order of their POST_TEMPLATES 'derived_from' graph: each one as soon as the files it
+#        is derived from have accessions, with up to MAX_POSTS validate-post jobs at once.  So a replicate takes about
+#        the depth of the graph (reads -> bam -> signals) in validations, rather than one per file.
+#      - main() exits at once, as this script is obsolete: files are posted by dxencode's splashdown.py.  post_order()
+#        and submit_files() need nothing of main() (post() starts a validate-post job however the caller likes), so
+#        they are kept working for splashdown.py to import rather than posting one file at a time itself, and for
+#        main() if this script is ever revived.
 
 GENOMES_SUPPORTED = ['hg19', 'mm10']
 GENOME_DEFAULT = 'hg19'
@@ -52,6 +61,15 @@ RESULT_FOLDER_DEFAULT = '/lrna/'
 
 RUNS_LAUNCHED_FILE = "launchedRuns.txt"
 
+MAX_POSTS = 8
+''' The most validate-post jobs running at once.'''
+
+POST_RETRIES = 2
+''' Times a validate-post job that failed or was terminated is run again.'''
+
+POST_TIMEOUT = 6 * 3600
+''' Seconds to wait for a run's files to be posted before giving up on those still waiting or running.'''
+
 REP_STEP_ORDER = {
     # for SE or PE the list in order of steps to run
     "se": [ "concatR1",             "align-tophat-se", "topBwSe", "align-star-se", "starBwSe", "quant-rsem" ],
@@ -519,6 +537,83 @@ def find_ref_files(priors,psv):
     psv['ref_files'] = GENOME_REFERENCES.keys()
 
 
+def post_order(tokens, templates=POST_TEMPLATES):
+    '''Returns tokens in waves, each derived only from files in earlier waves or not being posted.'''
+    remaining = set(tokens)
+    waves = []
+    while remaining:
+        wave = sorted([ token for token in remaining
+                        if not [ parent for parent in templates[token].get('derived_from', []) if parent in remaining ] ])
+        if not wave:
+            sys.exit("ERROR: 'derived_from' loop among %s" % sorted(remaining))
+        waves.append(wave)
+        remaining -= set(wave)
+    return waves
+
+
+def submit_files(run, tokens, post, monitor, max_posts=MAX_POSTS, retries=POST_RETRIES, templates=POST_TEMPLATES,
+                 timeout=POST_TIMEOUT):
+    '''Posts each token's file with post(token, derived_from), which returns a validate-post job id, as soon as the
+       files it is derived from have accessions in run['accessions'].  Returns the tokens not posted.'''
+    waiting = list(itertools.chain(*post_order(tokens, templates)))
+    running = {}  # job id: (token, tries, derived_from)
+    failed = set()
+    deadline = time.time() + timeout
+    while waiting or running:
+        if time.time() > deadline:
+            for (job_id, (token, tries, derived_from)) in sorted(running.items()):
+                print "Not posted %s: %s still %s after %d seconds" % (token, job_id, monitor.state(job_id), timeout)
+            failed.update(waiting + [ job[0] for job in running.values() ])
+            break
+        # Files whose parents are settled: posted, failed or never to be posted
+        ready = []
+        unsettled = set(waiting) | set([ job[0] for job in running.values() ])
+        for token in waiting:
+            parents = templates[token].get('derived_from', [])
+            if [ parent for parent in parents if parent in unsettled ]:
+                continue
+            derived = [ run['accessions'][parent] for parent in parents if run['accessions'].get(parent) ]
+            if parents and not derived:
+                print "Not posting %s: none of %s has an accession" % (token, parents)
+                failed.add(token)
+            elif len(ready) + len(running) < max_posts:
+                ready.append((token, list(itertools.chain(*derived)), 1))
+        for (token, derived_from, tries) in ready:
+            waiting.remove(token)
+        waiting = [ token for token in waiting if token not in failed ]
+        # Preparing and starting each post makes several calls, so a batch of them is started together
+        jobs = CLIENT.gather(dict((token, (post, token, derived_from)) for (token, derived_from, tries) in ready))
+        for (token, derived_from, tries) in ready:
+            print "Submitting %s: %s" % (token, jobs[token])
+            running[jobs[token]] = (token, tries, derived_from)
+        monitor.track(jobs.values())  # so the next refresh looks back far enough to find them
+        if not running:
+            continue
+
+        monitor.refresh()
+        finished = [ job_id for job_id in running if monitor.finished(job_id) ]
+        if not finished:
+            time.sleep(monitor.interval)
+            continue
+        for job_id in finished:
+            (token, tries, derived_from) = running.pop(job_id)
+            job = monitor.describe(job_id)
+            if job['state'] != 'done' and tries <= retries:
+                print "Retrying %s: %s %s" % (token, job_id, job['state'])
+                retry_id = post(token, derived_from)
+                running[retry_id] = (token, tries + 1, derived_from)
+                monitor.track([retry_id])
+                continue
+            output = job.get('output') or {}
+            accession = output.get('accession')
+            print "Posted %s (%s): %s" % (token, output.get('error', job['state']), accession or "Unknown Acc")
+            if accession:
+                run['accessions'][token] = [ accession ]
+            else:
+                failed.add(token)
+    return sorted(failed)
+
+
 #######################
 def main():
     print "OBSOLETE!!! Run dxencode/splasdown.py instead."
@@ -569,6 +664,14 @@ def main():
         psv['accessions'] = { 'reads1': [], 'reads2': [] }
                 
     exp = dxencode.get_exp(psv['experiment'])
+    monitor = CLIENT.monitor(projectId)  # one query per look covers every folder and post job
+    if args.testserver:
+        server = 'test'
+    else:
+        server = 'www'
+    if not args.test:
+        applet = dxencode.find_applet_by_name('validate-post', projectId )
+    n = 0
 
     # TODO: Prevent resubmissions
     for run in  (psv['reps'].values() + [ psv ]):
@@ -580,81 +683,57 @@ def main():
                                 (psv['experiment'],run['rep_tech'],run['stepsToDo'])
     
         print "Checking for currently running analyses..."
-        dxencode.check_run_log(rep['resultsFolder'],projectId, verbose=True)
+        # The folder's run log may name analyses older than the monitor's look back
+        if not CLIENT.none_running(projectId, run['resultsFolder']):
+            dxencode.check_run_log(run['resultsFolder'],projectId, verbose=True)
 
         to_submit = [ k for k in run['priors'].keys() if POST_TEMPLATES.get(k) ]
-        n = 0 # skip reads
-        print "Attempting to submit %s files to args.experiment" % len(to_submit)
-        while(to_submit):
-            if n > len(run['priors']) * len(run['priors']):
-                print "Too many itereations: %s" % run['priors']
-                break
-            token = to_submit.pop(0)
-            print "%s %s" % (token, run['priors'][token])
-            f_ob = POST_TEMPLATES.get(token, None)
-            n += 1
-            if f_ob:
-                derive_check = f_ob.get('derived_from', [])
-                if derive_check:
-                    derived = [ run['accessions'][f] for f in derive_check if run['accessions'].get(f) ]
-                    if not derived:
-                        to_submit.append(token)
-                        continue
-                    else:
-                        f_ob['derived_from'] = list(itertools.chain(*derived))
-                dxFile = dxpy.DXFile(dxid=run['priors'][token])
-                print "Post File: %s %s" % (token, dxFile.name)
-                f_ob['dataset'] = args.experiment
-                f_ob['lab'] = exp['lab']['@id']
-                f_ob['award'] = exp['award']['@id']
-                f_ob['assembly'] = psv['genome']
-                f_ob['genome_annotation'] = psv['annotation']
-                ## temporary haxors until file display works
-                if 'replicate_id' not in run:
-                    f_ob['replicate'] = rep['replicate_id']
-                f_ob['notes'] = json.dumps(dxencode.create_notes(dxFile, dxencode.get_sw_from_log(dxFile, '\* (\S+)\s+version:\s+(\S+)')))
-                print json.dumps(f_ob, sort_keys=True, indent=4, separators=(',',': '))
-                if args.test:
-                    fake_acc = 'ENCFF%03dAAA' % n
-                    print "Fake submission: %s" % fake_acc
-                    run['accessions'][token] = [ fake_acc ]
-                else:
-                    f_ob['derived_from'] = list(itertools.chain(*derived))
-            dxFile = dxpy.DXFile(dxid=priors[token])
+        print "Attempting to submit %s files to %s" % (len(to_submit), args.experiment)
+
+        def file_meta(token, derived_from):
+            f_ob = dict(POST_TEMPLATES[token])  # a copy, as the templates serve every run
+            f_ob['derived_from'] = derived_from
+            dxFile = dxpy.DXFile(dxid=run['priors'][token])
+            ci_results = dxFile.get_properties().get('ci_results')
+            if ci_results:  # deferred RSEM results superseded by those with credibility intervals
+                dxFile = dxpy.DXFile(dxid=ci_results)
             print "Post File: %s %s" % (token, dxFile.name)
             f_ob['dataset'] = args.experiment
-            f_ob['lab'] = '/labs/j-michael-cherry/'
-            f_ob['award'] = '/awards/U41HG006992/'
-            f_ob['assembly'] = mapping['genome']
-            f_ob['genome_annotation'] = args.annotation
+            f_ob['lab'] = exp['lab']['@id']
+            f_ob['award'] = exp['award']['@id']
+            f_ob['assembly'] = psv['genome']
+            f_ob['genome_annotation'] = psv['annotation']
             ## temporary haxors until file display works
-            f_ob['replicate'] = mapping['replicate_id']
+            if 'replicate_id' in run:
+                f_ob['replicate'] = run['replicate_id']
             f_ob['notes'] = json.dumps(dxencode.create_notes(dxFile, dxencode.get_sw_from_log(dxFile, '\* (\S+)\s+version:\s+(\S+)')))
             print json.dumps(f_ob, sort_keys=True, indent=4, separators=(',',': '))
-            if args.testserver:
-                server = 'test'
-            else:
-                server = 'www'
+            return (dxFile, f_ob)
 
-            if args.test:
+        if args.test:
+            for token in itertools.chain(*post_order(to_submit)):
+                derived = [ run['accessions'][f] for f in POST_TEMPLATES[token]['derived_from'] if run['accessions'].get(f) ]
+                file_meta(token, list(itertools.chain(*derived)))
+                n += 1
                 fake_acc = 'ENCFF%03dAAA' % n
                 print "Fake submission: %s" % fake_acc
-                submitted[token] = [ fake_acc ]
-            else:
-                applet = dxencode.find_applet_by_name('validate-post', projectId )
-                job = applet.run({
-                    "pipe_file": dxpy.dxlink(dxFile),
-                    "file_meta": f_ob,
-                    "key": server,
-                    "debug": True,
-                    "skipvalidate": args.skipvalidate or False
-                    })
-                print "Submitting %s" % job.id
-                job.wait_on_done(interval=1)
-                accession = job.describe()['output'].get('accession', "Unknown Acc")
-                error = job.describe()['output'].get('error', "Unknown Error")
-                submitted[token] = [ accession ]
-                print "Posted (%s): %s" % (error, accession)
+                run['accessions'][token] = [ fake_acc ]
+            continue
+
+        def post(token, derived_from):
+            (dxFile, f_ob) = file_meta(token, derived_from)
+            job = applet.run({
+                "pipe_file": dxpy.dxlink(dxFile),
+                "file_meta": f_ob,
+                "key": server,
+                "debug": True,
+                "skipvalidate": args.skipvalidate or False
+                })
+            return job.get_id()
+
+        not_posted = submit_files(run, to_submit, post, monitor)
+        if not_posted:
+            print "Not posted for %s: %s" % (run.get('rep_tech', 'combined'), ", ".join(not_posted))
 
     # Exit if test only
     if args.test:
@@ -32,6 +32,18 @@ def root_name_from_pair(filename_a,filename_b):
     if len(a_parts[2]) > 0:
         out_root += a_parts[2]
     return out_root # exp1_rep1_1_quants.tsv and exp1_rep2_1_quants.tsv yield exp1_rep1-2_1_quants.tsv
+
+def columnar_companion(dxfile, suffix=".genes.results", qcol_suffix=".genes.qcol"):
+    '''Returns the '.qcol' file uploaded beside an RSEM quantification (see quant_columns.py), or None.'''
+    if not dxfile.name.endswith(suffix):
+        return None
+    desc = dxfile.describe()
+    try:
+        return dxpy.find_one_data_object(classname='file', name=dxfile.name[:-len(suffix)] + qcol_suffix,
+                                         project=desc['project'], folder=desc['folder'], recurse=False,
+                                         zero_ok=True, return_handler=True)
+    except dxpy.exceptions.DXAPIError:
+        return None  # e.g. a project the job cannot search
     
 @dxpy.entry_point("main")
 def main(quants_a, quants_b):
@@ -43,8 +55,23 @@ def main(quants_a, quants_b):
     dxfile_b = dxpy.DXFile(quants_b)
 
     print "* Downloading files..."
-    dxpy.download_dxfile(dxfile_a.get_id(), "quants_a")
-    dxpy.download_dxfile(dxfile_b.get_id(), "quants_b")
+    mad_inputs = None
+    (columns_a, columns_b) = (columnar_companion(dxfile_a), columnar_companion(dxfile_b))
+    if columns_a is not None and columns_b is not None:
+        # Columnar companions share an id dictionary, so their FPKMs are paired by gene without parsing or joining
+        dxpy.download_dxfile(columns_a.get_id(), "quants_a.qcol")
+        dxpy.download_dxfile(columns_b.get_id(), "quants_b.qcol")
+        try:
+            paired = subprocess.check_output(['quant_columns.py', 'paste', 'FPKM', "quants_a.qcol", "quants_b.qcol"])
+            with open("quants_paired.tsv", 'w') as fh:
+                fh.write(paired)
+            mad_inputs = ["quants_paired.tsv"]
+        except subprocess.CalledProcessError:
+            print "* Columnar quantifications do not share genes, so reading the text quantifications"
+    if mad_inputs is None:
+        dxpy.download_dxfile(dxfile_a.get_id(), "quants_a")
+        dxpy.download_dxfile(dxfile_b.get_id(), "quants_b")
+        mad_inputs = ["quants_a", "quants_b"]
 
     # Create and appropriate name for output files
     out_root = root_name_from_pair(dxfile_a.name.split('.')[0],dxfile_b.name.split('.')[0])
@@ -52,7 +79,7 @@ def main(quants_a, quants_b):
         
     # DX/ENCODE independent script is found in resources/usr/bin
     print "* Runnning MAD.R..."
-    mad_output = subprocess.check_output(['Rscript', '/usr/bin/MAD.R', 'quants_a', 'quants_b'])
+    mad_output = subprocess.check_output(['Rscript', '/usr/bin/MAD.R'] + mad_inputs)
     subprocess.check_call(['mv', "MAplot.png", mad_plot_file])
     
     print "* package properties..."
@@ -0,0 +1,34 @@
+#!/bin/bash -e
+
+if [ $# -lt 4 ] || [ $# -gt 5 ]; then
+    echo "usage v1: lrna_merge_annotation.sh <gene_annotation.gtf.gz> <trna_annotation.gtf.gz> <spike_in.fa.gz> <out_root> [<ncpus>]"
+    echo "Merge gene and tRNA annotations with spike-in sequences into a single gtf.  Is independent of DX and encodeD."
+    echo "Inputs are read compressed, so nothing but the compressed result is written to disk."
+    exit -1;
+fi
+gene_gtf_gz=$1      # Gzipped main gtf file (e.g. GENCODE annotation) which will be passed through.
+trna_gtf_gz=$2      # Gzipped tRNA gtf file (exons only) which will all be labelled 'exon'.
+spike_in_fa_gz=$3   # Gzipped spike-in fasta file, each record of which will become a single exon.
+out_root=$4         # root name for output (e.g. "out" will create "out.gtf.gz")
+ncpus=`grep -c ^processor /proc/cpuinfo`
+if [ $# -eq 5 ]; then
+    ncpus=$5        # Number of cpus available (default: all).
+fi
+
+echo "-- Merged annotation will be: '${out_root}.gtf.gz'"
+
+compressor="gzip -c"
+if which pigz > /dev/null 2>&1; then
+    compressor="pigz -c -p $ncpus"
+fi
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
+echo "-- Merge GTF files..."
+telemetry mark merge_gtf
+set -x
+awk -f /usr/bin/GTF.awk <(zcat $gene_gtf_gz) <(zcat $trna_gtf_gz) <(zcat $spike_in_fa_gz) | $compressor > ${out_root}.gtf.gz
+set +x
+
+echo "-- The results..."
+ls -l ${out_root}.gtf.gz
@@ -11,38 +11,48 @@ main() {
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
 
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     echo "* Value of gene_annotation: '$gene_annotation'"
     echo "* Value of trna_annoation: '$trna_annotation'"
     echo "* Value of spike_in: '$spike_in'"
 
     echo "* Download files..."
+    # Annotations are kept compressed: the merge reads them as streams
     gene_fn=`dx describe "$gene_annotation" --name`
     gene_fn=${gene_fn%.gtf.gz}
     dx download "$gene_annotation" -o "$gene_fn".gtf.gz
-    gunzip "$gene_fn".gtf.gz
 
     trna_fn=`dx describe "$trna_annotation" --name`
     trna_fn=${trna_fn%.gtf.gz}
     dx download "$trna_annotation" -o "$trna_fn".gtf.gz
-    gunzip "$trna_fn".gtf.gz
 
     spike_in_fn=`dx describe "$spike_in" --name`
     spike_in_fn=${spike_in_fn%.fasta.gz}
     spike_in_fn=${spike_in_fn%.fa.gz}
     dx download "$spike_in" -o "$spike_in_fn".fa.gz
-    gunzip "$spike_in_fn".fa.gz
 
-    # Fill in your application code here.
+    out_fn="$gene_fn"-"tRNAs"-"$spike_in_fn".gtf
 
-    echo "* Merge GTF files..."
+    # DX/ENCODE independent script is found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
     set -x
-    out_fn="$gene_fn"-"tRNAs"-"$spike_in_fn".gtf
-    awk -f /usr/bin/GTF.awk ${gene_fn}.gtf ${trna_fn}.gtf ${spike_in_fn}.fa > ${out_fn}
-    gzip ${out_fn}
+    lrna_merge_annotation.sh ${gene_fn}.gtf.gz ${trna_fn}.gtf.gz ${spike_in_fn}.fa.gz ${out_fn%.gtf}
     set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
 
     echo "* Upload results..."
-    combined_gtf=$(dx upload $out_fn.gz --property SW="$versions" --brief)
+    telemetry=`telemetry details`
+    telemetry mark upload
+    combined_gtf=$(dx upload $out_fn.gz --details="{ $telemetry }" --property SW="$versions" --brief)
     dx-jobutil-add-output combined_gtf "$combined_gtf" --class=file
+    if [ -f /usr/bin/anno_model.py ]; then
+        # Stages that only need gene ids, biotypes, intervals or TSSs can load this instead of the gtf
+        anno_model.py build $out_fn.gz ${out_fn%.gtf}_anno.qcol
+        anno_model=$(dx upload ${out_fn%.gtf}_anno.qcol --details="{ $telemetry }" --property SW="$versions" --brief)
+        dx-jobutil-add-output anno_model "$anno_model" --class=file
+    fi
+    telemetry stop
     echo "* Finished."
 }
@@ -0,0 +1,138 @@
+#!/bin/bash -e
+
+if [ $# -lt 8 ] || [ $# -gt 11 ]; then
+    echo "usage v2: lrna_index_all.sh <ref_fasta_gz> <spike_in_fasta_gz> <annotation_gtf_gz> <tiny_fq_gz> <annotation_version> <genome> <ncpus> <memory_GB> [<gender> [<rsem_ref_fasta_gz> <rsem_gender>]]"
+    echo "Creates STAR, RSEM and TopHat indexes of reference genome, annotation and spike-ins for long-RNA-seq, all at once."
+    echo "Is independent of DX and encodeD."
+    exit -1;
+fi
+ref_fasta_gz=$1      # Reference genome assembly in gzipped fasta format.
+spike_fasta_gz=$2    # All spike-ins in single gzipped fasta format.
+anno_gtf_gz=$3       # Gene annotation in gzipped gtf format
+tiny_fq_gz=$4        # Tiny gzipped fastq used to fake a TopHat alignment, which completes the TopHat index.
+anno=$5              # Annotation (e.g. 'v24')
+genome=$6            # Genome (e.g. 'GRCh38')
+ncpus=$7             # Number of cpus shared by all three index builds.
+memory_GB=$8         # Memory (GB) shared by all three index builds.
+gender=""
+if [ $# -ge 9 ]; then
+    gender=$9        # Gender. Values: 'female', 'male', 'XX', 'XY' will be included in names.  Otherwise, gender neutral.
+fi
+rsem_fasta_gz=$ref_fasta_gz
+rsem_gender=$gender
+if [ $# -ge 10 ]; then
+    rsem_fasta_gz=${10}  # Genome for the RSEM index when not ref_fasta_gz (RSEM takes the male genome for female refs).
+    rsem_gender=${11}    # Gender of that genome, for the RSEM index's name.
+fi
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
+echo "-- Unzipping reference files once, into 'shared/'..."
+telemetry mark unzip
+ref_fasta=`basename ${ref_fasta_gz%.gz}`
+spike_fasta=`basename ${spike_fasta_gz%.gz}`
+anno_gtf=`basename ${anno_gtf_gz%.gz}`
+tiny_fq=`basename ${tiny_fq_gz%.gz}`
+rsem_fasta=`basename ${rsem_fasta_gz%.gz}`
+set -x
+mkdir shared
+gunzip -c $ref_fasta_gz > shared/$ref_fasta &
+unzip_pids="$!"
+gunzip -c $spike_fasta_gz > shared/$spike_fasta &
+unzip_pids="$unzip_pids $!"
+gunzip -c $anno_gtf_gz > shared/$anno_gtf &
+unzip_pids="$unzip_pids $!"
+gunzip -c $tiny_fq_gz > shared/$tiny_fq &
+unzip_pids="$unzip_pids $!"
+if [ "$rsem_fasta" != "$ref_fasta" ]; then
+    gunzip -c $rsem_fasta_gz > shared/$rsem_fasta &
+    unzip_pids="$unzip_pids $!"
+fi
+for pid in $unzip_pids; do
+    wait $pid
+done
+set +x
+
+# Each index is built by its own applet's script in its own directory, all reading the same unzipped files.
+for index in star rsem tophat; do
+    mkdir $index
+    for file in $ref_fasta $spike_fasta $anno_gtf; do
+        ln -s ../shared/$file $index/$file
+    done
+done
+ln -s ../shared/$tiny_fq tophat/$tiny_fq
+if [ "$rsem_fasta" != "$ref_fasta" ]; then
+    ln -s ../shared/$rsem_fasta rsem/$rsem_fasta
+fi
+
+# bowtie2-build and rsem-prepare-reference are single threaded, so STAR gets all but 2 cpus, which the 'quicky'
+# tophat uses once bowtie2-build is done.  STAR's genomeGenerate needs ~10 bytes per reference base (~32GB for human),
+# while bowtie2-build and rsem-prepare-reference together need less than half of that.  When all three do not fit
+# in memory, RSEM and TopHat are built first and then STAR alone, with all cpus.
+ref_GB=$(( ( `stat -c %s shared/$ref_fasta` + `stat -c %s shared/$spike_fasta` ) / 1000000000 + 1 ))
+star_GB=$(( ref_GB * 10 ))
+others_GB=$(( ref_GB * 4 ))
+star_cpus=$(( ncpus - 2 ))
+if [ $star_cpus -lt 1 ]; then
+    star_cpus=1
+fi
+tophat_cpus=2
+concurrent="true"
+if [ $(( star_GB + others_GB )) -gt $memory_GB ]; then
+    concurrent="false"
+    star_cpus=$ncpus
+fi
+echo "-- Expecting STAR to need ${star_GB}GB and RSEM with TopHat ${others_GB}GB of the ${memory_GB}GB available."
+
+finish_build() {
+    # Waits for one index build and adds its log to this one
+    index=$1
+    pid=$2
+    build_status=0
+    wait $pid || build_status=$?
+    echo "-- ===== ${index} index build log ====="
+    cat ${index}_index.log
+    if [ $build_status -ne 0 ]; then
+        echo "ERROR: ${index} index build failed with status $build_status"
+        exit $build_status
+    fi
+}
+
+echo "-- Building indexes (concurrently with STAR: $concurrent)..."
+# The concurrent builds (and collecting their archives) are one sub-step, as their own marks would interleave
+telemetry mark build_indexes
+unset STAGE_TELEMETRY
+set -x
+(cd rsem;   lrna_index_rsem.sh   $rsem_fasta $spike_fasta $anno_gtf         $anno $genome "$rsem_gender" ) \
+    > rsem_index.log 2>&1 &
+rsem_pid=$!
+(cd tophat; lrna_index_tophat.sh $ref_fasta $spike_fasta $anno_gtf $tiny_fq $anno $genome "$gender" $tophat_cpus) \
+    > tophat_index.log 2>&1 &
+tophat_pid=$!
+if [ "$concurrent" == "true" ]; then
+    (cd star; lrna_index_star.sh $ref_fasta $spike_fasta $anno_gtf $anno $genome "$gender" $star_cpus) \
+        > star_index.log 2>&1 &
+    star_pid=$!
+else
+    finish_build rsem $rsem_pid
+    finish_build tophat $tophat_pid
+    (cd star; lrna_index_star.sh $ref_fasta $spike_fasta $anno_gtf $anno $genome "$gender" $star_cpus) \
+        > star_index.log 2>&1 &
+    star_pid=$!
+fi
+finish_build star $star_pid
+if [ "$concurrent" == "true" ]; then
+    finish_build rsem $rsem_pid
+    finish_build tophat $tophat_pid
+fi
+set +x
+
+echo "-- Collect archives..."
+set -x
+mv star/*_starIndex.tgz rsem/*_rsemIndex.tgz tophat/*_tophatIndex.tgz .
+rm -rf shared star rsem tophat
+set +x
+
+echo "-- The results..."
+ls -l *_starIndex.tgz *_rsemIndex.tgz *_tophatIndex.tgz
+
@@ -0,0 +1,163 @@
+#!/bin/bash
+# prep-indexes.sh
+
+main() {
+    # Builds the prep-star, prep-rsem and prep-tophat indexes in one job, from one download and unzip of the inputs.
+    # Results are named just as those applets name them.
+
+    # If available, will print tool versions to stderr and json string to stdout
+    versions=''
+    if [ -f /usr/bin/tool_versions.py ]; then
+        versions=`tool_versions.py --dxjson dnanexus-executable.json`
+    fi
+
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
+    echo "* Value of ref_genome:  '$ref_genome'"
+    echo "* Value of spike_in:    '$spike_in'"
+    echo "* Value of annotations: '$annotations'"
+    echo "* Value of tiny_fq:     '$tiny_fq'"
+    if [ "$rsem_genome" != "" ]; then
+        echo "* Value of rsem_genome: '$rsem_genome'"
+    fi
+
+    ncpus=`grep -c ^processor /proc/cpuinfo`
+    memory_GB=$(( `grep MemTotal /proc/meminfo | awk '{print $2}'` / 1048576 ))
+    echo "* Cpus: '$ncpus', memory: '${memory_GB}GB'"
+
+    echo "* Download files..."
+    ref_root=`dx describe "$ref_genome" --name`
+    ref_root=${ref_root%.fasta.gz}
+    ref_root=${ref_root%.fa.gz}
+    dx download "$ref_genome" -o ${ref_root}.fa.gz
+
+    spike_root=`dx describe "$spike_in" --name`
+    spike_root=${spike_root%.fasta.gz}
+    spike_root=${spike_root%.fa.gz}
+    dx download "$spike_in" -o ${spike_root}.fa.gz
+
+    anno_root=`dx describe "$annotations" --name`
+    anno_root=${anno_root%.gtf.gz}
+    dx download "$annotations" -o ${anno_root}.gtf.gz
+
+    dx download "$tiny_fq" -o tiny.fq.gz
+
+    # RSEM may be given its own genome (the male genome for a female ref_genome), so no separate prep-rsem is needed
+    rsem_args=""
+    rsem_gender=""
+    if [ "$rsem_genome" != "" ]; then
+        rsem_root=`dx describe "$rsem_genome" --name`
+        rsem_root=${rsem_root%.fasta.gz}
+        rsem_root=${rsem_root%.fa.gz}
+        if [ "$rsem_root" != "$ref_root" ]; then
+            dx download "$rsem_genome" -o ${rsem_root}.fa.gz
+            if [ -f /usr/bin/parse_property.py ]; then
+                rsem_gender=`parse_property.py -f "$rsem_genome" -p gender`
+            fi
+            if [ "$rsem_gender" == "" ]; then
+                if [[ $rsem_root == *"female"* ]] || [[ $rsem_root == *"XX"* ]]; then
+                    rsem_gender="XX"
+                elif [[ $rsem_root == *"male"* ]] || [[ $rsem_root == *"XY"* ]]; then
+                    rsem_gender="XY"
+                fi
+            fi
+            rsem_args="${rsem_root}.fa.gz $rsem_gender"
+        fi
+    fi
+
+    # hg19/mm10 and male/female?
+    if [ -f /usr/bin/parse_property.py ]; then
+        genome=`parse_property.py -f "$ref_genome" -p genome`
+        gender=`parse_property.py -f "$ref_genome" -p gender`
+        anno=`parse_property.py -f "$annotations" -p annotation`
+    fi
+    if [ "$genome" == "" ]; then
+        if [[ $ref_root == *"hg19"* ]]; then
+            genome="hg19"
+        elif [[ $ref_root == *"GRCh38"* ]]; then
+            genome="GRCh38"
+        elif [[ $ref_root == *"mm10"* ]]; then
+            genome="mm10"
+        fi
+    fi
+    if [ "$genome" == "" ]; then
+        genome="unknown"
+        echo "* WARNING genome: '$genome'" 
+    else
+        echo "* genome: '$genome'" 
+    fi
+    if [ "$gender" == "" ]; then
+        if [[ $ref_root == *"female"* ]] || [[ $ref_root == *"XX"* ]]; then
+            gender="XX"
+        elif [[ $ref_root == *"male"* ]] || [[ $ref_root == *"XY"* ]]; then
+            gender="XY"
+        fi
+    fi
+    if [ "$gender" != "" ]; then
+        echo "* gender: '$gender'" 
+    fi
+    if [ "$anno" == "" ]; then
+        if [[ $anno_root == *"v19"* ]] || [[ $anno_root == *"V19"* ]]; then
+            anno="v19"
+            echo "* WARNING annotation version: '$anno'" 
+        elif [[ $anno_root == *"v24"* ]] || [[ $anno_root == *"V24"* ]]; then
+            anno="v24"
+        elif [[ $anno_root == *"M4"* ]]; then
+            anno="M4"
+        elif [[ $anno_root == *"M3"* ]]; then
+            anno="M3"
+        elif [[ $anno_root == *"M2"* ]]; then
+            anno="M2"
+        fi
+    fi
+    if [ "$anno" == "" ]; then
+        anno="unknown"
+        echo "* WARNING annotation version: '$anno'"
+    else 
+        echo "* annotation version: '$anno'" 
+    fi
+
+    # DX/ENCODE independent script is found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    lrna_index_all.sh ${ref_root}.fa.gz ${spike_root}.fa.gz ${anno_root}.gtf.gz tiny.fq.gz $anno $genome \
+                      $ncpus $memory_GB "$gender" $rsem_args
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+    archive_root="${genome}_${anno}_${spike_root}"
+    if [ "$gender" == "famale" ] || [ "$gender" == "male" ] || [ "$gender" == "XX" ] || [ "$gender" == "XY" ]; then
+        archive_root="${genome}_${gender}_${anno}_${spike_root}"
+    fi
+    rsem_archive_root=$archive_root
+    if [ "$rsem_args" != "" ]; then
+        rsem_archive_root="${genome}_${anno}_${spike_root}"
+        if [ "$rsem_gender" == "famale" ] || [ "$rsem_gender" == "male" ] || [ "$rsem_gender" == "XX" ] || \
+           [ "$rsem_gender" == "XY" ]; then
+            rsem_archive_root="${genome}_${rsem_gender}_${anno}_${spike_root}"
+        fi
+    else
+        rsem_gender=$gender
+    fi
+
+    echo "* Upload results..."
+    telemetry=`telemetry details`
+    telemetry mark upload
+    star_index=$(dx upload ${archive_root}_starIndex.tgz --property genome="$genome"   --property gender="$gender" \
+                                                         --property annotation="$anno"  --property spike_in="$spike_root" \
+                                                         --details="{ $telemetry }" --property SW="$versions" --brief)
+    rsem_index=$(dx upload ${rsem_archive_root}_rsemIndex.tgz --property genome="$genome" \
+                                                         --property gender="$rsem_gender" \
+                                                         --property annotation="$anno"  --property spike_in="$spike_root" \
+                                                         --details="{ $telemetry }" --property SW="$versions" --brief)
+    tophat_index=$(dx upload ${archive_root}_tophatIndex.tgz --property genome="$genome"   --property gender="$gender" \
+                                                             --property annotation="$anno"  --property spike_in="$spike_root" \
+                                                             --details="{ $telemetry }" \
+                                                             --property SW="$versions" --brief)
+
+    dx-jobutil-add-output star_index $star_index --class=file
+    dx-jobutil-add-output rsem_index $rsem_index --class=file
+    dx-jobutil-add-output tophat_index $tophat_index --class=file
+    telemetry stop
+    echo "* Finished."
+}
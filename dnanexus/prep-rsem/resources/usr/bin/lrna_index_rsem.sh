@@ -5,27 +5,36 @@ if [ $# -lt 5 ] || [ $# -gt 6 ]; then
     echo "Creates RSEM index of reference genome, annotation and spike-ins for long-RNA-seq. Is independent of DX and encodeD."
     exit -1; 
 fi
-ref_fasta_gz=$1      # Reference genome assembly in gzipped fasta format.
-spike_fasta_gz=$2    # All spike-ins in single gzipped fasta format.
-anno_gtf_gz=$3       # Gene annotation in gzipped gtf format
+ref_fasta_gz=$1      # Reference genome assembly in gzipped (or unzipped) fasta format.
+spike_fasta_gz=$2    # All spike-ins in single gzipped (or unzipped) fasta format.
+anno_gtf_gz=$3       # Gene annotation in gzipped (or unzipped) gtf format
 anno=$4              # Annotation (e.g. 'v24')
 genome=$5            # Genome (e.g. 'GRCh38')
 if [ $# -eq 6 ]; then
     gender=$6        # Gender. Values: 'female', 'male', 'XX', 'XY' will be included in names.  Otherwise, gender neutral.  
 fi
 
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
 echo "-- Unzipping reference files..."
+telemetry mark unzip
 ref_fasta=${ref_fasta_gz%.gz}
 ref_root=${ref_fasta%.fasta}
 ref_root=${ref_root%.fa}
-gunzip $ref_fasta_gz
+if [ "$ref_fasta" != "$ref_fasta_gz" ]; then
+    gunzip $ref_fasta_gz
+fi
 spike_fasta=${spike_fasta_gz%.gz}
 spike_root=${spike_fasta%.fasta}
 spike_root=${spike_root%.fa}
-gunzip $spike_fasta_gz
+if [ "$spike_fasta" != "$spike_fasta_gz" ]; then
+    gunzip $spike_fasta_gz
+fi
 anno_gtf=${anno_gtf_gz%.gz}
 anno_root=${anno_gtf%.gtf}
-gunzip $anno_gtf_gz
+if [ "$anno_gtf" != "$anno_gtf_gz" ]; then
+    gunzip $anno_gtf_gz
+fi
 
 archive_file="${genome}_${anno}_${spike_root}_rsemIndex.tgz"
 if [ "$gender" == "famale" ] || [ "$gender" == "male" ] || [ "$gender" == "XX" ] || [ "$gender" == "XY" ]; then
@@ -34,6 +43,7 @@ fi
 echo "-- Results will be: '${archive_file}'."
 
 echo "-- Prepare reference..."
+telemetry mark rsem_prepare_reference
 set -x
 mkdir out
 rsem-prepare-reference --gtf $anno_gtf ${ref_fasta},${spike_fasta} out/rsem
@@ -41,6 +51,7 @@ set +x
 
 # Attempt to make bamCommentLines.txt, which should be reviewed. NOTE tabs handled by assignment.
 echo "-- Create bam header..."
+telemetry mark bam_header
 set -x
 refComment="@CO\tREFID:$(basename ${ref_root})"
 annotationComment="@CO\tANNID:$(basename ${anno_root})"
@@ -53,7 +64,11 @@ set +x
 
 echo "* Tar up index..."
 set -x
-tar -czf $archive_file out/*
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py create $archive_file out/* --threads `grep -c ^processor /proc/cpuinfo`
+else
+    tar -czf $archive_file out/*
+fi
 set +x
 
 echo "-- The results..."
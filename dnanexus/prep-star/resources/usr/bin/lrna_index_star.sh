@@ -1,48 +1,77 @@
 #!/bin/bash -e
 
-if [ $# -lt 5 ] || [ $# -gt 6 ]; then
-    echo "usage v1: lrna_index_star.sh <ref_fasta_gz> <spike_in_fasta_gz> <annotation_gtf_gz> <annotation_version> <genome> [<gender>]"
+if [ $# -lt 5 ] || [ $# -gt 8 ]; then
+    echo "usage v1: lrna_index_star.sh <ref_fasta_gz> <spike_in_fasta_gz> <annotation_gtf_gz> <annotation_version> <genome> [<gender>] [<ncpus>] [<profile>]"
     echo "Creates STAR index of reference genome, annotation and spike-ins for long-RNA-seq. Is independent of DX and encodeD."
     exit -1; 
 fi
-ref_fasta_gz=$1      # Reference genome assembly in gzipped fasta format.
-spike_fasta_gz=$2    # All spike-ins in single gzipped fasta format.
-anno_gtf_gz=$3       # Gene annotation in gzipped gtf format
+ref_fasta_gz=$1      # Reference genome assembly in gzipped (or unzipped) fasta format.
+spike_fasta_gz=$2    # All spike-ins in single gzipped (or unzipped) fasta format.
+anno_gtf_gz=$3       # Gene annotation in gzipped (or unzipped) gtf format
 anno=$4              # Annotation (e.g. 'v24')
 genome=$5            # Genome (e.g. 'GRCh38')
-if [ $# -eq 6 ]; then
+if [ $# -ge 6 ]; then
     gender=$6        # Gender. Values: 'female', 'male', 'XX', 'XY' will be included in names.  Otherwise, gender neutral.  
 fi
+ncpus=8
+if [ $# -ge 7 ]; then
+    ncpus=$7         # Number of threads STAR may use (default 8).
+fi
+profile="full"
+if [ $# -eq 8 ]; then
+    profile=$8       # Index profile: 'full' (default) or 'sparse', which keeps every 2nd suffix for half the memory.
+fi
+sparse_params=""
+if [ "$profile" == "sparse" ]; then
+    sparse_params="--genomeSAsparseD 2"
+elif [ "$profile" != "full" ]; then
+    echo "ERROR: unknown index profile '$profile'"
+    exit 1
+fi
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
 
 echo "-- Unzipping reference files..."
+telemetry mark unzip
 ref_fasta=${ref_fasta_gz%.gz}
 ref_root=${ref_fasta%.fasta}
 ref_root=${ref_root%.fa}
-gunzip $ref_fasta_gz
+if [ "$ref_fasta" != "$ref_fasta_gz" ]; then
+    gunzip $ref_fasta_gz
+fi
 spike_fasta=${spike_fasta_gz%.gz}
 spike_root=${spike_fasta%.fasta}
 spike_root=${spike_root%.fa}
-gunzip $spike_fasta_gz
+if [ "$spike_fasta" != "$spike_fasta_gz" ]; then
+    gunzip $spike_fasta_gz
+fi
 anno_gtf=${anno_gtf_gz%.gz}
 anno_root=${anno_gtf%.gtf}
-gunzip $anno_gtf_gz
+if [ "$anno_gtf" != "$anno_gtf_gz" ]; then
+    gunzip $anno_gtf_gz
+fi
 
 archive_file="${genome}_${anno}_${spike_root}_starIndex.tgz"
 if [ "$gender" == "famale" ] || [ "$gender" == "male" ] || [ "$gender" == "XX" ] || [ "$gender" == "XY" ]; then
     archive_file="${genome}_${gender}_${anno}_${spike_root}_starIndex.tgz"
 fi
+if [ "$profile" != "full" ]; then
+    archive_file="${archive_file%_starIndex.tgz}_${profile}_starIndex.tgz"
+fi
 echo "-- Results will be: '${archive_file}'."
 
 echo "-- Build index..."
+telemetry mark star_index_build
 set -x
 mkdir out
 STAR --runMode genomeGenerate --genomeFastaFiles $ref_fasta $spike_fasta \
-     --sjdbOverhang 100 --sjdbGTFfile $anno_gtf --runThreadN 8 --genomeDir out/ \
-     --outFileNamePrefix out
+     --sjdbOverhang 100 --sjdbGTFfile $anno_gtf --runThreadN $ncpus --genomeDir out/ \
+     --outFileNamePrefix out $sparse_params
 set +x
 
 # Attempt to make bamCommentLines.txt, which should be reviewed. NOTE tabs handled by assignment.
 echo "-- Create bam header..."
+telemetry mark bam_header
 set -x
 refComment="@CO\tREFID:$(basename ${ref_root})"
 annotationComment="@CO\tANNID:$(basename ${anno_root})"
@@ -50,12 +79,21 @@ spikeInComment="@CO\tSPIKEID:${spike_root}"
 echo -e ${refComment} > out/star_bamCommentLines.txt
 echo -e ${annotationComment} >> out/star_bamCommentLines.txt
 echo -e ${spikeInComment} >> out/star_bamCommentLines.txt
+if [ "$profile" != "full" ]; then
+    profileComment="@CO\tSTARPROFILE:${profile}"
+    echo -e ${profileComment} >> out/star_bamCommentLines.txt
+fi
 echo `cat "out/star_bamCommentLines.txt"`
 set +x
 
 echo "-- Tar up results..."
+telemetry mark archive
 set -x
-tar -czvf $archive_file out/
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py create $archive_file out/ --threads $ncpus
+else
+    tar -czvf $archive_file out/
+fi
 set +x
 
 echo "-- The results..."
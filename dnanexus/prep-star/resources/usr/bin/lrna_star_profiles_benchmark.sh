@@ -0,0 +1,64 @@
+#!/bin/bash -e
+
+if [ $# -lt 5 ] || [ $# -gt 6 ]; then
+    echo "usage v1: lrna_star_profiles_benchmark.sh <ref_fasta_gz> <spike_in_fasta_gz> <annotation_gtf_gz> <reads_fq_gz> <ncpus> [<results_tsv>]"
+    echo "Compares the memory and speed of the 'full' and 'sparse' STAR index profiles, building each and aligning the"
+    echo "same reads to each.  Meant for the chr21 test genome.  Is independent of DX and encodeD."
+    exit -1;
+fi
+ref_fasta_gz=$1      # Reference genome assembly in gzipped fasta format (e.g. 'chr21.fa.gz').
+spike_fasta_gz=$2    # All spike-ins in single gzipped fasta format.
+anno_gtf_gz=$3       # Gene annotation in gzipped gtf format
+reads_fq_gz=`readlink -f $4`  # gzipped fastq of single-end reads to align to each index.
+ncpus=$5             # Number of cpus available.
+results_tsv="star_profiles_benchmark.tsv"
+if [ $# -eq 6 ]; then
+    results_tsv=$6   # Tab separated results, one line per profile (default: 'star_profiles_benchmark.tsv')
+fi
+profiles="full sparse"
+
+echo "-- Unzipping reference files once, into 'shared/'..."
+ref_fasta=`basename ${ref_fasta_gz%.gz}`
+spike_fasta=`basename ${spike_fasta_gz%.gz}`
+anno_gtf=`basename ${anno_gtf_gz%.gz}`
+set -x
+mkdir shared
+gunzip -c $ref_fasta_gz > shared/$ref_fasta
+gunzip -c $spike_fasta_gz > shared/$spike_fasta
+gunzip -c $anno_gtf_gz > shared/$anno_gtf
+set +x
+
+echo -e "profile\tindex_MB\tbuild_sec\tbuild_peak_MB\talign_sec\talign_peak_MB\tuniquely_mapped" > $results_tsv
+for profile in $profiles; do
+    echo "-- Building the '$profile' index..."
+    set -x
+    mkdir $profile
+    for file in $ref_fasta $spike_fasta $anno_gtf; do
+        ln -s ../shared/$file $profile/$file
+    done
+    (cd $profile; /usr/bin/time -f "%e\t%M" -o build.time \
+        lrna_index_star.sh $ref_fasta $spike_fasta $anno_gtf bench bench "" $ncpus $profile > build.log 2>&1)
+    set +x
+
+    echo "-- Aligning to the '$profile' index..."
+    # The alignment itself is what the index profile changes, so bams are neither sorted nor kept
+    set -x
+    (cd $profile; /usr/bin/time -f "%e\t%M" -o align.time \
+        STAR --genomeDir out --readFilesIn $reads_fq_gz                                   \
+             --readFilesCommand zcat --runThreadN $ncpus --genomeLoad NoSharedMemory      \
+             --outFilterMultimapNmax 20 --alignSJoverhangMin 8 --alignSJDBoverhangMin 1    \
+             --outFilterMismatchNmax 999 --outFilterMismatchNoverReadLmax 0.04              \
+             --alignIntronMin 20 --alignIntronMax 1000000 --alignMatesGapMax 1000000         \
+             --outFilterType BySJout --outSAMtype None --sjdbScore 1 > align.log 2>&1)
+    set +x
+
+    index_MB=$(( `du -sk $profile/out | cut -f1` / 1024 ))
+    build=`tail -1 $profile/build.time | awk -F '\t' '{printf "%s\t%d", $1, $2/1024}'`
+    align=`tail -1 $profile/align.time | awk -F '\t' '{printf "%s\t%d", $1, $2/1024}'`
+    unique=`grep "Uniquely mapped reads %" $profile/Log.final.out | cut -d '|' -f2 | tr -d ' \t'`
+    echo -e "${profile}\t${index_MB}\t${build}\t${align}\t${unique}" >> $results_tsv
+done
+rm -rf shared
+
+echo "-- The results..."
+cat $results_tsv
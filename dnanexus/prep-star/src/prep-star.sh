@@ -14,9 +14,13 @@ main() {
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
 
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     echo "* Value of ref_genome:  '$ref_genome'"
     echo "* Value of spike_in:    '$spike_in'"
     echo "* Value of annotations: '$annotations'"
+    echo "* Value of index_profile: '$index_profile'"
 
     echo "* Download files..."
     ref_root=`dx describe "$ref_genome" --name`
@@ -88,19 +92,26 @@ main() {
     # DX/ENCODE independent script is found in resources/usr/bin
     echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
     set -x
-    lrna_index_star.sh ${ref_root}.fa.gz ${spike_root}.fa.gz ${anno_root}.gtf.gz $anno $genome $gender
+    lrna_index_star.sh ${ref_root}.fa.gz ${spike_root}.fa.gz ${anno_root}.gtf.gz $anno $genome "$gender" 8 $index_profile
     set +x
     echo "* ===== Returned from dnanexus and encodeD independent script ====="
     archive_file="${genome}_${anno}_${spike_root}_starIndex.tgz"
     if [ "$gender" == "famale" ] || [ "$gender" == "male" ] || [ "$gender" == "XX" ] || [ "$gender" == "XY" ]; then
         archive_file="${genome}_${gender}_${anno}_${spike_root}_starIndex.tgz"
     fi
+    if [ "$index_profile" != "full" ]; then
+        archive_file="${archive_file%_starIndex.tgz}_${index_profile}_starIndex.tgz"
+    fi
 
     echo "* Upload results..."
+    telemetry=`telemetry details`
+    telemetry mark upload
     star_index=$(dx upload $archive_file --property genome="$genome"   --property gender="$gender" \
                                          --property annotation="$anno"  --property spike_in="$spike_root" \
+                                         --property index_profile="$index_profile" --details="{ $telemetry }" \
                                          --property SW="$versions" --brief)
 
     dx-jobutil-add-output star_index $star_index --class=file
+    telemetry stop
     echo "* Finished."
 }
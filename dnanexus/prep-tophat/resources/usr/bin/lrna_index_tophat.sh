@@ -1,34 +1,49 @@
 #!/bin/bash -e
 
-if [ $# -lt 6 ] || [ $# -gt 7 ]; then
-    echo "usage v1: lrna_index_tophat.sh <ref_fasta_gz> <spike_in_fasta_gz> <annotation_gtf_gz> <tiny_fq_gz> <annotation_version> <genome> [<gender>]"
+if [ $# -lt 6 ] || [ $# -gt 8 ]; then
+    echo "usage v1: lrna_index_tophat.sh <ref_fasta_gz> <spike_in_fasta_gz> <annotation_gtf_gz> <tiny_fq_gz> <annotation_version> <genome> [<gender>] [<ncpus>]"
     echo "Creates TopHat index of reference genome, annotation and spike-ins for long-RNA-seq. Is independent of DX and encodeD."
     exit -1; 
 fi
-ref_fasta_gz=$1      # Reference genome assembly in gzipped fasta format.
-spike_fasta_gz=$2 # All spike-ins in single gzipped fasta format.
-anno_gtf_gz=$3       # Gene annotation in gzipped gtf format
-tiny_fq_gz=$4
+ref_fasta_gz=$1      # Reference genome assembly in gzipped (or unzipped) fasta format.
+spike_fasta_gz=$2 # All spike-ins in single gzipped (or unzipped) fasta format.
+anno_gtf_gz=$3       # Gene annotation in gzipped (or unzipped) gtf format
+tiny_fq_gz=$4        # Tiny gzipped (or unzipped) fastq used to fake an alignment, which completes the index.
 anno=$5              # Annotation (e.g. 'v24')
 genome=$6            # Genome (e.g. 'GRCh38')
-if [ $# -eq 7 ]; then
+if [ $# -ge 7 ]; then
     gender=$7        # Gender. Values: 'female', 'male', 'XX', 'XY' will be included in names.  Otherwise, gender neutral.  
 fi
+ncpus=8
+if [ $# -eq 8 ]; then
+    ncpus=$8         # Number of threads the 'quicky' tophat may use (default 8).
+fi
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
 
 echo "-- Unzipping reference files..."
+telemetry mark unzip
 ref_fasta=${ref_fasta_gz%.gz}
 ref_root=${ref_fasta%.fasta}
 ref_root=${ref_root%.fa}
-gunzip $ref_fasta_gz
+if [ "$ref_fasta" != "$ref_fasta_gz" ]; then
+    gunzip $ref_fasta_gz
+fi
 spike_fasta=${spike_fasta_gz%.gz}
 spike_root=${spike_fasta%.fasta}
 spike_root=${spike_root%.fa}
-gunzip $spike_fasta_gz
+if [ "$spike_fasta" != "$spike_fasta_gz" ]; then
+    gunzip $spike_fasta_gz
+fi
 anno_gtf=${anno_gtf_gz%.gz}
 anno_root=${anno_gtf%.gtf}
-gunzip $anno_gtf_gz
+if [ "$anno_gtf" != "$anno_gtf_gz" ]; then
+    gunzip $anno_gtf_gz
+fi
 tiny_fq=${tiny_fq_gz%.gz}
-gunzip $tiny_fq_gz
+if [ "$tiny_fq" != "$tiny_fq_gz" ]; then
+    gunzip $tiny_fq_gz
+fi
 
 archive_file="${genome}_${anno}_${spike_root}_tophatIndex.tgz"
 if [ "$gender" == "famale" ] || [ "$gender" == "male" ] || [ "$gender" == "XX" ] || [ "$gender" == "XY" ]; then
@@ -37,6 +52,7 @@ fi
 echo "-- Results will be: '${archive_file}'."
 
 echo "-- bowtie build..."
+telemetry mark bowtie_build
 set -x
 mkdir out
 #bowtie2-build --offrate 3 -f ${ref} out/$geno_prefix  ### Definitely has an effect on results
@@ -47,6 +63,7 @@ set +x
 
 # Attempt to make bamCommentLines.txt. NOTE tabs handled by assignment.
 echo "-- Create bam header..."
+telemetry mark bam_header
 set -x
 refComment="@CO\tREFID:${ref_root}"
 annotationComment="@CO\tANNID:${anno_root}"
@@ -61,16 +78,22 @@ echo `cat "out/${genome}_bamCommentLines.txt"`
 set +x
 
 echo "-- Run a 'quicky' tophat to generate index..."
+telemetry mark tophat_transcriptome_index
 set -x
-tophat --no-discordant --no-mixed -p 8 -z0 --min-intron-length 20 --max-intron-length 1000000 \
+tophat --no-discordant --no-mixed -p $ncpus -z0 --min-intron-length 20 --max-intron-length 1000000 \
        --read-mismatches 4 --read-edit-dist 4 --max-multihits 20 --library-type fr-firststrand \
        --GTF "$anno_root".gtf --no-coverage-search \
-       --transcriptome-index=out/${anno} out/${genome} tiny.fq
+       --transcriptome-index=out/${anno} out/${genome} $tiny_fq
 set +x
 
 echo "-- Tar up results..."
+telemetry mark archive
 set -x
-tar -czvf ${archive_file} out/${genome}* out/${anno}*
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py create ${archive_file} out/${genome}* out/${anno}* --threads $ncpus
+else
+    tar -czvf ${archive_file} out/${genome}* out/${anno}*
+fi
 set +x
 
 echo "-- The results..."
@@ -14,6 +14,9 @@ main() {
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
 
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     echo "* Value of ref_genome:  '$ref_genome'"
     echo "* Value of spike_in:    '$spike_in'"
     echo "* Value of annotations: '$annotations'"
@@ -109,10 +112,13 @@ main() {
     fi
 
     echo "* Upload results..."
+    telemetry=`telemetry details`
+    telemetry mark upload
     tophat_index=$(dx upload $archive_file --property genome="$genome"   --property gender="$gender" \
                                            --property annotation="$anno"  --property spike_in="$spike_root" \
-                                           --property SW="$versions" --brief)
+                                           --details="{ $telemetry }" --property SW="$versions" --brief)
 
     dx-jobutil-add-output tophat_index $tophat_index --class=file
+    telemetry stop
     echo "* Finished."
 }
@@ -0,0 +1,53 @@
+#!/bin/bash
+# quant-rsem-ci.sh
+
+main() {
+    # If available, will print tool versions to stderr and json string to stdout
+    versions=''
+    if [ -f /usr/bin/tool_versions.py ]; then 
+        versions=`tool_versions.py --dxjson dnanexus-executable.json`
+    fi
+
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
+    echo "* Value of rsem_state:     '$rsem_state'"
+    echo "* Value of rsem_index:     '$rsem_index'"
+    echo "* Value of rsem_gene_results: '$rsem_gene_results'"
+    echo "* Value of rsem_iso_results:  '$rsem_iso_results'"
+
+    echo "* Download files..."
+    state_root=`dx describe "$rsem_state" --name`
+    state_root=${state_root%_rsem_state.tgz}
+    dx download "$rsem_state" -o ${state_root}_rsem_state.tgz
+    dx download "$rsem_index" -o rsem_index.tgz
+
+    # DX/ENCODE independent script is found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    lrna_rsem_credibility_intervals.sh rsem_index.tgz ${state_root}_rsem_state.tgz
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+
+    echo "* Upload results..."
+    telemetry=`telemetry details`
+    telemetry mark upload
+    rsem_ci_gene_results=$(dx upload ${state_root}_rsem_ci.genes.results   --details="{ $telemetry }" \
+                                              --property SW="$versions" --property ci_mode=full --brief)
+    rsem_ci_iso_results=$(dx upload ${state_root}_rsem_ci.isoforms.results --details="{ $telemetry }" \
+                                              --property SW="$versions" --property ci_mode=full --brief)
+    # The deferred results, which may already be published, now point to these to publish in their place
+    if [ -n "$rsem_gene_results" ]; then
+        dx set_properties `dx-jobutil-parse-link "$rsem_gene_results"` ci_mode=superseded \
+                                                                       ci_results=$rsem_ci_gene_results
+    fi
+    if [ -n "$rsem_iso_results" ]; then
+        dx set_properties `dx-jobutil-parse-link "$rsem_iso_results"` ci_mode=superseded \
+                                                                      ci_results=$rsem_ci_iso_results
+    fi
+
+    dx-jobutil-add-output rsem_ci_gene_results "$rsem_ci_gene_results" --class=file
+    dx-jobutil-add-output rsem_ci_iso_results "$rsem_ci_iso_results" --class=file
+    telemetry stop
+    echo "* Finished."
+}
@@ -0,0 +1,93 @@
+#!/bin/bash
+# quant-rsem-multi.sh
+
+main() {
+    # If available, will print tool versions to stderr and json string to stdout
+    versions=''
+    if [ -f /usr/bin/tool_versions.py ]; then 
+        versions=`tool_versions.py --dxjson dnanexus-executable.json`
+    fi
+
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
+    echo "* Value of star_anno_bams: '${star_anno_bams[@]}'"
+    echo "* Value of rsem_index:     '$rsem_index'"
+    echo "* Value of paired:         '${paired_end[@]}'"
+    echo "* vaule of read_strand:    '${read_strand[@]}'"
+    echo "* Random number seeds:     '${rnd_seed[@]}'"
+    echo "* Value of nthreads:       '$nthreads'"
+    echo "* Value of ci_mode:        '$ci_mode'"
+
+    nsamples=${#star_anno_bams[@]}
+    if [ ${#paired_end[@]} -ne $nsamples ] || [ ${#read_strand[@]} -ne $nsamples ]; then
+        echo "ERROR: paired_end and read_strand must each have one value per bam"
+        exit 1
+    fi
+    if [ ${#rnd_seed[@]} -ne 0 ] && [ ${#rnd_seed[@]} -ne $nsamples ]; then
+        echo "ERROR: rnd_seed must have one value per bam"
+        exit 1
+    fi
+    ncpus=`grep -c ^processor /proc/cpuinfo`
+
+    echo "* Download files..."
+    bam_roots=()
+    samples=""
+    for ix in ${!star_anno_bams[@]}; do
+        bam_root=`dx describe "${star_anno_bams[$ix]}" --name`
+        bam_root=${bam_root%_star_anno.bam}
+        bam_root=${bam_root%.bam}
+        dx download "${star_anno_bams[$ix]}" -o ${bam_root}.bam
+        bam_roots[$ix]=$bam_root
+        seed=12345
+        if [ ${#rnd_seed[@]} -ne 0 ]; then
+            seed=${rnd_seed[$ix]}
+        fi
+        samples="$samples ${bam_root}.bam,${paired_end[$ix]},${read_strand[$ix]},${seed},${nthreads}"
+    done
+    dx download "$rsem_index" -o rsem_index.tgz
+
+    # DX/ENCODE independent script is found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    lrna_rsem_quantification_multi.sh rsem_index.tgz $ncpus $ci_mode $samples
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+
+    echo "* Upload results..."
+    telemetry=`telemetry details`
+    telemetry mark upload
+    for bam_root in ${bam_roots[@]}; do
+        # Results without credibility intervals say so, and quant-rsem-ci links them to the results with them
+        ci_property="ci_mode=full"
+        if [ -f ${bam_root}_rsem_state.tgz ]; then
+            ci_property="ci_mode=deferred"
+        fi
+        rsem_gene_results=$(dx upload ${bam_root}_rsem.genes.results   --details="{ $telemetry }" \
+                                              --property SW="$versions" --property $ci_property --brief)
+        rsem_iso_results=$(dx upload ${bam_root}_rsem.isoforms.results --details="{ $telemetry }" \
+                                              --property SW="$versions" --property $ci_property --brief)
+
+        dx-jobutil-add-output rsem_gene_results "$rsem_gene_results" --class=array:file
+        dx-jobutil-add-output rsem_iso_results "$rsem_iso_results" --class=array:file
+        if [ -f /usr/bin/quant_columns.py ]; then
+            # Columnar companions let cross-sample analyses load values without parsing the text results
+            quant_columns.py write rsem ${bam_root}_rsem.genes.results    ${bam_root}_rsem.genes.qcol
+            quant_columns.py write rsem ${bam_root}_rsem.isoforms.results ${bam_root}_rsem.isoforms.qcol
+            rsem_gene_columns=$(dx upload ${bam_root}_rsem.genes.qcol   --details="{ $telemetry }" \
+                                                                        --property SW="$versions" --brief)
+            rsem_iso_columns=$(dx upload ${bam_root}_rsem.isoforms.qcol --details="{ $telemetry }" \
+                                                                        --property SW="$versions" --brief)
+            dx-jobutil-add-output rsem_gene_columns "$rsem_gene_columns" --class=array:file
+            dx-jobutil-add-output rsem_iso_columns "$rsem_iso_columns" --class=array:file
+        fi
+        if [ -f ${bam_root}_rsem_state.tgz ]; then
+            # Credibility intervals were deferred to quant-rsem-ci jobs
+            rsem_state=$(dx upload ${bam_root}_rsem_state.tgz --details="{ $telemetry }" \
+                                                              --property SW="$versions" --brief)
+            dx-jobutil-add-output rsem_state "$rsem_state" --class=array:file
+        fi
+    done
+    telemetry stop
+    echo "* Finished."
+}
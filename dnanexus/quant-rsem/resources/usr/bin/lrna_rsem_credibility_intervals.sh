@@ -0,0 +1,63 @@
+#!/bin/bash -e
+
+if [ $# -ne 2 ]; then
+    echo "usage v1: lrna_rsem_credibility_intervals.sh <rsem_index.tgz> <rsem_state.tgz>"
+    echo "Calculate RSEM credibility intervals deferred by 'lrna_rsem_quantification.sh ... defer'.  Is independent of DX and encodeD."
+    echo "Results are the same as if credibility intervals had been calculated with the quantification."
+    exit -1;
+fi
+rsem_index_tgz=$1  # RSEM Index archive used for the quantification.
+rsem_state_tgz=$2  # RSEM state saved by the deferred quantification (e.g. "out_bam_rsem_state.tgz").
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
+echo "-- Extracting rsem index archive..."
+telemetry mark index_extraction
+if which index_archive.py > /dev/null 2>&1; then
+    # Quantifying reads only the reference (.grp, .ti, .seq); the transcript fastas are for building aligners
+    index_archive.py extract $rsem_index_tgz --threads `grep -c ^processor /proc/cpuinfo` \
+        --member '*.grp' --member '*.ti' --member '*.seq' --member '*.chrlist'
+else
+    tar zxvf $rsem_index_tgz --exclude=.index_archive_toc.json
+fi
+# should be 'out/rsem'
+
+echo "-- Extracting rsem state archive..."
+telemetry mark state_extraction
+tar zxvf $rsem_state_tgz
+sample_name=`ls *_rsem.seed`
+sample_name=${sample_name%.seed}
+imd_name=${sample_name}.temp/${sample_name}
+stat_name=${sample_name}.stat/${sample_name}
+read rnd_seed ncpus < ${sample_name}.seed
+echo "-- Credibility interval results will be: '${sample_name}_ci.genes.results' and '${sample_name}_ci.isoforms.results'"
+
+# Same commands, settings and random seeds that rsem-calculate-expression uses with '--calc-ci --ci-memory 30000'
+run_em=`grep "^rsem-run-em " ${sample_name}.log`
+ref_name=`echo $run_em | awk '{print $2}'`
+seeds=(`perl -e 'srand($ARGV[0]); for (my $i = 0; $i < 3; $i++) { print int(rand(1 << 32)), " "; }' $rnd_seed`)
+rsem_utils=`dirname $(which rsem-calculate-expression)`
+
+echo "-- Rerun EM saving the output needed for Gibbs sampling..."
+telemetry mark rsem_em
+set -x
+$run_em --gibbs-out
+set +x
+
+echo "-- Gibbs sampling..."
+telemetry mark gibbs_sampling
+set -x
+rsem-run-gibbs $ref_name $imd_name $stat_name 200 1000 1 -p $ncpus --seed ${seeds[1]}
+set +x
+
+echo "-- Calculate credibility intervals..."
+telemetry mark credibility_intervals
+set -x
+rsem-calculate-credibility-intervals $ref_name $imd_name $stat_name 0.95 1000 50 30000 -p $ncpus --seed ${seeds[2]}
+perl -I $rsem_utils -Mrsem_perl_utils=collectResults \
+    -e 'collectResults("isoform", "'${imd_name}'.iso_res", "'${sample_name}'_ci.isoforms.results");
+        collectResults("gene", "'${imd_name}'.gene_res", "'${sample_name}'_ci.genes.results");'
+set +x
+
+echo "-- The results..."
+ls -l ${sample_name}_ci*.results
@@ -1,8 +1,10 @@
 #!/bin/bash -e
 
-if [ $# -ne 6 ]; then
-    echo "usage v1: lrna_rsem_quantification.sh <rsem_index.tgz> <anno_bam> <paired_end> <read_strand> <rnd_seed> <ncpus>"
+if [ $# -lt 6 ] || [ $# -gt 7 ]; then
+    echo "usage v1: lrna_rsem_quantification.sh <rsem_index.tgz> <anno_bam> <paired_end> <read_strand> <rnd_seed> <ncpus> [<ci_mode>]"
     echo "Align single-end reads with STAR.  Is independent of DX and encodeD."
+    echo "If ci_mode is 'defer' only the expected counts, TPM and FPKM are calculated.  The model state needed for"
+    echo "lrna_rsem_credibility_intervals.sh to add credibility intervals later is saved as '<anno_bam_root>_rsem_state.tgz'."
     exit -1; 
 fi
 rsem_index_tgz=$1  # RSEM Index archive.
@@ -11,14 +13,32 @@ paired_end=$3      # "true" if alignment was on paired-end data.
 read_strand=$4     # strandedness of read (forward, reverse, unstranded)
 rnd_seed=$5        # Random seed.  ENCODE has been using 12345
 ncpus=$6            # Number of cpus available.
+ci_mode="full"     # "full" calculates credibility intervals now, "defer" saves state to calculate them later.
+if [ $# -eq 7 ]; then
+    ci_mode=$7
+fi
 
 
 bam_root=${anno_bam%.bam}
 echo "-- Qunatification results will be: '${bam_root}_rsem.genes.results' and '${bam_root}_rsem.isoforms.results'"
 
-echo "-- Extracting star index archive..."
-tar zxvf $rsem_index_tgz
-# should be 'out/rsem'
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
+if ls out/*.grp > /dev/null 2>&1; then
+    # lrna_rsem_quantification_multi.sh extracts the index once for all of its samples
+    echo "-- Using already extracted rsem index..."
+else
+    echo "-- Extracting star index archive..."
+    telemetry mark index_extraction
+    if which index_archive.py > /dev/null 2>&1; then
+        # Quantifying reads only the reference (.grp, .ti, .seq); the transcript fastas are for building aligners
+        index_archive.py extract $rsem_index_tgz --threads $ncpus \
+            --member '*.grp' --member '*.ti' --member '*.seq' --member '*.chrlist'
+    else
+        tar zxvf $rsem_index_tgz --exclude=.index_archive_toc.json
+    fi
+    # should be 'out/rsem'
+fi
 
 grp=`ls out/*.grp`
 index_prefix=${grp%.grp}
@@ -44,11 +64,28 @@ else
 fi
 echo "-- Running as $msg"
 
-echo "-- Quantify with extra flags: [${extra_flags}]..."
-set -x
-rsem-calculate-expression --bam --estimate-rspd --calc-ci --seed ${rnd_seed} -p $ncpus \
-    --no-bam-output --ci-memory 30000 ${extra_flags} $anno_bam ${index_prefix} ${bam_root}_rsem
-set +x
+if [ "$ci_mode" == "defer" ]; then
+    # Without '--calc-ci' the expected counts, TPM and FPKM are unchanged, but Gibbs sampling and CIs are skipped
+    echo "-- Quantify with extra flags: [${extra_flags}], deferring credibility intervals..."
+    telemetry mark rsem_quantification
+    set -x
+    rsem-calculate-expression --bam --estimate-rspd --keep-intermediate-files --seed ${rnd_seed} -p $ncpus \
+        --no-bam-output ${extra_flags} $anno_bam ${index_prefix} ${bam_root}_rsem > ${bam_root}_rsem.log \
+        || { cat ${bam_root}_rsem.log >&2; exit 1; }
+    cat ${bam_root}_rsem.log
+    echo "$rnd_seed $ncpus" > ${bam_root}_rsem.seed
+    tar -czf ${bam_root}_rsem_state.tgz ${bam_root}_rsem.temp ${bam_root}_rsem.stat ${bam_root}_rsem.log ${bam_root}_rsem.seed
+    rm -rf ${bam_root}_rsem.temp ${bam_root}_rsem.log ${bam_root}_rsem.seed
+    set +x
+    ls -l ${bam_root}_rsem_state.tgz
+else
+    echo "-- Quantify with extra flags: [${extra_flags}]..."
+    telemetry mark rsem_quantification
+    set -x
+    rsem-calculate-expression --bam --estimate-rspd --calc-ci --seed ${rnd_seed} -p $ncpus \
+        --no-bam-output --ci-memory 30000 ${extra_flags} $anno_bam ${index_prefix} ${bam_root}_rsem
+    set +x
+fi
 
 echo "-- The results..."
 ls -l ${bam_root}*.results
@@ -0,0 +1,104 @@
+#!/bin/bash -e
+
+if [ $# -lt 4 ]; then
+    echo "usage v1: lrna_rsem_quantification_multi.sh <rsem_index.tgz> <ncpus> <ci_mode> <anno_bam>,<paired_end>,<read_strand>,<rnd_seed>,<nthreads> [...]"
+    echo "Quantify several annotation bams with RSEM, extracting the index once.  Is independent of DX and encodeD."
+    echo "Each sample is run by lrna_rsem_quantification.sh with its own settings, so its results are just as they would"
+    echo "be if run alone.  Samples are run concurrently as long as their nthreads fit within ncpus."
+    exit -1;
+fi
+rsem_index_tgz=$1  # RSEM Index archive.
+ncpus=$2           # Number of cpus available to share among samples.
+ci_mode=$3         # "full" calculates credibility intervals now, "defer" saves state to calculate them later.
+shift 3
+samples=$@         # One comma separated setting list per sample: anno_bam,paired_end,read_strand,rnd_seed,nthreads
+
+roots=""
+for sample in $samples; do
+    anno_bam=`echo $sample | cut -d, -f1`
+    bam_root=${anno_bam%.bam}
+    if [[ " $roots " == *" $bam_root "* ]]; then
+        echo "-- ERROR: More than one sample would be written as '${bam_root}_rsem.*'"
+        exit 1
+    fi
+    roots="$roots $bam_root"
+done
+echo "-- Qunatification results will be: '<anno_bam_root>_rsem.genes.results' and '<anno_bam_root>_rsem.isoforms.results' for:$roots"
+
+source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+
+echo "-- Extracting rsem index archive..."
+telemetry mark index_extraction
+set -x
+if which index_archive.py > /dev/null 2>&1; then
+    # Quantifying reads only the reference (.grp, .ti, .seq); the transcript fastas are for building aligners
+    index_archive.py extract $rsem_index_tgz --threads $ncpus \
+        --member '*.grp' --member '*.ti' --member '*.seq' --member '*.chrlist'
+else
+    tar zxvf $rsem_index_tgz --exclude=.index_archive_toc.json
+fi
+set +x
+# should be 'out/rsem'
+
+echo "-- Quantifying samples within $ncpus cpus..."
+# Samples quantified side by side are one sub-step, as their own marks would interleave
+telemetry mark rsem_quantification
+unset STAGE_TELEMETRY
+running=""   # pid:nthreads:bam_root of each running sample
+used=0
+failed=0
+reap() {
+    # Collect samples that have finished and release their cpus
+    local job pid job_threads job_root still_running=""
+    for job in $running; do
+        pid=`echo $job | cut -d: -f1`
+        if kill -0 $pid 2> /dev/null; then
+            still_running="$still_running $job"
+            continue
+        fi
+        job_threads=`echo $job | cut -d: -f2`
+        job_root=`echo $job | cut -d: -f3`
+        used=$(( used - job_threads ))
+        cat ${job_root}_rsem_quant.log
+        rm -f ${job_root}_rsem_quant.log
+        if wait $pid; then
+            echo "-- Finished '$job_root'"
+        else
+            echo "-- ERROR: Quantifying '$job_root' failed"
+            failed=$(( failed + 1 ))
+        fi
+    done
+    running=$still_running
+}
+for sample in $samples; do
+    IFS=, read anno_bam paired_end read_strand rnd_seed threads <<< "$sample"
+    bam_root=${anno_bam%.bam}
+    # A sample wanting more than all cpus runs alone but keeps its own threads, so its results are unchanged
+    need=$threads
+    if [ $need -gt $ncpus ]; then
+        need=$ncpus
+    fi
+    reap
+    while [ $(( used + need )) -gt $ncpus ]; do
+        sleep 5
+        reap
+    done
+    echo "-- Starting '$bam_root' with $threads threads ($(( used + need )) of $ncpus cpus in use)"
+    set -x
+    lrna_rsem_quantification.sh $rsem_index_tgz $anno_bam $paired_end $read_strand $rnd_seed $threads $ci_mode \
+        > ${bam_root}_rsem_quant.log 2>&1 &
+    set +x
+    running="$running $!:$need:$bam_root"
+    used=$(( used + need ))
+done
+while [ "$running" != "" ]; do
+    sleep 5
+    reap
+done
+if [ $failed -gt 0 ]; then
+    echo "-- ERROR: $failed sample(s) failed"
+    exit 1
+fi
+
+echo "-- The results..."
+ls -l *_rsem*.results
@@ -26,12 +26,16 @@ main() {
         versions=`tool_versions.py --dxjson dnanexus-executable.json`
     fi
 
+    source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+    telemetry start download
+
     echo "* Value of annotation_bam: '$star_anno_bam'"
     echo "* Value of rsem_index:     '$rsem_index'"
     echo "* Value of paired:         '$paired_end'"
     echo "* vaule of read_strand:    '$read_strand'"
     echo "* Random number seed:      '$rnd_seed'"
     echo "* Value of nthreads:       '$nthreads'"
+    echo "* Value of ci_mode:        '$ci_mode'"
 
     echo "* Download files..."
     bam_root=`dx describe "$star_anno_bam" --name`
@@ -43,15 +47,41 @@ main() {
     # DX/ENCODE independent script is found in resources/usr/bin
     echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
     set -x
-    lrna_rsem_quantification.sh rsem_index.tgz ${bam_root}.bam $paired_end $read_strand $rnd_seed $nthreads
+    lrna_rsem_quantification.sh rsem_index.tgz ${bam_root}.bam $paired_end $read_strand $rnd_seed $nthreads $ci_mode
     set +x
     echo "* ===== Returned from dnanexus and encodeD independent script ====="
 
     echo "* Upload results..."
-    rsem_gene_results=$(dx upload ${bam_root}_rsem.genes.results   --property SW="$versions" --brief)
-    rsem_iso_results=$(dx upload ${bam_root}_rsem.isoforms.results --property SW="$versions" --brief)
+    telemetry=`telemetry details`
+    telemetry mark upload
+    # Results without credibility intervals say so, and quant-rsem-ci links them to the results with them
+    ci_property="ci_mode=full"
+    if [ -f ${bam_root}_rsem_state.tgz ]; then
+        ci_property="ci_mode=deferred"
+    fi
+    rsem_gene_results=$(dx upload ${bam_root}_rsem.genes.results   --details="{ $telemetry }" \
+                                          --property SW="$versions" --property $ci_property --brief)
+    rsem_iso_results=$(dx upload ${bam_root}_rsem.isoforms.results --details="{ $telemetry }" \
+                                          --property SW="$versions" --property $ci_property --brief)
 
     dx-jobutil-add-output rsem_gene_results "$rsem_gene_results" --class=file
     dx-jobutil-add-output rsem_iso_results "$rsem_iso_results" --class=file
+    if [ -f /usr/bin/quant_columns.py ]; then
+        # Columnar companions let cross-sample analyses load values without parsing the text results
+        quant_columns.py write rsem ${bam_root}_rsem.genes.results    ${bam_root}_rsem.genes.qcol
+        quant_columns.py write rsem ${bam_root}_rsem.isoforms.results ${bam_root}_rsem.isoforms.qcol
+        rsem_gene_columns=$(dx upload ${bam_root}_rsem.genes.qcol   --details="{ $telemetry }" \
+                                                                    --property SW="$versions" --brief)
+        rsem_iso_columns=$(dx upload ${bam_root}_rsem.isoforms.qcol --details="{ $telemetry }" \
+                                                                    --property SW="$versions" --brief)
+        dx-jobutil-add-output rsem_gene_columns "$rsem_gene_columns" --class=file
+        dx-jobutil-add-output rsem_iso_columns "$rsem_iso_columns" --class=file
+    fi
+    if [ -f ${bam_root}_rsem_state.tgz ]; then
+        # Credibility intervals were deferred to a quant-rsem-ci job
+        rsem_state=$(dx upload ${bam_root}_rsem_state.tgz --details="{ $telemetry }" --property SW="$versions" --brief)
+        dx-jobutil-add-output rsem_state "$rsem_state" --class=file
+    fi
+    telemetry stop
     echo "* Finished."
 }
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# control_catalog.py 0.0.3
+# Maintains a catalog of long-RNA-seq genome bams that may serve as rampage controls, so that launching need not
+# search the long-RNA-seq folder tree.  The catalog is a json file keyed by experiment/genome/annotation and is
+# refreshed incrementally: only bams modified since the last refresh are looked up.  As a refresh cannot see bams that
+# were removed, the bams found for a launch are checked (in one query) and any that are gone are pruned.
+# A control experiment usually has a bam for each replicate.  As a launch takes one control, the bam of its first
+# replicate folder (e.g. 'rep1_1' before 'rep2_1') is taken.  Bams of more than one of the possible control
+# experiments, or more than one bam in a replicate folder, are ambiguous and left for the launcher to resolve.
+
+import argparse, os, sys, json, re, time
+
+import dxpy
+
+CATALOG_DEFAULT = os.path.expanduser('~/.dnanexus_config/rampage_control_catalog.json')
+'''Where the catalog is kept unless told otherwise.'''
+
+EXPERIMENT_PATTERN = re.compile(r'^ENCSR[0-9]{3}[A-Z]{3}$')
+VERIFY_BATCH = 1000
+
+class ControlCatalog(object):
+    '''Catalog of long-RNA-seq genome bams keyed by experiment, genome and annotation.'''
+
+    def __init__(self, project, root_folder, file_glob, path=CATALOG_DEFAULT):
+        self.path = path
+        self.project = project
+        self.root_folder = root_folder
+        self.file_glob = file_glob
+        self.catalog = {"project": project, "root_folder": root_folder, "file_glob": file_glob,
+                        "refreshed": 0, "bams": {}}
+        if os.path.exists(path):
+            with open(path, 'r') as fh:
+                catalog = json.load(fh)
+            # A catalog of another project or folder is of no use and will be rebuilt.
+            if catalog.get("project") == project and catalog.get("root_folder") == root_folder \
+               and catalog.get("file_glob") == file_glob:
+                self.catalog = catalog
+
+    @staticmethod
+    def key(experiment, genome, annotation):
+        return "/".join([experiment, genome, annotation])
+
+    @staticmethod
+    def parse_folder(folder):
+        '''Returns (experiment, genome, annotation) from a results folder such as /lrna/GRCh38/v24/ENCSR000AAA/rep1_1/.'''
+        parts = [part for part in folder.split('/') if part != '']
+        for (ix, part) in enumerate(parts):
+            if EXPERIMENT_PATTERN.match(part) and ix >= 2:
+                return (part, parts[ix - 2], parts[ix - 1])
+        return (None, None, None)
+
+    def refresh(self, verbose=False):
+        '''Adds bams created or modified since the last refresh.  Returns the number of bams (re)cataloged.'''
+        started = int(time.time() * 1000)
+        query = {"classname": "file", "name": self.file_glob, "name_mode": "glob", "project": self.project,
+                 "folder": self.root_folder, "recurse": True, "state": "closed",
+                 "describe": {"fields": {"name": True, "folder": True, "modified": True}}}
+        if self.catalog["refreshed"] > 0:
+            query["modified_after"] = self.catalog["refreshed"]
+        found = 0
+        for result in dxpy.find_data_objects(**query):
+            desc = result["describe"]
+            (experiment, genome, annotation) = self.parse_folder(desc["folder"])
+            if experiment is None:
+                continue
+            bams = self.catalog["bams"].setdefault(self.key(experiment, genome, annotation), [])
+            bams[:] = [bam for bam in bams if bam["id"] != result["id"]]
+            bams.append({"id": result["id"], "name": desc["name"], "folder": desc["folder"],
+                         "modified": desc["modified"]})
+            bams.sort(key=lambda bam: bam["folder"] + '/' + bam["name"])
+            found += 1
+        self.catalog["refreshed"] = started
+        self.save()
+        if verbose:
+            print >> sys.stderr, "Cataloged %d bam(s) from %s:%s" % (found, self.project, self.root_folder)
+        return found
+
+    def verify(self, bams, verbose=False):
+        '''Checks that cataloged bams are still in place, pruning any that are gone.  Returns those that remain.'''
+        ids = [bam["id"] for bam in bams]
+        found = {}
+        for start in range(0, len(ids), VERIFY_BATCH):
+            query = {"id": ids[start:start + VERIFY_BATCH], "class": "file", "state": "closed",
+                     "scope": {"project": self.project, "folder": self.root_folder, "recurse": True},
+                     "describe": {"fields": {"name": True, "folder": True, "modified": True}}}
+            while True:
+                response = dxpy.api.system_find_data_objects(query)
+                for result in response["results"]:
+                    found[result["id"]] = result["describe"]
+                if response.get("next") is None:
+                    break
+                query["starting"] = response["next"]
+        changed = 0
+        for (key, cataloged) in self.catalog["bams"].items():
+            for bam in [bam for bam in cataloged if bam["id"] in ids]:
+                desc = found.get(bam["id"])
+                if desc is not None and (desc["folder"], desc["name"]) == (bam["folder"], bam["name"]):
+                    continue
+                # Gone, or moved or renamed (and so perhaps no longer the same experiment's): cataloged afresh if found
+                cataloged.remove(bam)
+                changed += 1
+                if desc is None:
+                    continue
+                (experiment, genome, annotation) = self.parse_folder(desc["folder"])
+                if experiment is not None:
+                    self.catalog["bams"].setdefault(self.key(experiment, genome, annotation), []).append(
+                        {"id": bam["id"], "name": desc["name"], "folder": desc["folder"], "modified": desc["modified"]})
+            if len(cataloged) == 0:
+                del self.catalog["bams"][key]
+        if changed > 0:
+            self.save()
+            if verbose:
+                print >> sys.stderr, "Pruned %d of %d cataloged bam(s) no longer in place" % (changed, len(ids))
+        return [bam for bam in bams if bam["id"] in found and (found[bam["id"]]["folder"], found[bam["id"]]["name"])
+                                                                == (bam["folder"], bam["name"])]
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder != '' and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(self.path + '.tmp', 'w') as fh:
+            json.dump(self.catalog, fh, indent=1, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+
+    def lookup(self, experiment, genome, annotation):
+        '''Returns the bams cataloged for an experiment, genome and annotation (possibly empty).'''
+        return self.catalog["bams"].get(self.key(experiment, genome, annotation), [])
+
+    @staticmethod
+    def choose_control(bams):
+        '''Returns the first replicate's bam of a single experiment's bams, or None if the choice is ambiguous.'''
+        experiments = set([ControlCatalog.parse_folder(bam["folder"])[0] for bam in bams])
+        rep_folders = [bam["folder"].rstrip('/') for bam in bams]
+        if len(bams) == 0 or len(experiments) > 1 or len(set(rep_folders)) < len(rep_folders):
+            return None
+        return sorted(bams, key=lambda bam: bam["folder"].rstrip('/'))[0]
+
+    def find_control(self, experiments, genome, annotation, verbose=False):
+        '''Returns the id of the control bam among some experiments, refreshing once if none is cataloged.'''
+        for attempt in range(2):
+            bams = []
+            for experiment in experiments:
+                bams.extend(self.lookup(experiment, genome, annotation))
+            if len(bams) > 0 and attempt == 0:
+                bams = self.verify(bams, verbose)
+            if len(bams) > 0 or attempt > 0:
+                break
+            self.refresh(verbose)
+        control = self.choose_control(bams)
+        if control is not None:
+            if verbose and len(bams) > 1:
+                print >> sys.stderr, "Taking the first replicate's of %d control bams: %s" % \
+                                     (len(bams), control["folder"] + '/' + control["name"])
+            return control["id"]
+        if verbose and len(bams) > 1:
+            print >> sys.stderr, "Found %d possible control bams: %s" % \
+                                 (len(bams), ", ".join([bam["folder"] + '/' + bam["name"] for bam in bams]))
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintains a catalog of long-RNA-seq bams for rampage controls.")
+    parser.add_argument('-p', '--project', required=True, help="Project holding long-RNA-seq results.")
+    parser.add_argument('-f', '--folder', default='/long-RNA-seq/', help="Root folder of long-RNA-seq results.")
+    parser.add_argument('-g', '--glob', default='*_star_genome.bam', help="Name pattern of control bams.")
+    parser.add_argument('-c', '--catalog', default=CATALOG_DEFAULT, help="Catalog file.")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the catalog, rather than refreshing it.")
+    parser.add_argument('--prune', action='store_true', help="Check every cataloged bam and prune those now gone.")
+    parser.add_argument('--lookup', nargs=3, metavar=('EXPERIMENT', 'GENOME', 'ANNOTATION'),
+                        help="Print the bams cataloged for an experiment.")
+    args = parser.parse_args()
+
+    project = dxpy.find_one_project(name=args.project, zero_ok=True)
+    project_id = project["id"] if project is not None else args.project
+    catalog = ControlCatalog(project_id, args.folder, args.glob, args.catalog)
+    if args.rebuild:
+        catalog.catalog["refreshed"] = 0
+        catalog.catalog["bams"] = {}
+    if args.prune:
+        catalog.verify([bam for bams in catalog.catalog["bams"].values() for bam in bams], verbose=True)
+    if args.lookup:
+        for bam in catalog.lookup(*args.lookup):
+            print "%s\t%s%s" % (bam["id"], bam["folder"] + '/', bam["name"])
+    elif not args.prune:
+        catalog.refresh(verbose=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,20 @@
 #!/bin/bash -e
 
+signal_root=""
+if [ $# -ge 10 ] && [ "${@: -4:1}" == "--signals" ]; then
+    chrom_sizes=${@: -3:1}  # chrom_sizes file that matches the genome in the star index.
+    signal_root=${@: -2:1}  # Root name of signals result files (e.g. 'signal' will result in signal_plusAll.bw etc.)
+    stranded=${@: -1}       # Strand specific library: T/F.
+    stranded=${stranded:0:1}
+    set -- "${@:1:$(($# - 4))}"
+fi
+strand_arg=""
+if [ "${stranded^^}" == "T" ] || [ "${stranded^^}" == "Y" ] || [ "${stranded}" == "1" ]; then
+    strand_arg="--stranded"
+fi
 if [ $# -lt 6 ] || [ $# -gt 7 ]; then
-    echo "usage v1: rampage_align_star.sh <star_index.tgz> <read1.fq.gz> [<read2.fq.gz>] <library_id> <ncpus> <ram_GB> <bam_root>"
-    echo "Align paired-end reads with STAR for Rampage.  Is independent of DX and encodeD."
+    echo "usage v2: rampage_align_star.sh <star_index.tgz> <read1.fq.gz> [<read2.fq.gz>] <library_id> <ncpus> <ram_GB> <bam_root> [--signals <chrom_sizes> <signal_root> <stranded:T/F>]"
+    echo "Align paired-end reads with STAR for Rampage and optionally make 5' signals.  Is independent of DX and encodeD."
     exit -1;
 fi
 star_index_tgz=$1  # STAR Index archive.
@@ -23,44 +35,102 @@ fi
 
 echo "-- Alignments file will be: '${bam_root}_marked.bam'"
 
+echo "-- Reading the index's bam comment lines..."
+# An index archive gives up the one member without the rest being decompressed, so the header is known before the
+# index is extracted.  Plain '.tgz' indexes are read once, by the extraction.
+rm -f index_comments.txt
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py cat $star_index_tgz '*_bamCommentLines.txt' --indexed_only > index_comments.txt \
+        || rm -f index_comments.txt
+fi
+
 echo "-- Extracting star index archive..."
-tar zxvf $star_index_tgz
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py extract $star_index_tgz --threads $ncpus
+else
+    tar zxvf $star_index_tgz --exclude=.index_archive_toc.json
+fi
 # unzips into "out/"
+if [ ! -f index_comments.txt ]; then
+    cat out/*_bamCommentLines.txt > index_comments.txt
+fi
 
 echo "-- Set up headers..."
 set -x
 libraryComment="@CO\tLIBID:${library_id}"
 echo -e ${libraryComment} > COfile.txt
-cat out/*_bamCommentLines.txt >> COfile.txt
+cat index_comments.txt >> COfile.txt
 set +x
 echo "-- cat COfile.txt --"
 cat COfile.txt
 echo "--------------------"
 
 echo "-- Map reads..."
-set -x
-STAR --genomeDir out --readFilesIn $read1_fq_gz $read2_fq_gz                         \
-    --readFilesCommand zcat --runThreadN $ncpus --genomeLoad NoSharedMemory           \
-    --outFilterMultimapNmax 500 --alignSJoverhangMin 8 --alignSJDBoverhangMin 1        \
-    --outFilterMismatchNmax 999 --outFilterMismatchNoverReadLmax 0.04                   \
-    --alignIntronMin 20 --alignIntronMax 1000000 --alignMatesGapMax 1000000              \
-    --outSAMheaderCommentFile COfile.txt --outSAMheaderHD @HD VN:1.4 SO:coordinate        \
-    --outSAMunmapped Within --outFilterType BySJout --outSAMattributes NH HI AS NM MD      \
-    --outFilterScoreMinOverLread 0.85 --outFilterIntronMotifs RemoveNoncanonicalUnannotated \
-    --clip5pNbases 6 15 --seedSearchStartLmax 30 --outSAMtype BAM SortedByCoordinate         \
-    --limitBAMsortRAM ${ram_GB}000000000
-set +x
-ls -l Aligned.sortedByCoord.out.bam
+# If available, will log STAR's throughput, mapping rate and ETA while it maps
+if which star_progress.py > /dev/null 2>&1; then
+    star_progress.py Log.progress.out $read1_fq_gz --pid $$ --out ${bam_root}_star_progress.json &
+fi
+star_args="--genomeDir out --readFilesIn $read1_fq_gz $read2_fq_gz
+    --readFilesCommand zcat --runThreadN $ncpus --genomeLoad NoSharedMemory
+    --outFilterMultimapNmax 500 --alignSJoverhangMin 8 --alignSJDBoverhangMin 1
+    --outFilterMismatchNmax 999 --outFilterMismatchNoverReadLmax 0.04
+    --alignIntronMin 20 --alignIntronMax 1000000 --alignMatesGapMax 1000000
+    --outSAMheaderCommentFile COfile.txt --outSAMheaderHD @HD VN:1.4 SO:coordinate
+    --outSAMunmapped Within --outFilterType BySJout --outSAMattributes NH HI AS NM MD
+    --outFilterScoreMinOverLread 0.85 --outFilterIntronMotifs RemoveNoncanonicalUnannotated
+    --clip5pNbases 6 15 --seedSearchStartLmax 30 --outSAMtype BAM SortedByCoordinate
+    --limitBAMsortRAM ${ram_GB}000000000"
 
-echo "-- Marking PCR duplicates..."
-set -x
-STAR --inputBAMfile Aligned.sortedByCoord.out.bam --bamRemoveDuplicatesType UniqueIdentical \
-    --runMode inputAlignmentsFromBAM --bamRemoveDuplicatesMate2basesN 15 \
-    --outFileNamePrefix markdup. --limitBAMsortRAM ${ram_GB}000000000
+if [ "$read2_fq_gz" != "" ] && [ "$signal_root" != "" ] && which rampage_mark_signals.py > /dev/null 2>&1; then
+    # One pass: the sorted alignments stream from STAR through duplicate marking and 5' signal counting straight into
+    # the marked bam, so the unmarked bam is never written and nothing is read back for the signals.
+    echo "-- Map reads, marking PCR duplicates and making 5' signals as they stream..."
+    set -x -o pipefail
+    STAR $star_args --outStd BAM_SortedByCoordinate | samtools view -h - \
+        | rampage_mark_signals.py --prefix read1_5p. $strand_arg \
+        | samtools view -@ $ncpus -Sb - > ${bam_root}_marked.bam
+    set +x +o pipefail
+    mv Log.final.out ${bam_root}_Log.final.out
+else
+    set -x
+    STAR $star_args
+    set +x
+    ls -l Aligned.sortedByCoord.out.bam
 
-mv markdup.Processed.out.bam ${bam_root}_marked.bam
-mv Log.final.out ${bam_root}_Log.final.out
-set +x
+    echo "-- Marking PCR duplicates..."
+    set -x
+    STAR --inputBAMfile Aligned.sortedByCoord.out.bam --bamRemoveDuplicatesType UniqueIdentical \
+        --runMode inputAlignmentsFromBAM --bamRemoveDuplicatesMate2basesN 15 \
+        --outFileNamePrefix markdup. --limitBAMsortRAM ${ram_GB}000000000
+
+    mv markdup.Processed.out.bam ${bam_root}_marked.bam
+    mv Log.final.out ${bam_root}_Log.final.out
+    set +x
+
+    if [ "$signal_root" != "" ]; then
+        echo "-- Make 5' signals from the marked bam..."
+        set -x
+        STAR --runMode inputAlignmentsFromBAM --inputBAMfile ${bam_root}_marked.bam --outWigType bedGraph read1_5p \
+            --outWigStrand `[ "$strand_arg" == "--stranded" ] && echo Stranded || echo Unstranded` \
+            --outFileNamePrefix read1_5p. --outWigReferencesPrefix chr
+        set +x
+    fi
+fi
+
+if [ "$signal_root" != "" ]; then
+    echo "-- Convert bedGraphs to bigWigs..."
+    set -x
+    if [ "$strand_arg" == "--stranded" ]; then
+        bedGraphToBigWig read1_5p.Signal.UniqueMultiple.str2.out.bg $chrom_sizes ${signal_root}_minusAll.bw
+        bedGraphToBigWig read1_5p.Signal.Unique.str2.out.bg         $chrom_sizes ${signal_root}_minusUniq.bw
+        bedGraphToBigWig read1_5p.Signal.UniqueMultiple.str1.out.bg $chrom_sizes ${signal_root}_plusAll.bw
+        bedGraphToBigWig read1_5p.Signal.Unique.str1.out.bg         $chrom_sizes ${signal_root}_plusUniq.bw
+    else
+        bedGraphToBigWig read1_5p.Signal.UniqueMultiple.str1.out.bg $chrom_sizes ${signal_root}_all.bw
+        bedGraphToBigWig read1_5p.Signal.Unique.str1.out.bg         $chrom_sizes ${signal_root}_uniq.bw
+    fi
+    set +x
+fi
 
 echo "-- Collect bam flagstats..."
 set -x
@@ -0,0 +1,233 @@
+#!/usr/bin/env python2.7
+# rampage_mark_signals.py v1 Marks PCR duplicates in coordinate sorted, paired-end RAMPAGE alignments and makes their
+#                            read1 5' signals in the same pass.  Reads sam (with header) on stdin, writes the marked sam
+#                            to stdout and the signals as bedGraphs, named as STAR names them.
+#
+# Usage in rampage_align_star.sh, in place of STAR's duplicate marking and signal passes over the bam:
+#     STAR ... --outStd BAM_SortedByCoordinate | samtools view -h - \
+#         | rampage_mark_signals.py --prefix read1_5p. --stranded \
+#         | samtools view -@ $ncpus -Sb - > ${bam_root}_marked.bam
+#
+# NOTES: Duplicates are marked as 'STAR --bamRemoveDuplicatesType UniqueIdentical --bamRemoveDuplicatesMate2basesN 15'
+#        marks them:
+#      - Every record is marked a duplicate (flag 0x400), then one pair of each set of identical unique (NH:i:1)
+#        pairs is unmarked, so multi-mappers and unmapped reads stay marked.
+#      - Pairs are identical when their mate starts, read1's flag, both cigars and the first --mate2_bases bases of
+#        read2 (from its 5' end) are all the same.  Of identical pairs the one with the best AS is kept, and of those
+#        the first by read name.
+#      - Pairs are compared within groups of overlapping alignments: a group ends at a new reference or at a record
+#        starting past the furthest mate of the group's unique pairs.  Only a group is held in memory.
+#      - Signals are 'STAR --outWigType bedGraph read1_5p --outWigReferencesPrefix chr' with --outWigNorm RPM:
+#        one count at the 5' end of each read1, '.Unique.' counting unique reads and '.UniqueMultiple.' adding 1/NH for
+#        every read, on str1 and str2 when --stranded (all on str1 otherwise, at the leftmost base as STAR does).
+#        Unique signals are scaled by 1e6/unique reads and UniqueMultiple by 1e6/(unique + multi reads), counted over
+#        all mates, which are only known at the end: runs are kept unscaled in a temporary file until then.
+
+import sys, os, argparse
+
+MATE2_BASES = 15
+REFERENCES_PREFIX = "chr"
+DUPLICATE = 0x400
+UNMAPPED_POS = 0xffffffff  # bam's -1 position, compared unsigned as STAR compares it
+SIGNALS = ["Unique.str1", "UniqueMultiple.str1", "Unique.str2", "UniqueMultiple.str2"]
+
+def tag_value(fields, tag):
+    '''Returns the integer value of an optional sam tag (e.g. 'NH:i:') or None.'''
+    for field in fields[11:]:
+        if field.startswith(tag):
+            return int(field[5:])
+    return None
+
+def bam_pos(pos):
+    '''Converts a 1-based sam position to bam's 0-based one, as unsigned.'''
+    pos = int(pos) - 1
+    return pos if pos >= 0 else UNMAPPED_POS
+
+class DuplicateMarker(object):
+    '''Holds a group of overlapping records until it is complete, then marks its duplicates and releases it.'''
+
+    def __init__(self, out, mate2_bases=MATE2_BASES):
+        self.out = out
+        self.mate2_bases = mate2_bases
+        self.group = []     # every record of the group, in order: [fields, flag]
+        self.unique = []    # the group's unique records
+        self.group_ref = None
+        self.right_max = 0
+        self.records = 0
+        self.kept = 0
+        self.unpaired = 0
+
+    def add(self, fields):
+        ref = fields[2]
+        left = bam_pos(fields[3])
+        if self.group and (ref != self.group_ref or (self.right_max > 0 and left > self.right_max)):
+            self.flush()
+        if not self.group:
+            self.group_ref = ref
+        record = [fields, int(fields[1]) | DUPLICATE]
+        self.group.append(record)
+        self.records += 1
+        if tag_value(fields, "NH:i:") == 1:
+            self.unique.append(record)
+            right = bam_pos(fields[7])
+            if right > left:
+                self.right_max = max(self.right_max, right)
+
+    def pair_key(self, mate1, mate2):
+        (fields1, flag1) = mate1
+        (fields2, flag2) = mate2
+        seq = fields2[9]
+        if flag2 & 0x10:
+            start = seq[len(seq) - self.mate2_bases:] if self.mate2_bases > 0 else ""
+        else:
+            start = seq[:self.mate2_bases]
+        return (bam_pos(fields1[3]), bam_pos(fields2[3]), flag1, fields1[5], fields2[5], start)
+
+    def mark(self):
+        '''Unmarks the best pair of each set of identical unique pairs in the group.'''
+        pairs = {}
+        for record in self.unique:
+            pairs.setdefault(record[0][0], [None, None])[1 if record[1] & 0x80 else 0] = record
+        best = {}
+        for name in sorted(pairs.keys()):
+            (mate1, mate2) = pairs[name]
+            if mate1 is None or mate2 is None:
+                self.unpaired += 1
+                continue
+            key = self.pair_key(mate1, mate2)
+            score = tag_value(mate1[0], "AS:i:")
+            if key not in best or score > best[key][0]:
+                best[key] = (score, mate1, mate2)
+        for (score, mate1, mate2) in best.values():
+            mate1[1] ^= DUPLICATE
+            mate2[1] ^= DUPLICATE
+        self.kept += len(best)
+
+    def flush(self):
+        self.mark()
+        write = self.out.write
+        for (fields, flag) in self.group:
+            fields[1] = str(flag)
+            write('\t'.join(fields))
+        self.group = []
+        self.unique = []
+        self.right_max = 0
+
+class SignalMaker(object):
+    '''Counts read1 5' ends per reference, writing each reference's unscaled runs as the next one begins.'''
+
+    def __init__(self, prefix, stranded, references_prefix=REFERENCES_PREFIX):
+        self.prefix = prefix
+        self.stranded = stranded
+        self.references_prefix = references_prefix
+        self.signals = SIGNALS if stranded else SIGNALS[:2]
+        self.raw_names = [prefix + "Signal." + signal + ".raw" for signal in self.signals]
+        self.raw = [open(name, 'w') for name in self.raw_names]
+        self.ref = None
+        self.counts = [{} for signal in self.signals]
+        self.n_unique = 0
+        self.n_multi = 0.0
+
+    def add(self, fields, flag, nh):
+        ref = fields[2]
+        if ref == '*' or not ref.startswith(self.references_prefix):
+            return
+        if nh is None:
+            nh = 1  # as STAR: no NH tag is taken as unique, but not counted for scaling
+        elif nh == 1:
+            self.n_unique += 1
+        elif nh > 1:
+            self.n_multi += 1.0 / nh
+        if nh == 0 or flag & 0x80:
+            return
+        if ref != self.ref:
+            self.write_runs()
+            self.ref = ref
+        pos = int(fields[3]) - 1
+        strand = 1 if self.stranded and flag & 0x10 else 0
+        if strand:
+            for (length, op) in cigar_ops(fields[5]):
+                if op in "MDN":
+                    pos += length
+            pos -= 1
+        if nh == 1:
+            counts = self.counts[2 * strand]
+            counts[pos] = counts.get(pos, 0.0) + 1
+        counts = self.counts[2 * strand + 1]
+        counts[pos] = counts.get(pos, 0.0) + 1.0 / nh
+
+    def write_runs(self):
+        '''Writes the current reference's runs of equal counts, merging adjacent bases as STAR does.'''
+        for (counts, raw) in zip(self.counts, self.raw):
+            run = None
+            for pos in sorted(counts.keys()):
+                count = counts[pos]
+                if run is not None and pos == run[1] and count == run[2]:
+                    run[1] = pos + 1
+                    continue
+                if run is not None:
+                    raw.write("%s\t%d\t%d\t%r\n" % (self.ref, run[0], run[1], run[2]))
+                run = [pos, pos + 1, count]
+            if run is not None:
+                raw.write("%s\t%d\t%d\t%r\n" % (self.ref, run[0], run[1], run[2]))
+            counts.clear()
+
+    def finish(self):
+        '''Scales the runs and writes the bedGraphs.  Returns their names.'''
+        self.write_runs()
+        scales = [1.0e6 / self.n_unique if self.n_unique else 0.0,
+                  1.0e6 / (self.n_unique + self.n_multi) if self.n_unique + self.n_multi else 0.0]
+        names = []
+        for (ix, raw_name) in enumerate(self.raw_names):
+            self.raw[ix].close()
+            name = raw_name[:-len(".raw")] + ".out.bg"
+            scale = scales[ix % 2]
+            with open(raw_name) as raw, open(name, 'w') as bedgraph:
+                for line in raw:
+                    (ref, start, end, count) = line.rstrip('\n').split('\t')
+                    bedgraph.write("%s\t%s\t%s\t%.5e\n" % (ref, start, end, float(count) * scale))
+            os.remove(raw_name)
+            names.append(name)
+        return names
+
+def cigar_ops(cigar):
+    '''Yields (length, op) of a sam cigar string.'''
+    length = 0
+    for char in cigar:
+        if char.isdigit():
+            length = length * 10 + ord(char) - 48
+        else:
+            yield (length, char)
+            length = 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Marks duplicates in sorted paired-end RAMPAGE sam on stdin, " +
+                                                 "writing it to stdout, and makes its read1 5' signal bedGraphs.")
+    parser.add_argument('--prefix', default="read1_5p.", help="Prefix of the bedGraph files (as STAR's).")
+    parser.add_argument('--stranded', action='store_true', help="Make str1 and str2 signals.")
+    parser.add_argument('--mate2_bases', type=int, default=MATE2_BASES,
+                        help="Bases from the 5' end of read2 that must also be identical in duplicates.")
+    parser.add_argument('--references_prefix', default=REFERENCES_PREFIX, help="Only make signals on these references.")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    marker = DuplicateMarker(out, args.mate2_bases)
+    signals = SignalMaker(args.prefix, args.stranded, args.references_prefix)
+    for line in sys.stdin:
+        if line.startswith('@'):
+            out.write(line)
+            continue
+        fields = line.split('\t')
+        marker.add(fields)
+        signals.add(fields, int(fields[1]), tag_value(fields, "NH:i:"))
+    if marker.group:
+        marker.flush()
+    out.flush()
+    names = signals.finish()
+
+    print >> sys.stderr, "-- %d records, %d unique pairs kept as not duplicates, %d unique reads unpaired" % \
+                         (marker.records, marker.kept, marker.unpaired)
+    print >> sys.stderr, "-- Signals: %s" % ", ".join(names)
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,10 @@ main() {
     echo "* Value of star_index: '$star_index'"
     echo "* Value of library_id: '$library_id'"
     echo "* Value of assay_type: '$assay_type'"
+    if [ "$chrom_sizes" != "" ]; then
+        echo "* Value of chrom_sizes: '$chrom_sizes'"
+        echo "* Value of stranded: '$stranded'"
+    fi
 
     # Determine memory available
     memory_GB=60
@@ -137,9 +141,18 @@ main() {
 
     # DX/ENCODE independent script is found in resources/usr/bin
     bam_root="${bam_root}_${assay_type}_star"
+    signal_root=""
+    signal_args=""
+    if [ "$chrom_sizes" != "" ]; then
+        # Signals are made as the alignments stream into the marked bam, rather than from it in another job
+        signal_root=${bam_root%_star}_5p
+        dx download "$chrom_sizes" -o chrom.sizes
+        signal_args="--signals chrom.sizes $signal_root $stranded"
+    fi
     echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
     set -x
-    rampage_align_star.sh star_index.tgz $reads1_fq_gz $reads2_fq_gz "$library_id" $nthreads ${memory_GB} $bam_root
+    rampage_align_star.sh star_index.tgz $reads1_fq_gz $reads2_fq_gz "$library_id" $nthreads ${memory_GB} $bam_root \
+                                                                                                        $signal_args
     set +x
     echo "* ===== Returned from dnanexus and encodeD independent script ====="
 
@@ -164,6 +177,27 @@ main() {
     dx-jobutil-add-output rampage_star_log "$rampage_star_log" --class=file
     dx-jobutil-add-output rampage_flagstat "$rampage_flagstat" --class=file
 
+    if [ "$signal_root" != "" ]; then
+        echo "* Upload signals..."
+        if [ "$stranded" == "true" ]; then
+            all_minus_bw=$(dx upload ${signal_root}_minusAll.bw     --property SW="$versions" --brief)
+            all_plus_bw=$(dx upload ${signal_root}_plusAll.bw       --property SW="$versions" --brief)
+            unique_minus_bw=$(dx upload ${signal_root}_minusUniq.bw --property SW="$versions" --brief)
+            unique_plus_bw=$(dx upload ${signal_root}_plusUniq.bw   --property SW="$versions" --brief)
+
+            dx-jobutil-add-output all_minus_bw "$all_minus_bw" --class=file
+            dx-jobutil-add-output all_plus_bw "$all_plus_bw" --class=file
+            dx-jobutil-add-output unique_minus_bw "$unique_minus_bw" --class=file
+            dx-jobutil-add-output unique_plus_bw "$unique_plus_bw" --class=file
+        else
+            all_bw=$(dx upload ${signal_root}_all.bw   --property SW="$versions" --brief)
+            uniq_bw=$(dx upload ${signal_root}_uniq.bw --property SW="$versions" --brief)
+
+            dx-jobutil-add-output all_bw "$all_bw" --class=file
+            dx-jobutil-add-output uniq_bw "$uniq_bw" --class=file
+        fi
+    fi
+
     dx-jobutil-add-output reads "$reads" --class=string
     dx-jobutil-add-output metadata "{ $qc_stats }" --class=string
     echo "* Finished."
@@ -54,24 +54,30 @@ call_peaks $reads_flag $rampage_bam --rnaseq-reads $control_bam --threads $ncpus
            --annotation-quantifications-ofname ${peaks_root}_quant.tsv
 set +x
  
-echo "-- Removing 'chrphiX' from bed..."
-# Because validateFiles fails on too long of bed lines, we now trim column 11 to first 512 bytes
+echo "-- Compressing gff while bed is polished..."
 set -x
-grep -v "^track" ${peaks_root}.bed | sort -k1,1 -k2,2n > peaks.bed
-cat peaks.bed | awk -F '\t' '{printf "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%.512s\n",$1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11}' \
-                > ${peaks_root}.bed
+pigz -p $ncpus ${peaks_root}.gff &
+gff_pid=$!
 set +x
 
-echo "-- Converting bed to bigBed..."
+echo "-- Removing 'chrphiX' from bed..."
+# Because validateFiles fails on too long of bed lines, we now trim column 11 to first 512 bytes
+# One pass drops the track line and trims, one sort orders the peaks, and one pass writes both the full bed and the
+# 'chr' only bed for bigBed.  Peak names (column 4) are unique, so this sorts exactly as sorting before trimming did.
 set -x
-grep "^chr" ${peaks_root}.bed | sort -k1,1 -k2,2n > peaks_polished.bed
-bedToBigBed peaks_polished.bed -type=bed6+ -as=/usr/bin/tss_peak.as $chrom_sizes ${peaks_root}.bb
+awk -F '\t' '!/^track/ {printf "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%.512s\n",$1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11}' ${peaks_root}.bed | \
+    sort -k1,1 -k2,2n -S 2G --parallel=$ncpus -T ./ | \
+    awk -v bed=peaks.bed -v polished=peaks_polished.bed '{ print > bed } /^chr/ { print > polished }'
+mv peaks.bed ${peaks_root}.bed
 set +x
- 
-echo "-- Compressing bed and gff..."
+
+echo "-- Converting bed to bigBed and compressing bed..."
 set -x
-pigz ${peaks_root}.bed
-pigz ${peaks_root}.gff
+bedToBigBed peaks_polished.bed -type=bed6+ -as=/usr/bin/tss_peak.as $chrom_sizes ${peaks_root}.bb &
+bb_pid=$!
+pigz -p $ncpus ${peaks_root}.bed
+wait $bb_pid
+wait $gff_pid
 set +x
 
 echo "-- The results..."
@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 # rampageLaunch.py 0.0.1
 
-import argparse,os, sys, json
+import argparse,os, sys, json, copy
 
-import dxpy
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import launch_client
+import launch_profile
+launch_profile.defer_imports()  # dxpy and dxencode are imported when first used, not to parse arguments
 from launch import Launch
+from control_catalog import ControlCatalog, CATALOG_DEFAULT
 #from template import Launch # (does not use dxencode at all)
 
 class RampageLaunch(Launch):
@@ -28,6 +32,7 @@ class RampageLaunch(Launch):
     ''' This the default location to place results folders for each experiment.'''
 
     # NOTE '/lrna/' or '/run/' is safer and more efficient than '/', but also more brittle
+    # NOTE: control_catalog.py keeps a catalog of these bams so most launches need not search this folder at all
     #CONTROL_ROOT_FOLDER = '/'
     CONTROL_ROOT_FOLDER = '/long-RNA-seq/'
     ''' Rampage requires a control file which may be discoverable.'''
@@ -39,7 +44,7 @@ class RampageLaunch(Launch):
     PIPELINE_BRANCHES = {
     #'''Each branch must define the 'steps' and their (artificially) linear order.'''
          "REP": {
-                "ORDER": [ "rampage-align-pe", "rampage-signals", "rampage-peaks" ],
+                "ORDER": [ "rampage-align-signals", "rampage-peaks" ],
                 "STEPS": {
                             "rampage-align-pe": {
                                 "app":     "rampage-align-pe",
@@ -49,6 +54,20 @@ class RampageLaunch(Launch):
                                              "star_index": "star_index" },
                                 "results": { "rampage_marked_bam": "rampage_marked_bam" }
                             },
+                            "rampage-align-signals": {
+                                "app":     "rampage-align-pe",
+                                "params":  { "library_id": "library_id", "assay_type": "assay_type", "nthreads": "nthreads",
+                                             "stranded":   "stranded" },
+                                "inputs":  { "reads1":     "reads1",
+                                             "reads2":     "reads2",
+                                             "star_index": "star_index",
+                                             "chrom_sizes": "chrom_sizes" },
+                                "results": { "rampage_marked_bam": "rampage_marked_bam",
+                                             "all_plus_bw":    "all_plus_bw",
+                                             "all_minus_bw":    "all_minus_bw",
+                                             "unique_plus_bw": "unique_plus_bw",
+                                             "unique_minus_bw": "unique_minus_bw" }
+                            },
                             "rampage-signals": {
                                 "app":    "rampage-signals",
                                 "params":  {"stranded":       "stranded"},
@@ -97,6 +116,9 @@ class RampageLaunch(Launch):
          }
     }
 
+    SEPARATE_SIGNALS_ORDER = [ "rampage-align-pe", "rampage-signals", "rampage-peaks" ]
+    '''With '--separate_signals', signals are made in their own job after alignment, rather than in the alignment job.'''
+
     FILE_GLOBS = {
         "all_plus_bw":        "/*_5p_plusAll.bw",
         "rampage_marked_bam": "/*_star_marked.bam",
@@ -186,6 +208,24 @@ class RampageLaunch(Launch):
                         default=self.ANNO_DEFAULT,
                         required=False)
 
+        ap.add_argument('--control_catalog',
+                        help="Catalog of long-RNA-seq bams for finding the control (default: '" + CATALOG_DEFAULT + "')",
+                        default=CATALOG_DEFAULT,
+                        required=False)
+
+        ap.add_argument('--separate_signals',
+                        help='Make signals in a separate job, rather than in the alignment job.',
+                        action='store_true',
+                        required=False)
+
+        ap.add_argument('--after_running',
+                        help="First wait for analyses still running in the experiment's results folder (e.g. " + \
+                             "replicates launched on their own) to finish, so the combined replicate steps follow.",
+                        action='store_true',
+                        required=False)
+
+        launch_profile.add_argument(ap)
+
         return ap.parse_args()
 
     def pipeline_specific_vars(self,args,verbose=False):
@@ -208,6 +248,8 @@ class RampageLaunch(Launch):
             if self.exp["assay_term_name"] == "CAGE":
                 psv['assay_type'] = "cage"
             psv['control'] = args.control
+            if psv['control'] is None:
+                psv['control'] = self.catalog_control(args, psv)
 
             if psv['paired_end'] and psv['assay_type'] == "cage":
                 print "ERROR: CAGE is always expected to be single-end but mapping says otherwise."
@@ -234,6 +276,11 @@ class RampageLaunch(Launch):
                 psv['name'] = psv['assay_type'] + psv['name'][4:]
                 psv['title'] = "CAGE" + psv['title'][7:]
 
+        if args.separate_signals:
+            branches = copy.deepcopy(self.PIPELINE_BRANCHES)
+            branches["REP"]["ORDER"] = list(self.SEPARATE_SIGNALS_ORDER)
+            self.PIPELINE_BRANCHES = branches
+
         # Must override results location because of annotation
         psv['resultsLoc'] = self.umbrella_folder(args.folder,self.FOLDER_DEFAULT,self.proj_name,psv['exp_type'], \
                                                                                         psv['genome'],psv['annotation'])
@@ -241,6 +288,10 @@ class RampageLaunch(Launch):
         if not self.template:
             psv['resultsFolder'] += psv['experiment'] + '/'
         self.update_rep_result_folders(psv)
+        if args.after_running:
+            failed = launch_client.CLIENT.wait_running(self.proj_id,psv['resultsFolder'])
+            if failed:
+                sys.exit("ERROR: Not done: " + ", ".join(failed))
 
         if verbose:
             print "Pipeline Specific Vars:"
@@ -248,28 +299,54 @@ class RampageLaunch(Launch):
         return psv
 
 
+    def catalog_control(self,args,psv):
+        '''Looks up the control bam of the experiment's possible controls in the control catalog, or returns None.'''
+        experiments = []
+        for control in self.exp.get('possible_controls', []):
+            if isinstance(control, dict):
+                control = control.get('accession', control.get('@id', ''))
+            experiments.append(control.strip('/').split('/')[-1])
+        if len(experiments) == 0:
+            return None
+        import dxpy
+        project = dxpy.find_one_project(name=self.proj_name, zero_ok=True)
+        if project is None:
+            return None
+        catalog = ControlCatalog(project['id'], self.CONTROL_ROOT_FOLDER, self.CONTROL_FILE_GLOB, args.control_catalog)
+        control = catalog.find_control(experiments, psv['genome'], psv['annotation'], verbose=True)
+        if control is not None:
+            print "Found control '%s' in catalog for %s" % (control, ", ".join(experiments))
+        return control
+
+    def check_run_log(self,results_folder,*args,**kwargs):
+        '''Checks for analyses still running in the results folder, looking at all of the project's at once.'''
+        # Launch's own check reads the folder's run log, which may name analyses older than the monitor knows of
+        if launch_client.CLIENT.none_running(self.proj_id,results_folder):
+            return True
+        return Launch.check_run_log(self,results_folder,*args,**kwargs)
+
+    def find_file(self,path,*args,**kwargs):
+        '''Looks up a file, except a prior result that the listed results folder shows is not there.'''
+        psv = getattr(self, 'psv', None) or {}
+        project = args[0] if args else kwargs.get('project')
+        if psv.get('resultsFolder') and project == getattr(self, 'proj_id', None) and \
+           launch_client.CLIENT.known_missing(path,project,psv['resultsFolder']):
+            return None
+        return Launch.find_file(self,path,*args,**kwargs)
+
     def find_ref_files(self,priors):
         '''Locates all reference files based upon organism and gender.'''
-        star_path = self.psv['refLoc']+self.REFERENCE_FILES['star_index'][self.psv['genome']][self.psv['gender']][self.psv['annotation']]
-        star_fid = self.find_file(star_path,self.REF_PROJECT_DEFAULT)
-        if star_fid == None:
-            sys.exit("ERROR: Unable to locate STAR index file '" + star_path + "'")
-        else:
-            priors['star_index'] = star_fid
-
-        anno_path = self.psv['refLoc']+self.REFERENCE_FILES['gene_annotation'][self.psv['genome']][self.psv['annotation']]
-        anno_fid = self.find_file(anno_path,self.REF_PROJECT_DEFAULT)
-        if anno_fid == None:
-            sys.exit("ERROR: Unable to locate Gene Annotation file '" + anno_path + "'")
-        else:
-            priors['gene_annotation'] = anno_fid
-
-        chrom_sizes = self.psv['refLoc']+self.REFERENCE_FILES['chrom_sizes'][self.psv['genome']][self.psv['gender']]
-        chrom_sizes_fid = self.find_file(chrom_sizes,self.REF_PROJECT_DEFAULT)
-        if chrom_sizes_fid == None:
-            sys.exit("ERROR: Unable to locate Chrom Sizes file '" + chrom_sizes + "'")
-        else:
-            priors['chrom_sizes'] = chrom_sizes_fid
+        (genome, gender, annotation) = (self.psv['genome'], self.psv['gender'], self.psv['annotation'])
+        paths = {'star_index':      self.psv['refLoc']+self.REFERENCE_FILES['star_index'][genome][gender][annotation],
+                 'gene_annotation': self.psv['refLoc']+self.REFERENCE_FILES['gene_annotation'][genome][annotation],
+                 'chrom_sizes':     self.psv['refLoc']+self.REFERENCE_FILES['chrom_sizes'][genome][gender]}
+        # The lookups are independent, so are made together (and only once for a batch of experiments)
+        fids = launch_client.CLIENT.find_files(self.find_file,paths,self.REF_PROJECT_DEFAULT)
+        for (key, label) in [('star_index', "STAR index"), ('gene_annotation', "Gene Annotation"),
+                             ('chrom_sizes', "Chrom Sizes")]:
+            if fids[key] == None:
+                sys.exit("ERROR: Unable to locate " + label + " file '" + paths[key] + "'")
+            priors[key] = fids[key]
         self.psv['ref_files'] = self.REFERENCE_FILES.keys()
         return priors
 
@@ -279,5 +356,5 @@ class RampageLaunch(Launch):
 if __name__ == '__main__':
     '''Run from the command line.'''
     rampageLaunch = RampageLaunch()
-    rampageLaunch.run()
+    launch_profile.PROFILE.run(rampageLaunch)
 
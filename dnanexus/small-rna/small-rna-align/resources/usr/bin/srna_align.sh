@@ -1,8 +1,9 @@
 #!/bin/bash -e
 
-if [ $# -lt 5 ] ||  [ $# -gt 6 ]; then
-    echo "usage v1: srna_align.sh <star_index.tgz> <reads.fq.gz> <library_id> <ncpus> <bam_root> [<clipping_model>]"
+if [ $# -lt 5 ] ||  [ $# -gt 7 ]; then
+    echo "usage v1: srna_align.sh <star_index.tgz> <reads.fq.gz> <library_id> <ncpus> <bam_root> [<clipping_model>] [<align_mode>]"
     echo "Align single-end short-RNA-seq reads with STAR.  Is independent of DX and encodeD."
+    echo "If align_mode is 'collapsed' only the unique inserts of the reads are aligned, then expanded to every read."
     exit -1; 
 fi
 star_index_tgz=$1  # STAR Index archive.
@@ -11,21 +12,41 @@ library_id=$3      # Library identifier which will be added to bam header.
 ncpus=$4           # Number of cpus available.
 bam_root="$5_srna_star" # root name for output bam (e.g. "out_bam" will create "out_bam_srna_star.bam")
 clipping_model="ENCODE3"
-if [ $# -eq 6 ]; then
+if [ $# -ge 6 ]; then
     clipping_model=$6  # "A_Tailing_No_Barcode", "A_Tailing_N3", "A_Tailing_N4"
 fi
+align_mode="reads"
+if [ $# -eq 7 ]; then
+    align_mode=$7      # "reads" aligns every read, "collapsed" aligns each unique insert once.
+fi
 
 echo "-- Alignments file will be: '${bam_root}.bam'"
 
+echo "-- Reading the index's bam comment lines..."
+# An index archive gives up the one member without the rest being decompressed, so the header is known before the
+# index is extracted.  Plain '.tgz' indexes are read once, by the extraction.
+rm -f index_comments.txt
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py cat $star_index_tgz '*_bamCommentLines.txt' --indexed_only > index_comments.txt \
+        || rm -f index_comments.txt
+fi
+
 echo "-- Extracting star index archive..."
-tar zxvf $star_index_tgz
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py extract $star_index_tgz --threads $ncpus
+else
+    tar zxvf $star_index_tgz --exclude=.index_archive_toc.json
+fi
 # unzips into "out/"
+if [ ! -f index_comments.txt ]; then
+    cat out/*_bamCommentLines.txt > index_comments.txt
+fi
 
 echo "-- Set up headers..."
 set -x
 libraryComment="@CO\tLIBID:${library_id}"
 echo -e ${libraryComment} > COfile.txt
-cat out/*_bamCommentLines.txt >> COfile.txt
+cat index_comments.txt >> COfile.txt
 echo `cat COfile.txt`
 set +x
 
@@ -40,20 +61,58 @@ elif [ $clipping_model != "ENCODE3" ]; then
     echo "-- WARNING: Unknown clipping model '$clipping_model'"
     clipping_model="ENCODE3"
 fi
-echo "-- Using clipping model '$clipping_model'"
+echo "-- Using clipping model '$clipping_model' aligning $align_mode"
 
 
-echo "-- Map reads..."
+if [ "$align_mode" == "collapsed" ]; then
+    # Adapters are clipped by srna_collapse.py with the same rules STAR uses for the clipping model, so STAR is not
+    # given clip_params.  Each unique insert is aligned once and its alignments, gene counts and log are expanded
+    # to every read it came from.
+    echo "-- Collapse reads to unique inserts..."
+    set -x
+    srna_collapse.py --verbose collapse $reads_fq_gz $clipping_model collapsed_inserts.fa
+    set +x
+
+    echo "-- Map unique inserts..."
+    # If available, will log STAR's throughput, mapping rate and ETA while it maps
+    if which star_progress.py > /dev/null 2>&1; then
+        star_progress.py collapsed_Log.progress.out collapsed_inserts.fa --pid $$ --out ${bam_root}_progress.json &
+    fi
+    set -x
+    STAR --genomeDir out --readFilesIn collapsed_inserts.fa --outFileNamePrefix collapsed_     \
+        --runThreadN $ncpus --outFilterMultimapNmax 20 --alignIntronMax 1                       \
+        --outFilterMismatchNoverLmax 0.03                                                       \
+        --outFilterScoreMinOverLread 0 --outFilterMatchNminOverLread 0 --outFilterMatchNmin 16  \
+        --outSAMheaderCommentFile COfile.txt --outSAMheaderHD @HD VN:1.4 SO:coordinate          \
+        --genomeLoad NoSharedMemory --outSAMunmapped Within --outSAMtype SAM                    \
+        --outSAMattributes NH HI AS nM jM --quantMode GeneCounts --alignSJDBoverhangMin 1000
+    set +x
+
+    echo "-- Expand alignments to reads..."
+    set -x
+    set -o pipefail
+    srna_collapse.py --verbose expand $reads_fq_gz $clipping_model collapsed_inserts.fa collapsed_ out | \
+        samtools view -bS - | samtools sort -@ $ncpus -m 2G - ${bam_root}
+    set +o pipefail
+    rm collapsed_Aligned.out.sam
+else
+    echo "-- Map reads..."
+    # If available, will log STAR's throughput, mapping rate and ETA while it maps
+    if which star_progress.py > /dev/null 2>&1; then
+        star_progress.py Log.progress.out $reads_fq_gz --pid $$ --out ${bam_root}_progress.json &
+    fi
+    set -x
+    STAR --genomeDir out --readFilesIn $reads_fq_gz --readFilesCommand zcat                     \
+        --runThreadN $ncpus --outFilterMultimapNmax 20 --alignIntronMax 1                       \
+        $clip_params --outFilterMismatchNoverLmax 0.03                                          \
+        --outFilterScoreMinOverLread 0 --outFilterMatchNminOverLread 0 --outFilterMatchNmin 16  \
+        --outSAMheaderCommentFile COfile.txt --outSAMheaderHD @HD VN:1.4 SO:coordinate          \
+        --genomeLoad NoSharedMemory --outSAMunmapped Within --outSAMtype BAM SortedByCoordinate \
+        --quantMode GeneCounts --alignSJDBoverhangMin 1000 --limitBAMsortRAM 60000000000
+    mv Aligned.sortedByCoord.out.bam ${bam_root}.bam
+fi
+
 set -x
-STAR --genomeDir out --readFilesIn $reads_fq_gz --readFilesCommand zcat                     \
-    --runThreadN $ncpus --outFilterMultimapNmax 20 --alignIntronMax 1                       \
-    $clip_params --outFilterMismatchNoverLmax 0.03                                          \
-    --outFilterScoreMinOverLread 0 --outFilterMatchNminOverLread 0 --outFilterMatchNmin 16  \
-    --outSAMheaderCommentFile COfile.txt --outSAMheaderHD @HD VN:1.4 SO:coordinate          \
-    --genomeLoad NoSharedMemory --outSAMunmapped Within --outSAMtype BAM SortedByCoordinate \
-    --quantMode GeneCounts --alignSJDBoverhangMin 1000 --limitBAMsortRAM 60000000000
-        
-mv Aligned.sortedByCoord.out.bam ${bam_root}.bam
 mv ReadsPerGene.out.tab ${bam_root}_quant.tsv
 mv Log.final.out ${bam_root}_Log.final.out
 set +x
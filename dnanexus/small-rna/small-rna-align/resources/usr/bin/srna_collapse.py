@@ -0,0 +1,490 @@
+#!/usr/bin/env python2.7
+# srna_collapse.py v1 Collapses small-RNA reads into their unique inserts before alignment, and expands the alignments
+#                     of the unique inserts back into per-read alignments, STAR gene counts and STAR log afterwards.
+#                     Adapters are clipped by STAR's own rules for each srna_align.sh clipping model, so aligning the
+#                     unique inserts once gives each read the alignments STAR would have given it, while STAR's cost
+#                     scales with the library's diversity rather than its depth.
+#
+# collapse: reads.fq.gz -> unique inserts fasta ('>u<n>_x<reads>'), most frequent first.
+# expand:   reads.fq.gz + the inserts fasta + STAR's unsorted SAM, ReadsPerGene.out.tab and Log.final.out of the inserts
+#           -> per-read SAM on stdout (original names, sequences and qualities, clipped bases soft-clipped),
+#              ReadsPerGene.out.tab and Log.final.out as if every read had been aligned.
+#
+# Gene counts are recounted from the STAR index (exonGeTrInfo.tab) with STAR's GeneCounts rules, weighting each insert
+# by its reads.  Counting the inserts once each must reproduce STAR's own counts of the collapsed run, which is checked.
+
+import sys, gzip, bisect, datetime, argparse
+
+CLIPPING_MODELS = {
+    # model:                  (3' adapter,   adapter mismatch fraction, 5' bases)
+    "ENCODE3":                ("TGGAATTCTC", 0.1,                       0),
+    "A_Tailing_No_Barcode":   ("AAAAA",      0.0,                       0),
+    "A_Tailing_N3":           ("AAAAA",      0.0,                       5),
+    "A_Tailing_N4":           ("AAAAA",      0.0,                       6),
+}
+'''Must match the STAR clip_params of srna_align.sh.'''
+
+UNMAPPED_REASONS = ["% of reads unmapped: other", "% of reads unmapped: too short",
+                    "% of reads unmapped: too many mismatches", "Number of reads mapped to too many loci"]
+'''Log.final.out lines for STAR's unmapped read types (the uT tag of unmapped records), in uT order.'''
+
+COMPLEMENT = dict(zip('ACGTNacgtn', 'TGCANtgcan'))
+
+def read_fastq(path):
+    '''Yields (name, sequence, quality) of each read in a (gzipped) fastq, with names as STAR writes them.'''
+    opener = gzip.open if path.endswith('.gz') else open
+    fh = opener(path, 'r')
+    while True:
+        header = fh.readline()
+        if header == '':
+            break
+        seq = fh.readline().rstrip('\n')
+        fh.readline()
+        qual = fh.readline().rstrip('\n')
+        name = header[1:].split()[0]
+        if name.endswith('/1'):
+            name = name[:-2]
+        yield (name, seq, qual)
+    fh.close()
+
+def adapter_start(seq, adapter, mm_fraction):
+    '''Returns where the 3' adapter starts in seq (len(seq) when absent), as STAR's localSearch finds it.'''
+    seq = seq.upper()
+    (best, match_best, mm_best) = (len(seq), 0, 0)
+    for ix in range(len(seq)):
+        (match, mm) = (0, 0)
+        for (base, adapter_base) in zip(seq[ix:], adapter):
+            if base not in 'ACGT':
+                continue
+            if base == adapter_base:
+                match += 1
+            else:
+                mm += 1
+        if (match > match_best or (match >= match_best and mm < mm_best)) \
+           and match + mm > 0 and float(mm) / (match + mm) <= mm_fraction:
+            (best, match_best, mm_best) = (ix, match, mm)
+    return best
+
+class Clipper(object):
+    '''Clips reads by a clipping model, remembering the clips of every distinct read sequence.'''
+
+    def __init__(self, model):
+        if model not in CLIPPING_MODELS:
+            model = "ENCODE3"  # As srna_align.sh falls back
+        (self.adapter, self.mm_fraction, self.clip5) = CLIPPING_MODELS[model]
+        self._clips = {}
+
+    def clips(self, seq):
+        '''Returns the (5', 3') bases clipped from a read.'''
+        clips = self._clips.get(seq)
+        if clips is None:
+            clips = (self.clip5, len(seq) - adapter_start(seq, self.adapter, self.mm_fraction))
+            self._clips[seq] = clips
+        return clips
+
+    def insert(self, seq):
+        (clip5, clip3) = self.clips(seq)
+        return seq[clip5:len(seq) - clip3]
+
+def collapse(reads, model, fasta, verbose=False):
+    '''Writes the unique inserts of the reads as fasta.  Returns (reads, distinct reads, unique inserts).'''
+    read_counts = {}
+    for (name, seq, qual) in read_fastq(reads):
+        read_counts[seq] = read_counts.get(seq, 0) + 1
+    clipper = Clipper(model)
+    insert_counts = {}
+    for (seq, count) in read_counts.iteritems():
+        insert = clipper.insert(seq)
+        insert_counts[insert] = insert_counts.get(insert, 0) + count
+    # Empty inserts have nothing to align; expand() reports their reads as STAR does: unmapped 'other'.
+    insert_counts.pop('', None)
+    inserts = sorted(insert_counts.iteritems(), key=lambda (insert, count): (-count, insert))
+    with open(fasta, 'w') as fh:
+        for (ix, (insert, count)) in enumerate(inserts):
+            fh.write(">u%d_x%d\n%s\n" % (ix, count, insert))
+    totals = (sum(read_counts.itervalues()), len(read_counts), len(inserts))
+    if verbose:
+        sys.stderr.write("Collapsed %d reads (%d distinct) into %d unique inserts\n" % totals)
+    return totals
+
+def parse_cigar(cigar):
+    '''Returns [(length, op), ...] of a CIGAR string.'''
+    ops = []
+    length = ''
+    for char in cigar:
+        if char.isdigit():
+            length += char
+        else:
+            ops.append((int(length), char))
+            length = ''
+    return ops
+
+def format_cigar(ops):
+    return ''.join(["%d%s" % (length, op) for (length, op) in ops])
+
+def soft_clip(ops, left, right):
+    '''Restores bases clipped before alignment as soft clips on either end of the CIGAR.'''
+    if left > 0:
+        if ops[0][1] == 'S':
+            ops[0] = (ops[0][0] + left, 'S')
+        else:
+            ops.insert(0, (left, 'S'))
+    if right > 0:
+        if ops[-1][1] == 'S':
+            ops[-1] = (ops[-1][0] + right, 'S')
+        else:
+            ops.append((right, 'S'))
+    return ops
+
+class GeneCounter(object):
+    '''Counts reads per gene as STAR's '--quantMode GeneCounts' does, from the exons of a STAR index.'''
+
+    def __init__(self, index_dir):
+        names = [line.split()[0] for line in open(index_dir + '/chrName.txt') if line.strip() != '']
+        starts = [int(line) for line in open(index_dir + '/chrStart.txt') if line.strip() != '']
+        self.chr_start = dict(zip(names, starts))
+        exons = []
+        with open(index_dir + '/exonGeTrInfo.tab') as fh:
+            fh.readline()  # number of exons
+            for line in fh:
+                (start, end, strand, gene) = [int(value) for value in line.split()[:4]]
+                exons.append((start, end, strand, gene))
+        exons.sort()
+        self.starts = [exon[0] for exon in exons]
+        self.ends = [exon[1] for exon in exons]
+        self.strands = [exon[2] for exon in exons]
+        self.genes = [exon[3] for exon in exons]
+        self.end_max = []
+        for end in self.ends:
+            self.end_max.append(max(end, self.end_max[-1]) if self.end_max else end)
+
+    def blocks(self, rname, pos, ops):
+        '''Returns the (start, end) genome coordinates, 0-based inclusive, of an alignment's aligned blocks.'''
+        blocks = []
+        start = self.chr_start[rname] + pos - 1
+        for (length, op) in ops:
+            if op in 'M=X':
+                blocks.append((start, start + length - 1))
+                start += length
+            elif op in 'DN':
+                start += length
+        return blocks
+
+    def assign(self, blocks, reverse):
+        '''Returns the gene index (or -1: no feature, -2: ambiguous) of a unique alignment in each count column.'''
+        genes = [-1, -1, -1]
+        strand = 1 if reverse else 0
+        for (block_start, block_end) in blocks:
+            ex = bisect.bisect_right(self.starts, block_end) - 1
+            while ex >= 0 and self.end_max[ex] >= block_start:
+                if self.ends[ex] >= block_start:
+                    exon_strand = self.strands[ex] - 1  # 0: '+', 1: '-', otherwise genes without strand
+                    for column in range(3):
+                        if column == 1 and exon_strand in (0, 1) and strand != exon_strand:
+                            continue
+                        if column == 2 and exon_strand in (0, 1) and strand == exon_strand:
+                            continue
+                        if genes[column] == -1:
+                            genes[column] = self.genes[ex]
+                        elif genes[column] >= 0 and genes[column] != self.genes[ex]:
+                            genes[column] = -2
+                ex -= 1
+        return genes
+
+def tag_value(fields, tag):
+    '''Returns the value of a SAM tag (e.g. 'NH:i:') of a record's fields, or None.'''
+    for field in fields[11:]:
+        if field.startswith(tag):
+            return field[len(tag):]
+    return None
+
+class InsertStats(object):
+    '''What one unique insert contributes, per read, to the gene counts and STAR's log.'''
+
+    def __init__(self, records, counter):
+        self.records = records
+        first = records[0]
+        flag = int(first[1])
+        self.unmapped = flag & 4 != 0
+        self.reason = None
+        self.multi = False
+        self.genes = None
+        if self.unmapped:
+            reason = tag_value(first, 'uT:A:')
+            self.reason = int(reason) if reason is not None and reason.isdigit() else None
+            return
+        self.multi = int(tag_value(first, 'NH:i:')) > 1
+        if self.multi:
+            return
+        ops = parse_cigar(first[5])
+        self.genes = counter.assign(counter.blocks(first[2], int(first[3]), ops), flag & 16 != 0)
+        self.mapped_length = sum([length for (length, op) in ops if op in 'M=X'])
+        self.mismatches = int(tag_value(first, 'nM:i:') or 0)
+        self.deletions = [length for (length, op) in ops if op == 'D']
+        self.insertions = [length for (length, op) in ops if op == 'I']
+        self.splices = []
+        motifs = tag_value(first, 'jM:B:c,')
+        if motifs is not None:
+            self.splices = [int(motif) for motif in motifs.split(',') if int(motif) >= 0]
+        else:
+            self.splices = [0] * len([op for (length, op) in ops if op == 'N'])
+
+def load_alignments(sam, verbose=False):
+    '''Returns (header lines, {insert number: [record fields, ...]}) of STAR's SAM of the unique inserts.'''
+    header = []
+    alignments = {}
+    with open(sam, 'r') as fh:
+        for line in fh:
+            if line.startswith('@'):
+                header.append(line)
+                continue
+            fields = line.rstrip('\n').split('\t')
+            ix = int(fields[0].split('_')[0][1:])
+            alignments.setdefault(ix, []).append(fields)
+    if verbose:
+        sys.stderr.write("Read alignments of %d unique inserts from '%s'\n" % (len(alignments), sam))
+    return (header, alignments)
+
+def read_counts_table(path):
+    '''Returns (summary lines {name: [counts]}, [gene ids], [[counts], ...]) of a ReadsPerGene.out.tab.'''
+    summary = {}
+    gene_ids = []
+    counts = []
+    for line in open(path, 'r'):
+        fields = line.rstrip('\n').split('\t')
+        if fields[0].startswith('N_'):
+            summary[fields[0]] = [int(value) for value in fields[1:]]
+        else:
+            gene_ids.append(fields[0])
+            counts.append([int(value) for value in fields[1:]])
+    return (summary, gene_ids, counts)
+
+class Tally(object):
+    '''Gene counts and log statistics over inserts, each weighted by a number of reads.'''
+    SUMMARY = ["N_unmapped", "N_multimapping", "N_noFeature", "N_ambiguous"]
+
+    def __init__(self, genes):
+        self.summary = dict([(name, [0, 0, 0]) for name in self.SUMMARY])
+        self.counts = [[0, 0, 0] for ix in range(genes)]
+        self.reads = 0
+        self.read_bases = 0
+        self.unique = 0
+        self.multi = 0
+        self.mapped_bases = 0
+        self.mismatches = 0
+        self.deletions = [0, 0]   # events, bases
+        self.insertions = [0, 0]
+        self.splices = {}         # jM motif: count
+        self.unmapped = 0
+        self.reasons = {}         # uT reason: count
+
+    def add(self, stats, weight):
+        if stats is None or stats.unmapped:
+            self.unmapped += weight
+            reason = 0 if stats is None else stats.reason
+            self.reasons[reason] = self.reasons.get(reason, 0) + weight
+            for column in range(3):
+                self.summary["N_unmapped"][column] += weight
+        elif stats.multi:
+            self.multi += weight
+            for column in range(3):
+                self.summary["N_multimapping"][column] += weight
+        else:
+            self.unique += weight
+            self.mapped_bases += weight * stats.mapped_length
+            self.mismatches += weight * stats.mismatches
+            self.deletions[0] += weight * len(stats.deletions)
+            self.deletions[1] += weight * sum(stats.deletions)
+            self.insertions[0] += weight * len(stats.insertions)
+            self.insertions[1] += weight * sum(stats.insertions)
+            for motif in stats.splices:
+                self.splices[motif] = self.splices.get(motif, 0) + weight
+            for (column, gene) in enumerate(stats.genes):
+                if gene == -1:
+                    self.summary["N_noFeature"][column] += weight
+                elif gene == -2:
+                    self.summary["N_ambiguous"][column] += weight
+                else:
+                    self.counts[gene][column] += weight
+
+    def write_counts(self, path, gene_ids):
+        with open(path, 'w') as fh:
+            for name in self.SUMMARY:
+                fh.write('\t'.join([name] + [str(value) for value in self.summary[name]]) + '\n')
+            for (gene_id, counts) in zip(gene_ids, self.counts):
+                fh.write('\t'.join([gene_id] + [str(value) for value in counts]) + '\n')
+
+def check_counts(tally, collapsed_counts):
+    '''Fails unless counting each insert once reproduces STAR's own gene counts of the collapsed run.'''
+    (summary, gene_ids, counts) = collapsed_counts
+    for name in Tally.SUMMARY:
+        if summary.get(name) != tally.summary[name]:
+            raise ValueError("%s of the unique inserts is %s by STAR but %s recounted" % \
+                             (name, summary.get(name), tally.summary[name]))
+    for (gene_id, star, recounted) in zip(gene_ids, counts, tally.counts):
+        if star != recounted:
+            raise ValueError("Gene %s has %s unique inserts by STAR but %s recounted" % (gene_id, star, recounted))
+
+def format_like(value, original):
+    '''Formats a log value as the value it replaces is formatted.'''
+    if original.endswith('%'):
+        return "%.2f%%" % value
+    if '.' in original:
+        return "%.2f" % value
+    return "%d" % value
+
+def percent(part, whole):
+    return 100.0 * part / whole if whole > 0 else 0.0
+
+def ratio(part, whole):
+    return float(part) / whole if whole > 0 else 0.0
+
+def write_log(path, collapsed_log, tally):
+    '''Rewrites STAR's log of the collapsed run with the statistics of all reads.'''
+    lines = [line.rstrip('\n') for line in open(collapsed_log, 'r')]
+    original = {}
+    for line in lines:
+        if '|' in line:
+            (label, value) = line.split('|', 1)
+            original[label.strip()] = value.strip()
+
+    motifs = {"Number of splices: Total":         range(7) + range(20, 27),
+              "Number of splices: GT/AG":         [1, 2, 21, 22],
+              "Number of splices: GC/AG":         [3, 4, 23, 24],
+              "Number of splices: AT/AC":         [5, 6, 25, 26],
+              "Number of splices: Non-canonical": [0, 20],
+              "Number of splices: Annotated (sjdb)": range(20, 27)}
+    values = {
+        "Number of input reads":                    tally.reads,
+        "Average input read length":                ratio(tally.read_bases, tally.reads),
+        "Uniquely mapped reads number":             tally.unique,
+        "Uniquely mapped reads %":                  percent(tally.unique, tally.reads),
+        "Average mapped length":                    ratio(tally.mapped_bases, tally.unique),
+        "Mismatch rate per base, %":                percent(tally.mismatches, tally.mapped_bases),
+        "Deletion rate per base":                   percent(tally.deletions[1], tally.mapped_bases),
+        "Deletion average length":                  ratio(tally.deletions[1], tally.deletions[0]),
+        "Insertion rate per base":                  percent(tally.insertions[1], tally.mapped_bases),
+        "Insertion average length":                 ratio(tally.insertions[1], tally.insertions[0]),
+        "Number of reads mapped to multiple loci":  tally.multi,
+        "% of reads mapped to multiple loci":       percent(tally.multi, tally.reads),
+        "Number of chimeric reads":                 0,
+        "% of chimeric reads":                      0.0,
+    }
+    for (label, codes) in motifs.items():
+        values[label] = sum([tally.splices.get(code, 0) for code in codes])
+
+    # Unmapped reads are split by the reason STAR tagged them with.  STAR versions that do not tag unmapped records
+    # leave the reasons unknown, so those reads are split as the collapsed run's unmapped inserts were.
+    reasons = dict([(code, count) for (code, count) in tally.reasons.items() if code is not None])
+    unknown = tally.reasons.get(None, 0)
+    if unknown > 0:
+        collapsed = [float(original.get(label, '0').rstrip('%')) for label in UNMAPPED_REASONS]
+        collapsed_total = sum(collapsed)
+        if collapsed_total == 0:
+            (collapsed, collapsed_total) = ([1.0], 1.0)
+        for (code, share) in enumerate(collapsed):
+            reasons[code] = reasons.get(code, 0) + int(round(unknown * share / collapsed_total))
+    too_many = reasons.get(3, 0)
+    values["Number of reads mapped to too many loci"] = too_many
+    values["% of reads mapped to too many loci"] = percent(too_many, tally.reads)
+    for (code, label) in enumerate(UNMAPPED_REASONS[:3]):
+        values[label] = percent(reasons.get(code, 0), tally.reads)
+
+    try:
+        started = datetime.datetime.strptime(original["Started mapping on"], "%b %d %H:%M:%S")
+        seconds = (datetime.datetime.strptime(original["Finished on"], "%b %d %H:%M:%S") - started).total_seconds()
+        if seconds > 0:
+            values["Mapping speed, Million of reads per hour"] = tally.reads / 1e6 / (seconds / 3600.0)
+    except (KeyError, ValueError):
+        pass
+
+    with open(path, 'w') as fh:
+        for line in lines:
+            if '|' in line:
+                (label, value) = line.split('|', 1)
+                if label.strip() in values:
+                    line = label + '|\t' + format_like(values[label.strip()], value.strip())
+            fh.write(line + '\n')
+
+def read_inserts(fasta):
+    '''Returns {insert: insert number} of the unique inserts written by collapse().'''
+    numbers = {}
+    with open(fasta, 'r') as fh:
+        for line in fh:
+            if line.startswith('>'):
+                ix = int(line[1:].split('_')[0][1:])
+            else:
+                numbers[line.rstrip('\n')] = ix
+    return numbers
+
+def expand(reads, model, fasta, collapsed_prefix, index_dir, out_prefix='', out=sys.stdout, verbose=False):
+    '''Writes the per-read SAM of a collapsed alignment to out, and its gene counts and log under out_prefix.'''
+    (header, alignments) = load_alignments(collapsed_prefix + 'Aligned.out.sam', verbose)
+    collapsed_counts = read_counts_table(collapsed_prefix + 'ReadsPerGene.out.tab')
+    counter = GeneCounter(index_dir)
+    stats = dict([(ix, InsertStats(records, counter)) for (ix, records) in alignments.iteritems()])
+
+    check = Tally(len(collapsed_counts[1]))
+    for insert_stats in stats.itervalues():
+        check.add(insert_stats, 1)
+    check_counts(check, collapsed_counts)
+
+    numbers = read_inserts(fasta)
+    clipper = Clipper(model)
+    tally = Tally(len(collapsed_counts[1]))
+    tags_unmapped = any([tag_value(records[0], 'uT:A:') is not None for records in alignments.itervalues()])
+    for line in header:
+        out.write(line)
+    for (name, seq, qual) in read_fastq(reads):
+        tally.reads += 1
+        tally.read_bases += len(seq)
+        (clip5, clip3) = clipper.clips(seq)
+        ix = numbers.get(seq[clip5:len(seq) - clip3])
+        if ix not in alignments:
+            tally.add(None, 1)
+            tags = ["NH:i:0", "HI:i:0", "AS:i:0", "nM:i:0"] + (["uT:A:0"] if tags_unmapped else [])
+            out.write('\t'.join([name, '4', '*', '0', '0', '*', '*', '0', '0', seq, qual] + tags) + '\n')
+            continue
+        tally.add(stats[ix], 1)
+        for fields in alignments[ix]:
+            flag = int(fields[1])
+            record = [name] + fields[1:]
+            if flag & 4:
+                record[9:11] = [seq, qual]
+            elif flag & 16:
+                record[5] = format_cigar(soft_clip(parse_cigar(fields[5]), clip3, clip5))
+                record[9:11] = [''.join([COMPLEMENT.get(base, base) for base in reversed(seq)]), qual[::-1]]
+            else:
+                record[5] = format_cigar(soft_clip(parse_cigar(fields[5]), clip5, clip3))
+                record[9:11] = [seq, qual]
+            out.write('\t'.join([field for field in record if not field.startswith('jM:')]) + '\n')
+
+    tally.write_counts(out_prefix + 'ReadsPerGene.out.tab', collapsed_counts[1])
+    write_log(out_prefix + 'Log.final.out', collapsed_prefix + 'Log.final.out', tally)
+    if verbose:
+        sys.stderr.write("Expanded the alignments of %d unique inserts to %d reads\n" % (len(alignments), tally.reads))
+
+def main():
+    parser = argparse.ArgumentParser(description="Collapses small-RNA reads to unique inserts and expands their alignments.")
+    subparsers = parser.add_subparsers(dest='command')
+    collapser = subparsers.add_parser('collapse', help="Write the unique inserts of the reads as fasta.")
+    collapser.add_argument('reads', help="Single-end reads (gzipped fastq).")
+    collapser.add_argument('model', help="Clipping model (" + ", ".join(sorted(CLIPPING_MODELS.keys())) + ").")
+    collapser.add_argument('fasta', help="Unique inserts fasta to write.")
+    expander = subparsers.add_parser('expand', help="Write per-read SAM to stdout, gene counts and STAR log.")
+    expander.add_argument('reads', help="The reads that were collapsed (gzipped fastq).")
+    expander.add_argument('model', help="Clipping model the reads were collapsed with.")
+    expander.add_argument('fasta', help="Unique inserts fasta the reads were collapsed into.")
+    expander.add_argument('collapsed', help="Prefix of STAR's unsorted SAM, ReadsPerGene.out.tab and Log.final.out.")
+    expander.add_argument('index', help="Directory of the STAR index the inserts were aligned to.")
+    expander.add_argument('-o', '--out_prefix', default='', help="Prefix of ReadsPerGene.out.tab and Log.final.out.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Make some noise.")
+    args = parser.parse_args()
+
+    if args.command == 'collapse':
+        collapse(args.reads, args.model, args.fasta, args.verbose)
+    else:
+        expand(args.reads, args.model, args.fasta, args.collapsed, args.index, args.out_prefix, sys.stdout, args.verbose)
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,7 @@ main() {
     echo "* Value of star_index:     '$star_index'"
     echo "* Value of library_id:     '$library_id'"
     echo "* Value of clipping_model: '$clipping_model'"
+    echo "* Value of collapse_reads: '$collapse_reads'"
     echo "* Value of nthreads:       '$nthreads'"
 
     #echo "* Download files..."
@@ -70,10 +71,15 @@ main() {
     echo "* Downloading star index archive..."
     dx download "$star_index" -o star_index.tgz
 
+    align_mode="reads"
+    if [ "$collapse_reads" == "true" ]; then
+        align_mode="collapsed"
+    fi
+
     # DX/ENCODE independent script is found in resources/usr/bin
     echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
     set -x
-    srna_align.sh star_index.tgz ${reads_root}.fq.gz "$library_id" $nthreads $bam_root $clipping_model
+    srna_align.sh star_index.tgz ${reads_root}.fq.gz "$library_id" $nthreads $bam_root $clipping_model $align_mode
     set +x
     echo "* ===== Returned from dnanexus and encodeD independent script ====="
     bam_root="${bam_root}_srna_star"
@@ -102,6 +108,12 @@ main() {
     dx-jobutil-add-output srna_quant "$srna_quant" --class=file
     dx-jobutil-add-output star_log "$star_log" --class=file
     dx-jobutil-add-output srna_flagstat "$srna_flagstat" --class=file
+    if [ -f /usr/bin/quant_columns.py ]; then
+        # Columnar companion lets cross-sample analyses load counts without parsing the text quantification
+        quant_columns.py write star_counts ${bam_root}_quant.tsv ${bam_root}_quant.qcol
+        srna_quant_columns=$(dx upload ${bam_root}_quant.qcol --property SW="$versions" --brief)
+        dx-jobutil-add-output srna_quant_columns "$srna_quant_columns" --class=file
+    fi
 
     dx-jobutil-add-output reads "$reads" --class=string
     dx-jobutil-add-output metadata "{ $qc_stats }" --class=string
@@ -0,0 +1,45 @@
+#!/bin/bash
+# small-rna-expr-matrix.sh
+
+main() {
+    # If available, will print tool versions to stderr and json string to stdout
+    versions=''
+    if [ -f /usr/bin/tool_versions.py ]; then
+        versions=`tool_versions.py --dxjson dnanexus-executable.json`
+    fi
+
+    echo "* Value of quants:      '${quants[@]}'"
+    echo "* Value of annotations: '$annotations'"
+    echo "* Value of out_root:    '$out_root'"
+
+    echo "* Download files..."
+    mkdir quants
+    quant_files=""
+    for ix in ${!quants[@]}; do
+        quant_name=`dx describe "${quants[$ix]}" --name`
+        if [ -f quants/${quant_name} ]; then
+            echo "ERROR: more than one quantification is named '${quant_name}'"
+            exit 1
+        fi
+        dx download "${quants[$ix]}" -o quants/${quant_name}
+        quant_files="$quant_files quants/${quant_name}"
+    done
+    anno_name=`dx describe "$annotations" --name`
+    dx download "$annotations" -o ${anno_name}
+
+    # DX/ENCODE independent script is found in resources/usr/bin
+    echo "* ===== Calling DNAnexus and ENCODE independent script... ====="
+    set -x
+    srna_expression.py ${anno_name} $quant_files --out_root $out_root --verbose
+    set +x
+    echo "* ===== Returned from dnanexus and encodeD independent script ====="
+
+    echo "* Upload results..."
+    cpm_matrix=$(dx upload ${out_root}_srna_cpm.tsv --property SW="$versions" --brief)
+    expr_summary=$(dx upload ${out_root}_srna_summary.tsv --property SW="$versions" --brief)
+
+    dx-jobutil-add-output cpm_matrix "$cpm_matrix" --class=file
+    dx-jobutil-add-output expr_summary "$expr_summary" --class=file
+
+    echo "* Finished."
+}
@@ -1,36 +1,54 @@
 #!/bin/bash -e
 
 if [ $# -ne 4 ]; then
-    echo "usage v1: srna-mad-qc.sh <annotation_gtf_gz> <quants_a_tsv> <quants_a_tsv> <out_root>"
+    echo "usage v1: srna-mad-qc.sh <annotation_gtf_gz|srna_gene_ids_txt> <quants_a_tsv> <quants_a_tsv> <out_root>"
     echo "Calculates Mean Absolute Deviation and other stats on a pair of quantifications. Is independent of DX and encodeD."
+    echo "Small-RNA gene ids are extracted from the annotation, unless a list of them ('*.txt') is given instead."
     echo "Expects extract_gene_ids.awk, sum_srna_expression.awk and MAD.R in current directory."
+    echo "Both quantifications are summed in one pass by srna_expression.py when it is on the path, which also reads"
+    echo "their columnar '_quant.qcol' companions (see quant_columns.py) in place of the tsvs."
     exit -1; 
 fi
-annotation_gtf_gz=$1 # Annotation in gzipped gtf format
+annotation_gtf_gz=$1 # Annotation in gzipped gtf format, or already extracted small-RNA gene ids, one per line
 quants_a_tsv=$2      # A quantification file from STAR alignment in tsv format
 quants_b_tsv=$3      # B quantification file from STAR alignment in tsv format
 out_root="$4_mad"    # Root name for output (e.g. "out" will create "out_mad_qc.txt" and "out_mad_plot.png")
 
-echo "-- Uncompressing annotation..."
-annotation_gtf=${annotation_gtf_gz%.gz}
-set -x
-gunzip $annotation_gtf_gz
-set +x
+if [[ "$annotation_gtf_gz" == *.txt ]]; then
+    echo "-- Using extracted gene ids..."
+    if [ "$annotation_gtf_gz" != "srna_gene_ids.txt" ]; then
+        cp $annotation_gtf_gz srna_gene_ids.txt
+    fi
+else
+    echo "-- Uncompressing annotation..."
+    annotation_gtf=${annotation_gtf_gz%.gz}
+    set -x
+    gunzip $annotation_gtf_gz
+    set +x
 
-echo "-- Extracting gene ids from annotation..."
-set -x
-gawk -f extract_gene_ids.awk $annotation_gtf out=srna_gene_ids.txt
-set +x
+    echo "-- Extracting gene ids from annotation..."
+    set -x
+    gawk -f extract_gene_ids.awk $annotation_gtf out=srna_gene_ids.txt
+    set +x
+fi
     
-echo "-- Generating expression values for '$quants_a_tsv'..."
-set -x
-gawk -f sum_srna_expression.awk srna_gene_ids.txt $quants_a_tsv out=expr_a.tsv
-set +x
+if which srna_expression.py > /dev/null 2>&1; then
+    echo "-- Generating expression values for '$quants_a_tsv' and '$quants_b_tsv'..."
+    set -x
+    srna_expression.py srna_gene_ids.txt $quants_a_tsv $quants_b_tsv --out_root $out_root --expr expr_a.tsv expr_b.tsv
+    set +x
+    cat ${out_root}_srna_summary.tsv
+else
+    echo "-- Generating expression values for '$quants_a_tsv'..."
+    set -x
+    gawk -f sum_srna_expression.awk srna_gene_ids.txt $quants_a_tsv out=expr_a.tsv
+    set +x
 
-echo "-- Generating expression values for '$quants_b_tsv'..."
-set -x
-gawk -f sum_srna_expression.awk srna_gene_ids.txt $quants_b_tsv out=expr_b.tsv
-set +x
+    echo "-- Generating expression values for '$quants_b_tsv'..."
+    set -x
+    gawk -f sum_srna_expression.awk srna_gene_ids.txt $quants_b_tsv out=expr_b.tsv
+    set +x
+fi
 
 echo "-- Runnning MAD.R..."
 set -x
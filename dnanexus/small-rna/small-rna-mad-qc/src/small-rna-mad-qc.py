@@ -2,6 +2,7 @@
 # Runs "mean absolute deviation" QC metrics on two long-RNA-seq gene quantifications
 
 import os, subprocess, json
+from distutils.spawn import find_executable
 import dxpy
 
 def divide_on_common(str_a,str_b):
@@ -32,6 +33,18 @@ def root_name_from_pair(filename_a,filename_b):
     if len(a_parts[2]) > 0:
         out_root += a_parts[2]
     return out_root # exp1_rep1_1_quants.tsv and exp1_rep2_1_quants.tsv yield exp1_rep1-2_1_quants.tsv
+
+def columnar_companion(dxfile, suffix="_quant.tsv", qcol_suffix="_quant.qcol"):
+    '''Returns the '.qcol' file uploaded beside a STAR quantification (see quant_columns.py), or None.'''
+    if not dxfile.name.endswith(suffix):
+        return None
+    desc = dxfile.describe()
+    try:
+        return dxpy.find_one_data_object(classname='file', name=dxfile.name[:-len(suffix)] + qcol_suffix,
+                                         project=desc['project'], folder=desc['folder'], recurse=False,
+                                         zero_ok=True, return_handler=True)
+    except dxpy.exceptions.DXAPIError:
+        return None  # e.g. a project the job cannot search
     
 @dxpy.entry_point("main")
 def main(quants_a, quants_b, annotations):
@@ -44,9 +57,28 @@ def main(quants_a, quants_b, annotations):
     dxfile_anno = dxpy.DXFile(annotations)
 
     print "* Downloading files..."
-    dxpy.download_dxfile(dxfile_a.get_id(), "quants_a.tsv")
-    dxpy.download_dxfile(dxfile_b.get_id(), "quants_b.tsv")
-    dxpy.download_dxfile(dxfile_anno.get_id(), "annotations.gtf.gz")
+    (quants_a_file, quants_b_file) = ("quants_a.tsv", "quants_b.tsv")
+    (columns_a, columns_b) = (None, None)
+    if find_executable('srna_expression.py'):
+        # srna_expression.py reads the columnar companions in place of parsing the text quantifications
+        (columns_a, columns_b) = (columnar_companion(dxfile_a), columnar_companion(dxfile_b))
+    if columns_a is not None and columns_b is not None:
+        (quants_a_file, quants_b_file) = ("quants_a.qcol", "quants_b.qcol")
+        dxpy.download_dxfile(columns_a.get_id(), quants_a_file)
+        dxpy.download_dxfile(columns_b.get_id(), quants_b_file)
+    else:
+        dxpy.download_dxfile(dxfile_a.get_id(), quants_a_file)
+        dxpy.download_dxfile(dxfile_b.get_id(), quants_b_file)
+    annotations_file = "annotations.gtf.gz"
+    if dxfile_anno.name.endswith("_anno.qcol"):
+        # A gene model already holds the biotypes, so the gtf need not be rescanned
+        dxpy.download_dxfile(dxfile_anno.get_id(), "annotations_anno.qcol")
+        gene_ids = subprocess.check_output(['anno_model.py', 'gene-ids', "annotations_anno.qcol"])
+        annotations_file = "srna_gene_ids.txt"
+        with open(annotations_file, 'w') as fh:
+            fh.write(gene_ids)
+    else:
+        dxpy.download_dxfile(dxfile_anno.get_id(), annotations_file)
     
     # Create and appropriate name for output files
     out_root = root_name_from_pair(dxfile_a.name.split('.')[0],dxfile_b.name.split('.')[0])
@@ -59,7 +91,7 @@ def main(quants_a, quants_b, annotations):
     
     # DX/ENCODE independent script is found in resources/usr/bin
     print "* ===== Calling DNAnexus and ENCODE independent script... ====="
-    subprocess.check_call(['srna_mad_qc.sh','annotations.gtf.gz','quants_a.tsv','quants_b.tsv',out_root])
+    subprocess.check_call(['srna_mad_qc.sh',annotations_file,quants_a_file,quants_b_file,out_root])
     print "* ===== Returned from dnanexus and encodeD independent script ====="
     mad_plot_file = out_root + '_mad_plot.png'
     mad_qc_file = out_root + '_mad_qc.txt'
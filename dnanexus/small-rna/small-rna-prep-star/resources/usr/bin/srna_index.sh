@@ -44,7 +44,11 @@ set +x
 
 echo "-- Create archive file..."
 set -x
-tar -czvf $archive_file out/
+if which index_archive.py > /dev/null 2>&1; then
+    index_archive.py create $archive_file out/ --threads 8
+else
+    tar -czvf $archive_file out/
+fi
 set +x
 
 echo "-- The results..."
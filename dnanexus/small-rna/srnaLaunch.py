@@ -3,7 +3,10 @@
 
 import argparse,os, sys, json
 
-import dxpy
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import launch_client
+import launch_profile
+launch_profile.defer_imports()  # dxpy and dxencode are imported when first used, not to parse arguments
 from launch import Launch
 #from template import Launch # (does not use dxencode at all)
 
@@ -36,6 +39,7 @@ class SrnaLaunch(Launch):
                                 "app":      "small-rna-align", 
                                 "params": { "library_id":     "library_id",
                                             "clipping_model": "clipping_model", 
+                                            "collapse_reads": "collapse_reads",
                                             "nthreads":       "nthreads"      }, 
                                 "inputs": { "reads":          "reads", 
                                             "star_index":     "star_index"    }, 
@@ -74,10 +78,10 @@ class SrnaLaunch(Launch):
         "srna_bam":         "/*_srna_star.bam", 
         "star_log":         "/*_srna_star_Log.final.out", 
         "srna_quant":       "/*_srna_star_quant.tsv", 
-        "all_minus_bw":     "/*_small_minusAll.bw", 
-        "all_plus_bw":      "/*_small_plusAll.bw", 
-        "unique_minus_bw":  "/*_small_minusUniq.bw",
-        "unique_plus_bw":   "/*_small_plusUniq.bw", 
+        "all_minus_bw":     "/*_srna_star_minusAll.bw", 
+        "all_plus_bw":      "/*_srna_star_plusAll.bw", 
+        "unique_minus_bw":  "/*_srna_star_minusUniq.bw",
+        "unique_plus_bw":   "/*_srna_star_plusUniq.bw", 
         "quants_a":         "/*_srna_star_quant.tsv",
         "quants_b":         "/*_srna_star_quant.tsv",
         "mad_plot":         "/*_mad_plot.png", 
@@ -98,6 +102,11 @@ class SrnaLaunch(Launch):
                         "hg19":   {"v19": "gencodeV19-tRNAs-ERCC.gtf.gz"        },
                         #"mm10":  {"M4":  "gencode.vM4-tRNAs-ERCC.gtf.gz"       },
                         },
+        "anno_model":   {
+                        "GRCh38": {"v24": "gencodeV24pri-tRNAs-ERCC-phiX_anno.qcol"},
+                        "hg19":   {"v19": "gencodeV19-tRNAs-ERCC_anno.qcol"        },
+                        #"mm10":  {"M4":  "gencode.vM4-tRNAs-ERCC_anno.qcol"       },
+                        },
         "chrom_sizes":  {
                         "GRCh38":   {"female":   "GRCh38_EBV.chrom.sizes",
                                      "male":     "GRCh38_EBV.chrom.sizes"  },
@@ -120,6 +129,17 @@ class SrnaLaunch(Launch):
                         choices=[self.ANNO_DEFAULT, 'M2','M3','M4'],
                         default=self.ANNO_DEFAULT,
                         required=False)
+        ap.add_argument('--collapse_reads',
+                        help="Align each unique insert once and expand the alignments to every read.",
+                        action='store_true',
+                        required=False)
+        ap.add_argument('--after_running',
+                        help="First wait for analyses still running in the experiment's results folder (e.g. " + \
+                             "replicates launched on their own) to finish, so the combined replicate steps follow.",
+                        action='store_true',
+                        required=False)
+
+        launch_profile.add_argument(ap)
         return ap.parse_args()
 
     def pipeline_specific_vars(self,args,verbose=False):
@@ -144,6 +164,7 @@ class SrnaLaunch(Launch):
 
         # Some specific settings
         psv['nthreads']   = 8
+        psv['collapse_reads'] = args.collapse_reads
 
         # By replicate:
         for ltr in psv['reps'].keys():
@@ -170,6 +191,10 @@ class SrnaLaunch(Launch):
         if not self.template:
             psv['resultsFolder'] += psv['experiment'] + '/'
         self.update_rep_result_folders(psv)
+        if args.after_running:
+            failed = launch_client.CLIENT.wait_running(self.proj_id,psv['resultsFolder'])
+            if failed:
+                sys.exit("ERROR: Not done: " + ", ".join(failed))
 
         if verbose:
             print "Pipeline Specific Vars:"
@@ -177,28 +202,44 @@ class SrnaLaunch(Launch):
         return psv
 
 
+    def check_run_log(self,results_folder,*args,**kwargs):
+        '''Checks for analyses still running in the results folder, looking at all of the project's at once.'''
+        # Launch's own check reads the folder's run log, which may name analyses older than the monitor knows of
+        if launch_client.CLIENT.none_running(self.proj_id,results_folder):
+            return True
+        return Launch.check_run_log(self,results_folder,*args,**kwargs)
+
+    def find_file(self,path,*args,**kwargs):
+        '''Looks up a file, except a prior result that the listed results folder shows is not there.'''
+        psv = getattr(self, 'psv', None) or {}
+        project = args[0] if args else kwargs.get('project')
+        if psv.get('resultsFolder') and project == getattr(self, 'proj_id', None) and \
+           launch_client.CLIENT.known_missing(path,project,psv['resultsFolder']):
+            return None
+        return Launch.find_file(self,path,*args,**kwargs)
+
     def find_ref_files(self,priors):
         '''Locates all reference files based upon organism and gender.'''
-        star_path = self.psv['refLoc']+self.REFERENCE_FILES['star_index'][self.psv['genome']][self.psv['gender']]
-        star_fid = self.find_file(star_path,self.REF_PROJECT_DEFAULT)
-        if star_fid == None:
-            sys.exit("ERROR: Unable to locate STAR index file '" + star_path + "'")
-        else:
-            priors['star_index'] = star_fid
-
-        anno_path = self.psv['refLoc']+self.REFERENCE_FILES['annotations'][self.psv['genome']][self.psv['annotation']]
-        anno_fid = self.find_file(anno_path,self.REF_PROJECT_DEFAULT)
-        if anno_fid == None:
-            sys.exit("ERROR: Unable to locate Annotation file '" + anno_path + "'")
-        else:
-            priors['annotations'] = anno_fid
-
-        chrom_sizes = self.psv['refLoc']+self.REFERENCE_FILES['chrom_sizes'][self.psv['genome']][self.psv['gender']]
-        chrom_sizes_fid = self.find_file(chrom_sizes,self.REF_PROJECT_DEFAULT)
-        if chrom_sizes_fid == None:
-            sys.exit("ERROR: Unable to locate Chrom Sizes file '" + chrom_sizes + "'")
-        else:
-            priors['chrom_sizes'] = chrom_sizes_fid
+        (genome, gender, annotation) = (self.psv['genome'], self.psv['gender'], self.psv['annotation'])
+        paths = {'star_index':  self.psv['refLoc']+self.REFERENCE_FILES['star_index'][genome][gender],
+                 'anno_model':  self.psv['refLoc']+self.REFERENCE_FILES['anno_model'][genome][annotation],
+                 'annotations': self.psv['refLoc']+self.REFERENCE_FILES['annotations'][genome][annotation],
+                 'chrom_sizes': self.psv['refLoc']+self.REFERENCE_FILES['chrom_sizes'][genome][gender]}
+        # The lookups are independent, so are made together (and only once for a batch of experiments)
+        fids = launch_client.CLIENT.find_files(self.find_file,paths,self.REF_PROJECT_DEFAULT)
+        if fids['star_index'] == None:
+            sys.exit("ERROR: Unable to locate STAR index file '" + paths['star_index'] + "'")
+        priors['star_index'] = fids['star_index']
+
+        # A gene model made from the annotation by merge-annotation is preferred, as mad-qc then need not parse the gtf
+        anno_key = 'anno_model' if fids['anno_model'] != None else 'annotations'
+        if fids[anno_key] == None:
+            sys.exit("ERROR: Unable to locate Annotation file '" + paths[anno_key] + "'")
+        priors['annotations'] = fids[anno_key]
+
+        if fids['chrom_sizes'] == None:
+            sys.exit("ERROR: Unable to locate Chrom Sizes file '" + paths['chrom_sizes'] + "'")
+        priors['chrom_sizes'] = fids['chrom_sizes']
         self.psv['ref_files'] = self.REFERENCE_FILES.keys()
         return priors
 
@@ -207,5 +248,5 @@ class SrnaLaunch(Launch):
 if __name__ == '__main__':
     '''Run from the command line.'''
     srnaLaunch = SrnaLaunch()
-    srnaLaunch.run()
+    launch_profile.PROFILE.run(srnaLaunch)
 
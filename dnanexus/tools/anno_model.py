@@ -0,0 +1,202 @@
+#!/usr/bin/env python2.7
+# anno_model.py v2 Parses a gtf annotation once into a compact gene model, and answers the questions that stages
+#                  otherwise gunzip and rescan the whole gtf for.
+#                  The model is a quant_columns.py file of kind 'anno_model': one row per gene_id in sorted order, with
+#                  biotype and chromosome codes, gene intervals and TSSs, plus row orders for interval and TSS lookups.
+#                  Biotype filters become masks over the biotype codes.
+#
+# NOTES: A gene's biotype is taken just as extract_gene_ids.awk takes it, from the 14th whitespace separated field of
+#        its records, so the small-RNA gene sets are the ones the awk has always selected.  That field is gene_type for
+#        GENCODE v19 style records (gene_id, transcript_id, gene_type...), but another attribute in releases whose
+#        gene records start gene_id, gene_type (e.g. v24), where neither selects the small-RNA genes by gene_type.
+
+import sys, re, gzip, bisect, argparse
+import quant_columns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KIND = "anno_model"
+SRNA_BIOTYPES = ["miRNA", "snoRNA", "snRNA", "tRNAscan"]
+'''Small-RNA biotypes, as selected by extract_gene_ids.awk.'''
+EXON_ONLY_BIOTYPES = ["tRNAscan"]
+'''Biotypes of genes that are annotated by exons alone (the tRNA gtf), so are selected without a 'gene' record.'''
+
+ATTRIBUTE = re.compile(r'(\S+) "([^"]*)"')
+
+def awk_biotype(line):
+    '''Returns the biotype as extract_gene_ids.awk reads it: 'substr($14,2,length($14)-3)'.'''
+    words = line.split()
+    word = words[13] if len(words) > 13 else ""
+    return word[1:len(word) - 2]
+
+def read_gtf(path, verbose=False):
+    '''Reads a (gzipped) gtf, returning {gene_id: [chrom, strand, start, end, biotype, gene_record]}.'''
+    genes = {}
+    opener = gzip.open if path.endswith('.gz') else open
+    fh = opener(path, 'r')
+    lines = 0
+    for line in fh:
+        if line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 9:
+            continue
+        lines += 1
+        attributes = dict(ATTRIBUTE.findall(fields[8]))
+        gene_id = attributes.get("gene_id")
+        if gene_id is None:
+            continue
+        biotype = awk_biotype(line)
+        (start, end) = (int(fields[3]), int(fields[4]))
+        gene = genes.get(gene_id)
+        if gene is None:
+            genes[gene_id] = [fields[0], fields[6], start, end, biotype, int(fields[2] == "gene")]
+            continue
+        if fields[2] == "gene":
+            # A gene record is authoritative for the gene's extent and biotype
+            gene[2:6] = [start, end, biotype, 1]
+        elif not gene[5]:
+            gene[2] = min(gene[2], start)
+            gene[3] = max(gene[3], end)
+    fh.close()
+    if verbose:
+        sys.stderr.write("Read %d genes from %d records of '%s'\n" % (len(genes), lines, path))
+    return genes
+
+def build(gtf, model_path, verbose=False):
+    '''Parses a gtf and writes its gene model.'''
+    genes = read_gtf(gtf, verbose)
+    ids = sorted(genes.keys())
+    chroms = sorted(set([gene[0] for gene in genes.values()]))
+    biotypes = sorted(set([gene[4] for gene in genes.values()]))
+    chrom_codes = dict([(chrom, ix) for (ix, chrom) in enumerate(chroms)])
+    biotype_codes = dict([(biotype, ix) for (ix, biotype) in enumerate(biotypes)])
+    strand_codes = {"+": 1, "-": -1}
+
+    rows = [genes[gene_id] for gene_id in ids]
+    chrom = [chrom_codes[gene[0]] for gene in rows]
+    strand = [strand_codes.get(gene[1], 0) for gene in rows]
+    start = [gene[2] for gene in rows]
+    end = [gene[3] for gene in rows]
+    tss = [gene[3] if gene[1] == "-" else gene[2] for gene in rows]
+    interval_order = sorted(range(len(ids)), key=lambda ix: (chrom[ix], start[ix], end[ix]))
+    tss_order = sorted(range(len(ids)), key=lambda ix: (chrom[ix], tss[ix]))
+    longest = [0] * len(chroms)
+    for ix in range(len(ids)):
+        longest[chrom[ix]] = max(longest[chrom[ix]], end[ix] - start[ix] + 1)
+
+    columns = [("biotype",        '<i8', [biotype_codes[gene[4]] for gene in rows]),
+               ("gene_record",    '<i8', [gene[5] for gene in rows]),
+               ("chrom",          '<i8', chrom),
+               ("strand",         '<i8', strand),
+               ("start",          '<i8', start),
+               ("end",            '<i8', end),
+               ("tss",            '<i8', tss),
+               ("interval_order", '<i8', interval_order),
+               ("tss_order",      '<i8', tss_order)]
+    summary = {"source": gtf.split('/')[-1], "chroms": chroms, "biotypes": biotypes, "longest": longest}
+    quant_columns.write_columns(model_path, KIND, "gene_id", ids, columns, summary, verbose)
+
+class AnnoModel(object):
+    '''Reader of a gene model written by build().'''
+
+    def __init__(self, path):
+        self.qcol = quant_columns.QuantColumns(path)
+        if self.qcol.kind != KIND:
+            raise ValueError("'%s' is a '%s' file, not an annotation model" % (path, self.qcol.kind))
+        self.chroms = self.qcol.summary["chroms"]
+        self.biotypes = self.qcol.summary["biotypes"]
+        self._cache = {}
+
+    def column(self, name):
+        if name not in self._cache:
+            self._cache[name] = self.qcol.column(name)
+        return self._cache[name]
+
+    def gene_ids(self):
+        return self.qcol.ids()
+
+    def biotype_mask(self, biotypes):
+        '''Returns a mask of the genes that have one of the biotypes and either a gene record or an exon-only biotype.'''
+        codes = [self.biotypes.index(biotype) for biotype in biotypes if biotype in self.biotypes]
+        exon_only = [self.biotypes.index(biotype) for biotype in EXON_ONLY_BIOTYPES if biotype in self.biotypes]
+        biotype = self.column("biotype")
+        gene_record = self.column("gene_record")
+        if numpy is not None:
+            return numpy.in1d(biotype, codes) & ((gene_record == 1) | numpy.in1d(biotype, exon_only))
+        return [code in codes and (record == 1 or code in exon_only) for (code, record) in zip(biotype, gene_record)]
+
+    def select_ids(self, mask):
+        ids = self.gene_ids()
+        return [ids[ix] for (ix, keep) in enumerate(mask) if keep]
+
+    def _chrom_rows(self, chrom, order_name, key_name):
+        '''Returns (rows, keys) of one chromosome's genes in the given order.'''
+        if (chrom, order_name) not in self._cache:
+            code = self.chroms.index(chrom)
+            chroms = self.column("chrom")
+            keys = self.column(key_name)
+            rows = [ix for ix in self.column(order_name) if chroms[ix] == code]
+            self._cache[(chrom, order_name)] = (rows, [keys[ix] for ix in rows])
+        return self._cache[(chrom, order_name)]
+
+    def overlapping(self, chrom, start, end):
+        '''Returns the gene ids whose intervals overlap chrom:start-end (1-based, inclusive).'''
+        if chrom not in self.chroms:
+            return []
+        (rows, starts) = self._chrom_rows(chrom, "interval_order", "start")
+        longest = self.qcol.summary["longest"][self.chroms.index(chrom)]
+        ends = self.column("end")
+        ids = self.gene_ids()
+        first = bisect.bisect_left(starts, start - longest + 1)
+        last = bisect.bisect_right(starts, end)
+        return [ids[rows[ix]] for ix in range(first, last) if ends[rows[ix]] >= start]
+
+    def nearest_tss(self, chrom, position):
+        '''Returns (gene_id, distance) of the TSS nearest to chrom:position, or None.'''
+        if chrom not in self.chroms:
+            return None
+        (rows, tsss) = self._chrom_rows(chrom, "tss_order", "tss")
+        if len(rows) == 0:
+            return None
+        ix = bisect.bisect_left(tsss, position)
+        candidates = [cx for cx in (ix - 1, ix) if 0 <= cx < len(rows)]
+        best = min(candidates, key=lambda cx: abs(tsss[cx] - position))
+        return (self.gene_ids()[rows[best]], tsss[best] - position)
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds and queries compact gene models of gtf annotations.")
+    subparsers = parser.add_subparsers(dest='command')
+    builder = subparsers.add_parser('build', help="Parse a (gzipped) gtf into a gene model.")
+    builder.add_argument('gtf', help="Annotation in (gzipped) gtf format.")
+    builder.add_argument('model', help="Gene model file to write (e.g. 'annotation_anno.qcol').")
+    ids = subparsers.add_parser('gene-ids', help="Print the ids of genes of some biotypes, one per line.")
+    ids.add_argument('model', help="Gene model file.")
+    ids.add_argument('-b', '--biotypes', nargs='+', default=SRNA_BIOTYPES,
+                     help="Biotypes to select (default: " + " ".join(SRNA_BIOTYPES) + ").")
+    tss = subparsers.add_parser('tss', help="Print the TSS of every gene as bed.")
+    tss.add_argument('model', help="Gene model file.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Make some noise.")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.gtf, args.model, args.verbose)
+        return
+    model = AnnoModel(args.model)
+    if args.command == 'gene-ids':
+        for gene_id in model.select_ids(model.biotype_mask(args.biotypes)):
+            print gene_id
+    else:
+        (chroms, strands) = (model.column("chrom"), model.column("strand"))
+        tsss = model.column("tss")
+        gene_ids = model.gene_ids()
+        for ix in model.column("tss_order"):
+            strand = {1: "+", -1: "-"}.get(strands[ix], ".")
+            print "%s\t%d\t%d\t%s\t0\t%s" % (model.chroms[chroms[ix]], tsss[ix] - 1, tsss[ix], gene_ids[ix], strand)
+
+if __name__ == '__main__':
+    main()
+
@@ -0,0 +1,320 @@
+#!/usr/bin/env python2.7
+# index_archive.py v2 Writes and reads reference index archives that are compressed in parallel and can be read by
+#                     member.  An index archive is still an ordinary gzipped tar ('.tgz') to tar and gunzip: it is a
+#                     series of independent gzip members, which gunzip reads as one stream.
+#
+# Layout (each line is one or more gzip members, in order):
+#     toc       one stored (uncompressed) gzip member holding the tar entry '.index_archive_toc.json', padded with
+#               spaces to a size fixed before compression, so it can be rewritten in place once offsets are known.
+#     entries   for each file, directory or link: its tar header in one member, then the file's data (padded to tar's
+#               512 byte blocks) in members of up to --chunk_mb MB, which are compressed in parallel.
+#     end       tar's end of archive blocks in one member.
+# The json toc holds {"format", "version", "entries": [{name, type, mode, mtime, size, linkname, chunks}]}, where each
+# of a file's chunks is [archive offset, compressed length, uncompressed length] of one gzip member.
+#
+# Readers decompress the chunks in parallel straight into place, or fetch one member without reading the rest.
+# Archives without a toc (plain '.tgz' files) are read with tar, as before.
+#
+# Usage in the DX independent scripts, where only part of an index is needed or the index is not extracted yet:
+#     index_archive.py extract $rsem_index_tgz --threads $ncpus --member '*.grp' --member '*.ti' --member '*.seq'
+#     index_archive.py cat $star_index_tgz '*_bamCommentLines.txt' --indexed_only >> COfile.txt
+# Members may be names, directories (selecting everything below them) or glob patterns.
+
+import sys, os, json, zlib, fnmatch, tarfile, argparse, subprocess, multiprocessing
+
+FORMAT = "index_archive"
+VERSION = 1
+TOC_NAME = ".index_archive_toc.json"
+CHUNK_MB = 64
+BLOCK = tarfile.BLOCKSIZE
+RECORD = tarfile.RECORDSIZE
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+READ_BYTES = 1024 * 1024
+TYPES = {tarfile.REGTYPE: "file", tarfile.AREGTYPE: "file", tarfile.DIRTYPE: "dir", tarfile.SYMTYPE: "symlink",
+         tarfile.LNKTYPE: "link"}
+
+def gzip_member(data, level):
+    '''Returns data as one complete gzip member.'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def padding(length):
+    return (BLOCK - length % BLOCK) % BLOCK
+
+def compress_piece(piece):
+    '''Compresses a tar header or a chunk of a file's data (read here, so workers share the reading).'''
+    (kind, source, offset, length, pad, level) = piece
+    if kind == "bytes":
+        data = source
+    else:
+        with open(source, 'rb') as fh:
+            fh.seek(offset)
+            data = fh.read(length)
+        if len(data) != length:
+            raise IOError("'%s' changed while it was archived" % source)
+        data += '\0' * pad
+    return (gzip_member(data, level), len(data))
+
+def walk(path):
+    '''Yields path and, for a directory, everything below it in sorted order.'''
+    yield path
+    if os.path.isdir(path) and not os.path.islink(path):
+        for name in sorted(os.listdir(path)):
+            for entry in walk(os.path.join(path, name)):
+                yield entry
+
+def toc_member(toc, reserved):
+    '''Returns the toc's gzip member: a stored tar entry whose size does not depend on the toc's contents.'''
+    text = json.dumps(toc, sort_keys=True, separators=(',', ':'))
+    if len(text) > reserved:
+        raise ValueError("Table of contents outgrew its reserved %d bytes" % reserved)
+    text += ' ' * (reserved - len(text))
+    info = tarfile.TarInfo(TOC_NAME)
+    info.size = reserved
+    info.mode = 0644
+    return gzip_member(info.tobuf(tarfile.GNU_FORMAT) + text + '\0' * padding(reserved), 0)
+
+def create(archive, paths, threads=1, chunk_mb=CHUNK_MB, level=6, verbose=False):
+    '''Writes paths (recursively) to an index archive.'''
+    chunk_bytes = max(chunk_mb * 1024 * 1024 / BLOCK, 1) * BLOCK
+    namer = tarfile.open(os.devnull, 'w')  # gettarinfo() recognizes hard links across calls
+    entries = []
+    pieces = []
+    chunk_entries = {}
+    for path in paths:
+        for name in walk(os.path.normpath(path)):
+            info = namer.gettarinfo(name)
+            if info.type not in TYPES:
+                raise ValueError("Can not archive '%s', which is not a file, directory or link" % name)
+            entry = {"name": info.name, "type": TYPES[info.type], "mode": info.mode, "mtime": int(info.mtime),
+                     "size": info.size if info.isreg() else 0, "linkname": info.linkname, "chunks": []}
+            entries.append(entry)
+            pieces.append(("bytes", info.tobuf(tarfile.GNU_FORMAT), 0, 0, 0, level))
+            if info.isreg():
+                for offset in range(0, info.size, chunk_bytes):
+                    length = min(chunk_bytes, info.size - offset)
+                    pad = padding(info.size) if offset + length == info.size else 0
+                    pieces.append(("file", name, offset, length, pad, level))
+                    chunk_entries[len(pieces) - 1] = entry
+    namer.close()
+
+    # Every offset and length fits in 15 digits, so a toc with all of them that long reserves enough room.
+    toc = {"format": FORMAT, "version": VERSION, "entries": entries}
+    for entry in chunk_entries.values():
+        entry["chunks"].append([10 ** 15, 10 ** 15, 10 ** 15])
+    reserved = len(json.dumps(toc, sort_keys=True, separators=(',', ':')))
+    for entry in entries:
+        entry["chunks"] = []
+    toc_bytes = toc_member(toc, reserved)
+
+    pool = multiprocessing.Pool(threads) if threads > 1 else None
+    results = pool.imap(compress_piece, pieces) if pool else (compress_piece(piece) for piece in pieces)
+    uncompressed = BLOCK + reserved + padding(reserved)
+    with open(archive, 'wb') as fh:
+        fh.write(toc_bytes)
+        for (ix, (member, length)) in enumerate(results):
+            if pieces[ix][0] == "file":
+                chunk_entries[ix]["chunks"].append([fh.tell(), len(member), length])
+            fh.write(member)
+            uncompressed += length
+        end = 2 * BLOCK
+        end += (RECORD - (uncompressed + end) % RECORD) % RECORD
+        fh.write(gzip_member('\0' * end, level))
+        fh.seek(0)
+        fh.write(toc_member(toc, reserved))
+    if pool:
+        pool.close()
+        pool.join()
+    if verbose:
+        sys.stderr.write("Wrote %d entries in %d gzip members to '%s'\n" % (len(entries), len(pieces) + 2, archive))
+    return toc
+
+def read_toc(archive):
+    '''Returns the table of contents of an index archive, or None for any other gzipped tar.'''
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    data = ''
+    with open(archive, 'rb') as fh:
+        # Only the first block is needed to recognize a toc, however large a plain archive's first member is.
+        while len(data) < BLOCK:
+            compressed = fh.read(READ_BYTES)
+            if compressed == '':
+                return None
+            data += decompressor.decompress(decompressor.unconsumed_tail + compressed, BLOCK - len(data))
+            if decompressor.unconsumed_tail == '' and decompressor.unused_data != '':
+                break
+        try:
+            info = tarfile.TarInfo.frombuf(data[:BLOCK])
+        except tarfile.HeaderError:
+            return None
+        if info.name != TOC_NAME:
+            return None
+        data += decompressor.decompress(decompressor.unconsumed_tail)
+        while len(data) < BLOCK + info.size and decompressor.unused_data == '':
+            compressed = fh.read(READ_BYTES)
+            if compressed == '':
+                break
+            data += decompressor.decompress(compressed)
+    toc = json.loads(data[BLOCK:BLOCK + info.size])
+    if toc.get("format") != FORMAT or toc.get("version") != VERSION:
+        raise ValueError("'%s' has an unknown table of contents format" % archive)
+    return toc
+
+def read_chunk(archive, chunk):
+    (offset, length, size) = chunk
+    with open(archive, 'rb') as fh:
+        fh.seek(offset)
+        data = zlib.decompress(fh.read(length), GZIP_WBITS)
+    if len(data) != size:
+        raise IOError("'%s' is truncated or damaged at offset %d" % (archive, offset))
+    return data
+
+def extract_chunk(job):
+    '''Decompresses one chunk of a file's data into its place in the (already created) file.'''
+    (archive, chunk, path, file_offset, keep) = job
+    data = read_chunk(archive, chunk)
+    with open(path, 'r+b') as fh:
+        fh.seek(file_offset)
+        fh.write(data[:keep])
+
+def safe_path(directory, name):
+    if os.path.isabs(name) or '..' in name.split('/'):
+        raise ValueError("Refusing to extract '%s' outside of '%s'" % (name, directory))
+    return os.path.join(directory, name)
+
+def matches(name, member):
+    '''Whether a member name, directory or glob pattern names an archived name.'''
+    name = name.rstrip('/')
+    prefix = member.rstrip('/')
+    return name == prefix or name.startswith(prefix + '/') or fnmatch.fnmatchcase(name, prefix)
+
+def selected(entries, members):
+    '''Returns the entries named by members, where a directory name selects everything below it.'''
+    if not members:
+        return entries
+    return [entry for entry in entries if any([matches(entry["name"], member) for member in members])]
+
+def extract(archive, members=None, directory='.', threads=1, verbose=False):
+    '''Extracts all or some members of an index archive, in parallel.  Plain '.tgz' archives are extracted by tar.'''
+    toc = read_toc(archive)
+    if toc is None:
+        if verbose:
+            sys.stderr.write("'%s' has no table of contents, so is extracted by tar\n" % archive)
+        command = ['tar', '-xzf', archive, '-C', directory, '--exclude=' + TOC_NAME]
+        if members:
+            command += ['--wildcards'] + members
+        subprocess.check_call(command)
+        return
+    entries = selected(toc["entries"], members)
+    jobs = []
+    for entry in entries:
+        path = safe_path(directory, entry["name"])
+        if entry["type"] == "dir":
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            continue
+        parent = os.path.dirname(path)
+        if parent != '' and not os.path.isdir(parent):
+            os.makedirs(parent)
+        if os.path.lexists(path):
+            os.remove(path)
+        if entry["type"] == "symlink":
+            os.symlink(entry["linkname"], path)
+        elif entry["type"] == "file":
+            with open(path, 'wb') as fh:
+                fh.truncate(entry["size"])
+            file_offset = 0
+            for chunk in entry["chunks"]:
+                keep = min(chunk[2], entry["size"] - file_offset)
+                jobs.append((archive, chunk, path, file_offset, keep))
+                file_offset += keep
+    pool = multiprocessing.Pool(threads) if threads > 1 and len(jobs) > 1 else None
+    if pool:
+        pool.map(extract_chunk, jobs, 1)
+        pool.close()
+        pool.join()
+    else:
+        for job in jobs:
+            extract_chunk(job)
+    # Hard links need their targets, and directory times are only kept once nothing more is written below them.
+    for entry in entries:
+        if entry["type"] == "link":
+            path = safe_path(directory, entry["name"])
+            if os.path.lexists(path):
+                os.remove(path)
+            os.link(safe_path(directory, entry["linkname"]), path)
+    for entry in reversed(entries):
+        if entry["type"] != "symlink":
+            path = safe_path(directory, entry["name"])
+            os.chmod(path, entry["mode"])
+            os.utime(path, (entry["mtime"], entry["mtime"]))
+    if verbose:
+        sys.stderr.write("Extracted %d entries from %d chunks of '%s'\n" % (len(entries), len(jobs), archive))
+
+def cat(archive, member, out=sys.stdout, indexed_only=False):
+    '''Writes the first file named by member without decompressing the rest of the archive.  Returns False, having
+    written nothing, for a plain '.tgz' when indexed_only (as the whole of it might need decompressing).'''
+    toc = read_toc(archive)
+    if toc is None:
+        if indexed_only:
+            return False
+        with tarfile.open(archive, 'r:gz') as tar:
+            for info in tar:
+                if info.isfile() and matches(info.name, member):
+                    out.write(tar.extractfile(info).read())
+                    return True
+        raise KeyError("'%s' has no file named '%s'" % (archive, member))
+    for entry in toc["entries"]:
+        if entry["type"] == "file" and matches(entry["name"], member):
+            written = 0
+            for chunk in entry["chunks"]:
+                data = read_chunk(archive, chunk)[:entry["size"] - written]
+                out.write(data)
+                written += len(data)
+            return True
+    raise KeyError("'%s' has no file named '%s'" % (archive, member))
+
+def names(archive):
+    toc = read_toc(archive)
+    if toc is None:
+        with tarfile.open(archive, 'r:gz') as tar:
+            return tar.getnames()
+    return [entry["name"] for entry in toc["entries"]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes and reads parallel compressed, seekable index archives.")
+    subparsers = parser.add_subparsers(dest='command')
+    creator = subparsers.add_parser('create', help="Archive files and directories into an index archive.")
+    creator.add_argument('archive', help="Index archive to write (e.g. 'GRCh38_v24_ERCC_starIndex.tgz').")
+    creator.add_argument('paths', nargs='+', help="Files and directories to archive.")
+    creator.add_argument('-t', '--threads', type=int, default=1, help="Number of compressing processes.")
+    creator.add_argument('-c', '--chunk_mb', type=int, default=CHUNK_MB, help="Size of compressed chunks (MB).")
+    creator.add_argument('-l', '--level', type=int, default=6, help="gzip compression level.")
+    extractor = subparsers.add_parser('extract', help="Extract all or some members of an index archive or '.tgz'.")
+    extractor.add_argument('archive', help="Index archive or '.tgz' to extract.")
+    extractor.add_argument('-m', '--member', action='append', dest='members',
+                           help="Member, directory or glob pattern to extract (may be repeated; default: all).")
+    extractor.add_argument('-t', '--threads', type=int, default=1, help="Number of decompressing processes.")
+    extractor.add_argument('-C', '--directory', default='.', help="Directory to extract into.")
+    catter = subparsers.add_parser('cat', help="Write one member of an index archive or '.tgz' to stdout.")
+    catter.add_argument('archive', help="Index archive or '.tgz'.")
+    catter.add_argument('member', help="Name or glob pattern of the member (e.g. '*_bamCommentLines.txt').")
+    catter.add_argument('--indexed_only', action='store_true',
+                        help="Exit with status 3 for a plain '.tgz', rather than decompress up to the member.")
+    lister = subparsers.add_parser('list', help="List the members of an index archive or '.tgz'.")
+    lister.add_argument('archive', help="Index archive or '.tgz'.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Make some noise.")
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        create(args.archive, args.paths, args.threads, args.chunk_mb, args.level, args.verbose)
+    elif args.command == 'extract':
+        extract(args.archive, args.members, args.directory, args.threads, args.verbose)
+    elif args.command == 'cat':
+        if not cat(args.archive, args.member, indexed_only=args.indexed_only):
+            sys.exit(3)
+    else:
+        for name in names(args.archive):
+            print name
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python2.7
+# quant_columns.py v1 Writes and reads columnar binary companions of quantification files.
+#                     A '.qcol' file holds the same values as the tab separated quantification it is made from, with
+#                     rows in sorted id order, so samples quantified against the same annotation share one id dictionary
+#                     (recognized by its digest) and their columns line up without any joining.
+#
+# Layout (all integers and numbers little-endian, every block starts on an 8 byte boundary):
+#     8 bytes   magic 'QCOL\x01\x00\x00\x00'
+#     8 bytes   length of json header
+#     json      {"version", "kind", "rows", "ids": {offset, length, digest}, "columns": [{name, type, offset, length}],
+#                "summary": {...}}
+#     blocks    ids: '\n' joined sorted ids.  Column types: '<f8', '<i8' or 'text' ('\n' joined strings).
+#
+# Readers may memory map the file and view any numeric column in place (with numpy if available).
+
+import sys, json, argparse, hashlib, mmap, struct
+
+MAGIC = 'QCOL\x01\x00\x00\x00'
+VERSION = 1
+ALIGN = 8
+
+KINDS = {
+    # kind:          (id column, header line, fixed column names)
+    "rsem":          (0, True,  None),
+    "star_counts":   (0, False, ["gene_id", "unstranded", "forward", "reverse"]),
+    "tsv":           (0, True,  None),
+}
+'''Known quantification layouts.  STAR ReadsPerGene files have no header and lead with 'N_*' summary lines.'''
+
+def pad(length):
+    '''Returns the number of bytes needed to bring length up to the alignment boundary.'''
+    return (ALIGN - length % ALIGN) % ALIGN
+
+def column_type(values):
+    '''Returns the narrowest type that holds all values of a column.'''
+    for (cast, typ) in ((int, '<i8'), (float, '<f8')):
+        try:
+            for value in values:
+                cast(value)
+            return typ
+        except ValueError:
+            continue
+    return 'text'
+
+def read_quant(path, kind, verbose=False):
+    '''Reads a tab separated quantification file, returning (names, rows, summary) with rows in sorted id order.'''
+    (id_col, has_header, names) = KINDS[kind]
+    rows = []
+    summary = {}
+    with open(path, 'r') as fh:
+        if has_header:
+            names = fh.readline().rstrip('\n').split('\t')
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            if kind == "star_counts" and fields[id_col].startswith('N_'):
+                summary[fields[id_col]] = [int(value) for value in fields[1:]]
+                continue
+            rows.append(fields)
+    rows.sort(key=lambda fields: fields[id_col])
+    if verbose:
+        sys.stderr.write("Read %d rows of %d columns from '%s'\n" % (len(rows), len(names), path))
+    return (names, rows, summary)
+
+def write_columns(path, kind, id_name, ids, columns, summary, verbose=False):
+    '''Writes sorted ids and their (name, type, values) columns as a columnar file.'''
+    id_block = '\n'.join(ids)
+    blocks = [id_block]
+    specs = []
+    for (name, typ, values) in columns:
+        if typ == '<i8':
+            block = struct.pack('<%dq' % len(values), *[int(value) for value in values])
+        elif typ == '<f8':
+            block = struct.pack('<%dd' % len(values), *[float(value) for value in values])
+        else:
+            block = '\n'.join(values)
+        specs.append({"name": name, "type": typ, "length": len(block)})
+        blocks.append(block)
+
+    header = {"version": VERSION, "kind": kind, "rows": len(ids), "id_name": id_name,
+              "ids": {"length": len(id_block), "digest": hashlib.sha1(id_block).hexdigest()},
+              "columns": specs, "summary": summary}
+    # Offsets depend on the header length, which depends on the offsets, so size the header with wide placeholders.
+    header["ids"]["offset"] = 0
+    for spec in specs:
+        spec["offset"] = 0
+    placeholder = len(json.dumps(header, sort_keys=True)) + 20 * (len(specs) + 1)
+    offset = len(MAGIC) + 8 + placeholder + pad(placeholder)
+    targets = [header["ids"]] + specs
+    for (target, block) in zip(targets, blocks):
+        target["offset"] = offset
+        offset += len(block) + pad(len(block))
+    text = json.dumps(header, sort_keys=True)
+    text += ' ' * (placeholder + pad(placeholder) - len(text))
+
+    with open(path, 'wb') as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack('<Q', len(text)))
+        fh.write(text)
+        for block in blocks:
+            fh.write(block)
+            fh.write('\0' * pad(len(block)))
+    if verbose:
+        sys.stderr.write("Wrote %d rows and %d columns to '%s'\n" % (len(ids), len(specs), path))
+
+def write_qcol(path, kind, names, rows, summary, verbose=False):
+    '''Writes quantification rows (already in sorted id order) as a columnar file.'''
+    id_col = KINDS[kind][0]
+    ids = [fields[id_col] for fields in rows]
+    columns = []
+    for (ix, name) in enumerate(names):
+        if ix == id_col:
+            continue
+        values = [fields[ix] for fields in rows]
+        columns.append((name, column_type(values), values))
+    write_columns(path, kind, names[id_col], ids, columns, summary, verbose)
+
+class QuantColumns(object):
+    '''Memory mapped reader of a '.qcol' file.  Numeric columns are views of the file, not copies, when numpy is available.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, 'rb')
+        self._map = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("'%s' is not a quant columns file" % path)
+        (length,) = struct.unpack('<Q', self._map[len(MAGIC):len(MAGIC) + 8])
+        self.header = json.loads(self._map[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+        self.kind = self.header["kind"]
+        self.rows = self.header["rows"]
+        self.digest = self.header["ids"]["digest"]
+        self.summary = self.header.get("summary", {})
+        self._columns = dict([(column["name"], column) for column in self.header["columns"]])
+        self._ids = None
+
+    def names(self):
+        '''Returns the column names, in file order.'''
+        return [column["name"] for column in self.header["columns"]]
+
+    def ids(self):
+        '''Returns the sorted row ids.'''
+        if self._ids is None and self.rows == 0:
+            self._ids = []
+        elif self._ids is None:
+            block = self.header["ids"]
+            self._ids = self._map[block["offset"]:block["offset"] + block["length"]].split('\n')
+        return self._ids
+
+    def column(self, name):
+        '''Returns one column as a numpy array (zero-copy), or as a list without numpy.'''
+        column = self._columns[name]
+        start = column["offset"]
+        if column["type"] == 'text':
+            return self._map[start:start + column["length"]].split('\n')
+        try:
+            import numpy
+            return numpy.frombuffer(self._map, dtype=column["type"], count=self.rows, offset=start)
+        except ImportError:
+            code = 'q' if column["type"] == '<i8' else 'd'
+            return list(struct.unpack('<%d%s' % (self.rows, code), self._map[start:start + column["length"]]))
+
+    def close(self):
+        self._map.close()
+        self._fh.close()
+
+def load_columns(paths, name):
+    '''Loads the same column from several files that share an id dictionary, returning (ids, [column, ...]).'''
+    ids = None
+    digest = None
+    columns = []
+    for path in paths:
+        qcol = QuantColumns(path)
+        if digest is None:
+            digest = qcol.digest
+            ids = qcol.ids()
+        elif qcol.digest != digest:
+            raise ValueError("'%s' was not quantified against the same ids as '%s'" % (path, paths[0]))
+        columns.append(qcol.column(name))
+    return (ids, columns)
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes and reads columnar binary companions of quantification files.")
+    subparsers = parser.add_subparsers(dest='command')
+    writer = subparsers.add_parser('write', help="Write a '.qcol' file from a tab separated quantification file.")
+    writer.add_argument('kind', choices=sorted(KINDS.keys()), help="Layout of the quantification file.")
+    writer.add_argument('quant', help="Tab separated quantification file.")
+    writer.add_argument('qcol', help="Columnar file to write.")
+    reader = subparsers.add_parser('read', help="Print selected columns of a '.qcol' file as tab separated values.")
+    reader.add_argument('qcol', help="Columnar file to read.")
+    reader.add_argument('-c', '--columns', nargs='+', help="Columns to print (default: all).")
+    paster = subparsers.add_parser('paste', help="Print one column of several '.qcol' files side by side by id.")
+    paster.add_argument('column', help="Column to print (e.g. 'FPKM').")
+    paster.add_argument('qcols', nargs='+', help="Columnar files quantified against the same ids.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Make some noise.")
+    args = parser.parse_args()
+
+    if args.command == 'write':
+        (names, rows, summary) = read_quant(args.quant, args.kind, args.verbose)
+        write_qcol(args.qcol, args.kind, names, rows, summary, args.verbose)
+    elif args.command == 'paste':
+        # Samples sharing an id dictionary line up row for row, so they are pasted without any joining
+        try:
+            (ids, columns) = load_columns(args.qcols, args.column)
+        except ValueError as e:
+            sys.exit(str(e))
+        print '\t'.join([QuantColumns(args.qcols[0]).header["id_name"]] + args.qcols)
+        for (ix, row_id) in enumerate(ids):
+            print '\t'.join([row_id] + [repr(float(column[ix])) if isinstance(column[ix], float) else str(column[ix])
+                                        for column in columns])
+    else:
+        qcol = QuantColumns(args.qcol)
+        names = args.columns or qcol.names()
+        columns = [qcol.column(name) for name in names]
+        print '\t'.join([qcol.header["id_name"]] + names)
+        for (ix, row_id) in enumerate(qcol.ids()):
+            print '\t'.join([row_id] + [str(column[ix]) for column in columns])
+        qcol.close()
+
+if __name__ == '__main__':
+    main()
+
@@ -0,0 +1,151 @@
+#!/usr/bin/env python2.7
+# srna_expression.py v1 Sums small-RNA gene expression of many STAR quantification files at once, as
+#                       sum_srna_expression.awk does for one.  Counts are those of the 1st read strand aligned with RNA
+#                       (column 3 of ReadsPerGene), and each small-RNA gene's CPM is its count per million of the gene,
+#                       N_noFeature, N_ambiguous and N_multimapping reads.
+#                       Writes a sample x gene CPM matrix and the per sample N_* summaries, and optionally the
+#                       sum_srna_expression.awk style expression file of each sample for MAD.R.
+
+import sys, os, argparse
+import quant_columns
+import anno_model
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COUNT_COLUMN = "forward"
+'''The quant_columns.py name of the count column sum_srna_expression.awk reads ($3).'''
+NORMALIZING = ["N_noFeature", "N_ambiguous", "N_multimapping"]
+SUMMARY = ["N_unmapped", "N_multimapping", "N_noFeature", "N_ambiguous", "N_notSmallRNA", "N_smallRNA"]
+SUFFIXES = ["_srna_star_quant.tsv", "_srna_star_quant.qcol", "_quant.tsv", "_quant.qcol", ".tsv", ".qcol"]
+
+def read_gene_ids(path, verbose=False):
+    '''Returns the set of small-RNA gene ids from a gene model, a gene id list ('*.txt') or a (gzipped) gtf.'''
+    if path.endswith('.qcol'):
+        model = anno_model.AnnoModel(path)
+        gene_ids = model.select_ids(model.biotype_mask(anno_model.SRNA_BIOTYPES))
+    elif path.endswith('.txt'):
+        gene_ids = [line.split()[0] for line in open(path, 'r') if line.strip() != '']
+    else:
+        genes = anno_model.read_gtf(path, verbose)
+        gene_ids = [gene_id for (gene_id, gene) in genes.iteritems() if gene[4] in anno_model.SRNA_BIOTYPES \
+                    and (gene[5] or gene[4] in anno_model.EXON_ONLY_BIOTYPES)]
+    if verbose:
+        sys.stderr.write("Using %d small-RNA gene ids from '%s'\n" % (len(gene_ids), path))
+    return set(gene_ids)
+
+def sample_name(path):
+    name = os.path.basename(path)
+    for suffix in SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+def read_counts(path):
+    '''Returns (sorted gene ids, counts, {N_*: count}) of a STAR ReadsPerGene file or its '.qcol' companion.'''
+    if path.endswith('.qcol'):
+        qcol = quant_columns.QuantColumns(path)
+        summary = dict([(name, values[1]) for (name, values) in qcol.summary.items()])
+        return (qcol.ids(), qcol.column(COUNT_COLUMN), summary)
+    (names, rows, summary) = quant_columns.read_quant(path, "star_counts")
+    summary = dict([(name, values[1]) for (name, values) in summary.items()])
+    return ([fields[0] for fields in rows], [int(fields[2]) for fields in rows], summary)
+
+def read_samples(paths, verbose=False):
+    '''Returns (gene ids, per sample counts, per sample summaries) of quantifications against the same genes.'''
+    gene_ids = None
+    counts = []
+    summaries = []
+    for path in paths:
+        (ids, sample_counts, summary) = read_counts(path)
+        if gene_ids is None:
+            gene_ids = ids
+        elif ids != gene_ids:
+            raise ValueError("'%s' was not quantified against the same genes as '%s'" % (path, paths[0]))
+        counts.append(sample_counts)
+        summaries.append(summary)
+    if verbose:
+        sys.stderr.write("Read %d samples of %d genes\n" % (len(paths), len(gene_ids)))
+    return (gene_ids, counts, summaries)
+
+def expression(gene_ids, counts, summaries, srna_ids):
+    '''Returns (small-RNA gene ids, [CPMs per sample], [summary per sample]).'''
+    mask = [gene_id in srna_ids for gene_id in gene_ids]
+    srna_genes = [gene_id for (gene_id, keep) in zip(gene_ids, mask) if keep]
+    normalizing = [sum([summary.get(name, 0) for name in NORMALIZING]) for summary in summaries]
+    if numpy is not None:
+        matrix = numpy.array(counts, dtype=numpy.int64).reshape(len(counts), len(gene_ids))
+        mask = numpy.array(mask, dtype=bool)
+        totals = matrix.sum(axis=1)
+        srna = matrix[:, mask]
+        srna_totals = srna.sum(axis=1)
+        denominators = (totals + numpy.array(normalizing, dtype=numpy.int64)).astype(numpy.float64)
+        denominators[denominators == 0] = numpy.inf
+        cpms = srna / denominators[:, numpy.newaxis] * 1000000
+    else:
+        totals = [sum(sample) for sample in counts]
+        srna = [[count for (count, keep) in zip(sample, mask) if keep] for sample in counts]
+        srna_totals = [sum(sample) for sample in srna]
+        denominators = [float(total + extra) for (total, extra) in zip(totals, normalizing)]
+        cpms = [[count / denominator * 1000000 if denominator > 0 else 0.0 for count in sample] \
+                for (sample, denominator) in zip(srna, denominators)]
+    sample_summaries = []
+    for (ix, summary) in enumerate(summaries):
+        sample_summary = dict(summary)
+        sample_summary["N_notSmallRNA"] = int(totals[ix] - srna_totals[ix])
+        sample_summary["N_smallRNA"] = int(srna_totals[ix])
+        sample_summaries.append(sample_summary)
+    return (srna_genes, cpms, sample_summaries)
+
+def awk_number(value):
+    '''Formats a number as awk prints it.'''
+    if value == int(value) and abs(value) < 1e16:
+        return "%d" % value
+    return "%.6g" % value
+
+def write_matrix(path, names, genes, cpms):
+    with open(path, 'w') as fh:
+        fh.write('\t'.join(["sample"] + genes) + '\n')
+        for (name, sample) in zip(names, cpms):
+            fh.write('\t'.join([name] + [awk_number(value) for value in sample]) + '\n')
+
+def write_summary(path, names, summaries):
+    with open(path, 'w') as fh:
+        fh.write('\t'.join(["sample"] + SUMMARY) + '\n')
+        for (name, summary) in zip(names, summaries):
+            fh.write('\t'.join([name] + [str(summary.get(key, 0)) for key in SUMMARY]) + '\n')
+
+def write_expression(path, genes, sample):
+    '''Writes one sample's expression as sum_srna_expression.awk does.'''
+    with open(path, 'w') as fh:
+        for (gene_id, value) in zip(genes, sample):
+            fh.write('\t'.join([gene_id, '.', '.', '.', '.', '.', awk_number(value)]) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="Sums small-RNA gene expression of many STAR quantifications at once.")
+    parser.add_argument('genes', help="Gene model ('*_anno.qcol'), small-RNA gene id list ('*.txt') or gtf.")
+    parser.add_argument('quants', nargs='+', help="STAR gene quantifications ('*_srna_star_quant.tsv' or '.qcol').")
+    parser.add_argument('-o', '--out_root', default='srna', help="Root of '_srna_cpm.tsv' and '_srna_summary.tsv'.")
+    parser.add_argument('-x', '--expr', nargs='+', help="Also write each sample's expression, one file per quant.")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Make some noise.")
+    args = parser.parse_args()
+
+    if args.expr and len(args.expr) != len(args.quants):
+        parser.error("--expr needs one file for each quantification")
+    srna_ids = read_gene_ids(args.genes, args.verbose)
+    (gene_ids, counts, summaries) = read_samples(args.quants, args.verbose)
+    (genes, cpms, summaries) = expression(gene_ids, counts, summaries, srna_ids)
+    names = [sample_name(path) for path in args.quants]
+    write_matrix(args.out_root + '_srna_cpm.tsv', names, genes, cpms)
+    write_summary(args.out_root + '_srna_summary.tsv', names, summaries)
+    for (path, sample) in zip(args.expr or [], cpms):
+        write_expression(path, genes, sample)
+    if args.verbose:
+        for (name, summary) in zip(names, summaries):
+            sys.stderr.write("%s: %d small-RNA of %d gene assigned reads\n" % \
+                             (name, summary["N_smallRNA"], summary["N_smallRNA"] + summary["N_notSmallRNA"]))
+
+if __name__ == '__main__':
+    main()
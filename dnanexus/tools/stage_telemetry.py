@@ -0,0 +1,183 @@
+#!/usr/bin/env python2.7
+# stage_telemetry.py v1 Records the cpu, memory, I/O and scratch disk used by each sub-step of a job and writes them as
+#                       a json string for file details.  Write request to stdout and verbose info to stderr.
+#
+# Usage in dx app scripts (and the scripts they call):
+#     export STAGE_TELEMETRY=`pwd`/stage_telemetry.tsv
+#     stage_telemetry.py start download            # starts sampling in the background, the first sub-step is 'download'
+#     stage_telemetry.py mark star_mapping         # each later sub-step starts with a mark
+#     telemetry=`stage_telemetry.py details`       # '"stage_telemetry": {...}' to add to qc metrics in --details
+#     stage_telemetry.py stop                      # stops sampling and logs the whole job's sub-steps
+# Nothing is recorded unless STAGE_TELEMETRY is set, so scripts may mark sub-steps whether or not it is.
+#
+# A job has its instance to itself, so the counters are the instance's: busy cpu seconds and block I/O (/proc/stat and
+# /proc/diskstats) are differences between the marks, while memory in use (MemTotal - MemAvailable) and disk used on
+# the working directory's filesystem are their peaks, sampled every few seconds and at every mark.
+
+import sys, os, time, json, signal, argparse
+
+SAMPLE_SECONDS = 5
+MB = 1048576.0
+COLUMNS = ["kind", "time", "name", "cpu_sec", "mem_MB", "disk_MB", "read_MB", "write_MB"]
+
+def cpu_seconds():
+    '''Returns the busy (not idle or iowait) cpu seconds of the instance since boot.'''
+    with open("/proc/stat") as fh:
+        ticks = [int(tick) for tick in fh.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal ...
+    return (sum(ticks[:8]) - ticks[3] - ticks[4]) / float(os.sysconf('SC_CLK_TCK'))
+
+def memory_MB():
+    '''Returns the memory in use by processes (not reclaimable cache) in MB.'''
+    info = {}
+    with open("/proc/meminfo") as fh:
+        for line in fh:
+            (key, value) = line.split(':', 1)
+            info[key] = int(value.split()[0])
+    return (info["MemTotal"] - info["MemAvailable"]) / 1024.0
+
+def disk_MB(path):
+    '''Returns the disk used on path's filesystem in MB.'''
+    stats = os.statvfs(path)
+    return (stats.f_blocks - stats.f_bfree) * stats.f_frsize / MB
+
+def io_MB():
+    '''Returns the MB read from and written to the instance's disks (not partitions) since boot.'''
+    (read, written) = (0, 0)
+    with open("/proc/diskstats") as fh:
+        for line in fh:
+            fields = line.split()
+            name = fields[2]
+            if name.startswith(("loop", "ram")) or not os.path.exists("/sys/block/" + name.replace('/', '!')):
+                continue
+            read += int(fields[5])
+            written += int(fields[9])
+    return (read * 512 / MB, written * 512 / MB)
+
+def sample(kind, name, path):
+    '''Returns a row of the counters now.'''
+    (read, written) = io_MB()
+    return [kind, "%.2f" % time.time(), name, "%.2f" % cpu_seconds(), "%.1f" % memory_MB(),
+            "%.1f" % disk_MB(os.path.dirname(path)), "%.1f" % read, "%.1f" % written]
+
+def append(path, row):
+    '''Appends a row in one write, so rows from the sampler and from marks do not interleave.'''
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    os.write(fd, '\t'.join(row) + '\n')
+    os.close(fd)
+
+def read_rows(path):
+    '''Returns (sampler pid, seconds between samples, rows as dicts) of the telemetry file.'''
+    (pid, seconds) = (None, None)
+    rows = []
+    with open(path) as fh:
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == "pid":
+                (pid, seconds) = (int(fields[1]), int(fields[2]))
+                continue
+            row = dict(zip(COLUMNS, fields))
+            for column in COLUMNS[3:]:
+                row[column] = float(row[column])
+            row["time"] = float(row["time"])
+            rows.append(row)
+    return (pid, seconds, rows)
+
+def start(path, name="setup", seconds=SAMPLE_SECONDS):
+    '''Starts a new telemetry file, whose first sub-step is name, and a background process sampling into it.'''
+    with open(path, 'w') as fh:
+        pass
+    append(path, sample("mark", name, path))
+    if os.fork() > 0:
+        return
+    # The sampler leaves the job's process group and output, so waiting on either never waits on it
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    append(path, ["pid", str(os.getpid()), str(seconds)])
+    while os.path.exists(path):
+        time.sleep(seconds)
+        try:
+            append(path, sample("sample", "-", path))
+        except (IOError, OSError):
+            break
+    os._exit(0)
+
+def summarize(rows, now):
+    '''Returns one dict per sub-step: its wall and cpu seconds, I/O and peak memory and scratch disk.'''
+    marks = [row for row in rows if row["kind"] == "mark"] + [now]
+    base_disk = marks[0]["disk_MB"]
+    stages = []
+    for (begin, end) in zip(marks[:-1], marks[1:]):
+        window = [row for row in rows + [now] if begin["time"] <= row["time"] <= end["time"]]
+        stages.append({"stage":       begin["name"],
+                       "wall_sec":    round(end["time"] - begin["time"], 1),
+                       "cpu_sec":     round(end["cpu_sec"] - begin["cpu_sec"], 1),
+                       "peak_mem_MB": round(max(row["mem_MB"] for row in window), 1),
+                       "scratch_MB":  round(max(row["disk_MB"] for row in window) - base_disk, 1),
+                       "read_MB":     round(end["read_MB"] - begin["read_MB"], 1),
+                       "write_MB":    round(end["write_MB"] - begin["write_MB"], 1)})
+    return stages
+
+def log_stages(stages):
+    print >> sys.stderr, "%-24s %9s %9s %12s %11s %9s %9s" % \
+                         ("sub-step", "wall_sec", "cpu_sec", "peak_mem_MB", "scratch_MB", "read_MB", "write_MB")
+    for stage in stages:
+        print >> sys.stderr, "%-24s %9.1f %9.1f %12.1f %11.1f %9.1f %9.1f" % (stage["stage"], stage["wall_sec"],
+                             stage["cpu_sec"], stage["peak_mem_MB"], stage["scratch_MB"], stage["read_MB"],
+                             stage["write_MB"])
+
+def details(path):
+    '''Returns the '"stage_telemetry": {...}' json string of the sub-steps so far.'''
+    (pid, seconds, rows) = read_rows(path)
+    now = dict(zip(COLUMNS, sample("now", "-", path)))
+    for column in COLUMNS[1:]:
+        if column != "name":
+            now[column] = float(now[column])
+    stages = summarize(rows, now)
+    log_stages(stages)
+    telemetry = {"cpus": os.sysconf('SC_NPROCESSORS_ONLN'),
+                 "mem_total_MB": round(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / MB),
+                 "sample_sec": seconds, "stages": stages}
+    return '"stage_telemetry": ' + json.dumps(telemetry, sort_keys=True)
+
+def stop(path):
+    '''Stops the sampler, returning the json string of the whole job's sub-steps.'''
+    (pid, seconds, rows) = read_rows(path)
+    if pid is not None:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass  # already gone
+    return details(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Records the resources used by each sub-step of a job.")
+    parser.add_argument('command', choices=['start', 'mark', 'details', 'stop'],
+                        help="'start' sampling, 'mark' the start of a sub-step, print sub-steps' 'details' or 'stop'.")
+    parser.add_argument('name', nargs='?', help="Name of the sub-step that starts (for 'mark' and 'start').")
+    parser.add_argument('-f', '--file', default=os.environ.get("STAGE_TELEMETRY"),
+                        help="Telemetry file (default: $STAGE_TELEMETRY).  Without one nothing is recorded.")
+    parser.add_argument('-s', '--seconds', type=int, default=SAMPLE_SECONDS,
+                        help="Seconds between samples (for 'start').")
+    args = parser.parse_args()
+
+    if not args.file:
+        return
+    path = os.path.abspath(args.file)
+    if args.command == 'start':
+        start(path, args.name or "setup", args.seconds)
+    elif not os.path.exists(path):
+        return
+    elif args.command == 'mark':
+        if not args.name:
+            parser.error("'mark' needs the name of the sub-step.")
+        append(path, sample("mark", args.name, path))
+    elif args.command == 'details':
+        print details(path)
+    else:
+        print stop(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+#!/bin/bash
+# stage_telemetry.sh v1 Sourced by dx app scripts (and the DX-independent scripts they call) for one 'telemetry'
+#                       function over stage_telemetry.py, which records each sub-step's cpu, memory, I/O and scratch
+#                       disk for the results' details.
+#
+# Usage, which still runs (recording nothing) wherever this is not installed:
+#     source stage_telemetry.sh 2> /dev/null || telemetry() { :; }
+#     telemetry start download            # app script: starts recording if stage_telemetry.py is available
+#     telemetry mark star_mapping         # any script: each later sub-step starts with a mark
+#     telemetry=`telemetry details`       # app script: '"stage_telemetry": {...}' for --details, or '' if not recording
+#     telemetry stop                      # app script: stops recording
+# Marks are no-ops unless recording was started (exported STAGE_TELEMETRY), so scripts may mark sub-steps either way.
+
+telemetry() {
+    case "$1" in
+        start)
+            if which stage_telemetry.py > /dev/null 2>&1; then
+                export STAGE_TELEMETRY=`pwd`/stage_telemetry.tsv
+                stage_telemetry.py start $2
+            fi
+            ;;
+        stop)
+            [ -z "$STAGE_TELEMETRY" ] || stage_telemetry.py stop > /dev/null
+            ;;
+        *)
+            [ -z "$STAGE_TELEMETRY" ] || stage_telemetry.py "$@"
+            ;;
+    esac
+}
@@ -0,0 +1,202 @@
+#!/usr/bin/env python2.7
+# star_progress.py v1 Follows STAR's Log.progress.out while it maps and writes its throughput, mapping rate and ETA as
+#                     json records.  Write records to stdout (and --out) and verbose info to stderr.
+#
+# Usage in the DX independent scripts, started just before STAR:
+#     star_progress.py Log.progress.out $read1_fq_gz --pid $$ --out ${bam_root}_star_progress.json &
+# One record is written for each progress line STAR adds (about once a minute), prefixed by '-- STAR progress: ' on
+# stdout, and one per line in --out.  'status' is one of:
+#     loading  - STAR has started but not mapped a read yet (loading the genome)
+#     mapping  - a new progress line
+#     stalled  - no new progress line for --stall_min minutes
+#     done     - STAR wrote 'ALL DONE!'
+#     aborted  - the mapping rate collapsed below --min_mapped and STAR was killed
+# The percentages in Log.progress.out are of all reads so far.  'recent_mapped_pct' is of the reads since the previous
+# line, so a collapse late in a long run is seen as it happens.  The total reads behind 'eta_min' are estimated from the
+# bytes the first reads of the fastq take.
+#
+# STAR is only killed when --min_mapped (default: $STAR_MIN_MAPPED_PCT, otherwise never) is given: once --min_reads
+# have been mapped, a recent mapping rate below it kills any STAR process that is a child of --pid, so the script
+# fails at once rather than hours later.  The monitor ends with STAR's 'ALL DONE!' or when --pid ends.
+
+import sys, os, time, json, signal, zlib, argparse
+
+SAMPLE_BYTES = 4194304
+MIN_READS = 1000000
+STALL_MINUTES = 10
+
+def estimate_reads(path, sample_bytes=SAMPLE_BYTES):
+    '''Returns the number of reads (or pairs) in a fastq or fasta file, gzipped or not, from its first bytes.'''
+    size = os.path.getsize(path)
+    (consumed, lines, first) = (0, 0, None)
+    with open(path, 'rb') as fh:
+        gzipped = (fh.read(2) == '\x1f\x8b')
+        fh.seek(0)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        while consumed < sample_bytes:
+            chunk = fh.read(65536)
+            if not chunk:
+                break
+            consumed += len(chunk)
+            if gzipped:
+                text = decompressor.decompress(chunk)
+                while decompressor.unused_data:  # concatenated gzip members (e.g. fastqs joined with cat)
+                    rest = decompressor.unused_data
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    text += decompressor.decompress(rest)
+                chunk = text
+            if first is None and chunk:
+                first = chunk[0]
+            lines += chunk.count('\n')
+    if lines == 0:
+        return None
+    lines_per_read = 2 if first == '>' else 4
+    if consumed >= size:
+        return lines / lines_per_read
+    return int(lines * size / float(consumed) / lines_per_read)
+
+def read_progress(path):
+    '''Returns (progress lines as dicts, whether STAR is done) of a Log.progress.out.'''
+    progress = []
+    done = False
+    with open(path) as fh:
+        for line in fh:
+            if line.startswith("ALL DONE"):
+                done = True
+                continue
+            # Month Day HH:MM:SS M/hr reads length unique% length MMrate multi% multi+% unmapped: MM% short% other%
+            fields = line.split()
+            if len(fields) < 11 or not fields[4].isdigit():
+                continue
+            try:
+                progress.append({"star_time":   ' '.join(fields[:3]),
+                                 "speed_M_hr":  float(fields[3]),
+                                 "reads":       int(fields[4]),
+                                 "unique_pct":  float(fields[6].rstrip('%')),
+                                 "multi_pct":   float(fields[9].rstrip('%'))})
+            except ValueError:
+                continue
+    return (progress, done)
+
+def mapped_reads(line):
+    return line["reads"] * (line["unique_pct"] + line["multi_pct"]) / 100.0
+
+def make_record(status, started, progress, total_reads):
+    '''Returns the record of the latest progress line.'''
+    record = {"status": status, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "elapsed_min": round((time.time() - started) / 60.0, 1)}
+    if total_reads is not None:
+        record["estimated_reads"] = total_reads
+    if not progress:
+        return record
+    last = progress[-1]
+    record.update({"reads": last["reads"], "reads_per_hour": int(last["speed_M_hr"] * 1000000),
+                   "unique_pct": last["unique_pct"], "multi_pct": last["multi_pct"],
+                   "mapped_pct": round(last["unique_pct"] + last["multi_pct"], 2)})
+    record["recent_mapped_pct"] = record["mapped_pct"]
+    if len(progress) > 1 and last["reads"] > progress[-2]["reads"]:
+        recent = (mapped_reads(last) - mapped_reads(progress[-2])) / (last["reads"] - progress[-2]["reads"])
+        record["recent_mapped_pct"] = round(min(max(recent * 100.0, 0.0), 100.0), 2)
+    if total_reads is not None and last["speed_M_hr"] > 0:
+        record["eta_min"] = round(max(total_reads - last["reads"], 0) / (last["speed_M_hr"] * 1000000) * 60.0, 1)
+    return record
+
+def emit(record, out):
+    line = json.dumps(record, sort_keys=True)
+    print "-- STAR progress: " + line
+    sys.stdout.flush()
+    if out:
+        with open(out, 'a') as fh:
+            fh.write(line + '\n')
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def kill_star(pid):
+    '''Kills the STAR processes that are children of pid, returning how many.'''
+    killed = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry) as fh:
+                stat = fh.read()
+        except IOError:
+            continue
+        # pid (comm) state ppid ...
+        comm = stat[stat.index('(') + 1:stat.rindex(')')]
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        if ppid == pid and comm == "STAR":
+            try:
+                os.kill(int(entry), signal.SIGTERM)
+                killed += 1
+            except OSError:
+                pass
+    return killed
+
+def monitor(args):
+    started = time.time()
+    total_reads = None
+    for fastq in args.reads:
+        try:
+            total_reads = estimate_reads(fastq)
+            print >> sys.stderr, "Estimated %s reads in '%s'" % (total_reads, fastq)
+        except (IOError, OSError, zlib.error) as e:
+            print >> sys.stderr, "Unable to estimate the reads in '%s': %s" % (fastq, e)
+        break  # the mates of a pair are counted together
+    (seen, last_change, status) = (0, time.time(), None)
+    while True:
+        # A Log.progress.out older than the monitor is left from an earlier run
+        if os.path.exists(args.progress) and os.path.getmtime(args.progress) >= started - 1:
+            (progress, done) = read_progress(args.progress)
+            if done:
+                emit(make_record("done", started, progress, total_reads), args.out)
+                return 0
+            if len(progress) > seen:
+                seen = len(progress)
+                last_change = time.time()
+                record = make_record("mapping", started, progress, total_reads)
+                if args.min_mapped and record["reads"] >= args.min_reads \
+                                   and record["recent_mapped_pct"] < args.min_mapped:
+                    record["status"] = "aborted"
+                    emit(record, args.out)
+                    print >> sys.stderr, "Mapping rate %.2f%% is below %.2f%%: killed %d STAR process(es)" % \
+                                         (record["recent_mapped_pct"], args.min_mapped, kill_star(args.pid))
+                    return 1
+                emit(record, args.out)
+                status = "mapping"
+            elif seen == 0 and status is None:
+                status = "loading"
+                emit(make_record(status, started, progress, total_reads), args.out)
+            elif seen > 0 and status != "stalled" and time.time() - last_change > args.stall_min * 60:
+                status = "stalled"
+                emit(make_record(status, started, progress, total_reads), args.out)
+        if args.pid and not alive(args.pid):
+            return 0
+        time.sleep(args.interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Follows STAR's Log.progress.out and writes progress records.")
+    parser.add_argument('progress', help="STAR's Log.progress.out (it need not exist yet).")
+    parser.add_argument('reads', nargs='*', help="The (first) fastq STAR is mapping, to estimate the time left.")
+    parser.add_argument('-p', '--pid', type=int, default=os.getppid(),
+                        help="Process running STAR.  The monitor ends with it. (default: parent)")
+    parser.add_argument('-o', '--out', help="Also append the records to this file, one json per line.")
+    parser.add_argument('-i', '--interval', type=int, default=30, help="Seconds between looks at the progress.")
+    parser.add_argument('--stall_min', type=int, default=STALL_MINUTES,
+                        help="Minutes without progress before a 'stalled' record.")
+    parser.add_argument('--min_mapped', type=float, default=float(os.environ.get("STAR_MIN_MAPPED_PCT", 0)),
+                        help="Kill STAR when the recent mapping rate is below this percent. " + \
+                             "(default: $STAR_MIN_MAPPED_PCT or never)")
+    parser.add_argument('--min_reads', type=int, default=MIN_READS,
+                        help="Reads to map before the mapping rate may kill STAR.")
+    args = parser.parse_args()
+
+    sys.exit(monitor(args))
+
+if __name__ == '__main__':
+    main()
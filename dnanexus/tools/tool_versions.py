@@ -10,34 +10,48 @@ import commands
 # APP_TOOLS is a dict keyed by applet script name with a list of tools that it uses.
 APP_TOOLS = {
     # lrna:
-    "align-star-pe":            ["lrna_align_star_pe.sh", "STAR", "samtools"],
-    "align-star-se":            ["lrna_align_star_se.sh", "STAR", "samtools"],
-    "align-tophat-pe":          ["lrna_align_tophat_pe.sh", "TopHat", "bowtie2", "samtools", "tophat_bam_xsA_tag_fix.pl"],
-    "align-tophat-se":          ["lrna_align_tophat_se.sh", "TopHat", "bowtie2", "samtools"],
+    "align-star-pe":            ["lrna_align_star_pe.sh", "STAR", "samtools", "lrna_split_fastq.sh",
+                                 "lrna_merge_star_shards.sh", "merge_star_logs.awk", "index_archive.py"],
+    "align-star-se":            ["lrna_align_star_se.sh", "STAR", "samtools", "index_archive.py"],
+    "align-tophat-pe":          ["lrna_align_tophat_pe.sh", "TopHat", "bowtie2", "samtools", "tophat_bam_fix.awk",
+                                 "index_archive.py"],
+    "align-tophat-se":          ["lrna_align_tophat_se.sh", "TopHat", "bowtie2", "samtools", "tophat_bam_fix.awk",
+                                 "index_archive.py"],
     "bam-to-bigwig":            ["lrna_bam_to_signals.sh", "STAR", "bedGraphToBigWig"],
     # "bam-to-bigwig-stranded":   ["lrna_bam_to_stranded_signals.sh", "STAR", "bedGraphToBigWig"],
     # "bam-to-bigwig-unstranded": ["lrna_bam_to_unstranded_signals.sh", "STAR", "bedGraphToBigWig"],
-    "quant-rsem":               ["lrna_rsem_quantification.sh", "RSEM"],
+    "quant-rsem":               ["lrna_rsem_quantification.sh", "RSEM", "quant_columns.py", "index_archive.py"],
+    "quant-rsem-ci":            ["lrna_rsem_credibility_intervals.sh", "RSEM", "index_archive.py"],
+    "quant-rsem-multi":         ["lrna_rsem_quantification_multi.sh", "lrna_rsem_quantification.sh", "RSEM",
+                                 "quant_columns.py", "index_archive.py"],
+    "align-signal-quant-pe":    ["lrna_align_star_pe.sh", "lrna_bam_to_signals.sh", "lrna_rsem_quantification.sh",
+                                 "STAR", "samtools", "bedGraphToBigWig", "RSEM", "quant_columns.py", "index_archive.py"],
     "mad-qc":                   ["MAD.R"],
 
     # srna:
-    "small-rna-prep-star":      ["srna_index.sh", "STAR", "extract_gene_ids.awk"],
-    "small-rna-align":          ["srna_align.sh", "STAR", "samtools"],
+    "small-rna-prep-star":      ["srna_index.sh", "STAR", "extract_gene_ids.awk", "index_archive.py"],
+    "small-rna-align":          ["srna_align.sh", "STAR", "samtools", "quant_columns.py", "srna_collapse.py",
+                                 "index_archive.py"],
     "small-rna-signals":        ["srna_signals.sh", "STAR", "bedGraphToBigWig"],
-    "small-rna-mad-qc":         ["srna_mad_qc.sh", "MAD.R", "extract_gene_ids.awk", "sum_srna_expression.awk"],
+    "small-rna-mad-qc":         ["srna_mad_qc.sh", "MAD.R", "extract_gene_ids.awk", "sum_srna_expression.awk",
+                                 "anno_model.py", "srna_expression.py"],
+    "small-rna-expr-matrix":    ["srna_expression.py", "quant_columns.py", "anno_model.py"],
 
     # rampage:
-    "rampage-align-pe":         ["rampage_align_star.sh", "STAR", "samtools"],
+    "rampage-align-pe":         ["rampage_align_star.sh", "STAR", "samtools", "rampage_mark_signals.py",
+                                 "bedGraphToBigWig", "index_archive.py"],
     "rampage-signals":          ["rampage_signal.sh", "STAR", "bedGraphToBigWig"],
     "rampage-peaks":            ["rampage_peaks.sh", "call_peaks (grit)", "bedToBigBed", "pigz", "samtools"],
     "rampage-idr":              ["rampage_idr.sh", "Anaconda3", "idr", "bedToBigBed", "pigz"],
     "rampage-mad-qc":           ["rampage_mad_qc.sh", "MAD.R"],
 
     # utility:
-    "merge-annotation":         ["GTF.awk"],
-    "prep-rsem":                ["lrna_index_rsem.sh", "RSEM"],
-    "prep-star":                ["lrna_index_star.sh", "STAR"],
-    "prep-tophat":              ["lrna_index_tophat.sh", "TopHat", "bowtie2"],
+    "merge-annotation":         ["lrna_merge_annotation.sh", "GTF.awk", "pigz", "anno_model.py"],
+    "prep-indexes":             ["lrna_index_all.sh", "lrna_index_star.sh", "lrna_index_rsem.sh", "lrna_index_tophat.sh",
+                                 "STAR", "RSEM", "TopHat", "bowtie2", "index_archive.py"],
+    "prep-rsem":                ["lrna_index_rsem.sh", "RSEM", "index_archive.py"],
+    "prep-star":                ["lrna_index_star.sh", "STAR", "index_archive.py"],
+    "prep-tophat":              ["lrna_index_tophat.sh", "TopHat", "bowtie2", "index_archive.py"],
     }
 # Virtual apps only differ from their parent by name/version.
 VIRTUAL_APPS = {
@@ -47,6 +61,8 @@ VIRTUAL_APPS = {
     "bam-to-bigwig-se-tophat": "bam-to-bigwig",
     "quant-rsem-alt":          "quant-rsem",
     "mad-qc-alt":              "mad-qc",
+    "align-star-pe-lowmem":    "align-star-pe",
+    "align-star-se-lowmem":    "align-star-se",
 
     }
 
@@ -63,20 +79,33 @@ ALL_TOOLS = {
     "MAD.R":                     "grep version /usr/bin/MAD.R | awk '{print $3}'",
     "extract_gene_ids.awk":      "grep version /usr/bin/extract_gene_ids.awk | awk '{print $3}'",
     "sum_srna_expression.awk":   "grep version /usr/bin/sum_srna_expression.awk | awk '{print $3}'",
+    "merge_star_logs.awk":       "grep version /usr/bin/merge_star_logs.awk | awk '{print $3}'",
     "RSEM":                      "rsem-calculate-expression --version | awk '{print $5}'",
     "samtools":                  "samtools 2>&1 | grep Version | awk '{print $2}'",
     "STAR":                      "STAR --version | awk '{print $1}' | cut -d _ -f 2-",
     "TopHat":                    "tophat -v | awk '{print $2}'",
-    "tophat_bam_xsA_tag_fix.pl": "perl /usr/bin/tophat_bam_xsA_tag_fix.pl --version 2>&1",
+    "tophat_bam_fix.awk":        "grep version /usr/bin/tophat_bam_fix.awk | awk '{print $3}'",
     "pigz":                      "pigz --version 2>&1 | awk '{print $2}'",
+    "quant_columns.py":          "grep -m1 quant_columns.py /usr/bin/quant_columns.py | awk '{print $3}'",
+    "anno_model.py":             "grep -m1 anno_model.py /usr/bin/anno_model.py | awk '{print $3}'",
+    "srna_expression.py":        "grep -m1 srna_expression.py /usr/bin/srna_expression.py | awk '{print $3}'",
+    "srna_collapse.py":          "grep -m1 srna_collapse.py /usr/bin/srna_collapse.py | awk '{print $3}'",
+    "index_archive.py":          "grep -m1 index_archive.py /usr/bin/index_archive.py | awk '{print $3}'",
+    "rampage_mark_signals.py":   "grep -m1 rampage_mark_signals.py /usr/bin/rampage_mark_signals.py | awk '{print $3}'",
     "lrna_align_star_pe.sh":             "lrna_align_star_pe.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_align_star_se.sh":             "lrna_align_star_se.sh | grep usage | awk '{print $2}' | tr -d :",
+    "lrna_split_fastq.sh":               "lrna_split_fastq.sh | grep usage | awk '{print $2}' | tr -d :",
+    "lrna_merge_star_shards.sh":         "lrna_merge_star_shards.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_align_tophat_pe.sh":           "lrna_align_tophat_pe.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_align_tophat_se.sh":           "lrna_align_tophat_se.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_bam_to_signals.sh":            "lrna_bam_to_signals.sh | grep usage | awk '{print $2}' | tr -d :",
     # "lrna_bam_to_stranded_signals.sh":   "lrna_bam_to_stranded_signals.sh | grep usage | awk '{print $2}' | tr -d :",
     # "lrna_bam_to_unstranded_signals.sh": "lrna_bam_to_unstranded_signals.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_rsem_quantification.sh":       "lrna_rsem_quantification.sh | grep usage | awk '{print $2}' | tr -d :",
+    "lrna_rsem_credibility_intervals.sh": "lrna_rsem_credibility_intervals.sh | grep usage | awk '{print $2}' | tr -d :",
+    "lrna_rsem_quantification_multi.sh": "lrna_rsem_quantification_multi.sh | grep usage | awk '{print $2}' | tr -d :",
+    "lrna_merge_annotation.sh":          "lrna_merge_annotation.sh | grep usage | awk '{print $2}' | tr -d :",
+    "lrna_index_all.sh":                 "lrna_index_all.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_index_rsem.sh":                "lrna_index_rsem.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_index_star.sh":                "lrna_index_star.sh | grep usage | awk '{print $2}' | tr -d :",
     "lrna_index_tophat.sh":              "lrna_index_tophat.sh | grep usage | awk '{print $2}' | tr -d :",